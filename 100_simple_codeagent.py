@@ -1,6 +1,7 @@
 import os
 from dotenv import load_dotenv
 from smolagents import CodeAgent, LiteLLMModel
+from llm_cache import wrap_model_with_cache
 
 _= load_dotenv()
 oci_user = os.getenv("OCI_USER")
@@ -10,7 +11,8 @@ oci_region = os.getenv("OCI_REGION")
 oci_key = os.getenv("OCI_KEY")
 oci_compartment_id = os.getenv("OCI_COMPARTMENT_ID")
 
-model = LiteLLMModel(
+# temperature=0.0 なので同じメッセージ履歴への応答はディスクキャッシュから再利用する（LLM_CACHE_MODE）
+model = wrap_model_with_cache(LiteLLMModel(
     model_id="oci/xai.grok-4",
     oci_region=os.getenv("OCI_REGION"),                    # 例: "us-chicago-1"
     oci_user=os.getenv("OCI_USER"),                        # OCI User OCID
@@ -21,7 +23,7 @@ model = LiteLLMModel(
     temperature=0.0,
     max_tokens= 10000,
     drop_params=True
-)
+))
 
 agent = CodeAgent(tools=[], model=model)
 
@@ -1,6 +1,8 @@
 import os
 from dotenv import load_dotenv
 from smolagents import CodeAgent, LiteLLMModel
+from llm_cache import wrap_model_with_cache
+from web_fetch import fetch_url_tool, fetch_json_tool, fetch_urls_tool, get_web_fetcher
 
 _= load_dotenv()
 oci_user = os.getenv("OCI_USER")
@@ -10,7 +12,8 @@ oci_region = os.getenv("OCI_REGION")
 oci_key = os.getenv("OCI_KEY")
 oci_compartment_id = os.getenv("OCI_COMPARTMENT_ID")
 
-model = LiteLLMModel(
+# Web の最新の情報を答えるので、応答キャッシュは既定で使わない（LLM_CACHE_MODE=readwrite で有効になる）
+model = wrap_model_with_cache(LiteLLMModel(
     model_id="oci/xai.grok-4",
     oci_region=os.getenv("OCI_REGION"),                    # 例: "us-chicago-1"
     oci_user=os.getenv("OCI_USER"),                        # OCI User OCID
@@ -21,11 +24,13 @@ model = LiteLLMModel(
     temperature=0.0,
     max_tokens= 10000,
     drop_params=True
-)
+), default_mode="off")
 
-agent = CodeAgent(tools=[],
+# Web の取得はコネクションプールと HTTP キャッシュ（cache/http/）を共有するツールに任せる（web_fetch.py）
+agent = CodeAgent(tools=[fetch_url_tool, fetch_json_tool, fetch_urls_tool],
     model=model,
     additional_authorized_imports=['requests', 'bs4']
 )
 
-agent.run("https://www.oracle.com/jp/news/announcement/oracle-to-offer-google-gemini-models-to-customers-2025-08-14/ のタイトルは？")
\ No newline at end of file
+agent.run("https://www.oracle.com/jp/news/announcement/oracle-to-offer-google-gemini-models-to-customers-2025-08-14/ のタイトルは？")
+print(f"Web 取得: {get_web_fetcher().stats()}")
\ No newline at end of file
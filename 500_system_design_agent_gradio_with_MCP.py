@@ -1,13 +1,41 @@
-import datetime
+import asyncio
+import json
 import os
 import re
-from PIL import Image
+import time
 import subprocess
 import shutil
-from dotenv import load_dotenv
-from smolagents import CodeAgent, LiteLLMModel, tool, MCPClient
-from mcp import StdioServerParameters
-import gradio as gr
+from app_services import startup_timer, ServiceRegistry, launch_with_readiness
+with startup_timer.measure_import("dotenv"):
+    from dotenv import load_dotenv
+with startup_timer.measure_import("smolagents"):
+    from smolagents import CodeAgent, LiteLLMModel, tool
+    from smolagents.memory import ActionStep, PlanningStep, FinalAnswerStep
+    from smolagents.models import ChatMessageStreamDelta
+with startup_timer.measure_import("gradio"):
+    import gradio as gr
+with startup_timer.measure_import("app modules"):
+    from mermaid_renderer_pool import get_renderer_pool, RendererUnavailableError
+    from mermaid_render_cache import get_render_cache
+    from diagram_output import choose_render_size, render_formats, format_file, ensure_preview, diagram_files, diagram_downloads
+    from mermaid_lint import fix_mermaid_script, format_diagnostics, blocking_diagnostics
+    from mermaid_edit import apply_operations, get_diagram_model
+    from mermaid_partition import partition_mermaid_script, render_partitioned_diagram, describe_diagram_parts, remove_diagram_parts
+    from ddl_to_er import ddl_to_mermaid_er
+    from agent_pool import SessionAgentPool
+    from agent_stream import astream_agent_run, notify_diagram_generated, DiagramGenerated
+    from agent_memory import AgentMemoryCompactor
+    from run_control import CancellationToken, RunCancelled, run_child_process
+    from artifact_store import get_artifact_store
+    from semantic_cache import get_semantic_cache
+    from trajectory_cache import get_trajectory_cache, trajectory_steps
+    from mermaid_svg import try_render_file
+    from llm_cache import wrap_model_with_cache
+    from llm_router import with_fallback_providers, find_routing_model
+    from prompt_budget import agent_prompt_templates, measure_prompt_sections, format_prompt_budget, with_prompt_cache, get_prompt_mode, ToolSelector
+    from tracing import trace_span, trace_step_callback, trace_tools, TracedModel, new_trace_id, format_trace_timeline
+    from mcp_session_pool import create_sqlcl_mcp_pool
+    from schema_catalog import SchemaCatalogCache, schema_key_for
 
 load_dotenv()
 
@@ -18,18 +46,28 @@ oci_region = os.getenv("OCI_REGION")
 oci_key = os.getenv("OCI_KEY")
 oci_compartment_id = os.getenv("OCI_COMPARTMENT_ID")
 
-model = LiteLLMModel(
-    model_id="oci/xai.grok-4",
-    oci_region=os.getenv("OCI_REGION"),                    # 例: "us-ashburn-1"
-    oci_user=os.getenv("OCI_USER"),                        # OCI User OCID
-    oci_fingerprint=os.getenv("OCI_FINGERPRINT"),          # RSA key fingerprint
-    oci_tenancy=os.getenv("OCI_TENANCY"),                  # Tenancy OCID
-    oci_key=os.getenv("OCI_KEY"),                          # Private key content
-    oci_compartment_id=os.getenv("OCI_COMPARTMENT_ID"),    # Compartment OCID
-    temperature=0.0,
-    max_tokens= 10000,
-    drop_params=True
-)
+def create_model():
+    # temperature=0.0 なので同じメッセージ履歴への応答はディスクキャッシュから再利用する（LLM_CACHE_MODE）。
+    # LLM_FALLBACK_MODELS を設定すると、Grok が遅い・失敗する場合に別のプロバイダーへヘッジ・フェイルオーバーする
+    return wrap_model_with_cache(with_fallback_providers(with_prompt_cache(LiteLLMModel(
+        model_id="oci/xai.grok-4",
+        oci_region=os.getenv("OCI_REGION"),                    # 例: "us-ashburn-1"
+        oci_user=os.getenv("OCI_USER"),                        # OCI User OCID
+        oci_fingerprint=os.getenv("OCI_FINGERPRINT"),          # RSA key fingerprint
+        oci_tenancy=os.getenv("OCI_TENANCY"),                  # Tenancy OCID
+        oci_key=os.getenv("OCI_KEY"),                          # Private key content
+        oci_compartment_id=os.getenv("OCI_COMPARTMENT_ID"),    # Compartment OCID
+        temperature=0.0,
+        max_tokens= 10000,
+        drop_params=True
+    )), temperature=0.0, max_tokens=10000, drop_params=True))
+
+# LLM クライアント（litellm の import を含む）やレンダラーは最初に使う時点で初期化する。
+# 起動時はバックグラウンドでプリウォームし、状態は /ready で確認できる
+services = ServiceRegistry()
+model_service = services.register("model", create_model)
+services.register("renderer_pool", get_renderer_pool, required=False)
+services.register("artifact_store", get_artifact_store, required=False)
 
 @tool
 def get_mermaid_script_guidelines_tool() -> str:
@@ -55,8 +93,32 @@ def get_mermaid_script_guidelines_tool() -> str:
         - テーブル構造を表す場合の属性の構成要素は、データ型 カラム名 制約(PK, "NOT NULL", UK, CK, FK のいずれか) の順で記順してください。制約がない場合は、制約欄には何も書かないでください。
         - NUMBER にスケールは指定できません。NUMBER(精度,スケール)という記述はNGです。NUMBER(精度) とするかNUMBER とだけ記述してください。
         - VECTOR にデータフォーマットは指定できません。VECTOR(次元数, データフォーマット)という記述はNGです。VECTOR(次元数) とするか VECTOR とだけ記述してください。
+    # 生成済みのダイアグラムの修正
+        - 生成済みの flowchart/graph や ER 図への修正依頼では、スクリプト全体を書き直さず、edit_mermaid_diagram_tool に元の画像ファイルのパスと差分の操作だけを渡してください。
     """
 
+@tool
+def generate_er_diagram_script_from_ddl_tool(ddl: str, include_columns: bool = True) -> str:
+    """
+    Oracle の DDL（CREATE TABLE 文・制約・外部キー）から ER 図の Mermaid スクリプトを生成するツール。
+    LLM がカラムを書き写す必要はなく、記法ルール（NUMBER や VECTOR の表記など）にも沿ったスクリプトを返す。
+    DDL が与えられた ER 図の依頼では、このツールの戻り値をそのまま generate_mermaid_diagram_tool に渡してください。
+
+    Args:
+        ddl: CREATE TABLE 文を含む DDL、または DDL を書いた .sql ファイルのパス
+        include_columns: カラムを出力するかどうか。表が非常に多い場合は False にすると表とリレーションだけになる
+
+    Returns:
+        str: ER 図（erDiagram）の Mermaid スクリプト
+
+    Raises:
+        ValueError: DDL に CREATE TABLE 文がない場合
+    """
+    if ddl.strip().lower().endswith(".sql") and os.path.isfile(ddl.strip()):
+        with open(ddl.strip(), 'r', encoding='utf-8') as f:
+            ddl = f.read()
+    return ddl_to_mermaid_er(ddl, include_columns=include_columns)
+
 @tool
 def generate_mermaid_diagram_tool(mermaid_script: str) -> str:
     """
@@ -66,10 +128,10 @@ def generate_mermaid_diagram_tool(mermaid_script: str) -> str:
         mermaid_script: ダイアグラムを生成するためのマーメイドスクリプト
         
     Returns:
-        str: 生成されたPNGファイルのパス
+        str: 生成されたPNGファイルのパス。大きなダイアグラムは部分に分割して生成し、1 行目に全体図のパス、続けて部分ごとの PNG ファイルのパスを返す
         
     Raises:
-        ValueError: 入力パラメータが無効な場合
+        ValueError: 入力パラメータが無効な場合、または記法ルールに違反している場合（違反箇所を行・列付きで返す）
         RuntimeError: ダイアグラム生成に失敗した場合
         FileNotFoundError: mmdc コマンドが見つからない場合
     
@@ -84,24 +146,85 @@ def generate_mermaid_diagram_tool(mermaid_script: str) -> str:
     if not mermaid_script or not mermaid_script.strip():
         raise ValueError("mermaid_script is required and cannot be empty")
     
-    # outputディレクトリの作成
-    output_dir = "output"
-    try:
-        os.makedirs(output_dir, exist_ok=True)
-    except Exception as e:
-        raise RuntimeError(f"Failed to create output directory: {str(e)}")
+    # 記法ルールの事前検証（安全に直せるものは自動修正し、残った違反は行・列付きで返す）
+    # リンターが解析できないだけの記法（警告）ではレンダリングを止めず、mmdc に判断を任せる
+    mermaid_script, diagnostics = fix_mermaid_script(mermaid_script)
+    errors = blocking_diagnostics(diagnostics)
+    if errors:
+        raise ValueError(f"Mermaid script validation failed:\n{format_diagnostics(errors)}")
     
-    # ファイル名生成
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    mmd_file = f"{output_dir}/mermaid_diagram_{timestamp}.mmd"
-    png_file = f"{output_dir}/mermaid_diagram_{timestamp}.png"
+    # 画像の大きさはダイアグラムの大きさから決める（小さなダイアグラムを 2048x2048 にしない）
+    width, height = choose_render_size(mermaid_script)
+    formats = render_formats()
+
+    # 同じスクリプト・オプションで生成済みの画像があればそれを返す
+    render_cache = get_render_cache()
+    cache_key = None
+    if render_cache is not None:
+        cache_key = render_cache.make_key(mermaid_script, width=width, height=height, fmt=",".join(formats))
+        cached_png_file = render_cache.get(cache_key)
+        if cached_png_file is not None:
+            get_artifact_store().touch(cached_png_file)
+            notify_diagram_generated(cached_png_file)
+            return describe_diagram_parts(cached_png_file)
     
-    # スクリプトファイル書き込み
+    # 成果物ストアに一意な ID で登録し、スクリプトを書き込む（同じ秒に生成しても上書きしない）
+    artifact_store = get_artifact_store()
     try:
-        with open(mmd_file, 'w', encoding='utf-8') as f:
-            f.write(mermaid_script)
+        artifact = artifact_store.create(mermaid_script)
     except Exception as e:
         raise RuntimeError(f"Failed to write mermaid script file: {str(e)}")
+    mmd_file = artifact.script_file
+    png_file = artifact.image_file
+    
+    # 大きすぎるダイアグラムは部分に分割して並列にレンダリングし、部分どうしのつながりを示す全体図を png_file にする
+    partition = partition_mermaid_script(mermaid_script)
+    remove_diagram_parts(png_file)
+    failed_parts = []
+    if partition is not None:
+        with trace_span("diagram.partitioned_render", kind="tool", parts=len(partition.parts)):
+            results = render_partitioned_diagram(partition, png_file, render_mermaid_file, width=width, height=height)
+        failed_parts = [f"- {part_png_file}: {error}" for part_png_file, error in results if error]
+    else:
+        render_mermaid_file(mmd_file, png_file, width, height)
+        # SVG など PNG 以外のフォーマット（分割した場合は PNG のみ）
+        for fmt in formats[1:]:
+            render_mermaid_file(mmd_file, format_file(png_file, fmt), width, height)
+
+    # 画面には縮小版を表示するので、ここで作っておく（UI のイベントループで画像をデコードしない）
+    ensure_preview(png_file)
+    artifact_store.publish(artifact)
+    if render_cache is not None and not failed_parts:
+        render_cache.put(cache_key, png_file, mmd_file, extra_files=diagram_files(png_file))
+    notify_diagram_generated(png_file)
+    result = describe_diagram_parts(png_file)
+    if failed_parts:
+        result += "\n生成に失敗した部分:\n" + "\n".join(failed_parts)
+    return result
+
+def render_mermaid_file(mmd_file, png_file, width=2048, height=2048, timeout=60):
+    """
+    Mermaid スクリプトファイルから PNG を生成する（常駐レンダラープール、利用できない場合は mmdc の単発実行）。
+    png_file の拡張子が .svg の場合は SVG を生成する。
+    MERMAID_RENDER_ENGINE=python（auto で mmdc がない場合も）なら、対応するダイアグラムは mermaid_svg.py で描画する。
+
+    Raises:
+        RuntimeError: ダイアグラム生成に失敗した場合
+        FileNotFoundError: mmdc コマンドが見つからない場合
+    """
+    with trace_span("render.builtin"):
+        if try_render_file(mmd_file, png_file, width=width, height=height):
+            return png_file
+
+    renderer_pool = get_renderer_pool()
+    if renderer_pool is not None:
+        try:
+            with trace_span("subprocess.render_pool", kind="subprocess", workers=renderer_pool.size):
+                renderer_pool.render(mmd_file, png_file, width=width, height=height,
+                                     fmt=os.path.splitext(png_file)[1].lstrip("."), timeout=timeout)
+            return png_file
+        except RendererUnavailableError:
+            pass
     
     # mmdc コマンド確認
     mmdc_path = shutil.which("mmdc")
@@ -110,14 +233,16 @@ def generate_mermaid_diagram_tool(mermaid_script: str) -> str:
     
     # ダイアグラム生成
     try:
-        result = subprocess.run(
-            [mmdc_path, '-i', mmd_file, '-o', png_file, '--width', '2048', '--height', '2048'],
-            capture_output=True,
-            text=True,
-            shell=False,
-            encoding='utf-8',
-            timeout=60
-        )
+        # 停止ボタンでエージェントの実行が止められた場合は mmdc を kill する
+        with trace_span("subprocess.mmdc", kind="subprocess"):
+            result = run_child_process(
+                [mmdc_path, '-i', mmd_file, '-o', png_file, '--width', str(width), '--height', str(height)],
+                capture_output=True,
+                text=True,
+                shell=False,
+                encoding='utf-8',
+                timeout=timeout
+            )
         
         if result.returncode != 0:
             error_msg = f"mmdc failed (exit code {result.returncode})"
@@ -129,49 +254,331 @@ def generate_mermaid_diagram_tool(mermaid_script: str) -> str:
         
         if not os.path.exists(png_file):
             raise RuntimeError("Diagram file was not created")
-        
         return png_file
         
     except subprocess.TimeoutExpired:
-        raise RuntimeError("Diagram generation timed out (60 seconds)")
+        raise RuntimeError(f"Diagram generation timed out ({timeout} seconds)")
     except Exception as e:
-        if isinstance(e, RuntimeError):
-            raise  # RuntimeErrorは再発生
+        if isinstance(e, (RuntimeError, RunCancelled)):
+            raise  # RuntimeError と停止は再発生
         raise RuntimeError(f"Unexpected error during diagram generation: {str(e)}")
 
-# SQLcl MCPクライアントの設定
-sqlcl_server_parameters = StdioServerParameters(
-    command="D:\\tools\\sqlcl\\bin\\sql.exe",
-    args=["-mcp"],
+# SQLcl MCPのセッションプール（SQLcl は最初のエージェント作成時に起動する。パスは SQLCL_MCP_COMMAND で変更可）
+sqlcl_mcp_pool = create_sqlcl_mcp_pool()
+
+def start_sqlcl_mcp_pool():
+    sqlcl_mcp_pool.get_tools()
+    return sqlcl_mcp_pool
+
+services.register("sqlcl_mcp", start_sqlcl_mcp_pool)
+
+def run_catalog_query(sql):
+    run_sql_tool = next(tool for tool in sqlcl_mcp_pool.get_tools() if tool.name == "run_sql")
+    arguments = {"sql": sql}
+    # SQLcl のバージョンによっては、呼び出し元のクライアント名とモデル名も引数に取る
+    for name, value in (("mcp_client", "system-design-agent"), ("model", model_service.get().model_id)):
+        if name in run_sql_tool.inputs:
+            arguments[name] = value
+    return sqlcl_mcp_pool.call_tool("run_sql", **arguments)
+
+# データディクショナリのメタデータをまとめて取得してキャッシュし、同じスキーマの図は DB への問い合わせなしで描く
+schema_catalog = SchemaCatalogCache(
+    run_catalog_query,
+    db_file=os.getenv("SCHEMA_CATALOG_DB", os.path.join("cache", "schema_catalog.sqlite")),
+    ttl=int(os.getenv("SCHEMA_CATALOG_TTL", "3600"))
 )
-sqlcl_mcp_client = MCPClient(
-    server_parameters=sqlcl_server_parameters,
-    structured_output=False
+
+@tool
+def lookup_schema_catalog_tool(table_names: str = "", output_format: str = "mermaid", refresh: bool = False) -> str:
+    """
+    接続中の DB スキーマの表・カラム・主キー・一意キー・外部キーをキャッシュから返すツール。
+    データディクショナリ（USER_TABLES、USER_TAB_COLUMNS、USER_CONSTRAINTS など）を run_sql で問い合わせる前に、
+    必ずこのツールを使ってください。先に connect ツールで DB に接続しておく必要があります。
+
+    Args:
+        table_names: 対象の表名のカンマ区切り（空の場合はすべての表。末尾の * は前方一致。例: "SALES, CUST*"）
+        output_format: "mermaid"（ER 図の Mermaid スクリプト。そのまま generate_mermaid_diagram_tool に渡せる）または "tables"（表名とカラム数の一覧）
+        refresh: True の場合はキャッシュを使わずに読み込み直す（DDL を実行した直後など）
+
+    Returns:
+        str: ER 図の Mermaid スクリプト、または表の一覧
+    """
+    if output_format not in ("mermaid", "tables"):
+        raise ValueError("output_format must be 'mermaid' or 'tables'")
+    return schema_catalog.describe(
+        schema_key_for(sqlcl_mcp_pool.connect_args),
+        table_names=[name for name in table_names.split(",") if name.strip()],
+        output_format=output_format,
+        refresh=refresh
+    )
+
+@tool
+def edit_mermaid_diagram_tool(diagram_file: str, operations: str) -> str:
+    """
+    生成済みのダイアグラムに差分の操作（ノード・エッジの追加・削除・名前の変更など）だけを適用し、画像を生成し直すツール。
+    既存の flowchart/graph や ER 図への修正依頼では、スクリプト全体を書き直さずにこのツールを使ってください。
+    操作を適用してもダイアグラムが変わらない場合は、画像を生成し直さずに元の画像ファイルのパスを返します。
+
+    Args:
+        diagram_file: 編集するダイアグラムの PNG ファイル（または .mmd ファイル）のパス、または成果物の ID
+        operations: 操作の JSON 配列。使える操作は次のとおり（label, shape, subgraph, arrow は省略可）。
+            {"op": "add_node", "id": "Cache", "label": "キャッシュ", "shape": "database", "subgraph": "Backend"}
+            {"op": "remove_node", "id": "Cache"}（つながるエッジも削除）
+            {"op": "rename_node", "id": "API", "label": "API Gateway", "new_id": "Gateway"}
+            {"op": "add_edge", "from": "API", "to": "Cache", "label": "参照", "arrow": "-->"}
+            {"op": "remove_edge", "from": "API", "to": "DB"}
+            ER 図ではさらに add_node の "attributes": ["NUMBER ID PK"]、add_edge の arrow にカーディナリティ（"||--o{" など）、
+            {"op": "add_attribute", "node": "CUSTOMERS", "attribute": "VARCHAR2(50) CUST_EMAIL"}、
+            {"op": "remove_attribute", "node": "CUSTOMERS", "name": "CUST_EMAIL"} が使えます。
+
+    Returns:
+        str: 生成されたPNGファイルのパス
+
+    Raises:
+        ValueError: ダイアグラムが見つからない・編集できない種類の場合、または操作に誤りがある場合（操作の番号付きで返す）
+        RuntimeError: ダイアグラム生成に失敗した場合
+    """
+    script_file = re.sub(r'\.png$', '.mmd', get_artifact_store().resolve_image_file(diagram_file))
+    try:
+        diagram = get_diagram_model(script_file)
+    except FileNotFoundError:
+        raise ValueError(f"Diagram script not found: {script_file}")
+
+    edited_script = apply_operations(diagram, operations).to_script()
+
+    # 変化がなければ描き直さない
+    png_file = re.sub(r'\.mmd$', '.png', script_file)
+    if edited_script == diagram.to_script() and os.path.exists(png_file):
+        notify_diagram_generated(png_file)
+        return png_file
+    return generate_mermaid_diagram_tool(edited_script)
+
+# reset=False で会話を続けてもメモリが膨らみ続けないよう、ステップごとにトークン予算内へ圧縮する
+memory_compactor = AgentMemoryCompactor(
+    token_budget=int(os.getenv("AGENT_MEMORY_TOKEN_BUDGET", "30000"))
 )
-sqlcl_tools = sqlcl_mcp_client.get_tools()
-
-agent = CodeAgent(
-    tools=[get_mermaid_script_guidelines_tool, generate_mermaid_diagram_tool, *sqlcl_tools],  
-    model=model,
-    use_structured_outputs_internally=False,
-    max_steps=10,
-    additional_authorized_imports=["json"],
-    stream_outputs=True
+
+# compact モードでは、DB に関係しない依頼のときは SQLcl MCP とスキーマカタログのツールの説明をシステムプロンプトから省く
+tool_selector = ToolSelector({
+    "database": r"(?<![a-z])(db|database|sql[a-z]*|oracle|schema|tables?|columns?|ddl|er ?diagram|erd)(?![a-z])|データベース|スキーマ|テーブル|カラム|接続|表領域|ER ?図",
+})
+
+def create_agent():
+    database_tools = [lookup_schema_catalog_tool, *sqlcl_mcp_pool.get_tools()]
+    tools = trace_tools([get_mermaid_script_guidelines_tool, generate_er_diagram_script_from_ddl_tool, generate_mermaid_diagram_tool, edit_mermaid_diagram_tool, *database_tools])
+    agent = CodeAgent(
+        tools=tools,
+        model=TracedModel(model_service.get()),
+        # AGENT_PROMPT_MODE=compact ではステップごとに送るシステムプロンプトとツールの説明を短くする
+        prompt_templates=agent_prompt_templates(tools),
+        use_structured_outputs_internally=False,
+        max_steps=10,
+        additional_authorized_imports=["json"],
+        stream_outputs=True,
+        step_callbacks=[memory_compactor, trace_step_callback]
+    )
+    return tool_selector.register(agent, database=database_tools)
+
+# Gradio のセッションごとにエージェント（会話メモリ）を分け、同時実行数を制限する
+agent_pool = SessionAgentPool(
+    create_agent,
+    max_concurrent_runs=int(os.getenv("AGENT_MAX_CONCURRENT_RUNS", "4")),
+    idle_timeout=int(os.getenv("AGENT_SESSION_IDLE_TIMEOUT", "1800"))
 )
 
-def process_user_message_with_agent(user_message):
+# セッションごとの実行中の停止トークン（「停止」「クリア」ボタンで実行を止める）
+active_runs = {}
+
+# セマンティックキャッシュから再利用したダイアグラム（会話メモリにないので、次の依頼に対象のファイルを添える）
+reused_diagrams = {}
+
+async def process_user_message_with_agent(user_message, request: gr.Request = None):
     if not user_message.strip():
-        return "システム要件を入力してください。", "ステータス: 入力待ち", "", "", None, ""
+        yield "システム要件を入力してください。", "ステータス: 入力待ち", "", None, None, "", ""
+        return
     
+    session_id = request.session_hash if request is not None else "default"
+    cancel_token = CancellationToken(session_id=session_id)
+    active_runs[session_id] = cancel_token
+    ticket = agent_pool.admit(session_id)
+    replay_model = None
+    try:
+        # 同時実行数の上限に達している間は順番待ちの位置を表示する（待っている間はスレッドを占有しない）
+        while not await ticket.wait_async(timeout=1.0):
+            yield "", f"ステータス: 順番待ち（{ticket.position} 番目）", "", None, None, "", ""
+        yield "", "ステータス: 実行中", "", None, None, "", ""
+
+        # エージェントの作成は LLM クライアントの初期化を待つことがあるので、イベントループの外で行う
+        agent = await asyncio.to_thread(agent_pool.get_agent, session_id)
+        if get_prompt_mode() == "compact":
+            tool_selector.select(agent, user_message)
+
+        # 新しい会話では、過去の要件とほぼ同じ依頼には保存済みのダイアグラムを返し、近い依頼には過去のスクリプトを下書きとして渡す
+        semantic_cache = get_semantic_cache()
+        new_conversation = not agent.memory.steps and session_id not in reused_diagrams
+        match = None
+        if semantic_cache is not None and new_conversation:
+            match = await asyncio.to_thread(semantic_cache.lookup, user_message)
+        if match is not None and match.kind == "hit":
+            reused_diagrams[session_id] = match.image_file
+            get_artifact_store().touch(match.image_file)
+            script_file, downloads, preview_image, script_content = load_diagram(match.image_file)
+            yield (
+                f"過去の同じ要件のダイアグラムを再利用しました: {match.image_file}\n\n過去の要件: {match.requirement}",
+                "ダイアグラムが正常に生成されました（過去の要件のダイアグラムを再利用）。",
+                script_file,
+                downloads,
+                preview_image,
+                script_content,
+                "セマンティックキャッシュ: " + json.dumps(semantic_cache.stats(), ensure_ascii=False)
+            )
+            return
+        task_message = user_message
+        if match is not None:
+            task_message = f"{user_message}\n\n{match.draft_prompt()}"
+        elif session_id in reused_diagrams:
+            task_message = f"{user_message}\n\n（直前に表示したダイアグラム: {reused_diagrams.pop(session_id)}）"
+
+        # 同じ形の依頼で成功した手順があれば、文面が同じなら LLM の代わりに再生し、違えば手本として添える
+        trajectory_cache = get_trajectory_cache()
+        trajectory = None
+        if trajectory_cache is not None and new_conversation:
+            trajectory = await asyncio.to_thread(trajectory_cache.lookup, user_message)
+        if trajectory is not None and trajectory.kind == "replay":
+            replay_model = trajectory_cache.replay_model(agent.model, agent, trajectory)
+            agent.model = replay_model
+        elif trajectory is not None:
+            task_message = f"{task_message}\n\n{trajectory.exemplar_prompt()}"
+
+        # 実行が終わったら、LLM・ツール・子プロセスごとの所要時間を診断情報に表示する
+        trace_id = new_trace_id()
+        outputs = None
+        started = time.perf_counter()
+        async for outputs in run_agent_task(agent, task_message, trace_id, cancel_token):
+            yield (*outputs, "")
+        if outputs is not None:
+            # 新しい会話の要件から生成できたダイアグラムを、次の類似した依頼のためにキャッシュに追加する
+            succeeded = str(outputs[1]).startswith("ダイアグラムが正常に生成されました") and outputs[5]
+            if semantic_cache is not None and new_conversation and succeeded:
+                await asyncio.to_thread(
+                    semantic_cache.add, user_message, outputs[5], re.sub(r'\.mmd$', '.png', outputs[2]),
+                    time.perf_counter() - started, match
+                )
+            if trajectory_cache is not None and new_conversation and succeeded:
+                action_steps = [step for step in agent.memory.steps if isinstance(step, ActionStep)]
+                await asyncio.to_thread(
+                    trajectory_cache.record, user_message, trajectory_steps(action_steps, agent.tools),
+                    len(action_steps), time.perf_counter() - started
+                )
+            diagnostics = (format_trace_timeline(trace_id)
+                           + "\n\nシステムプロンプト: " + format_prompt_budget(measure_prompt_sections(agent))
+                           + "\nSQLcl MCP プール: " + json.dumps(sqlcl_mcp_pool.stats(), ensure_ascii=False)
+                           + "\nスキーマカタログ: " + json.dumps(schema_catalog.stats(), ensure_ascii=False))
+            router = find_routing_model(model_service.get())
+            if router is not None:
+                diagnostics += "\nLLM プロバイダー: " + json.dumps(router.stats(), ensure_ascii=False)
+            if semantic_cache is not None:
+                diagnostics += "\nセマンティックキャッシュ: " + json.dumps(semantic_cache.stats(), ensure_ascii=False)
+            if trajectory_cache is not None:
+                diagnostics += "\nトラジェクトリキャッシュ: " + json.dumps(trajectory_cache.stats(), ensure_ascii=False)
+            yield (*outputs, diagnostics)
+    finally:
+        if active_runs.get(session_id) is cancel_token:
+            del active_runs[session_id]
+        # 画面側で取り消された場合もエージェントを止める。エージェントのスレッドが止まるまでは
+        # 同じセッションの次の実行を受け付けない（会話メモリを壊さないため）
+        if not cancel_token.finished:
+            cancel_token.cancel()
+        if replay_model is not None:
+            # 再生用のモデルは、エージェントのスレッドが止まってから元のモデルに戻す
+            cancel_token.when_finished(lambda: setattr(agent, "model", replay_model.model))
+        cancel_token.when_finished(ticket.release)
+
+def stop_agent_run(request: gr.Request = None):
+    session_id = request.session_hash if request is not None else "default"
+    cancel_token = active_runs.get(session_id)
+    if cancel_token is None:
+        return "ステータス: 実行中のタスクはありません"
+    cancel_token.cancel()
+    return "ステータス: 停止しました"
+
+def load_diagram(image_file):
+    # mmd は png の拡張子を置換して導出（ディレクトリ探索はしない）。
+    # 画像はデコードせずにパスで渡し、画面には縮小版、フル解像度はダウンロード用のファイルとして渡す
+    script_file = re.sub(r'\.png$', '.mmd', image_file)
+    preview_image = ensure_preview(image_file)
+
+    script_content = ""
+    if os.path.exists(script_file):
+        try:
+            with open(script_file, 'r', encoding='utf-8') as f:
+                script_content = f.read()
+        except Exception as e:
+            script_content = f"スクリプトファイル読み込みエラー: {str(e)}"
+    return script_file, diagram_downloads(image_file), preview_image, script_content
+
+def format_action_step(step):
+    lines = [f"【ステップ {step.step_number}】"]
+    if step.model_output:
+        lines.append(str(step.model_output).strip())
+    elif step.code_action:
+        lines.append(step.code_action)
+    if step.observations:
+        lines.append(f"実行結果:\n{step.observations.strip()}")
+    if step.error:
+        lines.append(f"エラー: {step.error}")
+    return "\n".join(lines)
+
+async def run_agent_task(agent, user_message, trace_id=None, cancel_token=None):
+    progress_log = []
+    streaming_text = ""
+    step_number = 1
+    image_file = ""
+    downloads = None
+    script_file = ""
+    script_content = ""
+    preview_image = None
+    result = None
+
     try:   
         task_prompt = f"""
         ユーザーメッセージ：{user_message}
         """
-        result = agent.run(
-            task=task_prompt,
+        # ステップごとの計画・コード・実行結果とトークン単位の出力を逐次画面に反映する
+        async for event in astream_agent_run(
+            agent,
+            task_prompt,
+            trace_id=trace_id,
+            cancel_token=cancel_token,
             reset=False,  # 会話をリセットするかどうか。リセットする場合はTrue、しない場合はFalse
             max_steps=10   # 最大10ステップで制限
-        )
+        ):
+            if isinstance(event, ChatMessageStreamDelta):
+                streaming_text += event.content or ""
+                status_text = f"ステータス: ステップ {step_number} を生成中"
+            elif isinstance(event, PlanningStep):
+                progress_log.append(f"【計画】\n{event.plan.strip()}")
+                streaming_text = ""
+                status_text = "ステータス: 計画を作成しました"
+            elif isinstance(event, ActionStep):
+                progress_log.append(format_action_step(event))
+                streaming_text = ""
+                step_number = event.step_number + 1
+                status_text = f"ステータス: ステップ {event.step_number} を実行しました"
+            elif isinstance(event, DiagramGenerated):
+                # 最終回答を待たずに生成されたダイアグラムを表示する
+                if os.path.exists(event.image_file):
+                    image_file = event.image_file
+                    script_file, downloads, preview_image, script_content = load_diagram(image_file)
+                status_text = "ステータス: ダイアグラムを生成しました。回答を作成中"
+            elif isinstance(event, FinalAnswerStep):
+                result = event.output
+                continue
+            else:
+                continue
+
+            progress_text = "\n\n".join(progress_log + ([streaming_text] if streaming_text else []))
+            yield progress_text, status_text, script_file, downloads, preview_image, script_content
         
         # agent.runの戻り値からファイルパス名を抽出
         result_str = str(result)
@@ -179,66 +586,57 @@ def process_user_message_with_agent(user_message):
         # エージェントの応答は純粋な結果文字列を使用
         response_text = result_str
 
-        # CodeAgent の戻り値テキストから .png パスを抽出し、拡張子置換で .mmd を導出（ディレクトリ探索はしない）
-        png_pattern = r'output[/\\]mermaid_diagram_\d{8}_\d{6}\.png'
-
-        png_match = re.search(png_pattern, result_str)
-
-        if png_match:
-            image_file = png_match.group(0)
-            # mmd は result には含まれないため、png の拡張子を置換して導出
-            script_file = re.sub(r'\.png$', '.mmd', image_file)
+        # CodeAgent の戻り値テキストに含まれる成果物の ID をインデックスから引く（なければ実行中に生成されたダイアグラムを使う）
+        artifacts = get_artifact_store().find_in_text(result_str)
+        if artifacts:
+            image_file = artifacts[0].image_file
 
+        if image_file:
             if os.path.exists(image_file):
-                generated_image = Image.open(image_file)
-
-                script_content = ""
-                if script_file and os.path.exists(script_file):
-                    try:
-                        with open(script_file, 'r', encoding='utf-8') as f:
-                            script_content = f.read()
-                    except Exception as e:
-                        script_content = f"スクリプトファイル読み込みエラー: {str(e)}"
+                script_file, downloads, preview_image, script_content = load_diagram(image_file)
 
                 status_text = "ダイアグラムが正常に生成されました。"
-                if not script_file:
+                if not script_content:
                     status_text += " スクリプトファイルが見つかりません。"
 
-                return (
+                yield (
                     response_text,
                     status_text,
                     script_file,
-                    image_file,
-                    generated_image,
+                    downloads,
+                    preview_image,
                     script_content
                 )
             else:
-                return (
+                yield (
                     response_text,
                     f"エラー: 画像ファイル '{image_file}' が存在しません。",
-                    script_file if 'script_file' in locals() else "",
-                    image_file,
+                    re.sub(r'\.png$', '.mmd', image_file),
+                    None,
                     None,
                     ""
                 )
         else:
             # 画像ファイルの記載がエージェント応答に無い場合はテキスト応答を返す
-            return (
+            yield (
                 response_text,
                 "タスク完了: テキスト応答",
                 "",
-                "",
+                None,
                 None,
                 ""
             )
         
+    except RunCancelled:
+        yield "\n\n".join(progress_log), "ステータス: 停止しました", script_file, downloads, preview_image, script_content
     except Exception as e:
         error_msg = f"エラーが発生しました: {str(e)}"
         status_msg = f"エラーステータス: {type(e).__name__}"
-        return error_msg, status_msg, "", "", None, ""
+        yield error_msg, status_msg, "", None, None, ""
 
-def clear_all():
-    return "", "", "", "", "", None, ""
+def clear_all(request: gr.Request = None):
+    stop_agent_run(request)
+    return "", "", "", "", None, None, "", ""
 
 with gr.Blocks(title="システム設計支援エージェント") as interface:
     gr.Markdown("# システム設計支援エージェント")
@@ -254,6 +652,7 @@ with gr.Blocks(title="システム設計支援エージェント") as interface:
             )
             with gr.Row():
                 send_btn = gr.Button("送信", variant="primary")
+                stop_btn = gr.Button("停止", variant="stop")
                 clear_btn = gr.Button("クリア", variant="secondary")
             
         with gr.Column():
@@ -277,11 +676,10 @@ with gr.Blocks(title="システム設計支援エージェント") as interface:
                     max_lines=1,
                     show_copy_button=True
                 )
-                image_file_output = gr.Textbox(
-                    label="画像ファイル名",
-                    lines=1,
-                    max_lines=1,
-                    show_copy_button=True
+                image_file_output = gr.File(
+                    label="画像ファイル（フル解像度。クリックでダウンロード）",
+                    file_count="multiple",
+                    interactive=False
                 )
                 script_output = gr.Textbox(
                     label="生成されたスクリプト",
@@ -289,25 +687,44 @@ with gr.Blocks(title="システム設計支援エージェント") as interface:
                     max_lines=25,
                     show_copy_button=True
                 )
+            with gr.Accordion("診断情報", open=False):
+                diagnostics_output = gr.Textbox(
+                    label="直近の実行のタイムライン（LLM・ツール・子プロセスごとの所要時間）",
+                    lines=15,
+                    max_lines=30,
+                    show_copy_button=True
+                )
     
     with gr.Row():
         image_output = gr.Image(
-            label="ダイアグラム",
-            type="pil",
+            label="ダイアグラム（縮小版）",
+            type="filepath",
             height=1024,
             show_download_button=True
         )
     
-    send_btn.click(
+    send_event = send_btn.click(
         fn=process_user_message_with_agent,
         inputs=[user_message],
-        outputs=[result_output, status_output, script_file_output, image_file_output, image_output, script_output]
+        outputs=[result_output, status_output, script_file_output, image_file_output, image_output, script_output, diagnostics_output],
+        concurrency_limit=None  # 同時実行数は agent_pool で制御する
+    )
+    
+    # 実行中のエージェント・LLM のストリーミング・mmdc などの子プロセスを止める
+    stop_btn.click(
+        fn=stop_agent_run,
+        inputs=[],
+        outputs=[status_output],
+        cancels=[send_event]
     )
     
     clear_btn.click(
         fn=clear_all,
         inputs=[],
-        outputs=[user_message, result_output, status_output, script_file_output, image_file_output, image_output, script_output]
+        outputs=[user_message, result_output, status_output, script_file_output, image_file_output, image_output, script_output, diagnostics_output],
+        cancels=[send_event]
     )
 
-interface.launch(share=False)
\ No newline at end of file
+if __name__ == "__main__":
+    # 画面はすぐに提供し、LLM クライアントなどはバックグラウンドで初期化する
+    launch_with_readiness(interface, services, preload_modules=("litellm",))
@@ -0,0 +1,159 @@
+"""
+エージェントメモリの圧縮
+
+agent.run を reset=False で呼ぶと、過去のターンのステップ（長い Mermaid スクリプト、ツールの出力、
+MCP の問い合わせ結果など）がすべてメモリに残り、以降の LLM 呼び出しのたびに再送される。
+このモジュールはトークン数の予算を設け、古いステップを次の順で圧縮する。
+
+1. 古いステップの model_input_messages を破棄する（LLM には再送されないがメモリを圧迫する）
+2. Mermaid スクリプトはダイアグラムの種類ごとに最新のものだけを残し、古い版は省略表記に置き換える
+3. 予算を超えている場合、古いステップの長い実行結果（observations）を先頭と末尾だけに切り詰める
+4. それでも超えている場合、古いステップを 1 つの要約ステップにまとめる
+
+タスク（ユーザーの要件）と直近のステップはそのまま残すので、現在のダイアグラムの文脈は失われない。
+"""
+
+import re
+
+from smolagents.memory import ActionStep, PlanningStep, TaskStep
+
+MERMAID_SCRIPT = re.compile(
+    r'(?P<quote>"""|\'\'\')(?P<script>\s*(?P<kind>erDiagram|flowchart|graph|sequenceDiagram|classDiagram|stateDiagram(?:-v2)?|gantt|mindmap)\b.*?)(?P=quote)',
+    re.DOTALL
+)
+OMITTED_SCRIPT = "（古い {kind} スクリプトは省略。最新版は後のステップを参照）"
+
+
+def estimate_tokens(text):
+    """トークン数を概算する（ASCII は 4 文字で 1 トークン、日本語などはおおむね 1 文字 1 トークン）"""
+    if not text:
+        return 0
+    ascii_chars = sum(1 for char in text if ord(char) < 128)
+    return ascii_chars // 4 + (len(text) - ascii_chars)
+
+
+def _step_text(step):
+    if isinstance(step, TaskStep):
+        return step.task or ""
+    if isinstance(step, PlanningStep):
+        return step.plan or ""
+    if isinstance(step, ActionStep):
+        parts = [step.model_output or "", step.observations or "", str(step.error or "")]
+        for tool_call in step.tool_calls or []:
+            parts.append(str(tool_call.arguments))
+        return "\n".join(str(part) for part in parts)
+    return ""
+
+
+def _truncate(text, max_chars):
+    if text is None or len(text) <= max_chars:
+        return text
+    head = max_chars * 2 // 3
+    tail = max_chars - head
+    return f"{text[:head]}\n…（{len(text) - max_chars} 文字省略）…\n{text[-tail:]}"
+
+
+class AgentMemoryCompactor:
+    """
+    エージェントメモリをトークン予算内に収める。CodeAgent の step_callbacks にそのまま登録できる。
+
+    Args:
+        token_budget: メモリ全体（システムプロンプトを含む）のトークン数の目安
+        keep_recent_steps: 圧縮せずに残す直近のアクションステップ数
+        max_observation_chars: 古いステップの実行結果を切り詰める文字数
+    """
+
+    def __init__(self, token_budget=30000, keep_recent_steps=4, max_observation_chars=1500):
+        self.token_budget = token_budget
+        self.keep_recent_steps = keep_recent_steps
+        self.max_observation_chars = max_observation_chars
+        self.compactions = 0
+
+    def __call__(self, memory_step, agent=None):
+        if agent is not None:
+            self.compact(agent.memory)
+
+    def estimate(self, memory):
+        """メモリ全体のトークン数を概算する"""
+        system_prompt = getattr(memory.system_prompt, "system_prompt", "") or ""
+        return estimate_tokens(system_prompt) + sum(estimate_tokens(_step_text(step)) for step in memory.steps)
+
+    def compact(self, memory):
+        """
+        メモリを圧縮する。
+
+        Returns:
+            int: 圧縮後のトークン数の概算
+        """
+        steps = memory.steps
+        action_steps = [step for step in steps if isinstance(step, ActionStep)]
+        recent_steps = action_steps[-self.keep_recent_steps:] if self.keep_recent_steps else []
+        recent_ids = {id(step) for step in recent_steps}
+        old_steps = [step for step in action_steps if id(step) not in recent_ids]
+
+        for step in action_steps[:-1]:
+            step.model_input_messages = None
+        self._keep_latest_scripts(action_steps)
+
+        tokens = self.estimate(memory)
+        if tokens <= self.token_budget or not old_steps:
+            return tokens
+
+        for step in old_steps:
+            step.observations = _truncate(step.observations, self.max_observation_chars)
+            step.observations_images = None
+        tokens = self.estimate(memory)
+        if tokens <= self.token_budget:
+            return tokens
+
+        self._collapse(memory, old_steps)
+        self.compactions += 1
+        return self.estimate(memory)
+
+    def _keep_latest_scripts(self, action_steps):
+        seen_kinds = set()
+        # 新しいステップから順に見て、ダイアグラムの種類ごとに最初に見つかったスクリプトだけを残す
+        for step in reversed(action_steps):
+            step_kinds = set()
+
+            def replace(match):
+                kind = match.group("kind")
+                if kind in seen_kinds:
+                    return f'{match.group("quote")}{OMITTED_SCRIPT.format(kind=kind)}{match.group("quote")}'
+                step_kinds.add(kind)
+                return match.group(0)
+
+            if step.model_output:
+                step.model_output = MERMAID_SCRIPT.sub(replace, str(step.model_output))
+            if step.code_action:
+                step.code_action = MERMAID_SCRIPT.sub(replace, step.code_action)
+            for tool_call in step.tool_calls or []:
+                if isinstance(tool_call.arguments, str):
+                    tool_call.arguments = MERMAID_SCRIPT.sub(replace, tool_call.arguments)
+            seen_kinds |= step_kinds
+
+    def _collapse(self, memory, old_steps):
+        """古いアクションステップと計画ステップを 1 つの要約ステップにまとめる"""
+        summary_lines = ["これまでのステップの要約:"]
+        for step in old_steps:
+            thought = (step.model_output or step.code_action or "").strip().splitlines()
+            line = f"- ステップ {step.step_number}: {thought[0][:200] if thought else '（出力なし）'}"
+            if step.error:
+                line += f" → エラー: {str(step.error)[:200]}"
+            elif step.observations:
+                line += f" → 結果: {step.observations.strip()[:200]}"
+            summary_lines.append(line)
+
+        summary_step = old_steps[0]
+        summary_step.model_output = "\n".join(summary_lines)
+        summary_step.model_output_message = None
+        summary_step.code_action = None
+        summary_step.tool_calls = None
+        summary_step.observations = None
+        summary_step.observations_images = None
+        summary_step.error = None
+
+        # 計画ステップは最新のものだけを残す
+        planning_steps = [step for step in memory.steps if isinstance(step, PlanningStep)]
+        removed_ids = {id(step) for step in old_steps[1:]} | {id(step) for step in planning_steps[:-1]}
+        memory.steps = [step for step in memory.steps if id(step) not in removed_ids]
@@ -0,0 +1,201 @@
+"""
+セッションごとのエージェントプール
+
+Gradio アプリでモジュールレベルの CodeAgent を 1 つだけ使うと、同時アクセスしたユーザー同士で
+会話メモリが混ざってしまう。このモジュールは Gradio のセッションごとに CodeAgent を作成して保持し、
+同時に実行できる agent.run の数を制限する。
+
+- 上限を超えたリクエストは受付キューに入り、キュー内の順番（position）を取得できる
+- 同じセッションのリクエストは 1 件ずつ実行する（セッションのメモリを壊さないため）
+- 一定時間使われていないセッションのエージェントは破棄する
+"""
+
+import asyncio
+import threading
+import time
+
+
+class AdmissionTicket:
+    """受付キューの整理券"""
+
+    def __init__(self, pool, session_id):
+        self._pool = pool
+        self.session_id = session_id
+        self.granted = False
+        self.released = False
+        self._async_waiters = []
+
+    @property
+    def position(self):
+        """キュー内の順番（1 始まり）。実行中の場合は 0"""
+        return self._pool._position(self)
+
+    def wait(self, timeout=None):
+        """
+        実行の順番が来るまで待つ。
+
+        Returns:
+            bool: 実行できる場合は True、timeout までに順番が来なかった場合は False
+        """
+        with self._pool._condition:
+            self._pool._condition.wait_for(lambda: self.granted, timeout)
+            return self.granted
+
+    async def wait_async(self, timeout=None):
+        """wait の非同期版。待っている間はスレッドを占有しない"""
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def notify():
+            try:
+                loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+            except RuntimeError:
+                pass  # イベントループが終了している
+
+        with self._pool._condition:
+            if self.granted:
+                return True
+            self._async_waiters.append(notify)
+        try:
+            await asyncio.wait_for(granted, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with self._pool._condition:
+                if notify in self._async_waiters:
+                    self._async_waiters.remove(notify)
+        return self.granted
+
+    def release(self):
+        """実行終了（または待機の取り消し）を通知する"""
+        self._pool._release(self)
+
+    def __enter__(self):
+        self.wait()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class SessionAgentPool:
+    """
+    セッションごとの CodeAgent を管理するプール。
+
+    Args:
+        agent_factory: 新しいエージェントを作成する関数
+        max_concurrent_runs: 同時に実行できる agent.run の数
+        idle_timeout: この秒数使われなかったセッションのエージェントを破棄する
+        max_sessions: 保持するセッション数の上限（超えた場合は最も古いアイドルセッションから破棄する）
+    """
+
+    def __init__(self, agent_factory, max_concurrent_runs=4, idle_timeout=1800, max_sessions=100):
+        self.agent_factory = agent_factory
+        self.max_concurrent_runs = max_concurrent_runs
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._running = set()
+        self._agents = {}
+        self._last_used = {}
+        self.evictions = 0
+
+    def admit(self, session_id):
+        """
+        受付キューに並ぶ。
+
+        Returns:
+            AdmissionTicket: ticket.wait() で順番を待ち、終了後に ticket.release() を呼ぶ
+        """
+        ticket = AdmissionTicket(self, session_id)
+        with self._condition:
+            self._waiting.append(ticket)
+            self._grant()
+        return ticket
+
+    def _grant(self):
+        for ticket in list(self._waiting):
+            if len(self._running) >= self.max_concurrent_runs:
+                break
+            if ticket.session_id in self._running:
+                continue
+            self._waiting.remove(ticket)
+            self._running.add(ticket.session_id)
+            ticket.granted = True
+            for notify in ticket._async_waiters:
+                notify()
+        self._condition.notify_all()
+
+    def _position(self, ticket):
+        with self._condition:
+            if ticket.granted:
+                return 0
+            try:
+                return self._waiting.index(ticket) + 1
+            except ValueError:
+                return 0
+
+    def _release(self, ticket):
+        with self._condition:
+            if ticket.released:
+                return
+            ticket.released = True
+            if ticket.granted:
+                self._running.discard(ticket.session_id)
+                self._last_used[ticket.session_id] = time.monotonic()
+            elif ticket in self._waiting:
+                self._waiting.remove(ticket)
+            self._evict_idle()
+            self._grant()
+
+    def get_agent(self, session_id):
+        """セッションのエージェントを返す（なければ作成する）"""
+        with self._condition:
+            agent = self._agents.get(session_id)
+            self._last_used[session_id] = time.monotonic()
+        if agent is not None:
+            return agent
+
+        agent = self.agent_factory()
+        with self._condition:
+            # 作成中に同じセッションのエージェントが作られていたらそちらを使う
+            agent = self._agents.setdefault(session_id, agent)
+            self._evict_idle()
+        return agent
+
+    def reset(self, session_id):
+        """セッションのエージェントを破棄する（次回の get_agent で作り直される）"""
+        with self._condition:
+            if session_id not in self._running:
+                self._agents.pop(session_id, None)
+                self._last_used.pop(session_id, None)
+
+    def _evict_idle(self):
+        now = time.monotonic()
+        idle_sessions = [
+            session_id for session_id in self._agents
+            if session_id not in self._running
+        ]
+        idle_sessions.sort(key=lambda session_id: self._last_used.get(session_id, 0))
+
+        for session_id in idle_sessions:
+            expired = now - self._last_used.get(session_id, 0) > self.idle_timeout
+            over_capacity = len(self._agents) > self.max_sessions
+            if not expired and not over_capacity:
+                continue
+            del self._agents[session_id]
+            self._last_used.pop(session_id, None)
+            self.evictions += 1
+
+    def stats(self):
+        """実行中・待機中・保持しているセッションの数を返す"""
+        with self._condition:
+            return {
+                "running": len(self._running),
+                "waiting": len(self._waiting),
+                "sessions": len(self._agents),
+                "max_concurrent_runs": self.max_concurrent_runs,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,167 @@
+"""
+エージェント実行のストリーミング
+
+agent.run(..., stream=True) を専用スレッドで実行し、発生したイベント（トークン単位の出力、
+計画ステップ、アクションステップ、最終回答）を順に返す。Gradio のジェネレーター関数は
+呼び出しごとに別のスレッドで再開されることがあるため、エージェントは 1 つのスレッドで
+最後まで実行し、イベントはキュー経由で受け渡す。
+
+ツールからは notify_diagram_generated() を呼ぶと、実行中のストリームに DiagramGenerated イベントが
+流れるので、最終回答を待たずにダイアグラムを表示できる。
+
+通知先や停止トークンなどの実行ごとの状態は contextvars で持つ。smolagents 1.22 以降の LocalPythonExecutor は
+コードを timeout_seconds 付きの別スレッド（ThreadPoolExecutor）で実行し、そのスレッドにはコンテキストが
+引き継がれないので、ストリーミング実行ではタイムアウトを外してコードをエージェントのスレッドで実行する
+（実行の停止は CancellationToken で行う）。
+
+astream_agent_run() は同じイベントを非同期ジェネレーターで返す。待っている間はスレッドを占有しないので、
+Gradio の async ハンドラから使うと多数のセッションを少ないスレッドで扱える。CancellationToken
+（run_control.py）を渡すと、停止要求でエージェントの実行・LLM のストリーミング・子プロセスを止められる。
+"""
+
+import asyncio
+import contextvars
+import queue
+import threading
+
+from run_control import CancellationToken, RunCancelled, using_token
+from tracing import trace_span
+
+_listener = contextvars.ContextVar("agent_stream_listener", default=None)
+_DONE = object()
+
+
+class DiagramGenerated:
+    """ダイアグラム画像の生成完了イベント"""
+
+    def __init__(self, image_file):
+        self.image_file = image_file
+
+
+class _RunError:
+    def __init__(self, error):
+        self.error = error
+
+
+def notify_diagram_generated(image_file):
+    """
+    ダイアグラム画像が生成されたことを実行中のストリームに通知する。
+    ストリーミング実行中でなければ何もしない。
+    """
+    listener = _listener.get()
+    if listener is not None:
+        listener(DiagramGenerated(image_file))
+
+
+def _run_code_in_agent_thread(agent):
+    """コードの実行を別スレッドに移さないようにする（ツールから実行ごとの状態を参照できるように）"""
+    executor = getattr(agent, "python_executor", None)
+    if getattr(executor, "timeout_seconds", None) is not None:
+        executor.timeout_seconds = None
+
+
+def _start_run(agent, task, trace_id, cancel_token, put, run_kwargs):
+    """エージェントを専用スレッドで実行し、イベントを put に渡す（最後に _DONE を渡す）"""
+    _run_code_in_agent_thread(agent)
+    # 呼び出し元のコンテキスト（トレースのスパンなど）を引き継ぐ
+    context = contextvars.copy_context()
+
+    def run():
+        _listener.set(put)
+        # 停止要求があれば、実行中のステップが終わった時点でエージェントを止める
+        unregister = cancel_token.on_cancel(agent.interrupt)
+        try:
+            with using_token(cancel_token), trace_span("agent.run", kind="agent", trace_id=trace_id, task=task.strip()[:200]):
+                events = agent.run(task, stream=True, **run_kwargs)
+                try:
+                    # トークン単位のイベントごとに停止要求を確認し、LLM のストリーミングも途中で打ち切る
+                    for event in events:
+                        if cancel_token.cancelled:
+                            break
+                        put(event)
+                finally:
+                    events.close()
+                cancel_token.raise_if_cancelled()
+        except Exception as e:
+            put(_RunError(RunCancelled() if cancel_token.cancelled else e))
+        finally:
+            unregister()
+            _listener.set(None)
+            cancel_token.finish()
+            put(_DONE)
+
+    cancel_token.begin()
+    threading.Thread(target=context.run, args=(run,), daemon=True).start()
+
+
+def stream_agent_run(agent, task, trace_id=None, cancel_token=None, **run_kwargs):
+    """
+    エージェントをストリーミング実行し、イベントを順に返すジェネレーター。
+
+    Args:
+        agent: 実行する CodeAgent
+        task: タスク文字列
+        trace_id: 実行全体を記録するトレースの ID（省略時は自動採番）
+        cancel_token: 停止要求を受け取る CancellationToken（省略時は停止できない）
+        **run_kwargs: agent.run に渡す追加引数（reset, max_steps など）
+
+    Yields:
+        ChatMessageStreamDelta, PlanningStep, ActionStep, FinalAnswerStep, DiagramGenerated など
+
+    Raises:
+        RunCancelled: 停止要求によって実行を止めた場合
+        Exception: エージェント実行中に発生した例外
+    """
+    events = queue.Queue()
+    _start_run(agent, task, trace_id, cancel_token or CancellationToken(), events.put, run_kwargs)
+
+    while True:
+        event = events.get()
+        if event is _DONE:
+            break
+        if isinstance(event, _RunError):
+            raise event.error
+        yield event
+
+
+async def astream_agent_run(agent, task, trace_id=None, cancel_token=None, **run_kwargs):
+    """
+    stream_agent_run の非同期版。イベントを待つ間はイベントループを止めない。
+    このジェネレーターが取り消された（asyncio.CancelledError）・閉じられた場合は、エージェントの実行も停止する。
+
+    Args:
+        agent: 実行する CodeAgent
+        task: タスク文字列
+        trace_id: 実行全体を記録するトレースの ID（省略時は自動採番）
+        cancel_token: 停止要求を受け取る CancellationToken（省略時は内部で作成）
+        **run_kwargs: agent.run に渡す追加引数（reset, max_steps など）
+
+    Yields:
+        ChatMessageStreamDelta, PlanningStep, ActionStep, FinalAnswerStep, DiagramGenerated など
+
+    Raises:
+        RunCancelled: 停止要求によって実行を止めた場合
+        Exception: エージェント実行中に発生した例外
+    """
+    cancel_token = cancel_token or CancellationToken()
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def put(event):
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, event)
+        except RuntimeError:
+            pass  # イベントループが終了している（受け取り側がいない）
+
+    _start_run(agent, task, trace_id, cancel_token, put, run_kwargs)
+    try:
+        while True:
+            event = await events.get()
+            if event is _DONE:
+                break
+            if isinstance(event, _RunError):
+                raise event.error
+            yield event
+    finally:
+        if not cancel_token.finished:
+            cancel_token.cancel()
@@ -0,0 +1,244 @@
+"""
+アプリのサービス層（遅延初期化・バックグラウンドのプリウォーム・起動時間の計測）
+
+Gradio アプリを import すると、LLM クライアント（litellm）、SQLcl の MCP サーバ、レンダラープールなどを
+画面を表示する前にすべて初期化していたため、再起動のたびに待たされていた。このモジュールは
+
+- LazyService: 最初に使われた時点で初期化するサービス（初期化は 1 回だけ、スレッドセーフ）
+- ServiceRegistry: サービスをまとめて管理し、起動直後にバックグラウンドで初期化（プリウォーム）する
+- StartupTimer: import ごと・サービスごとの所要時間を記録する
+- launch_with_readiness: Gradio アプリに readiness エンドポイント（GET /ready）を付けて起動する
+
+を提供する。/ready は必須のサービスがすべて初期化済みなら 200、そうでなければ 503 を返し、
+本文にはサービスごとの状態と起動時間の内訳（JSON）を含める。
+
+環境変数:
+    APP_PREWARM          0 でプリウォームしない（最初のリクエストで初期化する）
+    GRADIO_SERVER_NAME   待ち受けるアドレス（既定 127.0.0.1）
+    GRADIO_SERVER_PORT   待ち受けるポート（既定 7860）
+"""
+
+import contextlib
+import importlib
+import os
+import threading
+import time
+
+
+class StartupTimer:
+    """起動処理の所要時間（import ごと、サービスごと）を記録する"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.ready_at = None
+        self.imports = {}
+        self.components = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure_import(self, name):
+        """with ブロック内の import の所要時間を name として記録する"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.imports[name] = self.imports.get(name, 0.0) + time.perf_counter() - started
+
+    def import_module(self, name):
+        """モジュールを import し、所要時間を記録する"""
+        with self.measure_import(name):
+            return importlib.import_module(name)
+
+    def record_component(self, name, seconds):
+        with self._lock:
+            self.components[name] = seconds
+
+    def mark_ready(self):
+        """画面の提供を始めた時点を記録する"""
+        if self.ready_at is None:
+            self.ready_at = time.perf_counter()
+
+    def report(self):
+        """起動時間の内訳（ミリ秒）を返す"""
+        with self._lock:
+            return {
+                "time_to_ready_ms": round((self.ready_at - self.started_at) * 1000, 1) if self.ready_at else None,
+                "imports_ms": {name: round(seconds * 1000, 1) for name, seconds in self.imports.items()},
+                "components_ms": {name: round(seconds * 1000, 1) for name, seconds in self.components.items()},
+            }
+
+    def format_report(self):
+        """起動時間の内訳を表示用の文字列にする"""
+        report = self.report()
+        lines = []
+        if report["time_to_ready_ms"] is not None:
+            lines.append(f"起動から画面の提供開始まで: {report['time_to_ready_ms']:.1f} ms")
+        for title, key in (("import", "imports_ms"), ("サービス初期化", "components_ms")):
+            for name, ms in sorted(report[key].items(), key=lambda item: -item[1]):
+                lines.append(f"  {title:<14} {name:<24} {ms:>10.1f} ms")
+        return "\n".join(lines)
+
+
+# アプリ全体で共有するタイマー（このモジュールを最初に import した時点を起動時刻とする）
+startup_timer = StartupTimer()
+
+
+class LazyService:
+    """
+    最初に使われた時点で初期化するサービス。
+
+    Args:
+        name: サービス名
+        factory: 初期化関数（引数なし、サービスのオブジェクトを返す）
+        required: readiness の判定に含めるかどうか（False の場合は初期化に失敗しても ready とみなす）
+        timer: 所要時間を記録する StartupTimer
+    """
+
+    def __init__(self, name, factory, required=True, timer=startup_timer):
+        self.name = name
+        self.factory = factory
+        self.required = required
+        self.timer = timer
+        self.error = None
+        self._value = None
+        self._initialized = False
+        self._initializing = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        サービスを返す。未初期化なら初期化する（初期化中なら完了を待つ）。
+
+        Raises:
+            Exception: 初期化に失敗した場合（次の呼び出しで再試行する）
+        """
+        if self._initialized:
+            return self._value
+        with self._lock:
+            if self._initialized:
+                return self._value
+            self._initializing = True
+            started = time.perf_counter()
+            try:
+                self._value = self.factory()
+                self._initialized = True
+                self.error = None
+            except Exception as e:
+                self.error = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                self._initializing = False
+                self.timer.record_component(self.name, time.perf_counter() - started)
+            return self._value
+
+    def set(self, value):
+        """初期化せずにサービスを差し替える（ベンチマークやテスト用）"""
+        with self._lock:
+            self._value = value
+            self._initialized = True
+            self.error = None
+
+    @property
+    def ready(self):
+        return self._initialized
+
+    def status(self):
+        if self._initialized:
+            return "ready"
+        if self._initializing:
+            return "initializing"
+        if self.error is not None:
+            return "failed"
+        return "pending"
+
+
+class ServiceRegistry:
+    """アプリのサービスをまとめて管理し、プリウォームと readiness の判定を行う"""
+
+    def __init__(self, timer=startup_timer):
+        self.timer = timer
+        self.services = {}
+        self._prewarm_thread = None
+
+    def register(self, name, factory, required=True):
+        """サービスを登録する（この時点では初期化しない）"""
+        service = LazyService(name, factory, required=required, timer=self.timer)
+        self.services[name] = service
+        return service
+
+    def prewarm(self, names=None):
+        """
+        サービスをバックグラウンドのスレッドで順に初期化する。失敗したサービスは最初の利用時に再試行される。
+
+        Returns:
+            threading.Thread | None: プリウォームのスレッド（APP_PREWARM=0 の場合は None）
+        """
+        if os.getenv("APP_PREWARM", "1") == "0":
+            return None
+        services = [self.services[name] for name in names] if names else list(self.services.values())
+
+        def run():
+            for service in services:
+                try:
+                    service.get()
+                except Exception as e:
+                    print(f"Prewarm of {service.name} failed: {type(e).__name__}: {e}")
+
+        self._prewarm_thread = threading.Thread(target=run, name="prewarm", daemon=True)
+        self._prewarm_thread.start()
+        return self._prewarm_thread
+
+    def readiness(self):
+        """readiness の判定結果（サービスごとの状態と起動時間の内訳）を返す"""
+        services = {
+            name: {"status": service.status(), "required": service.required, "error": service.error}
+            for name, service in self.services.items()
+        }
+        ready = all(service.ready for service in self.services.values() if service.required)
+        return {"ready": ready, "services": services, "startup": self.timer.report()}
+
+
+def launch_with_readiness(interface, registry, readiness_path="/ready", preload_modules=()):
+    """
+    Gradio アプリに readiness エンドポイントを付けて起動する（戻らない）。サービスのプリウォームは
+    サーバの起動が完了した時点で始める。
+
+    Args:
+        interface: gr.Blocks
+        registry: ServiceRegistry
+        readiness_path: readiness エンドポイントのパス
+        preload_modules: サーバの起動前にメインスレッドで import しておくモジュール。
+            litellm は import 中にロギングのフィルタを登録し、そのフィルタが遅延 import を行うため、
+            バックグラウンドで import するとメインスレッドのログ出力と import ロックのデッドロックになる
+    """
+    with startup_timer.measure_import("fastapi/uvicorn"):
+        import gradio as gr
+        import uvicorn
+        from fastapi import FastAPI
+        from fastapi.responses import JSONResponse
+
+    app = FastAPI()
+
+    @app.get(readiness_path)
+    def readiness():
+        result = registry.readiness()
+        return JSONResponse(result, status_code=200 if result["ready"] else 503)
+
+    # mount_gradio_app は既存の startup ハンドラを引き継ぐので、先に登録しておく
+    @app.on_event("startup")
+    def report_startup():
+        startup_timer.mark_ready()
+        print(startup_timer.format_report())
+        # uvicorn も起動中に自身のモジュールを遅延 import するので、プリウォームは起動完了後に始める
+        registry.prewarm()
+
+    app = gr.mount_gradio_app(app, interface, path="")
+
+    for name in preload_modules:
+        startup_timer.import_module(name)
+
+    host = os.getenv("GRADIO_SERVER_NAME", "127.0.0.1")
+    port = int(os.getenv("GRADIO_SERVER_PORT", "7860"))
+    print(f"Running on http://{host}:{port}/ (readiness: http://{host}:{port}{readiness_path})")
+    uvicorn.run(app, host=host, port=port)
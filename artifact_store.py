@@ -0,0 +1,353 @@
+"""
+ダイアグラムの成果物ストア
+
+generate_mermaid_diagram_tool はファイル名を output/mermaid_diagram_%Y%m%d_%H%M%S にしていたため、
+同じ秒に生成した図が互いに上書きし、output/ の直下にはファイルが際限なく増えていた。
+このモジュールは成果物（.mmd / .png と、分割した部分・SVG・縮小版などの派生ファイル）を次のように管理する。
+
+- ID: 生成時刻とランダムな 8 桁の 16 進数（例: 20261017_171803_a1b2c3d4）。ファイル名は mermaid_diagram_<ID>.png
+- 保存先: 日付ごとのディレクトリ（output/2026/10/17/）に分けて 1 つのディレクトリのファイル数を抑える
+- インデックス: SQLite（output/.artifacts.sqlite）にスクリプトのハッシュ・セッション・サイズ・作成／参照時刻を記録する
+- 書き込み: スクリプトは一時ファイルに書いてから置き換え、レンダリングが終わるまでインデックスでは
+  作成中（pending）として扱う
+- 保持期間: バックグラウンドのスレッドで、最終参照から ARTIFACT_MAX_AGE_DAYS を過ぎたもの、合計サイズが
+  ARTIFACT_MAX_MB を超えた分（参照が古い順）、作成中のまま残ったもの、インデックスにない日付ディレクトリ内の
+  ファイルを削除する（output/ 直下の以前の形式のファイルは対象外）
+
+成果物は正規表現とファイルの存在確認ではなく、ID でインデックスから引く（get / find_in_text / resolve_image_file）。
+
+環境変数:
+    ARTIFACT_ROOT: 保存先のディレクトリ（既定 output）
+    ARTIFACT_MAX_AGE_DAYS: 最終参照からの保持日数（既定 30、0 で無期限）
+    ARTIFACT_MAX_MB: 合計サイズの上限（既定 2048、0 で無制限）
+    ARTIFACT_GC_INTERVAL: 削除を実行する間隔の秒数（既定 3600、0 でバックグラウンドの削除を行わない）
+"""
+
+import glob
+import hashlib
+import os
+import re
+import secrets
+import sqlite3
+import threading
+import time
+
+from mermaid_render_cache import normalize_mermaid_script
+from run_control import current_token
+
+ARTIFACT_PREFIX = "mermaid_diagram_"
+ARTIFACT_ID = re.compile(r'(?<![0-9a-f])(\d{8}_\d{6}_[0-9a-f]{8})(?![0-9a-f])')
+
+# 作成中（pending）のまま残った成果物と、インデックスにないファイルを削除するまでの猶予（秒）
+PENDING_GRACE = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    artifact_id TEXT PRIMARY KEY,
+    session_id TEXT,
+    script_hash TEXT NOT NULL,
+    image_file TEXT NOT NULL,
+    script_file TEXT NOT NULL,
+    status TEXT NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_artifacts_access ON artifacts (status, last_access);
+CREATE INDEX IF NOT EXISTS idx_artifacts_script_hash ON artifacts (script_hash);
+CREATE INDEX IF NOT EXISTS idx_artifacts_session ON artifacts (session_id, created_at);
+"""
+
+
+def script_hash(mermaid_script):
+    """正規化したスクリプトのハッシュ（空白・改行の違いは無視する）"""
+    return hashlib.sha256(normalize_mermaid_script(mermaid_script).encode('utf-8')).hexdigest()
+
+
+class Artifact:
+    """成果物 1 つ（image_file / script_file は保存先のパス）"""
+
+    def __init__(self, artifact_id, image_file, script_file, session_id=None, status="ready", size=0,
+                 created_at=None, last_access=None):
+        self.artifact_id = artifact_id
+        self.image_file = image_file
+        self.script_file = script_file
+        self.session_id = session_id
+        self.status = status
+        self.size = size
+        self.created_at = created_at
+        self.last_access = last_access
+
+    @property
+    def files(self):
+        """成果物のファイル（派生ファイルを含む）のうち存在するもの"""
+        base = re.sub(r'\.png$', '', self.image_file)
+        return sorted(glob.glob(glob.escape(base) + ".*") + glob.glob(glob.escape(base) + "_*"))
+
+
+def artifact_id_of(path):
+    """ファイルのパスから成果物の ID を取り出す（成果物のファイルでなければ None）"""
+    name = os.path.basename(path or "")
+    if not name.startswith(ARTIFACT_PREFIX):
+        return None
+    match = ARTIFACT_ID.match(name[len(ARTIFACT_PREFIX):])
+    return match.group(1) if match else None
+
+
+class ArtifactStore:
+    """
+    成果物のファイルとインデックスを管理する。
+
+    Args:
+        root: 保存先のディレクトリ
+        index_file: インデックス（SQLite）のパス（省略時は <root>/.artifacts.sqlite）
+        max_age: 最終参照からの保持秒数（0 で無期限）
+        max_bytes: 合計サイズの上限（0 で無制限）
+    """
+
+    def __init__(self, root="output", index_file=None, max_age=30 * 24 * 3600, max_bytes=2048 * 1024 * 1024):
+        self.root = root
+        self.index_file = index_file or os.path.join(root, ".artifacts.sqlite")
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.created = 0
+        self.deleted = 0
+        self._lock = threading.Lock()
+        self._gc_thread = None
+        self._gc_stop = threading.Event()
+        os.makedirs(root, exist_ok=True)
+        directory = os.path.dirname(self.index_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.index_file, timeout=30)
+
+    def _row_to_artifact(self, row):
+        artifact_id, session_id, image_file, script_file, status, size, created_at, last_access = row
+        return Artifact(artifact_id, image_file, script_file, session_id, status, size, created_at, last_access)
+
+    _COLUMNS = "artifact_id, session_id, image_file, script_file, status, size, created_at, last_access"
+
+    def path_for(self, artifact_id, extension):
+        """ID の成果物のファイルのパス（日付ごとのディレクトリ。例: output/2026/10/17/mermaid_diagram_<ID>.png）"""
+        date = artifact_id[:8]
+        return os.path.join(self.root, date[:4], date[4:6], date[6:8], f"{ARTIFACT_PREFIX}{artifact_id}{extension}")
+
+    def create(self, mermaid_script, session_id=None):
+        """
+        新しい成果物を作成中（pending）として登録し、スクリプトを書き込む。
+
+        Args:
+            mermaid_script: 保存するスクリプト
+            session_id: 生成したセッション（省略時は実行中の CancellationToken の session_id。
+                ツールの引数は LLM が決めるので、ツールの中からは contextvars で引き継いだトークンで参照する）
+
+        Returns:
+            Artifact: image_file にレンダリングし、終わったら publish() を呼ぶ
+        """
+        if session_id is None:
+            session_id = getattr(current_token(), "session_id", None)
+        artifact_id = f"{time.strftime('%Y%m%d_%H%M%S')}_{secrets.token_hex(4)}"
+        artifact = Artifact(artifact_id, self.path_for(artifact_id, ".png"), self.path_for(artifact_id, ".mmd"), session_id, "pending")
+        os.makedirs(os.path.dirname(artifact.script_file), exist_ok=True)
+
+        tmp_file = f"{artifact.script_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(mermaid_script)
+        os.replace(tmp_file, artifact.script_file)
+
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "INSERT INTO artifacts (artifact_id, session_id, script_hash, image_file, script_file, status, size, created_at, last_access) "
+                "VALUES (?, ?, ?, ?, ?, 'pending', 0, ?, ?)",
+                (artifact_id, session_id, script_hash(mermaid_script), artifact.image_file, artifact.script_file, now, now)
+            )
+        with self._lock:
+            self.created += 1
+        artifact.created_at = artifact.last_access = now
+        return artifact
+
+    def publish(self, artifact):
+        """レンダリングが終わった成果物を参照できる状態（ready）にし、ファイルの合計サイズを記録する"""
+        artifact.size = sum(os.path.getsize(path) for path in artifact.files if os.path.isfile(path))
+        artifact.status = "ready"
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE artifacts SET status = 'ready', size = ?, last_access = ? WHERE artifact_id = ?",
+                (artifact.size, time.time(), artifact.artifact_id)
+            )
+        return artifact
+
+    def get(self, artifact_id, touch=True):
+        """
+        ID の成果物を返す（最終参照時刻を更新する）。
+
+        Returns:
+            Artifact | None: 未登録・作成中・画像が削除されている場合は None
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                f"SELECT {self._COLUMNS} FROM artifacts WHERE artifact_id = ? AND status = 'ready'", (artifact_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            artifact = self._row_to_artifact(row)
+            if not os.path.exists(artifact.image_file):
+                # レンダリングキャッシュの追い出しなどで外部から削除されていたらインデックスからも消す
+                connection.execute("DELETE FROM artifacts WHERE artifact_id = ?", (artifact_id,))
+                return None
+            if touch:
+                artifact.last_access = time.time()
+                connection.execute("UPDATE artifacts SET last_access = ? WHERE artifact_id = ?", (artifact.last_access, artifact_id))
+        return artifact
+
+    def touch(self, image_file):
+        """ファイルのパスから成果物の最終参照時刻を更新する（成果物でなければ何もしない）"""
+        artifact_id = artifact_id_of(image_file)
+        return self.get(artifact_id) if artifact_id else None
+
+    def find_in_text(self, text):
+        """
+        テキスト（エージェントの最終回答など）に含まれる ID の成果物を、出てきた順に返す。
+        ID の形をしていてもインデックスにないものは含めない。
+        """
+        artifacts = []
+        for artifact_id in dict.fromkeys(ARTIFACT_ID.findall(text or "")):
+            artifact = self.get(artifact_id)
+            if artifact is not None:
+                artifacts.append(artifact)
+        return artifacts
+
+    def resolve_image_file(self, path_or_id):
+        """成果物の ID またはファイルのパスから画像ファイルのパスを返す（成果物でないパスはそのまま返す）"""
+        value = (path_or_id or "").strip()
+        artifact_id = value if ARTIFACT_ID.fullmatch(value) else artifact_id_of(value)
+        artifact = self.get(artifact_id) if artifact_id else None
+        return artifact.image_file if artifact is not None else re.sub(r'\.mmd$', '.png', value)
+
+    def list_session(self, session_id, limit=20):
+        """セッションの成果物を新しい順に返す"""
+        with self._connect() as connection:
+            rows = connection.execute(
+                f"SELECT {self._COLUMNS} FROM artifacts WHERE session_id = ? AND status = 'ready' "
+                "ORDER BY created_at DESC LIMIT ?", (session_id, limit)
+            ).fetchall()
+        return [self._row_to_artifact(row) for row in rows]
+
+    # ---- 保持期間と削除 ----
+
+    def _delete(self, connection, artifact):
+        for path in artifact.files:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        connection.execute("DELETE FROM artifacts WHERE artifact_id = ?", (artifact.artifact_id,))
+        self.deleted += 1
+
+    def collect_garbage(self):
+        """
+        保持期間・合計サイズの上限を超えた成果物と、作成中のまま残った成果物、インデックスにないファイルを削除する。
+
+        Returns:
+            dict: 理由ごとの削除件数
+        """
+        now = time.time()
+        removed = {"expired": 0, "over_size": 0, "stale": 0, "missing": 0, "orphan_files": 0}
+        with self._lock, self._connect() as connection:
+            rows = connection.execute(f"SELECT {self._COLUMNS} FROM artifacts ORDER BY last_access").fetchall()
+            artifacts = [self._row_to_artifact(row) for row in rows]
+            kept = []
+            for artifact in artifacts:
+                if artifact.status == "pending":
+                    if now - artifact.created_at > PENDING_GRACE:
+                        self._delete(connection, artifact)
+                        removed["stale"] += 1
+                elif not os.path.exists(artifact.image_file):
+                    self._delete(connection, artifact)
+                    removed["missing"] += 1
+                elif self.max_age and now - artifact.last_access > self.max_age:
+                    self._delete(connection, artifact)
+                    removed["expired"] += 1
+                else:
+                    kept.append(artifact)
+
+            total_bytes = sum(artifact.size for artifact in kept)
+            for artifact in kept:
+                if not self.max_bytes or total_bytes <= self.max_bytes:
+                    break
+                self._delete(connection, artifact)
+                total_bytes -= artifact.size
+                removed["over_size"] += 1
+
+            known = {row[0] for row in connection.execute("SELECT artifact_id FROM artifacts")}
+
+        # 日付ごとのディレクトリにあって、インデックスにないファイル（書き込み途中で落ちた残りなど）
+        for path in glob.glob(os.path.join(glob.escape(self.root), "[0-9]" * 4, "[0-9]" * 2, "[0-9]" * 2, "*")):
+            if artifact_id_of(path) in known:
+                continue
+            try:
+                if now - os.path.getmtime(path) > PENDING_GRACE:
+                    os.remove(path)
+                    removed["orphan_files"] += 1
+            except OSError:
+                continue
+        for directory in sorted(glob.glob(os.path.join(glob.escape(self.root), "[0-9]" * 4, "*", "*")) +
+                                glob.glob(os.path.join(glob.escape(self.root), "[0-9]" * 4, "*")) +
+                                glob.glob(os.path.join(glob.escape(self.root), "[0-9]" * 4)), key=len, reverse=True):
+            try:
+                os.rmdir(directory)
+            except OSError:
+                pass
+        return removed
+
+    def start_gc(self, interval):
+        """interval 秒ごとに collect_garbage を実行するバックグラウンドのスレッドを開始する（何度呼んでもよい）"""
+        if interval <= 0 or self._gc_thread is not None:
+            return
+
+        def run():
+            while not self._gc_stop.wait(interval):
+                try:
+                    removed = self.collect_garbage()
+                    if any(removed.values()):
+                        print(f"Artifact store cleanup: {removed}")
+                except Exception as e:
+                    print(f"Artifact store cleanup failed: {type(e).__name__}: {e}")
+
+        self._gc_thread = threading.Thread(target=run, name="artifact-gc", daemon=True)
+        self._gc_thread.start()
+
+    def close(self):
+        self._gc_stop.set()
+
+    def stats(self):
+        """成果物の件数・合計サイズ・作成数・削除数を返す"""
+        with self._connect() as connection:
+            count, total_bytes = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM artifacts WHERE status = 'ready'"
+            ).fetchone()
+        return {"artifacts": count, "bytes": total_bytes, "created": self.created, "deleted": self.deleted}
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_artifact_store():
+    """共有の成果物ストアを返す（初回に保持期間のバックグラウンド削除を開始する）"""
+    global _store
+
+    with _store_lock:
+        if _store is None:
+            _store = ArtifactStore(
+                root=os.getenv("ARTIFACT_ROOT", "output"),
+                max_age=float(os.getenv("ARTIFACT_MAX_AGE_DAYS", "30")) * 24 * 3600,
+                max_bytes=int(os.getenv("ARTIFACT_MAX_MB", "2048")) * 1024 * 1024
+            )
+            _store.start_gc(float(os.getenv("ARTIFACT_GC_INTERVAL", "3600")))
+        return _store
@@ -0,0 +1,354 @@
+"""
+システム設計支援エージェントのバッチ実行（ヘッドレス）
+
+要件プロンプトを 1 行 1 タスクの JSONL から読み込み、Gradio アプリ（既定は 400_system_design_agent_gradio.py）と
+同じエージェント・ツールでダイアグラムをまとめて生成する。
+
+- タスクはワーカープールで並行に実行する（--concurrency）
+- LLM の呼び出しはプロバイダーごとにレート制限し、レート制限・一時的なエラーは指数バックオフで再試行する（llm_rate_limit.py）
+- 失敗したタスクは --max-attempts 回まで実行し直す。--task-timeout 秒を超えたタスクは停止する
+- 終わったタスクは 1 件ごとに <output-dir>/manifest.jsonl に追記する（チェックポイント）。同じ --output-dir で
+  実行し直すと、成功が記録されたタスクは飛ばして続きから再開する
+- 生成したダイアグラム（.png / .mmd、SVG、分割した部分）は <output-dir>/artifacts/<タスク ID>/ にコピーする
+
+タスクの形式:
+    {"id": "order_service", "prompt": "注文サービスのシーケンス図を作成してください。"}
+    id を省略した場合は行番号（line-1, line-2, ...）を使う。
+
+使い方:
+    python batch_run.py tasks.jsonl --output-dir batch_results/nightly --concurrency 4 --rpm 30
+    # スタブ LLM とスタブ mmdc で動作確認（タスクに script / script_file が必要。benchmarks/corpus.jsonl がそのまま使える）
+    python batch_run.py benchmarks/corpus.jsonl --output-dir batch_results/smoke --model scripted --mmdc stub
+"""
+
+import argparse
+import concurrent.futures
+import datetime
+import glob
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+from smolagents.memory import ActionStep, FinalAnswerStep
+
+from agent_stream import stream_agent_run, DiagramGenerated
+from artifact_store import get_artifact_store
+from diagram_output import format_file, render_formats
+from benchmark import ScriptedModel, StageRecorder, install_stub_mmdc, load_app
+from llm_rate_limit import RateLimitedModel, RateLimiter
+from mermaid_partition import part_file
+from prompt_budget import get_prompt_mode
+from run_control import CancellationToken, RunCancelled
+from tracing import new_trace_id
+
+def load_tasks(path, require_script=False):
+    """
+    タスクの JSONL を読み込む。
+
+    Raises:
+        ValueError: prompt がない、または id が重複している場合
+    """
+    tasks = []
+    seen = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            task.setdefault("id", f"line-{line_number}")
+            task["id"] = str(task["id"])
+            if not task.get("prompt"):
+                raise ValueError(f"{path}:{line_number}: prompt is required")
+            if task["id"] in seen:
+                raise ValueError(f"{path}:{line_number}: duplicate task id '{task['id']}'")
+            seen.add(task["id"])
+            if require_script and "script" not in task:
+                if "script_file" not in task:
+                    raise ValueError(f"{path}:{line_number}: script or script_file is required for --model scripted")
+                with open(task["script_file"], 'r', encoding='utf-8') as script_file:
+                    task["script"] = script_file.read()
+            tasks.append(task)
+    return tasks
+
+
+class Manifest:
+    """
+    タスクごとの結果を JSONL に追記するチェックポイント。
+    同じタスクの記録が複数ある場合（再実行した場合）は最後の記録を有効とする。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.records = {}
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # 書き込み途中で落ちた最後の行
+                    self.records[record["id"]] = record
+
+    def succeeded_ids(self):
+        return {task_id for task_id, record in self.records.items() if record["status"] == "succeeded"}
+
+    def append(self, record):
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.records[record["id"]] = record
+
+
+def _safe_name(task_id):
+    return re.sub(r'[^\w.-]', '_', task_id) or "task"
+
+
+def collect_artifacts(image_files, destination):
+    """
+    生成されたダイアグラムと、そのスクリプト・分割した部分のファイルを destination にコピーする。
+
+    Returns:
+        list: コピーしたファイルのパス
+    """
+    copied = []
+    for image_file in image_files:
+        sources = [image_file, re.sub(r'\.png$', '.mmd', image_file)]
+        sources += [format_file(image_file, fmt) for fmt in render_formats()[1:]]
+        sources += sorted(glob.glob(part_file(glob.escape(image_file), "*", ".*")))
+        for source in sources:
+            if not os.path.exists(source):
+                continue
+            os.makedirs(destination, exist_ok=True)
+            target = os.path.join(destination, os.path.basename(source))
+            shutil.copy2(source, target)
+            if target not in copied:
+                copied.append(target)
+    return copied
+
+
+class BatchRunner:
+    """タスクをワーカープールで実行し、結果をマニフェストに記録する"""
+
+    def __init__(self, app, manifest, output_dir, concurrency=4, max_attempts=2, retry_delay=5.0,
+                 task_timeout=None, max_steps=10):
+        self.app = app
+        self.manifest = manifest
+        self.output_dir = output_dir
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.task_timeout = task_timeout
+        self.max_steps = max_steps
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._active_tokens = set()
+
+    def stop(self):
+        """実行中のタスクをすべて止め、まだ始まっていないタスクを始めない"""
+        self._stopping.set()
+        with self._lock:
+            tokens = list(self._active_tokens)
+        for token in tokens:
+            token.cancel()
+
+    def _run_attempt(self, task, token):
+        """
+        エージェントを 1 回実行する。
+
+        Returns:
+            tuple: (最終回答, 生成されたダイアグラムの PNG ファイルのリスト, ステップ数, トレース ID)
+        """
+        agent = self.app.create_agent()
+        # 500 のアプリの compact モードでは、Gradio と同じく依頼に関係するツールだけを渡す
+        tool_selector = getattr(self.app, "tool_selector", None)
+        if tool_selector is not None and get_prompt_mode() == "compact":
+            tool_selector.select(agent, task["prompt"])
+        trace_id = new_trace_id()
+        image_files = []
+        answer = None
+        steps = 0
+        for event in stream_agent_run(
+            agent,
+            f"ユーザーメッセージ：{task['prompt']}",
+            trace_id=trace_id,
+            cancel_token=token,
+            reset=True,
+            max_steps=self.max_steps
+        ):
+            if isinstance(event, DiagramGenerated):
+                if event.image_file not in image_files:
+                    image_files.append(event.image_file)
+            elif isinstance(event, ActionStep):
+                steps += 1
+            elif isinstance(event, FinalAnswerStep):
+                answer = event.output
+        # 最終回答に書かれたダイアグラムも含める（キャッシュから返した場合など）
+        for artifact in get_artifact_store().find_in_text(str(answer)):
+            if artifact.image_file not in image_files:
+                image_files.append(artifact.image_file)
+        return answer, [path for path in image_files if os.path.exists(path)], steps, trace_id
+
+    def run_task(self, task):
+        """
+        タスクを実行して結果を記録する（失敗した場合は max_attempts 回まで実行し直す）。
+
+        Returns:
+            dict: マニフェストに記録した結果。停止要求で中断した場合は None（記録しないので再開時に実行し直す）
+        """
+        started = time.perf_counter()
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            if self._stopping.is_set():
+                return None
+            # 成果物のインデックスにはタスクの ID をセッションとして記録する
+            token = CancellationToken(session_id=f"batch:{task['id']}")
+            token.task_key = task["id"]
+            timed_out = threading.Event()
+            timer = None
+            if self.task_timeout:
+                timer = threading.Timer(self.task_timeout, lambda: (timed_out.set(), token.cancel()))
+                timer.daemon = True
+                timer.start()
+            with self._lock:
+                self._active_tokens.add(token)
+            try:
+                answer, image_files, steps, trace_id = self._run_attempt(task, token)
+            except RunCancelled:
+                if not timed_out.is_set():
+                    return None
+                error = f"Task timed out ({self.task_timeout} seconds)"
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+            else:
+                artifacts = collect_artifacts(image_files, os.path.join(self.output_dir, "artifacts", _safe_name(task["id"])))
+                return self._record(task, "succeeded", started, attempt, answer=str(answer), steps=steps, trace_id=trace_id,
+                                    artifacts=[os.path.relpath(path, self.output_dir) for path in artifacts],
+                                    source_files=image_files)
+            finally:
+                if timer is not None:
+                    timer.cancel()
+                with self._lock:
+                    self._active_tokens.discard(token)
+
+            print(f"[{task['id']}] attempt {attempt}/{self.max_attempts} failed: {error}")
+            if attempt < self.max_attempts and self._stopping.wait(self.retry_delay * (2 ** (attempt - 1))):
+                return None
+        return self._record(task, "failed", started, self.max_attempts, error=error)
+
+    def _record(self, task, status, started, attempts, **fields):
+        record = {
+            "id": task["id"],
+            "status": status,
+            "prompt": task["prompt"],
+            "attempts": attempts,
+            "duration_s": round(time.perf_counter() - started, 3),
+            "finished_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            **fields,
+        }
+        self.manifest.append(record)
+        return record
+
+    def run(self, tasks):
+        """
+        tasks を実行する。Ctrl+C で止めた場合は実行中のタスクを止めて KeyboardInterrupt を送出する。
+
+        Returns:
+            list: このバッチで記録した結果
+        """
+        results = []
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            futures = {executor.submit(self.run_task, task): task for task in tasks}
+            for future in concurrent.futures.as_completed(futures):
+                record = future.result()
+                if record is None:
+                    continue
+                results.append(record)
+                print(f"[{len(results)}/{len(tasks)}] {record['id']}: {record['status']} "
+                      f"({record['duration_s']}s, attempts={record['attempts']})")
+        except KeyboardInterrupt:
+            self.stop()
+            raise
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="システム設計支援エージェントのバッチ実行")
+    parser.add_argument("tasks", help="要件プロンプトのタスク（JSONL）")
+    parser.add_argument("--output-dir", required=True, help="マニフェストと成果物の保存先（同じディレクトリを指定すると再開）")
+    parser.add_argument("--app", default="400_system_design_agent_gradio.py", help="エージェントとツールを読み込む Gradio アプリ")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に実行するタスク数")
+    parser.add_argument("--rpm", type=float, help="LLM プロバイダーの 1 分あたりの呼び出し数の上限（既定は LLM_RATE_LIMIT_RPM）")
+    parser.add_argument("--max-attempts", type=int, default=2, help="失敗したタスクを実行する回数の上限")
+    parser.add_argument("--retry-delay", type=float, default=5.0, help="タスクを実行し直すまでの待ち時間（秒。回数ごとに倍にする）")
+    parser.add_argument("--task-timeout", type=float, help="1 タスクあたりのタイムアウト（秒）")
+    parser.add_argument("--max-steps", type=int, default=10, help="エージェントの最大ステップ数")
+    parser.add_argument("--restart", action="store_true", help="マニフェストの記録を無視してすべてのタスクを実行し直す")
+    parser.add_argument("--model", choices=("app", "scripted"), default="app",
+                        help="アプリの LLM を使うか、台本どおりに応答するスタブ LLM（benchmark.py）を使うか")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="スタブ LLM の 1 呼び出しあたりの遅延（秒）")
+    parser.add_argument("--mmdc", choices=("real", "stub"), default="real", help="インストール済みの mmdc を使うか、スタブの mmdc を使うか")
+    args = parser.parse_args()
+
+    tasks = load_tasks(args.tasks, require_script=args.model == "scripted")
+    os.makedirs(args.output_dir, exist_ok=True)
+    manifest_path = os.path.join(args.output_dir, "manifest.jsonl")
+    if args.restart and os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    manifest = Manifest(manifest_path)
+    done = manifest.succeeded_ids()
+    pending = [task for task in tasks if task["id"] not in done]
+    print(f"tasks: {len(tasks)}  already succeeded: {len(tasks) - len(pending)}  to run: {len(pending)}")
+    if not pending:
+        return
+
+    if args.mmdc == "stub":
+        install_stub_mmdc(tempfile.mkdtemp(prefix="batch_mmdc_"))
+        # 常駐レンダラーは本物の mermaid-cli が必要なので、スタブ使用時は単発実行にする
+        os.environ["MERMAID_RENDERER_WORKERS"] = "0"
+    if args.model == "scripted":
+        os.environ["LLM_CACHE_MODE"] = "off"
+
+    app = load_app(args.app)
+    model = ScriptedModel(tasks, StageRecorder(), latency=args.llm_latency) if args.model == "scripted" else app.model_service.get()
+    rate_limited_model = RateLimitedModel(model, limiter=RateLimiter(args.rpm) if args.rpm else None)
+    app.model_service.set(rate_limited_model)
+
+    runner = BatchRunner(
+        app, manifest, args.output_dir,
+        concurrency=args.concurrency,
+        max_attempts=args.max_attempts,
+        retry_delay=args.retry_delay,
+        task_timeout=args.task_timeout,
+        max_steps=args.max_steps
+    )
+    started = time.perf_counter()
+    try:
+        results = runner.run(pending)
+    except KeyboardInterrupt:
+        print(f"\n中断しました。同じ --output-dir で実行し直すと続きから再開します: {args.output_dir}")
+        sys.exit(130)
+    wall_time = time.perf_counter() - started
+
+    succeeded = sum(1 for record in results if record["status"] == "succeeded")
+    print(f"succeeded: {succeeded}  failed: {len(results) - succeeded}  wall_time: {wall_time:.1f}s  "
+          f"throughput: {len(results) / wall_time:.2f} tasks/s  llm_retries: {rate_limited_model.retries}  "
+          f"rate_limit_wait: {rate_limited_model.limiter.waited_seconds:.1f}s")
+    print(f"マニフェスト: {manifest_path}")
+    if succeeded < len(results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,518 @@
+"""
+システム設計支援エージェントのオフラインベンチマーク
+
+Gradio アプリ（既定は 400_system_design_agent_gradio.py）の process_user_message_with_agent を、
+台本どおりに応答するスタブ LLM と、スタブ（またはローカルの本物の）mmdc で駆動し、
+要件プロンプトのコーパスに対する処理時間を計測する。
+
+計測項目:
+    - ステージごとのレイテンシ（p50/p95）: queue（受付待ち）, llm, validation, rendering, image_load, code_execution
+      code_execution は全体の時間から他のステージを引いた残り（Python 実行器とエージェント内部の処理）
+    - タスクあたりのステップ数
+    - 同時ユーザー数 N でのスループット
+    - システムプロンプトのトークン数と、タスクあたりの LLM 入力トークン数（--prompt-mode で full と compact を比較できる）
+    - セマンティックキャッシュのヒット率と省いた生成時間（--semantic-cache。--repeat 2 以上で 2 周目からヒットする）
+    - トラジェクトリキャッシュで再生・手本にした回数と、1 周目と 2 周目以降の LLM ステップ数の差（--trajectory-cache --repeat 2）
+
+結果は JSON で保存するので、--compare で以前の結果と比較できる。
+
+使い方:
+    python benchmark.py --users 4 --repeat 3 --output bench_results/result.json
+    python benchmark.py --mmdc real --llm-latency 1.5
+    python benchmark.py --mmdc builtin --compare bench_results/real.json
+    python benchmark.py --compare bench_results/before.json --output bench_results/after.json
+    python benchmark.py --prompt-mode compact --compare bench_results/full.json
+    python benchmark.py --semantic-cache --repeat 2
+    python benchmark.py --trajectory-cache --repeat 2
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import contextvars
+import datetime
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+from smolagents.models import ChatMessage, ChatMessageStreamDelta, MessageRole
+from smolagents.monitoring import TokenUsage
+
+from agent_memory import estimate_tokens
+from prompt_budget import PROMPT_MODES, measure_prompt_sections
+
+STAGES = ("queue", "llm", "validation", "rendering", "image_load", "code_execution", "total")
+
+# 1x1 の白い PNG（スタブ mmdc が出力する）
+STUB_MMDC_SOURCE = r'''
+import base64, sys
+PNG = base64.b64decode(
+    "iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4nGP4//8/AAX+Av4N70a4AAAAAElFTkSuQmCC"
+)
+args = sys.argv[1:]
+output = args[args.index("-o") + 1]
+with open(output, "wb") as f:
+    f.write(PNG)
+'''
+
+
+def percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round((percent / 100) * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0, "mean": None, "p50": None, "p95": None}
+    return {
+        "count": len(values),
+        "mean": round(statistics.mean(values), 4),
+        "p50": round(percentile(values, 50), 4),
+        "p95": round(percentile(values, 95), 4),
+    }
+
+
+def load_corpus(path):
+    tasks = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            task = json.loads(line)
+            if "script" not in task:
+                with open(task["script_file"], 'r', encoding='utf-8') as script_file:
+                    task["script"] = script_file.read()
+            tasks.append(task)
+    return tasks
+
+
+def install_stub_mmdc(directory):
+    """PATH の先頭に 1x1 PNG を出力するだけの mmdc を置く"""
+    script_path = os.path.join(directory, "stub_mmdc.py")
+    with open(script_path, 'w', encoding='utf-8') as f:
+        f.write(STUB_MMDC_SOURCE)
+    if os.name == "nt":
+        with open(os.path.join(directory, "mmdc.cmd"), 'w', encoding='utf-8') as f:
+            f.write(f'@"{sys.executable}" "{script_path}" %*\r\n')
+    else:
+        launcher = os.path.join(directory, "mmdc")
+        with open(launcher, 'w', encoding='utf-8') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{script_path}" "$@"\n')
+        os.chmod(launcher, 0o755)
+    os.environ["PATH"] = directory + os.pathsep + os.environ.get("PATH", "")
+
+
+# 計測中のタスクの run_id。ドライバーが設定し、contextvars でアプリのハンドラ・エージェントのスレッド・
+# ツールのコードに引き継がれる（スレッドごとの対応表では、コードを別スレッドで実行すると失われる）
+_current_task = contextvars.ContextVar("benchmark_task", default=None)
+
+
+class StageRecorder:
+    """ステージごとの所要時間をタスク単位で集計する"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = {}
+        self.llm_calls = {}
+        self.input_tokens = {}
+
+    def current_task(self):
+        return _current_task.get()
+
+    def add(self, task_key, stage, seconds):
+        if task_key is None:
+            return
+        with self._lock:
+            stages = self.durations.setdefault(task_key, {})
+            stages[stage] = stages.get(stage, 0.0) + seconds
+
+    def timed(self, stage, function):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(self.current_task(), stage, time.perf_counter() - started)
+        return wrapper
+
+
+def _message_text(message):
+    content = message.get("content") if isinstance(message, dict) else message.content
+    if isinstance(content, list):
+        return "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+def _message_role(message):
+    role = message.get("role") if isinstance(message, dict) else message.role
+    return getattr(role, "value", role)
+
+
+class ScriptedModel:
+    """
+    コーパスの台本どおりに応答するスタブ LLM。
+
+    メッセージ履歴からタスク（ユーザーメッセージ）とステップ番号を特定し、
+    1) （draft_script があれば）下書きで生成 → 検証エラー、2) 正しいスクリプトで生成、3) final_answer の順に応答する。
+    """
+
+    model_id = "benchmark/scripted"
+
+    def __init__(self, tasks, recorder, latency=0.0, chunk_size=40, code_block_tags=("<code>", "</code>")):
+        self.tasks = tasks
+        self.recorder = recorder
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.code_block_tags = code_block_tags
+        self.kwargs = {"temperature": 0.0}
+
+    def _find_task(self, messages):
+        for index in range(len(messages) - 1, -1, -1):
+            text = _message_text(messages[index])
+            for task in self.tasks:
+                if task["prompt"] in text:
+                    return task, index
+        raise RuntimeError("ScriptedModel: task prompt not found in messages")
+
+    def _response(self, messages):
+        task, task_index = self._find_task(messages)
+        # 同じプロンプトが繰り返し・並行して実行されるので、実行ごとの run_id で集計する
+        task_key = self.recorder.current_task() or task["id"]
+        input_tokens = sum(estimate_tokens(_message_text(message)) for message in messages)
+        with self.recorder._lock:
+            self.recorder.llm_calls[task_key] = self.recorder.llm_calls.get(task_key, 0) + 1
+            self.recorder.input_tokens[task_key] = self.recorder.input_tokens.get(task_key, 0) + input_tokens
+
+        step = sum(1 for message in messages[task_index + 1:] if _message_role(message) == "assistant")
+        scripts = ([task["draft_script"]] if task.get("draft_script") else []) + [task["script"]]
+        open_tag, close_tag = self.code_block_tags
+
+        if step < len(scripts):
+            code = (
+                "guidelines = get_mermaid_script_guidelines_tool()\n" if step == 0 else ""
+            ) + (
+                f"mermaid_script = {scripts[step]!r}\n"
+                "diagram_path = generate_mermaid_diagram_tool(mermaid_script)\n"
+                "print(diagram_path)"
+            )
+            thought = "Thought: ガイドラインに従って Mermaid スクリプトを作成し、ダイアグラムを生成します。"
+        else:
+            code = 'final_answer(f"ダイアグラムを生成しました: {diagram_path}")'
+            thought = "Thought: ダイアグラムが生成できたので回答します。"
+        return task_key, f"{thought}\n{open_tag}\n{code}\n{close_tag}"
+
+    def generate(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        started = time.perf_counter()
+        task_key, text = self._response(messages)
+        time.sleep(self.latency)
+        self.recorder.add(task_key, "llm", time.perf_counter() - started)
+        return ChatMessage(
+            role=MessageRole.ASSISTANT,
+            content=text,
+            token_usage=TokenUsage(input_tokens=sum(len(_message_text(m)) for m in messages) // 4, output_tokens=len(text) // 4)
+        )
+
+    def generate_stream(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        started = time.perf_counter()
+        task_key, text = self._response(messages)
+        chunks = [text[i:i + self.chunk_size] for i in range(0, len(text), self.chunk_size)]
+        for index, chunk in enumerate(chunks):
+            time.sleep(self.latency / len(chunks))
+            last = index == len(chunks) - 1
+            if last:
+                self.recorder.add(task_key, "llm", time.perf_counter() - started)
+            yield ChatMessageStreamDelta(
+                content=chunk,
+                token_usage=TokenUsage(
+                    input_tokens=sum(len(_message_text(m)) for m in messages) // 4,
+                    output_tokens=len(text) // 4
+                ) if last else None
+            )
+
+    def __call__(self, *args, **kwargs):
+        return self.generate(*args, **kwargs)
+
+
+def load_app(app_path):
+    """Gradio アプリを読み込む（__main__ ではないので interface.launch は呼ばれない）"""
+    spec = importlib.util.spec_from_file_location("benchmark_app", app_path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def instrument_app(app, recorder):
+    """アプリの各ステージに計測用のラッパーを差し込む"""
+    app.fix_mermaid_script = recorder.timed("validation", app.fix_mermaid_script)
+
+    tool = app.generate_mermaid_diagram_tool
+    tool.forward = recorder.timed("diagram_tool", tool.forward)
+
+    original_load_diagram = app.load_diagram
+
+    def load_diagram(image_file):
+        started = time.perf_counter()
+        try:
+            return original_load_diagram(image_file)
+        finally:
+            recorder.add(recorder.current_task(), "image_load", time.perf_counter() - started)
+
+    app.load_diagram = load_diagram
+
+
+def run_task(app, task, user_index, recorder, new_session=False):
+    reset_task = _current_task.set(task["run_id"])
+    try:
+        return _run_task(app, task, user_index, recorder, new_session)
+    finally:
+        _current_task.reset(reset_task)
+
+
+def _run_task(app, task, user_index, recorder, new_session):
+    # セマンティックキャッシュは新しい会話の依頼にだけ効くので、その計測ではタスクごとにセッションを分ける
+    session_hash = f"benchmark-{task['run_id']}" if new_session else f"benchmark-user-{user_index}"
+    request = types.SimpleNamespace(session_hash=session_hash)
+
+    async def drive():
+        admitted_at = None
+        last_output = None
+        async for output in app.process_user_message_with_agent(task["prompt"], request):
+            if admitted_at is None and "実行中" in str(output[1]):
+                admitted_at = time.perf_counter()
+            last_output = output
+        return admitted_at, last_output
+
+    started = time.perf_counter()
+    admitted_at, last_output = asyncio.run(drive())
+    finished = time.perf_counter()
+
+    durations = recorder.durations.get(task["run_id"], {})
+    total = finished - started
+    queue_wait = (admitted_at or started) - started
+    rendering = max(0.0, durations.get("diagram_tool", 0.0) - durations.get("validation", 0.0))
+    measured = queue_wait + durations.get("llm", 0.0) + durations.get("diagram_tool", 0.0) + durations.get("image_load", 0.0)
+
+    status = str(last_output[1]) if last_output else ""
+    return {
+        "task_id": task["id"],
+        "run_id": task["run_id"],
+        "user": user_index,
+        "success": status.startswith("ダイアグラムが正常に生成されました"),
+        "status": status,
+        "steps": recorder.llm_calls.get(task["run_id"], 0),
+        "input_tokens": recorder.input_tokens.get(task["run_id"], 0),
+        "stages": {
+            "queue": round(queue_wait, 4),
+            "llm": round(durations.get("llm", 0.0), 4),
+            "validation": round(durations.get("validation", 0.0), 4),
+            "rendering": round(rendering, 4),
+            "image_load": round(durations.get("image_load", 0.0), 4),
+            "code_execution": round(max(0.0, total - measured), 4),
+            "total": round(total, 4),
+        },
+    }
+
+
+def run_benchmark(args):
+    os.environ["LLM_CACHE_MODE"] = "off"
+    os.environ["AGENT_PROMPT_MODE"] = args.prompt_mode
+    if not args.render_cache:
+        os.environ["MERMAID_RENDER_CACHE"] = "0"
+    if args.semantic_cache:
+        # 以前の実行のキャッシュを使わないよう、空のディレクトリから始める
+        os.environ["SEMANTIC_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench_semantic_")
+    else:
+        os.environ["SEMANTIC_CACHE"] = "0"
+    if args.trajectory_cache:
+        os.environ["TRAJECTORY_CACHE_DIR"] = tempfile.mkdtemp(prefix="bench_trajectory_")
+    else:
+        os.environ["TRAJECTORY_CACHE"] = "0"
+    os.environ.setdefault("AGENT_MAX_CONCURRENT_RUNS", str(args.users))
+
+    stub_dir = None
+    # builtin は対応するダイアグラムを mermaid_svg.py で描画し、それ以外はスタブの mmdc に回す
+    os.environ["MERMAID_RENDER_ENGINE"] = "python" if args.mmdc == "builtin" else "mmdc"
+    if args.mmdc in ("stub", "builtin"):
+        stub_dir = tempfile.mkdtemp(prefix="bench_mmdc_")
+        install_stub_mmdc(stub_dir)
+        # 常駐レンダラーは本物の mermaid-cli が必要なので、スタブ使用時は単発実行にする
+        os.environ["MERMAID_RENDERER_WORKERS"] = "0"
+
+    corpus = load_corpus(args.corpus)
+    recorder = StageRecorder()
+    app = load_app(args.app)
+    app.model_service.set(ScriptedModel(corpus, recorder, latency=args.llm_latency))
+    instrument_app(app, recorder)
+    prompt_sections = measure_prompt_sections(app.create_agent())
+
+    jobs = []
+    for repeat in range(args.repeat):
+        for task in corpus:
+            jobs.append(dict(task, run_id=f"{task['id']}#{repeat}"))
+
+    # ウォームアップ（インポートや初回の mmdc 起動のコストを計測から除く）
+    if args.warmup:
+        run_task(app, dict(corpus[0], run_id="warmup"), "warmup", recorder)
+        if args.semantic_cache:
+            app.get_semantic_cache().clear()
+        if args.trajectory_cache:
+            app.get_trajectory_cache().clear()
+
+    started = time.perf_counter()
+    results = []
+    # キャッシュは新しい会話の依頼にだけ効くので、どちらかを計測する場合はタスクごとにセッションを分ける
+    new_session = args.semantic_cache or args.trajectory_cache
+    with concurrent.futures.ThreadPoolExecutor(max_workers=args.users) as executor:
+        futures = [executor.submit(run_task, app, job, index % args.users, recorder, new_session) for index, job in enumerate(jobs)]
+        for future in concurrent.futures.as_completed(futures):
+            results.append(future.result())
+    wall_time = time.perf_counter() - started
+
+    results.sort(key=lambda result: result["run_id"])
+    report = {
+        "meta": {
+            "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+            "commit": _git_commit(),
+            "app": args.app,
+            "corpus": args.corpus,
+            "users": args.users,
+            "repeat": args.repeat,
+            "mmdc": args.mmdc,
+            "llm_latency": args.llm_latency,
+            "render_cache": args.render_cache,
+            "prompt_mode": args.prompt_mode,
+            "semantic_cache": args.semantic_cache,
+            "trajectory_cache": args.trajectory_cache,
+        },
+        "summary": {
+            "tasks": len(results),
+            "success_rate": round(sum(r["success"] for r in results) / len(results), 3) if results else None,
+            "wall_time": round(wall_time, 3),
+            "throughput_tasks_per_sec": round(len(results) / wall_time, 3) if wall_time else None,
+            "steps_per_task": summarize([r["steps"] for r in results]),
+            "system_prompt_tokens": prompt_sections,
+            "input_tokens_per_task": summarize([r["input_tokens"] for r in results]),
+            "stages": {stage: summarize([r["stages"][stage] for r in results]) for stage in STAGES},
+            "semantic_cache": app.get_semantic_cache().stats() if args.semantic_cache else None,
+            "trajectory_cache": dict(app.get_trajectory_cache().stats(), **steps_by_pass(results)) if args.trajectory_cache else None,
+        },
+        "tasks": results,
+    }
+    return report
+
+
+def steps_by_pass(results):
+    """コーパスの 1 周目（手順を記録する）と 2 周目以降（記録した手順を使う）の LLM ステップ数を比べる"""
+    first = [r["steps"] for r in results if r["run_id"].endswith("#0")]
+    later = [r["steps"] for r in results if not r["run_id"].endswith("#0")]
+    first_mean = round(statistics.mean(first), 4) if first else None
+    later_mean = round(statistics.mean(later), 4) if later else None
+    return {
+        "steps_per_task_first_pass": first_mean,
+        "steps_per_task_later_passes": later_mean,
+        "step_delta": round(later_mean - first_mean, 4) if first and later else None,
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def compare_reports(before, after):
+    """2 つの結果の p50/p95 を比較した表を返す"""
+    lines = [f"{'metric':<28}{'before':>12}{'after':>12}{'change':>10}"]
+
+    def add(name, old, new):
+        if old is None or new is None:
+            return
+        change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+        lines.append(f"{name:<28}{old:>12.4f}{new:>12.4f}{change:>10}")
+
+    for stage in STAGES:
+        for key in ("p50", "p95"):
+            add(f"{stage}.{key}", before["summary"]["stages"][stage][key], after["summary"]["stages"][stage][key])
+    add("steps_per_task.mean", before["summary"]["steps_per_task"]["mean"], after["summary"]["steps_per_task"]["mean"])
+    # トークン数を減らしても成功率が下がっていないことを合わせて確認する
+    add("success_rate", before["summary"]["success_rate"], after["summary"]["success_rate"])
+    if "system_prompt_tokens" in before["summary"]:
+        add("system_prompt_tokens", before["summary"]["system_prompt_tokens"]["total"], after["summary"]["system_prompt_tokens"]["total"])
+        add("input_tokens_per_task.mean", before["summary"]["input_tokens_per_task"]["mean"], after["summary"]["input_tokens_per_task"]["mean"])
+    add("throughput_tasks_per_sec", before["summary"]["throughput_tasks_per_sec"], after["summary"]["throughput_tasks_per_sec"])
+    return "\n".join(lines)
+
+
+def print_summary(report):
+    summary = report["summary"]
+    print(f"tasks: {summary['tasks']}  success_rate: {summary['success_rate']}  "
+          f"throughput: {summary['throughput_tasks_per_sec']} tasks/s  steps/task: {summary['steps_per_task']['mean']}")
+    print(f"prompt_mode: {report['meta']['prompt_mode']}  system_prompt: {summary['system_prompt_tokens']['total']} tokens  "
+          f"input_tokens/task: {summary['input_tokens_per_task']['mean']}")
+    if summary.get("semantic_cache"):
+        cache = summary["semantic_cache"]
+        print(f"semantic_cache: hit_rate {cache['hit_rate']}  hits {cache['hits']}  drafts {cache['drafts']}  "
+              f"saved {cache['saved_seconds']} s")
+    if summary.get("trajectory_cache"):
+        cache = summary["trajectory_cache"]
+        print(f"trajectory_cache: steps/task {cache['steps_per_task_first_pass']} (1st pass) -> "
+              f"{cache['steps_per_task_later_passes']} (later passes)  delta {cache['step_delta']}  "
+              f"replays {cache['replays']}  exemplars {cache['exemplars']}  replayed_steps {cache['replayed_steps']}  "
+              f"fallbacks {cache['fallbacks']}")
+    print(f"{'stage':<16}{'p50 (s)':>12}{'p95 (s)':>12}")
+    for stage in STAGES:
+        stats = summary["stages"][stage]
+        if stats["p50"] is not None:
+            print(f"{stage:<16}{stats['p50']:>12.4f}{stats['p95']:>12.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="システム設計支援エージェントのオフラインベンチマーク")
+    parser.add_argument("--app", default="400_system_design_agent_gradio.py", help="計測する Gradio アプリ")
+    parser.add_argument("--corpus", default=os.path.join("benchmarks", "corpus.jsonl"), help="要件プロンプトのコーパス（JSONL）")
+    parser.add_argument("--users", type=int, default=1, help="同時ユーザー数")
+    parser.add_argument("--repeat", type=int, default=1, help="コーパスを繰り返す回数")
+    parser.add_argument("--mmdc", choices=("stub", "real", "builtin"), default="stub",
+                        help="スタブの mmdc を使うか、インストール済みの mmdc を使うか、プロセス内レンダラー（mermaid_svg.py）を使うか")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="スタブ LLM の 1 呼び出しあたりの遅延（秒）")
+    parser.add_argument("--render-cache", action="store_true", help="レンダリングキャッシュを有効にする（既定は無効）")
+    parser.add_argument("--semantic-cache", action="store_true", help="セマンティックキャッシュを有効にする（既定は無効）")
+    parser.add_argument("--trajectory-cache", action="store_true",
+                        help="トラジェクトリキャッシュを有効にする（既定は無効。--repeat 2 以上で 1 周目と 2 周目以降のステップ数を比べる）")
+    parser.add_argument("--prompt-mode", choices=PROMPT_MODES, default="full", help="システムプロンプトのモード（AGENT_PROMPT_MODE）")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false", help="ウォームアップを行わない")
+    parser.add_argument("--output", help="結果を保存する JSON ファイル")
+    parser.add_argument("--compare", help="比較対象の結果 JSON ファイル")
+    args = parser.parse_args()
+
+    report = run_benchmark(args)
+    print_summary(report)
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"結果を保存しました: {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            print(compare_reports(json.load(f), report))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Web サイト・Web API のスタブ HTTP サーバ
+
+200/300 のコード例が使うページと API（国土地理院の住所検索、Open-Meteo の天気予報）に似た応答を返す。
+ネットワークに出ずに web_fetch.py の接続の再利用・HTTP キャッシュ・並列取得を確認できる。
+
+    python benchmarks/stub_http_server.py --port 8765
+    python web_fetch.py --repeat 2 http://127.0.0.1:8765/page/1 "http://127.0.0.1:8765/v1/forecast?latitude=35.6&longitude=139.8"
+
+エンドポイント:
+    /page/<n>                           HTML（ETag・Last-Modified 付き。max-age は STUB_HTTP_MAX_AGE）
+    /address-search/AddressSearch?q=    住所検索の結果（JSON。ETag 付き）
+    /v1/forecast?latitude=&longitude=   天気予報（JSON。キャッシュ用のヘッダなし）
+    /stats                              パスごとの受信数・200/304 の応答数・接続数（JSON。no-store）
+
+環境変数:
+    STUB_HTTP_DELAY    応答を遅らせる秒数（既定 0）
+    STUB_HTTP_MAX_AGE  /page の Cache-Control: max-age（既定 0 = 毎回条件付き GET で確認させる）
+"""
+
+import argparse
+import collections
+import email.utils
+import hashlib
+import json
+import os
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DELAY = float(os.getenv("STUB_HTTP_DELAY", "0"))
+MAX_AGE = int(os.getenv("STUB_HTTP_MAX_AGE", "0"))
+STARTED_AT = email.utils.formatdate(time.time(), usegmt=True)
+
+PLACES = {
+    "東京ディズニーランド": (139.880394, 35.632896),
+    "東京": (139.691711, 35.689499),
+    "大阪": (135.502165, 34.693738),
+}
+
+_lock = threading.Lock()
+_stats = {"paths": collections.Counter(), "status": collections.Counter(), "connections": 0}
+
+
+def _page(number):
+    items = "".join(f"<li>項目 {number}-{i}</li>" for i in range(1, 6))
+    return (
+        "<!DOCTYPE html><html><head><meta charset=\"utf-8\">"
+        f"<title>スタブページ {number}</title><style>body {{ color: #333; }}</style>"
+        "<script>console.log('ignored');</script></head><body>"
+        "<nav><a href=\"/\">ホーム</a> | <a href=\"/about\">概要</a></nav>"
+        f"<main><h1>スタブページ {number}</h1><p>これは web_fetch.py の確認用のページです。</p><ul>{items}</ul>"
+        "<table><tr><th>名前</th><th>値</th></tr><tr><td>A</td><td>1</td></tr></table></main>"
+        "<footer>&copy; stub</footer></body></html>"
+    ).encode("utf-8")
+
+
+def _address_search(query):
+    features = []
+    for name, (lon, lat) in PLACES.items():
+        if query and (query in name or name in query):
+            features.append({"geometry": {"coordinates": [lon, lat], "type": "Point"}, "type": "Feature",
+                             "properties": {"addressCode": "", "title": name}})
+    return features
+
+
+def _forecast(latitude, longitude):
+    return {
+        "latitude": latitude, "longitude": longitude, "timezone": "Asia/Tokyo",
+        "daily": {"time": ["2025-09-01", "2025-09-02"], "weather_code": [1, 3],
+                  "temperature_2m_max": [31.2, 29.8], "temperature_2m_min": [24.1, 23.5]},
+        "hourly": {"time": [f"2025-09-01T{h:02d}:00" for h in range(24)],
+                   "temperature_2m": [25.0 + h % 7 for h in range(24)],
+                   "weather_code": [1] * 24},
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with _lock:
+            _stats["connections"] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b"", content_type="application/json; charset=utf-8", headers=None):
+        with _lock:
+            _stats["status"][status] += 1
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _send_validated(self, body, content_type, headers):
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        headers = dict(headers, ETag=etag, **{"Last-Modified": STARTED_AT})
+        if self.headers.get("If-None-Match") == etag or self.headers.get("If-Modified-Since") == STARTED_AT:
+            self._send(304, headers=headers)
+        else:
+            self._send(200, body, content_type, headers)
+
+    def do_GET(self):
+        if DELAY:
+            time.sleep(DELAY)
+        parsed = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        with _lock:
+            _stats["paths"][parsed.path] += 1
+
+        if parsed.path.startswith("/page/"):
+            self._send_validated(_page(parsed.path.rsplit("/", 1)[-1]), "text/html; charset=utf-8",
+                                 {"Cache-Control": f"max-age={MAX_AGE}"})
+        elif parsed.path == "/address-search/AddressSearch":
+            body = json.dumps(_address_search(query.get("q", "")), ensure_ascii=False).encode("utf-8")
+            self._send_validated(body, "application/json; charset=utf-8", {})
+        elif parsed.path == "/v1/forecast":
+            try:
+                body = json.dumps(_forecast(float(query["latitude"]), float(query["longitude"]))).encode("utf-8")
+            except (KeyError, ValueError):
+                self._send(400, b'{"error":true,"reason":"latitude and longitude are required"}')
+                return
+            self._send(200, body)
+        elif parsed.path == "/stats":
+            with _lock:
+                body = json.dumps({"paths": _stats["paths"], "status": {str(k): v for k, v in _stats["status"].items()},
+                                   "connections": _stats["connections"]}, ensure_ascii=False).encode("utf-8")
+            self._send(200, body, headers={"Cache-Control": "no-store"})
+        else:
+            self._send(404, b'{"error":"not found"}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Web サイト・Web API のスタブ HTTP サーバ")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"stub http server: http://{args.host}:{server.server_port}/", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
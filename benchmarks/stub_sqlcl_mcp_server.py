@@ -0,0 +1,134 @@
+"""
+SQLcl MCP サーバのスタブ（stdio）
+
+SQLcl の MCP サーバと同じ名前のツール（list-connections, connect, disconnect, run-sql, run-sqlcl）を持ち、
+決まった結果を返す。存在しない表を参照する SQL は ORA-00942 のエラーになり、ツールのエラーは
+MCP のエラー応答（JSON-RPC のエラー）として返す。SQLcl がなくても MCP セッションプール
+（mcp_session_pool.py）の動作や 500 のアプリを確認できる。
+
+    SQLCL_MCP_COMMAND=python SQLCL_MCP_ARGS="benchmarks/stub_sqlcl_mcp_server.py" python 500_system_design_agent_gradio_with_MCP.py
+
+環境変数:
+    STUB_MCP_DELAY        run-sql / run-sqlcl の応答を遅らせる秒数（既定 0）
+    STUB_MCP_CRASH_AFTER  ツールを N 回呼び出したらプロセスを終了する（自動再起動の確認用、既定 0 = 終了しない）
+"""
+
+import os
+import re
+import time
+
+from mcp import types
+from mcp.server.fastmcp import FastMCP
+from mcp.shared.exceptions import McpError
+
+server = FastMCP("stub-sqlcl", log_level="WARNING")
+
+DELAY = float(os.getenv("STUB_MCP_DELAY", "0"))
+CRASH_AFTER = int(os.getenv("STUB_MCP_CRASH_AFTER", "0"))
+
+CONNECTIONS = ["sh_schema", "hr_schema"]
+# 表名 → [(カラム名, データ型, 長さ, 精度, NULL 可)]
+TABLES = {
+    "COUNTRIES": [("COUNTRY_ID", "NUMBER", "", "", "N"), ("COUNTRY_NAME", "VARCHAR2", "40", "", "N")],
+    "CUSTOMERS": [("CUST_ID", "NUMBER", "", "", "N"), ("CUST_NAME", "VARCHAR2", "100", "", "N"),
+                  ("COUNTRY_ID", "NUMBER", "", "", "Y")],
+    "SALES": [("SALE_ID", "NUMBER", "", "", "N"), ("CUST_ID", "NUMBER", "", "", "N"),
+              ("AMOUNT", "NUMBER", "", "10", "Y")],
+}
+# (表名, 制約名, 種類, カラム名, 参照先の表名)
+CONSTRAINTS = [
+    ("COUNTRIES", "COUNTRIES_PK", "P", "COUNTRY_ID", ""),
+    ("CUSTOMERS", "CUSTOMERS_PK", "P", "CUST_ID", ""),
+    ("CUSTOMERS", "CUSTOMERS_COUNTRY_FK", "R", "COUNTRY_ID", "COUNTRIES"),
+    ("SALES", "SALES_PK", "P", "SALE_ID", ""),
+    ("SALES", "SALES_CUSTOMER_FK", "R", "CUST_ID", "CUSTOMERS"),
+]
+
+_state = {"calls": 0, "connection": None}
+# FROM の後の表名（ディクショナリビューと DUAL 以外は TABLES にあるものだけ）
+_FROM_TABLE = re.compile(r"\bFROM\s+([A-Z_][A-Z0-9_$#]*)")
+
+
+def _count_call():
+    _state["calls"] += 1
+    if CRASH_AFTER and _state["calls"] > CRASH_AFTER:
+        os._exit(1)
+
+
+def _run_query(sql):
+    if DELAY:
+        time.sleep(DELAY)
+    if _state["connection"] is None:
+        return "Error: Not connected. Use the connect tool first."
+    query = sql.upper()
+    for table in _FROM_TABLE.findall(query):
+        if table not in TABLES and table != "DUAL" and not table.startswith(("USER_", "ALL_", "DBA_")):
+            raise RuntimeError("ORA-00942: table or view does not exist")
+    if "USER_OBJECTS" in query:
+        return f'"LAST_DDL_TIME","TABLE_COUNT"\n"2025-09-15 12:00:00",{len(TABLES)}'
+    if "USER_TAB_COLUMNS" in query:
+        lines = ['"TABLE_NAME","COLUMN_NAME","DATA_TYPE","CHAR_LENGTH","DATA_PRECISION","DATA_SCALE","NULLABLE","COLUMN_ID"']
+        for table, columns in TABLES.items():
+            for column_id, (name, data_type, length, precision, nullable) in enumerate(columns, start=1):
+                lines.append(f'"{table}","{name}","{data_type}",{length},{precision},,"{nullable}",{column_id}')
+        return "\n".join(lines) + f"\n\n{len(lines) - 1} rows selected."
+    if "USER_CONSTRAINTS" in query:
+        lines = ['"TABLE_NAME","CONSTRAINT_NAME","CONSTRAINT_TYPE","COLUMN_NAME","POSITION","R_TABLE_NAME"']
+        lines.extend(f'"{table}","{name}","{kind}","{column}",1,"{ref}"' for table, name, kind, column, ref in CONSTRAINTS)
+        return "\n".join(lines)
+    if "USER_TABLES" in query:
+        return "\n".join(['"TABLE_NAME"', *(f'"{table}"' for table in TABLES)])
+    return '"RESULT"\n"OK"'
+
+
+@server.tool(name="list-connections", description="List the saved database connections.")
+def list_connections() -> str:
+    _count_call()
+    return "\n".join(CONNECTIONS)
+
+
+@server.tool(name="connect", description="Connect to a saved database connection.")
+def connect(connection_name: str) -> str:
+    _count_call()
+    if connection_name not in CONNECTIONS:
+        return f"Error: Unknown connection {connection_name}"
+    _state["connection"] = connection_name
+    return f"Connected to {connection_name}"
+
+
+@server.tool(name="disconnect", description="Disconnect from the current database connection.")
+def disconnect() -> str:
+    _count_call()
+    _state["connection"] = None
+    return "Disconnected"
+
+
+@server.tool(name="run-sql", description="Run a SQL query against the connected database and return CSV.")
+def run_sql(sql: str) -> str:
+    _count_call()
+    return _run_query(sql)
+
+
+@server.tool(name="run-sqlcl", description="Run a SQLcl command against the connected database.")
+def run_sqlcl(sqlcl: str) -> str:
+    _count_call()
+    return _run_query(sqlcl)
+
+
+# FastMCP はツールの例外をエラーの結果（isError）にするので、MCP のエラー応答に変えて返す
+_call_tool_handler = server._mcp_server.request_handlers[types.CallToolRequest]
+
+
+async def _call_tool(request):
+    result = await _call_tool_handler(request)
+    if result.root.isError:
+        message = "".join(item.text for item in result.root.content if isinstance(item, types.TextContent))
+        raise McpError(types.ErrorData(code=types.INTERNAL_ERROR, message=message))
+    return result
+
+
+server._mcp_server.request_handlers[types.CallToolRequest] = _call_tool
+
+
+if __name__ == "__main__":
+    server.run()
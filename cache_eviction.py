@@ -0,0 +1,103 @@
+"""
+ディスクキャッシュのエントリ数の上限管理
+
+LLM 応答キャッシュ（llm_cache.py）と HTTP キャッシュ（web_fetch.py）は 1 エントリを 1 ファイルに保存する。
+保存のたびにディレクトリ全体を走査して件数を数えると、エントリが増えるほど保存が遅くなり、
+並列取得では複数のスレッドが同じ走査を繰り返していた。
+
+EntryLimit は件数をメモリ上で数え、上限を超えたときだけ走査する。走査したら更新日時の古いものから
+上限の 9 割まで削除するので、次の走査までに上限の 1 割の保存ができる（走査は上限の 1 割ごとに 1 回）。
+最初の保存のときに 1 回だけ走査して件数を数える。ほかのプロセスが同じディレクトリに保存した分は
+次の走査で数え直す。
+
+同じディレクトリの EntryLimit は get_entry_limit() でプロセス内の 1 つを共有する。
+"""
+
+import os
+import threading
+
+# 上限を超えたときに残す割合
+LOW_WATER = 0.9
+
+
+class EntryLimit:
+    """
+    ディレクトリ内のエントリ（suffix のファイル）の件数を max_entries 以下に保つ。
+
+    Args:
+        directory: エントリを保存するディレクトリ（サブディレクトリも含めて数える）
+        max_entries: 保持する最大エントリ数
+        suffix: エントリとして数えるファイルの拡張子
+        companions: エントリと一緒に削除するファイルの拡張子（本文を別ファイルに保存している場合など）
+    """
+
+    def __init__(self, directory, max_entries, suffix=".json", companions=()):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.suffix = suffix
+        self.companions = tuple(companions)
+        self.scans = 0
+        self._count = None
+        self._lock = threading.Lock()
+
+    def _scan(self):
+        self.scans += 1
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(self.suffix):
+                    path = os.path.join(root, name)
+                    try:
+                        entries.append((os.path.getmtime(path), path))
+                    except OSError:
+                        continue
+        return entries
+
+    def _remove(self, path):
+        base = path[:-len(self.suffix)]
+        for victim in (path,) + tuple(base + companion for companion in self.companions):
+            try:
+                os.remove(victim)
+            except OSError:
+                pass
+
+    def added(self, created=True):
+        """
+        エントリを保存した後に呼ぶ。上限を超えていれば古いエントリを削除する。
+
+        Args:
+            created: 新しいエントリなら True（既存のエントリを上書きした場合は False）
+        """
+        with self._lock:
+            if self._count is None:
+                self._count = len(self._scan())
+            elif created:
+                self._count += 1
+            if self._count <= self.max_entries:
+                return
+            entries = sorted(self._scan())
+            keep = min(self.max_entries, max(1, int(self.max_entries * LOW_WATER)))
+            for _, path in entries[:max(0, len(entries) - keep)]:
+                self._remove(path)
+            self._count = min(len(entries), keep)
+
+    def removed(self):
+        """エントリを削除した後に呼ぶ（期限切れのエントリを読み込み時に削除した場合など）"""
+        with self._lock:
+            if self._count:
+                self._count -= 1
+
+
+_limits = {}
+_limits_lock = threading.Lock()
+
+
+def get_entry_limit(directory, max_entries, suffix=".json", companions=()):
+    """directory の EntryLimit を返す（プロセス内で共有。max_entries は最後に指定した値を使う）"""
+    key = (os.path.abspath(directory), suffix)
+    with _limits_lock:
+        limit = _limits.get(key)
+        if limit is None:
+            limit = _limits[key] = EntryLimit(directory, max_entries, suffix, companions)
+        limit.max_entries = max_entries
+        return limit
@@ -0,0 +1,392 @@
+"""
+Oracle DDL から Mermaid の erDiagram を生成する
+
+「このスキーマの ER 図を描いて」という依頼では、LLM がカラムを 1 つずつ書き写すために何ステップも使い、
+NUMBER(10,2) や VECTOR(1536, FLOAT32) のような記法ルール違反も起きやすい。このモジュールは
+CREATE TABLE 文（カラム、インライン制約、表制約）と ALTER TABLE ... ADD CONSTRAINT を解析し、
+get_mermaid_script_guidelines_tool の記法ルールに沿った erDiagram を決定的に生成する。
+
+- データ型は記法ルールに合わせて正規化する（NUMBER(10,2) → NUMBER(10)、VECTOR(1536, FLOAT32) → VECTOR(1536)、
+  VARCHAR2(100 CHAR) → VARCHAR2(100)、TIMESTAMP(6) WITH TIME ZONE → TIMESTAMP_WITH_TIME_ZONE(6)）
+- 外部キーは「親 ||--o{ 子」のリレーションにする（外部キーのカラムが NULL 可なら |o--o{、一意なら ||--o|）
+- DDL に外部キーが 1 つもない場合は、他の表の単一カラム主キーと同じ名前のカラムからリレーションを推定し、
+  点線（||..o{）で描く
+- CREATE INDEX や PL/SQL ブロックなど、表定義以外の文は無視する
+
+使い方:
+    python ddl_to_er.py sql/SH_schema_CREATE_TABLE.sql -o output/sh_schema.mmd
+"""
+
+import argparse
+import re
+import sys
+
+CREATE_TABLE = re.compile(
+    r'^CREATE\s+(?:OR\s+REPLACE\s+)?(?:(?:GLOBAL|PRIVATE)\s+TEMPORARY\s+|SHARDED\s+|DUPLICATED\s+|'
+    r'(?:IMMUTABLE\s+)?BLOCKCHAIN\s+|IMMUTABLE\s+)?TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?(?P<name>(?:"[^"]+"|[\w$#]+)(?:\s*\.\s*(?:"[^"]+"|[\w$#]+))?)\s*\(',
+    re.IGNORECASE
+)
+ALTER_TABLE_ADD = re.compile(
+    r'^ALTER\s+TABLE\s+(?P<name>(?:"[^"]+"|[\w$#]+)(?:\s*\.\s*(?:"[^"]+"|[\w$#]+))?)\s+ADD\s+(?P<body>.*)$',
+    re.IGNORECASE | re.DOTALL
+)
+IDENTIFIER = re.compile(r'"[^"]+"|[\w$#]+')
+CONSTRAINT_NAME = re.compile(r'^CONSTRAINT\s+(?:"[^"]+"|[\w$#]+)\s+', re.IGNORECASE)
+TABLE_CONSTRAINT = re.compile(r'^(?:PRIMARY\s+KEY|UNIQUE|FOREIGN\s+KEY|CHECK)\b', re.IGNORECASE)
+# カラム定義でデータ型の後に続く句の先頭キーワード
+COLUMN_CLAUSE = re.compile(
+    r'\b(?:NOT\s+NULL|NULL|PRIMARY\s+KEY|UNIQUE|REFERENCES|CHECK|DEFAULT|GENERATED|CONSTRAINT|'
+    r'COLLATE|SORT|VISIBLE|INVISIBLE|ENCRYPT|AS|ANNOTATIONS)\b',
+    re.IGNORECASE
+)
+REFERENCES = re.compile(r'\bREFERENCES\s+(?P<table>(?:"[^"]+"|[\w$#]+)(?:\s*\.\s*(?:"[^"]+"|[\w$#]+))?)\s*(?:\((?P<columns>[^)]*)\))?', re.IGNORECASE)
+COMMENT_OR_STRING = re.compile(r"'(?:[^']|'')*'|--[^\n]*|/\*.*?(?:\*/|$)", re.DOTALL)
+MERMAID_NAME = re.compile(r'[^A-Za-z0-9_\-]')
+
+
+class Column:
+    """カラム定義"""
+
+    def __init__(self, name, data_type, not_null=False):
+        self.name = name
+        self.data_type = data_type
+        self.not_null = not_null
+
+
+class ForeignKey:
+    """外部キー（columns → ref_table の ref_columns）"""
+
+    def __init__(self, columns, ref_table, ref_columns=None, inferred=False):
+        self.columns = columns
+        self.ref_table = ref_table
+        self.ref_columns = ref_columns or []
+        self.inferred = inferred
+
+
+class Table:
+    """表定義"""
+
+    def __init__(self, name):
+        self.name = name
+        self.columns = []
+        self.primary_key = []
+        self.unique_keys = []
+        self.foreign_keys = []
+
+    def column(self, name):
+        for column in self.columns:
+            if column.name == name:
+                return column
+        return None
+
+
+def _normalize_identifier(identifier):
+    """引用符なしの識別子は大文字に、スキーマ名は取り除く"""
+    parts = IDENTIFIER.findall(identifier)
+    name = parts[-1] if parts else identifier.strip()
+    if name.startswith('"') and name.endswith('"'):
+        return name[1:-1]
+    return name.upper()
+
+
+def _identifier_list(text):
+    return [_normalize_identifier(part) for part in _split_top_level(text or "", ",") if part.strip()]
+
+
+def _strip_comments(ddl):
+    """-- と /* */ のコメントを取り除く（文字列リテラル内は残す）"""
+    return COMMENT_OR_STRING.sub(lambda match: match.group(0) if match.group(0).startswith("'") else "", ddl)
+
+
+def _split_top_level(text, separator):
+    """括弧と引用符の外にある separator で分割する"""
+    parts = []
+    depth = 0
+    quote = None
+    start = 0
+    for i, char in enumerate(text):
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        elif char == separator and depth == 0:
+            parts.append(text[start:i])
+            start = i + 1
+    parts.append(text[start:])
+    return parts
+
+
+def _split_statements(ddl):
+    # SQL*Plus の「/」だけの行は文の区切り
+    ddl = re.sub(r'(?m)^\s*/\s*$', ';', _strip_comments(ddl))
+    return [statement.strip() for statement in _split_top_level(ddl, ";") if statement.strip()]
+
+
+def _matching_paren(text, open_index):
+    depth = 0
+    quote = None
+    for i in range(open_index, len(text)):
+        char = text[i]
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                return i
+    return -1
+
+
+def normalize_data_type(data_type):
+    """
+    Oracle のデータ型を erDiagram で使える表記にする。
+
+    Examples:
+        NUMBER(10,2) → NUMBER(10)、VECTOR(1536, FLOAT32) → VECTOR(1536)、VECTOR(*, INT8) → VECTOR、
+        VARCHAR2(100 CHAR) → VARCHAR2(100)、TIMESTAMP(6) WITH TIME ZONE → TIMESTAMP_WITH_TIME_ZONE(6)
+    """
+    words = []
+    first_argument = None
+    for match in re.finditer(r'(?P<word>[\w$#]+)|\((?P<args>[^)]*)\)', data_type):
+        if match.group("word"):
+            words.append(match.group("word").upper())
+        elif first_argument is None:
+            argument = match.group("args").split(",")[0].strip().split()
+            first_argument = argument[0] if argument else ""
+    type_name = "_".join(words) or "UNKNOWN"
+    if first_argument and first_argument != "*":
+        return f"{type_name}({first_argument})"
+    return type_name
+
+
+def _parse_column(table, text):
+    match = IDENTIFIER.match(text)
+    if match is None:
+        return
+    name = _normalize_identifier(match.group(0))
+    rest = text[match.end():].strip()
+
+    clause = COLUMN_CLAUSE.search(rest)
+    type_text = rest[:clause.start()] if clause else rest
+    clauses = rest[clause.start():] if clause else ""
+    # 仮想列（名前 AS (式)）や型なしの列
+    data_type = normalize_data_type(type_text) if type_text.strip() else "VIRTUAL"
+
+    # CHECK (... IS NOT NULL) などの括弧内は制約の判定に使わない
+    flat_clauses = re.sub(r'\([^()]*\)', ' ', clauses)
+    column = Column(name, data_type, not_null=bool(re.search(r'\bNOT\s+NULL\b', flat_clauses, re.IGNORECASE)))
+    table.columns.append(column)
+
+    if re.search(r'\bPRIMARY\s+KEY\b', flat_clauses, re.IGNORECASE):
+        table.primary_key = [name]
+    if re.search(r'\bUNIQUE\b', flat_clauses, re.IGNORECASE):
+        table.unique_keys.append([name])
+    reference = REFERENCES.search(clauses)
+    if reference:
+        table.foreign_keys.append(ForeignKey(
+            [name], _normalize_identifier(reference.group("table")), _identifier_list(reference.group("columns"))
+        ))
+
+
+def _parse_table_constraint(table, text):
+    text = CONSTRAINT_NAME.sub("", text.strip())
+    keyword = re.match(r'(PRIMARY\s+KEY|UNIQUE|FOREIGN\s+KEY)\s*\((?P<columns>[^)]*)\)', text, re.IGNORECASE)
+    if keyword is None:
+        return
+    columns = _identifier_list(keyword.group("columns"))
+    kind = keyword.group(1).upper().split()[0]
+    if kind == "PRIMARY":
+        table.primary_key = columns
+    elif kind == "UNIQUE":
+        table.unique_keys.append(columns)
+    else:
+        reference = REFERENCES.search(text, keyword.end())
+        if reference:
+            table.foreign_keys.append(ForeignKey(
+                columns, _normalize_identifier(reference.group("table")), _identifier_list(reference.group("columns"))
+            ))
+
+
+def _parse_create_table(statement, match):
+    table = Table(_normalize_identifier(match.group("name")))
+    open_index = match.end() - 1
+    close_index = _matching_paren(statement, open_index)
+    if close_index == -1:
+        return None
+    for item in _split_top_level(statement[open_index + 1:close_index], ","):
+        item = item.strip()
+        if not item:
+            continue
+        if CONSTRAINT_NAME.match(item) or TABLE_CONSTRAINT.match(item):
+            _parse_table_constraint(table, item)
+        else:
+            _parse_column(table, item)
+    return table
+
+
+def parse_oracle_ddl(ddl):
+    """
+    Oracle の DDL から表定義を取り出す。
+
+    Args:
+        ddl: CREATE TABLE / ALTER TABLE 文を含む DDL
+
+    Returns:
+        list[Table]: DDL に現れた順の表定義
+    """
+    tables = {}
+    for statement in _split_statements(ddl):
+        match = CREATE_TABLE.match(statement)
+        if match:
+            table = _parse_create_table(statement, match)
+            if table is not None:
+                tables[table.name] = table
+            continue
+
+        match = ALTER_TABLE_ADD.match(statement)
+        if match:
+            table = tables.get(_normalize_identifier(match.group("name")))
+            if table is None:
+                continue
+            body = match.group("body").strip()
+            # ALTER TABLE t ADD (CONSTRAINT ..., CONSTRAINT ...) の形式
+            if body.startswith("(") and _matching_paren(body, 0) == len(body) - 1:
+                body = body[1:-1]
+            for item in _split_top_level(body, ","):
+                _parse_table_constraint(table, item)
+    return list(tables.values())
+
+
+def infer_foreign_keys(tables):
+    """
+    外部キーが定義されていない DDL 向けに、他の表の単一カラム主キーと同じ名前のカラムを外部キーとみなす。
+    自分自身の単一カラム主キーは対象外（1 対 1 の表どうしを循環させないため）。
+    """
+    owners = {}
+    for table in tables:
+        if len(table.primary_key) == 1:
+            owners.setdefault(table.primary_key[0], table.name)
+    for table in tables:
+        for column in table.columns:
+            owner = owners.get(column.name)
+            if owner is None or owner == table.name or table.primary_key == [column.name]:
+                continue
+            table.foreign_keys.append(ForeignKey([column.name], owner, [column.name], inferred=True))
+
+
+def _mermaid_name(name):
+    return MERMAID_NAME.sub("_", name)
+
+
+def _relationship(table, foreign_key):
+    nullable = any(not (table.column(name) and table.column(name).not_null) for name in foreign_key.columns)
+    unique = foreign_key.columns == table.primary_key or foreign_key.columns in table.unique_keys
+    parent = "|o" if nullable else "||"
+    child = "o|" if unique else "o{"
+    line = ".." if foreign_key.inferred else "--"
+    label = ", ".join(foreign_key.columns)
+    return f'    {_mermaid_name(foreign_key.ref_table)} {parent}{line}{child} {_mermaid_name(table.name)} : "{label}"'
+
+
+def tables_to_mermaid_er(tables, include_columns=True):
+    """
+    表定義から erDiagram の Mermaid スクリプトを作る。
+
+    Args:
+        tables: parse_oracle_ddl() の戻り値
+        include_columns: カラムを出力するかどうか（表が多い場合は False にすると表とリレーションだけになる）
+
+    Returns:
+        str: Mermaid スクリプト
+    """
+    names = {table.name for table in tables}
+    lines = ["erDiagram"]
+    for table in tables:
+        if not include_columns or not table.columns:
+            lines.append(f"    {_mermaid_name(table.name)}")
+            continue
+        foreign_key_columns = {name for fk in table.foreign_keys if not fk.inferred for name in fk.columns}
+        unique_columns = {name for unique_key in table.unique_keys for name in unique_key}
+        lines.append(f"    {_mermaid_name(table.name)} {{")
+        for column in table.columns:
+            keys = []
+            if column.name in table.primary_key:
+                keys.append("PK")
+            if column.name in foreign_key_columns:
+                keys.append("FK")
+            if column.name in unique_columns and "PK" not in keys:
+                keys.append("UK")
+            attribute = f"        {column.data_type} {_mermaid_name(column.name)}"
+            if keys:
+                attribute += " " + ", ".join(keys)
+            if column.not_null or column.name in table.primary_key:
+                attribute += ' "NOT NULL"'
+            lines.append(attribute)
+        lines.append("    }")
+
+    for table in tables:
+        for foreign_key in table.foreign_keys:
+            # DDL に含まれない表への外部キーはリレーションを描けないので省く
+            if foreign_key.ref_table in names:
+                lines.append(_relationship(table, foreign_key))
+    return "\n".join(lines) + "\n"
+
+
+def ddl_to_mermaid_er(ddl, include_columns=True, infer_relationships=None):
+    """
+    Oracle の DDL から erDiagram の Mermaid スクリプトを生成する。
+
+    Args:
+        ddl: CREATE TABLE / ALTER TABLE 文を含む DDL
+        include_columns: カラムを出力するかどうか
+        infer_relationships: カラム名からリレーションを推定するかどうか（None の場合は外部キーが 1 つもないときだけ推定）
+
+    Returns:
+        str: Mermaid スクリプト
+
+    Raises:
+        ValueError: DDL に CREATE TABLE 文がない場合
+    """
+    tables = parse_oracle_ddl(ddl)
+    if not tables:
+        raise ValueError("No CREATE TABLE statement found in the DDL")
+    if infer_relationships is None:
+        infer_relationships = not any(table.foreign_keys for table in tables)
+    if infer_relationships:
+        infer_foreign_keys(tables)
+    return tables_to_mermaid_er(tables, include_columns=include_columns)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Oracle DDL から Mermaid の erDiagram を生成する")
+    parser.add_argument("ddl_file", help="CREATE TABLE 文を含む .sql ファイル")
+    parser.add_argument("-o", "--output", help="出力する .mmd ファイル（省略時は標準出力）")
+    parser.add_argument("--no-columns", action="store_true", help="カラムを出力せず、表とリレーションだけにする")
+    parser.add_argument("--no-infer", action="store_true", help="カラム名からリレーションを推定しない")
+    args = parser.parse_args(argv)
+
+    with open(args.ddl_file, 'r', encoding='utf-8') as f:
+        ddl = f.read()
+    mermaid_script = ddl_to_mermaid_er(
+        ddl,
+        include_columns=not args.no_columns,
+        infer_relationships=False if args.no_infer else None
+    )
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(mermaid_script)
+    else:
+        sys.stdout.write(mermaid_script)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+ダイアグラムの出力フォーマット・解像度と画面への配信
+
+すべてのダイアグラムを 2048x2048 の PNG で生成し、画面では PIL で開いて gr.Image に渡していたため、
+リクエストごとに画像のデコードと Gradio での再エンコードが発生し、ブラウザにも数 MB を転送していた。
+このモジュールは次の機能を提供する。
+
+- choose_render_size(script): ダイアグラムの大きさ（行数）からレンダリングするビューポートの一辺を決める
+- render_formats(): PNG に加えて生成するフォーマット（SVG）
+- ensure_preview(image_file): 画面表示用の縮小版（既定は WebP）を作る。画面にはファイルのパスで渡し、
+  フル解像度の PNG・SVG はダウンロードしたときにだけ転送する
+- diagram_downloads(image_file): ダウンロード用のフル解像度のファイル（分割した部分を含む）
+
+環境変数:
+    DIAGRAM_FORMATS: 生成するフォーマット（カンマ区切り。既定 png。png,svg で SVG も生成する）
+    DIAGRAM_MIN_SIZE / DIAGRAM_MAX_SIZE: ビューポートの一辺の最小・最大ピクセル数（既定 1024 / 2048）
+    DIAGRAM_PREVIEW_SIZE: 縮小版の長辺の最大ピクセル数（既定 1024）
+    DIAGRAM_PREVIEW_FORMAT: 縮小版のフォーマット（webp（既定）/ png）
+"""
+
+import glob
+import os
+import re
+
+from mermaid_partition import part_file
+
+PREVIEW_FORMATS = ("webp", "png")
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+def render_formats():
+    """生成するフォーマットのリスト（先頭は常に png。エージェントや編集ツールは PNG のパスでダイアグラムを扱う）"""
+    formats = [name.strip().lower() for name in os.getenv("DIAGRAM_FORMATS", "png").split(",") if name.strip()]
+    return ["png"] + [name for name in dict.fromkeys(formats) if name != "png"]
+
+
+def diagram_complexity(mermaid_script):
+    """ダイアグラムの大きさの目安（コメントと空行を除いた行数。ノード・エッジ・カラムの数にほぼ比例する）"""
+    return sum(1 for line in mermaid_script.splitlines() if line.strip() and not line.strip().startswith("%%"))
+
+
+def choose_render_size(mermaid_script):
+    """
+    ダイアグラムの大きさからビューポートの一辺を決める（小さなダイアグラムを大きな画像にしない）。
+
+    Returns:
+        tuple[int, int]: (幅, 高さ)。256 の倍数で DIAGRAM_MIN_SIZE 以上 DIAGRAM_MAX_SIZE 以下
+    """
+    min_size = _env_int("DIAGRAM_MIN_SIZE", 1024)
+    max_size = _env_int("DIAGRAM_MAX_SIZE", 2048)
+    size = 512 + 32 * diagram_complexity(mermaid_script)
+    size = -(-size // 256) * 256
+    size = min(max_size, max(min_size, size))
+    return size, size
+
+
+def format_file(image_file, fmt):
+    """PNG のパスから同じ名前の別フォーマットのパスを返す（output/x.png → output/x.svg）"""
+    return re.sub(r'\.png$', f'.{fmt}', image_file)
+
+
+def preview_file(image_file):
+    """縮小版のパス（output/x.png → output/x_preview.webp）"""
+    fmt = os.getenv("DIAGRAM_PREVIEW_FORMAT", "webp")
+    if fmt not in PREVIEW_FORMATS:
+        raise ValueError(f"Unknown preview format: {fmt} (expected one of {', '.join(PREVIEW_FORMATS)})")
+    return part_file(image_file, "preview", f".{fmt}")
+
+
+def ensure_preview(image_file):
+    """
+    画面表示用の縮小版を作る（作成済みで PNG より新しければそのまま使う）。
+
+    Returns:
+        str: 縮小版のパス。作成できない場合は image_file
+    """
+    preview = preview_file(image_file)
+    try:
+        if os.path.getmtime(preview) >= os.path.getmtime(image_file):
+            return preview
+    except OSError:
+        pass
+
+    from PIL import Image
+
+    max_size = _env_int("DIAGRAM_PREVIEW_SIZE", 1024)
+    try:
+        with Image.open(image_file) as image:
+            if max(image.size) <= max_size and preview.endswith(".png"):
+                return image_file
+            image.thumbnail((max_size, max_size))
+            tmp_file = f"{preview}.tmp"
+            if preview.endswith(".webp"):
+                image.save(tmp_file, format="WEBP", quality=85, method=4)
+            else:
+                image.save(tmp_file, format="PNG", optimize=True)
+        os.replace(tmp_file, preview)
+    except OSError as e:
+        print(f"Preview generation failed for {image_file}: {e}")
+        return image_file
+    return preview
+
+
+def diagram_files(image_file):
+    """
+    ダイアグラム 1 つ分の派生ファイル（別フォーマット・縮小版）のうち存在するものを返す
+    （レンダリングキャッシュが成果物と一緒に削除するファイル）。
+    """
+    candidates = [format_file(image_file, fmt) for fmt in render_formats()[1:]]
+    candidates += [part_file(image_file, "preview", f".{fmt}") for fmt in PREVIEW_FORMATS]
+    return [path for path in candidates if path != image_file and os.path.exists(path)]
+
+
+def diagram_downloads(image_file):
+    """ダウンロード用のフル解像度のファイル（PNG、生成していれば SVG、分割した場合は部分の PNG）"""
+    files = [image_file] + [path for path in (format_file(image_file, fmt) for fmt in render_formats()[1:]) if os.path.exists(path)]
+    part_files = sorted(
+        glob.glob(part_file(glob.escape(image_file), "part*", ".png")),
+        key=lambda path: int(re.search(r'_part(\d+)\.png$', path).group(1))
+    )
+    return [path for path in files + part_files if os.path.exists(path)]
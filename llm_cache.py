@@ -0,0 +1,246 @@
+"""
+LLM 応答キャッシュ（記録・再生モード付き）
+
+各エントリポイントは temperature=0.0 の LiteLLMModel を使っているので、同じメッセージ履歴には
+同じ応答を再利用できる。CachedModel は smolagents のモデルをラップし、正規化したメッセージ・ツール・
+生成パラメータのハッシュをキーに応答をディスクに保存する。
+
+モード（環境変数 LLM_CACHE_MODE）:
+    off        キャッシュを使わない
+    readwrite  キャッシュがあれば使い、なければ LLM を呼び出して保存する（既定）
+    record     常に LLM を呼び出し、応答を保存（上書き）する
+    replay     キャッシュのみを使う。キャッシュミスは LLMCacheMissError（テストをオフラインで決定的に実行するため）
+
+- 保存先は cache/llm/（LLM_CACHE_DIR で変更可）
+- LLM_CACHE_TTL 秒（既定 7 日）を過ぎたエントリは使わない
+- LLM_CACHE_MAX_ENTRIES 件（既定 2000）を超えると古いものから削除する（件数はメモリ上で数え、
+  保存のたびにディレクトリを走査しない。cache_eviction.py）
+
+Web の最新の情報を答える 200/300 のコード例は、同じ質問に前回の応答を返さないよう既定で off にしている
+（wrap_model_with_cache の default_mode。LLM_CACHE_MODE を指定すれば有効になる）。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+from cache_eviction import get_entry_limit
+from smolagents.models import ChatMessage, ChatMessageStreamDelta, MessageRole
+from smolagents.monitoring import TokenUsage
+
+CACHE_MODES = ("off", "readwrite", "record", "replay")
+
+# キーに含める生成パラメータ（認証情報などは含めない）
+GENERATION_PARAMS = (
+    "temperature", "top_p", "top_k", "max_tokens", "max_completion_tokens", "seed",
+    "frequency_penalty", "presence_penalty", "reasoning_effort",
+)
+
+
+class LLMCacheMissError(RuntimeError):
+    """replay モードでキャッシュに応答がない場合の例外"""
+
+
+def _message_to_dict(message):
+    # raw（API の生レスポンス）や token_usage はキーにも保存内容にも含めない
+    if isinstance(message, dict):
+        role, content, tool_calls = message.get("role"), message.get("content"), message.get("tool_calls")
+    else:
+        role, content, tool_calls = message.role, message.content, message.tool_calls
+    return {"role": _to_jsonable(role), "content": _to_jsonable(content), "tool_calls": _to_jsonable(tool_calls)}
+
+
+def _to_jsonable(value):
+    if hasattr(value, "dict") and callable(value.dict):
+        return _to_jsonable(value.dict())
+    if isinstance(value, dict):
+        return {str(k): _to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_jsonable(v) for v in value]
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+class CachedModel:
+    """
+    smolagents のモデルに応答キャッシュを付けるラッパー。
+    generate / generate_stream 以外の属性はラップしたモデルに委譲する。
+
+    Args:
+        model: ラップするモデル（LiteLLMModel など）
+        cache_dir: キャッシュの保存先
+        mode: キャッシュモード（off, readwrite, record, replay）
+        ttl: エントリの有効期間（秒）
+        max_entries: 保持する最大エントリ数
+    """
+
+    def __init__(self, model, cache_dir=os.path.join("cache", "llm"), mode="readwrite", ttl=7 * 24 * 3600, max_entries=2000):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode: {mode} (expected one of {', '.join(CACHE_MODES)})")
+        self.model = model
+        self.cache_dir = cache_dir
+        self.mode = mode
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self._lock = threading.Lock()
+        self._limit = get_entry_limit(cache_dir, max_entries)
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __call__(self, *args, **kwargs):
+        return self.generate(*args, **kwargs)
+
+    def make_key(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        """正規化したメッセージ・ツール・生成パラメータからキャッシュキーを作る"""
+        model_kwargs = getattr(self.model, "kwargs", {}) or {}
+        params = {name: model_kwargs[name] for name in GENERATION_PARAMS if name in model_kwargs}
+        params.update({name: kwargs[name] for name in GENERATION_PARAMS if name in kwargs})
+        tools = [
+            {"name": tool.name, "description": tool.description, "inputs": tool.inputs}
+            for tool in tools_to_call_from or []
+        ]
+        payload = json.dumps({
+            "model_id": getattr(self.model, "model_id", None),
+            "messages": [_message_to_dict(message) for message in messages],
+            "stop_sequences": stop_sequences,
+            "response_format": _to_jsonable(response_format),
+            "tools": _to_jsonable(tools),
+            "params": params,
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _load(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.ttl and time.time() - entry.get("created_at", 0) > self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            else:
+                self._limit.removed()
+            return None
+        return entry
+
+    def _store(self, key, message):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        created = not os.path.exists(path)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "created_at": time.time(),
+                "model_id": getattr(self.model, "model_id", None),
+                "message": _message_to_dict(message),
+            }, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        with self._lock:
+            self.stores += 1
+        self._limit.added(created)
+
+    def _lookup(self, key):
+        if self.mode == "record":
+            return None
+        entry = self._load(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None and self.mode == "replay":
+            raise LLMCacheMissError(f"No cached LLM response for key {key} (LLM_CACHE_MODE=replay)")
+        return entry
+
+    def generate(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        if self.mode == "off":
+            return self.model.generate(messages, stop_sequences=stop_sequences, response_format=response_format,
+                                       tools_to_call_from=tools_to_call_from, **kwargs)
+
+        key = self.make_key(messages, stop_sequences, response_format, tools_to_call_from, **kwargs)
+        entry = self._lookup(key)
+        if entry is not None:
+            message = ChatMessage.from_dict(entry["message"])
+            # キャッシュヒットはトークンを消費しない
+            message.token_usage = TokenUsage(input_tokens=0, output_tokens=0)
+            return message
+
+        message = self.model.generate(messages, stop_sequences=stop_sequences, response_format=response_format,
+                                      tools_to_call_from=tools_to_call_from, **kwargs)
+        self._store(key, message)
+        return message
+
+    def generate_stream(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        if self.mode == "off":
+            yield from self.model.generate_stream(messages, stop_sequences=stop_sequences, response_format=response_format,
+                                                  tools_to_call_from=tools_to_call_from, **kwargs)
+            return
+
+        key = self.make_key(messages, stop_sequences, response_format, tools_to_call_from, **kwargs)
+        entry = self._lookup(key)
+        if entry is not None:
+            message = ChatMessage.from_dict(entry["message"])
+            yield ChatMessageStreamDelta(content=message.content, token_usage=TokenUsage(input_tokens=0, output_tokens=0))
+            return
+
+        contents = []
+        cacheable = True
+        for delta in self.model.generate_stream(messages, stop_sequences=stop_sequences, response_format=response_format,
+                                                tools_to_call_from=tools_to_call_from, **kwargs):
+            if delta.content:
+                contents.append(delta.content)
+            if delta.tool_calls:
+                # ツール呼び出しの差分は組み立てが必要なのでキャッシュしない
+                cacheable = False
+            yield delta
+
+        if cacheable:
+            self._store(key, ChatMessage(role=MessageRole.ASSISTANT, content="".join(contents)))
+
+    def stats(self):
+        """ヒット数・ミス数・保存数を返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "mode": self.mode,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "stores": self.stores,
+            }
+
+
+def wrap_model_with_cache(model, default_mode="readwrite"):
+    """
+    環境変数の設定に従ってモデルに応答キャッシュを付ける。
+
+    Args:
+        model: ラップするモデル
+        default_mode: LLM_CACHE_MODE が設定されていない場合のモード（最新の情報を答えるエージェントは "off"）
+
+    Returns:
+        LLM_CACHE_MODE=off の場合は model をそのまま、それ以外は CachedModel
+    """
+    mode = os.getenv("LLM_CACHE_MODE", default_mode)
+    if mode == "off":
+        return model
+    return CachedModel(
+        model,
+        cache_dir=os.getenv("LLM_CACHE_DIR", os.path.join("cache", "llm")),
+        mode=mode,
+        ttl=int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600))),
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "2000"))
+    )
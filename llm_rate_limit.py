@@ -0,0 +1,178 @@
+"""
+LLM プロバイダーごとのレート制限と再試行
+
+バッチ実行のように多数のタスクを並行して流すと、プロバイダーのレート制限（HTTP 429）や
+一時的な過負荷（503 など）に当たりやすい。モデルをラップして、呼び出しの前にプロバイダーごとの
+トークンバケットで間隔を空け、再試行できるエラーは指数バックオフ（ジッター付き）で再試行する。
+
+- RateLimiter: 1 分あたりの呼び出し数を制限するトークンバケット
+- get_rate_limiter(provider): プロバイダー（model_id の "/" より前。例: "oci"）ごとに共有するリミッター
+- RateLimitedModel: generate / generate_stream を制限・再試行するモデルラッパー
+- is_retryable_error(e): レート制限・一時的なエラーかどうか
+
+待っている間に停止要求（run_control.py）があれば RunCancelled を送出する。
+
+環境変数:
+    LLM_RATE_LIMIT_RPM: 1 プロバイダーあたりの 1 分間の呼び出し数の上限（既定 0 = 無制限）
+    LLM_RATE_LIMIT_RPM_<PROVIDER>: プロバイダーごとの上限（例: LLM_RATE_LIMIT_RPM_OCI=30）
+    LLM_RETRY_MAX: 再試行の回数（既定 5）
+    LLM_RETRY_BASE_DELAY / LLM_RETRY_MAX_DELAY: バックオフの初期値・上限の秒数（既定 1 / 60）
+"""
+
+import os
+import random
+import re
+import threading
+import time
+
+from run_control import RunCancelled, current_token, raise_if_cancelled
+
+_RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504, 529}
+_RETRYABLE_ERROR_NAMES = re.compile(r'RateLimit|Timeout|ServiceUnavailable|Overloaded|InternalServer|APIConnection', re.IGNORECASE)
+
+
+def is_retryable_error(error):
+    """レート制限・タイムアウト・一時的なサーバーエラーなど、再試行すれば成功しうるエラーなら True"""
+    if isinstance(error, RunCancelled):
+        return False
+    status_code = getattr(error, "status_code", None)
+    if isinstance(status_code, int):
+        return status_code in _RETRYABLE_STATUS_CODES
+    return bool(_RETRYABLE_ERROR_NAMES.search(type(error).__name__))
+
+
+def _retry_after(error):
+    """エラーに Retry-After ヘッダーがあれば待つ秒数を返す"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def _wait(seconds):
+    """seconds 秒待つ。停止要求があればすぐに RunCancelled を送出する"""
+    if seconds <= 0:
+        return
+    token = current_token()
+    if token is None:
+        time.sleep(seconds)
+        return
+    event = threading.Event()
+    unregister = token.on_cancel(event.set)
+    try:
+        event.wait(seconds)
+    finally:
+        unregister()
+    raise_if_cancelled()
+
+
+class RateLimiter:
+    """1 分あたりの呼び出し数を制限するトークンバケット（スレッドセーフ）"""
+
+    def __init__(self, requests_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self._interval = 60.0 / requests_per_minute if requests_per_minute > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_at = 0.0
+        self.waited_seconds = 0.0
+
+    def acquire(self):
+        """次の呼び出しが許可されるまで待つ（無制限なら待たない）"""
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start_at = max(now, self._next_at)
+            self._next_at = start_at + self._interval
+            delay = start_at - now
+            self.waited_seconds += delay
+        _wait(delay)
+
+    def penalize(self, seconds):
+        """レート制限を受けたときに、以降の呼び出しを seconds 秒後まで遅らせる"""
+        with self._lock:
+            self._next_at = max(self._next_at, time.monotonic() + seconds)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(provider):
+    """プロバイダーごとに共有する RateLimiter を返す（上限は環境変数で指定）"""
+    with _limiters_lock:
+        limiter = _limiters.get(provider)
+        if limiter is None:
+            rpm = os.getenv(f"LLM_RATE_LIMIT_RPM_{re.sub(r'[^A-Za-z0-9]', '_', provider).upper()}",
+                            os.getenv("LLM_RATE_LIMIT_RPM", "0"))
+            limiter = _limiters[provider] = RateLimiter(float(rpm))
+        return limiter
+
+
+def provider_of(model):
+    """モデルのプロバイダー名（model_id の "/" より前）を返す"""
+    model_id = str(getattr(model, "model_id", "") or "")
+    return model_id.split("/", 1)[0] if "/" in model_id else (model_id or "default")
+
+
+class RateLimitedModel:
+    """
+    呼び出しの前にプロバイダーのレート制限を待ち、再試行できるエラーは指数バックオフで再試行するモデルラッパー。
+    generate / generate_stream 以外の属性はラップしたモデルに委譲する。
+    generate_stream は最初のチャンクを受け取る前のエラーだけを再試行する（途中までの出力を重複させない）。
+    """
+
+    def __init__(self, model, limiter=None, max_retries=None, base_delay=None, max_delay=None):
+        self.model = model
+        self.limiter = limiter or get_rate_limiter(provider_of(model))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv("LLM_RETRY_MAX", "5"))
+        self.base_delay = base_delay if base_delay is not None else float(os.getenv("LLM_RETRY_BASE_DELAY", "1"))
+        self.max_delay = max_delay if max_delay is not None else float(os.getenv("LLM_RETRY_MAX_DELAY", "60"))
+        self._lock = threading.Lock()
+        self.retries = 0
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __call__(self, *args, **kwargs):
+        return self.generate(*args, **kwargs)
+
+    def _backoff(self, attempt, error):
+        """attempt 回目の失敗の後に待つ秒数を決めて待つ"""
+        delay = _retry_after(error)
+        if delay is None:
+            delay = min(self.max_delay, self.base_delay * (2 ** attempt))
+            delay = delay / 2 + random.uniform(0, delay / 2)
+        if getattr(error, "status_code", None) == 429 or "RateLimit" in type(error).__name__:
+            # 同じプロバイダーを使う他のスレッドの呼び出しも遅らせる
+            self.limiter.penalize(delay)
+        with self._lock:
+            self.retries += 1
+        print(f"LLM call failed ({type(error).__name__}), retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+        _wait(delay)
+
+    def generate(self, messages, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                return self.model.generate(messages, **kwargs)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                self._backoff(attempt, e)
+
+    def generate_stream(self, messages, **kwargs):
+        for attempt in range(self.max_retries + 1):
+            self.limiter.acquire()
+            started = False
+            try:
+                for delta in self.model.generate_stream(messages, **kwargs):
+                    started = True
+                    yield delta
+                return
+            except Exception as e:
+                if started or attempt >= self.max_retries or not is_retryable_error(e):
+                    raise
+                self._backoff(attempt, e)
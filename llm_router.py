@@ -0,0 +1,382 @@
+"""
+LLM プロバイダーのヘッジとフェイルオーバー
+
+OCI の Grok（oci/xai.grok-4）と Gemini（gemini/gemini-2.5-pro）のように複数のプロバイダーを優先順に並べ、
+1 つのモデルとして扱うラッパー。遅い・失敗するプロバイダーがそのままユーザーの待ち時間にならないようにする。
+
+- ヘッジ: 優先プロバイダーの応答（ストリーミングは最初のチャンク）が hedge_after 秒以内に来なければ、
+  次のプロバイダーにも同じリクエストを送り、先に応答した方を使う（遅れた方のストリーミングは打ち切る）
+- フェイルオーバー: プロバイダーがエラーを返したら次のプロバイダーで実行し直す。ストリーミングは
+  最初のチャンクを返す前のエラーだけを対象にする（途中までの出力を重複させない）
+- サーキットブレーカー: 続けて失敗したプロバイダーは一定時間使わない（その後 1 回だけ試して復帰を確認する）
+- プロバイダーごとのレイテンシのヒストグラムと p50/p95 を stats() で返す
+
+各プロバイダーのモデルは generate / generate_stream を持つオブジェクトならよいので、テストではローカルの
+偽のモデルを渡せる。停止要求（run_control.py）があれば待たずに RunCancelled を送出する。
+
+環境変数:
+    LLM_FALLBACK_MODELS: 2 番目以降のプロバイダーの model_id（カンマ区切り。例: gemini/gemini-2.5-pro。既定は空 = 使わない）
+    LLM_HEDGE_AFTER: ヘッジするまでの秒数（既定 0 = ヘッジせず、エラー時のフェイルオーバーのみ）
+    LLM_CIRCUIT_FAILURES: ブレーカーを開く連続失敗回数（既定 3）
+    LLM_CIRCUIT_RESET: ブレーカーを開いておく秒数（既定 30）
+"""
+
+import bisect
+import collections
+import contextvars
+import os
+import queue
+import threading
+import time
+
+from run_control import RunCancelled, current_token, using_token
+from tracing import trace_span
+
+# レイテンシのヒストグラムの区切り（秒）
+LATENCY_BUCKETS = (0.5, 1, 2, 5, 10, 20, 30, 60, 120)
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round((percent / 100) * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class AllProvidersFailedError(RuntimeError):
+    """すべてのプロバイダーが失敗した"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        details = "; ".join(f"{name}: {type(error).__name__}: {error}" for name, error in errors)
+        super().__init__(f"All LLM providers failed ({details})")
+
+
+class CircuitBreaker:
+    """
+    連続失敗回数で開くサーキットブレーカー。
+
+    closed（通常）→ failure_threshold 回続けて失敗すると open（使わない）→ reset_timeout 秒後に
+    half_open（1 回だけ試す）→ 成功すれば closed、失敗すればまた open。
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state()
+
+    def _state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        """リクエストを送ってよければ True（half_open では同時に 1 つだけ許可する）"""
+        with self._lock:
+            state = self._state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+    def release_trial(self):
+        """成功・失敗のどちらも記録せずに終わった試行（打ち切りなど）の half_open の枠を返す"""
+        with self._lock:
+            self._trial_running = False
+
+
+class LatencyHistogram:
+    """レイテンシ（秒）のヒストグラムと、直近の値から求める p50/p95"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS, max_samples=1000):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(buckets) + 1)
+        self._samples = collections.deque(maxlen=max_samples)
+
+    def observe(self, seconds):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, seconds)] += 1
+            self._samples.append(seconds)
+
+    def snapshot(self):
+        """{"p50", "p95"}（ミリ秒）と、区切りごとの件数 {"<=0.5s": n, ..., ">120s": n} を返す"""
+        with self._lock:
+            samples = list(self._samples)
+            counts = list(self._counts)
+        histogram = {f"<={bound}s": count for bound, count in zip(self.buckets, counts)}
+        histogram[f">{self.buckets[-1]}s"] = counts[-1]
+        return {
+            "p50": round(_percentile(samples, 50) * 1000, 1) if samples else None,
+            "p95": round(_percentile(samples, 95) * 1000, 1) if samples else None,
+            "histogram": histogram,
+        }
+
+
+class Provider:
+    """ルーティング先の 1 つのプロバイダー（モデルとブレーカー、統計）"""
+
+    def __init__(self, name, model, failure_threshold=3, reset_timeout=30.0):
+        self.name = name
+        self.model = model
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        # generate は応答まで、generate_stream は最初のチャンクまでの時間
+        self.latency = LatencyHistogram()
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.failures = 0
+        self.hedges = 0
+        self.wins = 0
+
+    def count(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+
+class _Attempt:
+    """1 つのプロバイダーへの 1 回のリクエスト（専用スレッドで実行し、結果はキューに入れる）"""
+
+    def __init__(self, provider, hedged):
+        self.provider = provider
+        self.hedged = hedged
+        self.abandoned = threading.Event()
+
+
+class RoutingModel:
+    """
+    複数のプロバイダーにヘッジ・フェイルオーバーするモデルラッパー。
+    generate / generate_stream 以外の属性は優先プロバイダーのモデルに委譲する
+    （model_id も優先プロバイダーのものなので、応答キャッシュのキーは変わらない）。
+    """
+
+    def __init__(self, providers, hedge_after=None):
+        """
+        Args:
+            providers: Provider のリスト（優先順）
+            hedge_after: ヘッジするまでの秒数（None または 0 でヘッジしない）
+        """
+        if not providers:
+            raise ValueError("At least one provider is required")
+        self.providers = providers
+        self.hedge_after = hedge_after or None
+
+    def __getattr__(self, name):
+        return getattr(self.providers[0].model, name)
+
+    def __call__(self, *args, **kwargs):
+        return self.generate(*args, **kwargs)
+
+    def _start(self, attempt, messages, kwargs, stream, events):
+        """attempt を専用スレッドで実行し、(種類, attempt, 値) をキューに入れる"""
+        provider = attempt.provider
+        provider.count("calls")
+        if attempt.hedged:
+            provider.count("hedges")
+        token = current_token()
+        context = contextvars.copy_context()
+
+        def run():
+            started = time.monotonic()
+            first = True
+            recorded = False
+            try:
+                with using_token(token), trace_span("model.provider", kind="model", provider=provider.name,
+                                                    hedged=attempt.hedged, stream=stream):
+                    chunks = provider.model.generate_stream(messages, **kwargs) if stream else [provider.model.generate(messages, **kwargs)]
+                    try:
+                        for chunk in chunks:
+                            if first:
+                                provider.latency.observe(time.monotonic() - started)
+                                first = False
+                            events.put(("chunk", attempt, chunk))
+                            if attempt.abandoned.is_set():
+                                break
+                    finally:
+                        if stream:
+                            chunks.close()
+                provider.breaker.record_success()
+                recorded = True
+                events.put(("done", attempt, None))
+            except Exception as e:
+                if attempt.abandoned.is_set() and isinstance(e, RunCancelled):
+                    return
+                provider.count("failures")
+                provider.breaker.record_failure()
+                recorded = True
+                events.put(("error", attempt, e))
+            finally:
+                # 打ち切られた試行がブレーカーを half_open のまま塞がないようにする
+                if not recorded:
+                    provider.breaker.release_trial()
+
+        threading.Thread(target=context.run, args=(run,), daemon=True).start()
+
+    def _route(self, messages, kwargs, stream):
+        """先に応答したプロバイダーの出力（generate は ChatMessage 1 つ）を順に返す"""
+        remaining = list(self.providers)
+        events = queue.Queue()
+        active = []
+        errors = []
+
+        def launch(hedged=False, provider=None):
+            """ブレーカーが許可する次のプロバイダーに送る（送れるプロバイダーがなければ False）"""
+            while provider is None and remaining:
+                candidate = remaining.pop(0)
+                if candidate.breaker.allow():
+                    provider = candidate
+            if provider is None:
+                return False
+            attempt = _Attempt(provider, hedged)
+            active.append(attempt)
+            self._start(attempt, messages, kwargs, stream, events)
+            return True
+
+        token = current_token()
+        unregister = token.on_cancel(lambda: events.put(("cancel", None, None))) if token is not None else (lambda: None)
+        winner = None
+        try:
+            if not launch():
+                # すべてのブレーカーが開いている場合は優先プロバイダーを試す
+                launch(provider=self.providers[0])
+            hedge_at = time.monotonic() + self.hedge_after if self.hedge_after else None
+            while True:
+                timeout = None
+                if winner is None and hedge_at is not None and remaining:
+                    timeout = max(0.0, hedge_at - time.monotonic())
+                try:
+                    kind, attempt, value = events.get(timeout=timeout)
+                except queue.Empty:
+                    # 優先プロバイダーが遅いので、次のプロバイダーにも送る
+                    hedge_at = None
+                    launch(hedged=True)
+                    continue
+
+                if kind == "cancel":
+                    raise RunCancelled()
+                if attempt.abandoned.is_set():
+                    continue
+                if kind == "chunk":
+                    if winner is None:
+                        winner = attempt
+                        attempt.provider.count("wins")
+                        for other in active:
+                            if other is not attempt:
+                                other.abandoned.set()
+                    yield value
+                elif kind == "done":
+                    return
+                else:
+                    active.remove(attempt)
+                    errors.append((attempt.provider.name, value))
+                    if attempt is winner:
+                        raise value
+                    if isinstance(value, RunCancelled):
+                        raise value
+                    if not active and not launch():
+                        raise errors[0][1] if len(errors) == 1 else AllProvidersFailedError(errors)
+        finally:
+            unregister()
+            for attempt in active:
+                attempt.abandoned.set()
+
+    def generate(self, messages, **kwargs):
+        for message in self._route(messages, kwargs, stream=False):
+            return message
+
+    def generate_stream(self, messages, **kwargs):
+        yield from self._route(messages, kwargs, stream=True)
+
+    def stats(self):
+        """プロバイダーごとの状態・呼び出し数・失敗数・ヘッジ数・採用数・レイテンシ（ミリ秒）を返す"""
+        return {
+            provider.name: {
+                "state": provider.breaker.state,
+                "calls": provider.calls,
+                "failures": provider.failures,
+                "hedges": provider.hedges,
+                "wins": provider.wins,
+                "latency_ms": provider.latency.snapshot(),
+            }
+            for provider in self.providers
+        }
+
+
+def create_litellm_model(model_id, **kwargs):
+    """
+    model_id のプロバイダーの認証情報を環境変数から設定した LiteLLMModel を作成する
+    （oci/...: OCI_*、gemini/...: GOOGLE_API_KEY）。
+    """
+    from smolagents import LiteLLMModel
+
+    if model_id.startswith("oci/"):
+        kwargs = {
+            "oci_region": os.getenv("OCI_REGION"),
+            "oci_user": os.getenv("OCI_USER"),
+            "oci_fingerprint": os.getenv("OCI_FINGERPRINT"),
+            "oci_tenancy": os.getenv("OCI_TENANCY"),
+            "oci_key": os.getenv("OCI_KEY"),
+            "oci_compartment_id": os.getenv("OCI_COMPARTMENT_ID"),
+            **kwargs,
+        }
+    elif model_id.startswith("gemini/"):
+        kwargs = {"api_key": os.getenv("GOOGLE_API_KEY"), **kwargs}
+    return LiteLLMModel(model_id=model_id, **kwargs)
+
+
+def with_fallback_providers(model, **model_kwargs):
+    """
+    LLM_FALLBACK_MODELS が設定されていれば、model を優先プロバイダーとする RoutingModel を返す（なければ model をそのまま返す）。
+
+    Args:
+        model: 優先プロバイダーのモデル
+        **model_kwargs: 2 番目以降のプロバイダーの LiteLLMModel に渡す引数（temperature, max_tokens など）
+
+    2 番目以降のプロバイダーも優先プロバイダーと同じく with_prompt_cache で包む。
+    """
+    from prompt_budget import with_prompt_cache
+
+    fallback_ids = [model_id.strip() for model_id in os.getenv("LLM_FALLBACK_MODELS", "").split(",") if model_id.strip()]
+    if not fallback_ids:
+        return model
+    failure_threshold = int(os.getenv("LLM_CIRCUIT_FAILURES", "3"))
+    reset_timeout = float(os.getenv("LLM_CIRCUIT_RESET", "30"))
+    providers = [Provider(str(getattr(model, "model_id", "primary")), model, failure_threshold, reset_timeout)]
+    providers += [
+        Provider(model_id, with_prompt_cache(create_litellm_model(model_id, **model_kwargs)), failure_threshold, reset_timeout)
+        for model_id in fallback_ids
+    ]
+    return RoutingModel(providers, hedge_after=float(os.getenv("LLM_HEDGE_AFTER", "0")))
+
+
+def find_routing_model(model):
+    """ラッパー（CachedModel、TracedModel など）の内側にある RoutingModel を返す（なければ None）"""
+    while model is not None and not isinstance(model, RoutingModel):
+        # __getattr__ による委譲をたどらないように、インスタンスの属性だけを見る
+        model = vars(model).get("model") if hasattr(model, "__dict__") else None
+    return model
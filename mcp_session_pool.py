@@ -0,0 +1,517 @@
+"""
+MCP セッションプール（SQLcl MCP 用）
+
+SQLcl の MCP サーバ（sql.exe -mcp）を MCPClient 1 つで共有すると、起動がアプリの import 時に
+行われて遅く、SQLcl のプロセスが落ちるとアプリごと使えなくなり、同時に呼ばれたツールは 1 本の
+stdio パイプで直列になる。このモジュールは MCP セッションをプールし、次の機能を提供する。
+
+- 遅延起動: 最初にツールが必要になった時点で 1 セッション目を起動し、同時呼び出しが増えたら上限まで追加する
+- 呼び出しごとのタイムアウト（MCP の応答待ちタイムアウト）
+- キープアライブ: 一定時間使われていないセッションに ping を送り、応答しないものは停止する
+- 自動再起動: 落ちた・タイムアウトしたセッションは次の利用時に起動し直す。MCP サーバのプロセスが落ちた場合は
+  起動し直したセッションで 1 度だけやり直すが、run-sql などは要求がサーバに届いていたかもしれなければやり直さない
+  （同じ DML / DDL を 2 度実行しないように）。ツールのエラー（ORA- など）ではセッションを起動し直さない
+- 接続状態の再適用: SQLcl の connect ツールで接続した DB は、後から起動したセッションにも同じ引数で接続する
+- stats() でプールの状態とレイテンシを取得できる
+- エージェントの実行が停止された場合（run_control.py）は、セッションの空き待ちをやめて RunCancelled を送出する
+  （すでに MCP サーバに送った呼び出しは、応答かタイムアウトまで待つ）
+
+エージェントには PooledMCPTool（MCP ツールと同じ名前・説明・入力のツール）を渡すので、
+どのセッションで実行されるかを意識する必要はない。
+
+環境変数:
+    SQLCL_MCP_COMMAND          MCP サーバのコマンド（既定 D:\\tools\\sqlcl\\bin\\sql.exe）
+    SQLCL_MCP_ARGS             コマンドの引数（既定 -mcp）
+    SQLCL_MCP_POOL_SIZE        最大セッション数（既定 2）
+    SQLCL_MCP_CALL_TIMEOUT     ツール呼び出しのタイムアウト秒数（既定 120）
+    SQLCL_MCP_STARTUP_TIMEOUT  セッション起動のタイムアウト秒数（既定 60）
+    SQLCL_MCP_KEEPALIVE        キープアライブの間隔秒数（既定 60、0 で無効）
+
+スタブの MCP サーバ（benchmarks/stub_sqlcl_mcp_server.py）を SQLCL_MCP_COMMAND / SQLCL_MCP_ARGS に
+指定すると、SQLcl なしで動作を確認できる。
+"""
+
+import asyncio
+import atexit
+import collections
+import datetime
+import os
+import shlex
+import threading
+import time
+
+import anyio
+from mcp import StdioServerParameters
+from smolagents import MCPClient, Tool
+
+from run_control import current_token, raise_if_cancelled
+
+
+class MCPPoolUnavailableError(RuntimeError):
+    """MCP セッションを起動できないことを表す例外"""
+
+
+class _SessionLostError(Exception):
+    """MCP サーバとの通信が切れたことを表す内部例外（__cause__ に元の例外を持つ）"""
+
+    def __init__(self, retryable):
+        super().__init__()
+        # やり直してよいか（要求がサーバに届いていない、または何度実行してもよいツール）
+        self.retryable = retryable
+
+
+# MCP の CONNECTION_CLOSED（応答を待っている間にサーバとの接続が切れた）
+_CONNECTION_CLOSED = -32000
+
+
+def _connection_failure(error):
+    """
+    ツール呼び出しの例外が MCP サーバとの通信の切断によるものかを調べる。
+
+    Returns:
+        "unsent": 要求を書き込めなかった（サーバのプロセスがすでに終了していた）
+        "lost": 要求を送った後で接続が切れた（サーバで実行されたかもしれない）
+        None: 通信の異常ではない（ツールのエラーなど）
+    """
+    while error is not None:
+        if isinstance(error, (anyio.ClosedResourceError, anyio.BrokenResourceError, BrokenPipeError)):
+            return "unsent"
+        if isinstance(error, (anyio.EndOfStream, EOFError, ConnectionError)):
+            return "lost"
+        code = getattr(getattr(error, "error", None), "code", None)
+        if code == _CONNECTION_CLOSED:
+            return "lost"
+        error = error.__cause__
+    return None
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round((percent / 100) * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class _MCPSession:
+    """MCP サーバのプロセス 1 つと、そのツール"""
+
+    def __init__(self, server_parameters, call_timeout, startup_timeout):
+        self.server_parameters = server_parameters
+        self.call_timeout = call_timeout
+        self.startup_timeout = startup_timeout
+        self.client = None
+        self.tools = {}
+        self.last_used = time.monotonic()
+        # プールの接続状態（connect / disconnect）のどの世代まで適用したか。-1 は未接続
+        self.session_generation = -1
+
+    def start(self):
+        try:
+            self.client = MCPClient(
+                server_parameters=self.server_parameters,
+                adapter_kwargs={
+                    "connect_timeout": self.startup_timeout,
+                    "client_session_timeout_seconds": datetime.timedelta(seconds=self.call_timeout),
+                },
+                structured_output=False
+            )
+            self.tools = {tool.name: tool for tool in self.client.get_tools()}
+        except Exception as e:
+            self.stop()
+            raise MCPPoolUnavailableError(f"Failed to start MCP server: {type(e).__name__}: {e}") from e
+        self.last_used = time.monotonic()
+        self.session_generation = -1
+
+    def stop(self):
+        client, self.client = self.client, None
+        self.tools = {}
+        if client is not None:
+            try:
+                client.disconnect()
+            except Exception:
+                pass
+
+    def is_alive(self):
+        if self.client is None:
+            return False
+        # MCPClient は MCPAdapt のイベントループスレッド上でセッションを保持している
+        adapter = getattr(self.client, "_adapter", None)
+        thread = getattr(adapter, "thread", None)
+        return thread is None or thread.is_alive()
+
+    def ping(self, timeout):
+        """MCP の ping を送る。応答しなければ例外"""
+        adapter = getattr(self.client, "_adapter", None)
+        sessions = getattr(adapter, "sessions", None)
+        if not sessions:
+            if not self.is_alive():
+                raise RuntimeError("MCP session is not running")
+            return
+        asyncio.run_coroutine_threadsafe(sessions[0].send_ping(), adapter.loop).result(timeout=timeout)
+
+    def call(self, tool_name, *args, **kwargs):
+        tool = self.tools.get(tool_name)
+        if tool is None:
+            raise ValueError(f"Unknown MCP tool: {tool_name}")
+        return tool.forward(*args, **kwargs)
+
+
+class PooledMCPTool(Tool):
+    """MCP ツールをプール経由で呼び出すツール（名前・説明・入力は元の MCP ツールと同じ）"""
+
+    def __init__(self, pool, tool):
+        self.pool = pool
+        self.name = tool.name
+        self.description = tool.description
+        self.inputs = tool.inputs
+        self.output_type = tool.output_type
+        self.is_initialized = True
+        self.skip_forward_signature_validation = True
+
+    def forward(self, *args, **kwargs):
+        return self.pool.call_tool(self.name, *args, **kwargs)
+
+
+class MCPSessionPool:
+    """
+    MCP セッションのプール。
+
+    Args:
+        server_parameters: MCP サーバの起動パラメータ（StdioServerParameters）
+        size: 最大セッション数
+        call_timeout: ツール呼び出しのタイムアウト（秒）
+        startup_timeout: セッション起動のタイムアウト（秒）
+        keepalive_interval: キープアライブの間隔（秒、0 で無効）
+        connect_tool: 接続状態を作るツール名（このツールの最後の呼び出しを他のセッションにも適用する）
+        disconnect_tool: 接続状態を解除するツール名
+        retry_tools: 通信が切れたときに、サーバで実行されたかもしれなくてもやり直してよいツール名
+            （connect_tool / disconnect_tool は常にやり直す）
+    """
+
+    def __init__(self, server_parameters, size=2, call_timeout=120, startup_timeout=60, keepalive_interval=60,
+                 connect_tool="connect", disconnect_tool="disconnect", retry_tools=("list_connections",)):
+        self.server_parameters = server_parameters
+        self.size = max(1, size)
+        self.call_timeout = call_timeout
+        self.startup_timeout = startup_timeout
+        self.keepalive_interval = keepalive_interval
+        self.connect_tool = connect_tool
+        self.disconnect_tool = disconnect_tool
+        self.retry_tools = {connect_tool, disconnect_tool, *retry_tools}
+
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._sessions = []
+        self._idle = []
+        self._starting = 0
+        self._waiting = 0
+        self._tools = None
+        self._connect_args = None
+        self._session_generation = 0
+        self._closed = False
+        self._keepalive_thread = None
+
+        self._calls = 0
+        self._failed = 0
+        self._timeouts = 0
+        self._restarts = 0
+        self._health_checks = 0
+        self._health_check_failures = 0
+        self._latencies = collections.deque(maxlen=500)
+        self._acquire_waits = collections.deque(maxlen=500)
+
+    def get_tools(self):
+        """
+        エージェントに渡すツールを返す。初回呼び出し時に 1 セッション目を起動する。
+
+        Raises:
+            MCPPoolUnavailableError: MCP サーバを起動できない場合
+        """
+        with self._lock:
+            if self._tools is not None:
+                return list(self._tools)
+
+        session = self._acquire()
+        try:
+            tools = [PooledMCPTool(self, tool) for tool in session.tools.values()]
+        finally:
+            self._release(session)
+
+        with self._lock:
+            if self._tools is None:
+                self._tools = tools
+            return list(self._tools)
+
+    @property
+    def connect_args(self):
+        """最後に connect ツールに渡した引数（未接続の場合は None）"""
+        with self._lock:
+            return dict(self._connect_args) if self._connect_args is not None else None
+
+    def _start_keepalive(self):
+        # 複数のセッションが同時に起動しても、スレッドは 1 つだけ起動する（確認と代入をロックの中で行う）
+        with self._lock:
+            if not self.keepalive_interval or self._keepalive_thread is not None:
+                return
+            thread = self._keepalive_thread = threading.Thread(target=self._keepalive_loop, daemon=True)
+        thread.start()
+
+    def _wake_waiters(self):
+        with self._available:
+            self._available.notify_all()
+
+    def _acquire(self):
+        """空いているセッションを取り出す。なければ上限まで起動し、上限に達していれば空くのを待つ"""
+        waited_from = time.monotonic()
+        token = current_token()
+        # 停止要求があったら空き待ちを起こす
+        unregister = token.on_cancel(self._wake_waiters) if token is not None else (lambda: None)
+        with self._available:
+            if self._closed:
+                unregister()
+                raise MCPPoolUnavailableError("MCP session pool is closed")
+            self._waiting += 1
+            try:
+                while not self._idle and len(self._sessions) + self._starting >= self.size:
+                    raise_if_cancelled()
+                    remaining = self.call_timeout - (time.monotonic() - waited_from)
+                    if remaining <= 0:
+                        raise TimeoutError(f"No MCP session became available within {self.call_timeout} seconds")
+                    self._available.wait(timeout=remaining)
+            finally:
+                self._waiting -= 1
+                unregister()
+
+            if self._idle:
+                session = self._idle.pop()
+                self._acquire_waits.append(time.monotonic() - waited_from)
+            else:
+                session = None
+                self._starting += 1
+
+        if session is None:
+            session = _MCPSession(self.server_parameters, self.call_timeout, self.startup_timeout)
+            try:
+                session.start()
+            except MCPPoolUnavailableError:
+                with self._available:
+                    self._starting -= 1
+                    self._available.notify()
+                raise
+            with self._available:
+                self._starting -= 1
+                self._sessions.append(session)
+                self._acquire_waits.append(time.monotonic() - waited_from)
+            self._start_keepalive()
+        elif not session.is_alive():
+            self._restart(session)
+        return session
+
+    def _release(self, session):
+        session.last_used = time.monotonic()
+        with self._available:
+            if session in self._sessions:
+                self._idle.append(session)
+            self._available.notify()
+
+    def _discard(self, session):
+        session.stop()
+        with self._available:
+            if session in self._sessions:
+                self._sessions.remove(session)
+            if session in self._idle:
+                self._idle.remove(session)
+            self._available.notify()
+
+    def _restart(self, session):
+        session.stop()
+        try:
+            session.start()
+        except MCPPoolUnavailableError:
+            self._discard(session)
+            raise
+        with self._lock:
+            self._restarts += 1
+
+    def _sync_session_state(self, session):
+        """プールの接続状態（最後の connect / disconnect）をセッションに適用する"""
+        with self._lock:
+            connect_args = self._connect_args
+            generation = self._session_generation
+        if session.session_generation == generation:
+            return
+        if connect_args is not None:
+            session.call(self.connect_tool, **connect_args)
+        elif session.session_generation != -1 and self.disconnect_tool in session.tools:
+            session.call(self.disconnect_tool)
+        session.session_generation = generation
+
+    def call_tool(self, tool_name, *args, **kwargs):
+        """
+        MCP ツールを空いているセッションで呼び出す。
+        MCP サーバのプロセスが落ちていた場合は、起動し直したセッションで 1 度だけやり直す。
+        ただし要求がサーバに届いていたかもしれない場合は、retry_tools のツールしかやり直さない。
+
+        Raises:
+            MCPPoolUnavailableError: MCP サーバを起動できない場合
+            TimeoutError: セッションが空かない、またはツールの応答がタイムアウトした場合
+            RuntimeError: MCP サーバとの通信に失敗した場合
+            RunCancelled: エージェントの実行が停止された場合
+            Exception: ツールがエラーを返した場合（MCP のエラー応答など。セッションはそのまま使う）
+        """
+        raise_if_cancelled()
+        try:
+            return self._call_tool_once(tool_name, args, kwargs)
+        except _SessionLostError as e:
+            if not e.retryable:
+                # サーバで実行済みかもしれないので、やり直すと同じ SQL を 2 度実行するおそれがある
+                raise RuntimeError(
+                    f"MCP tool {tool_name} failed and was not retried (the server may have run it): {e.__cause__}"
+                ) from e.__cause__
+        try:
+            return self._call_tool_once(tool_name, args, kwargs)
+        except _SessionLostError as e:
+            raise RuntimeError(f"MCP tool {tool_name} failed: {e.__cause__}") from e.__cause__
+
+    def _call_tool_once(self, tool_name, args, kwargs):
+        session = self._acquire()
+        started_at = time.monotonic()
+        healthy = True
+        sent = False
+        try:
+            if tool_name not in (self.connect_tool, self.disconnect_tool):
+                self._sync_session_state(session)
+            sent = True
+            result = session.call(tool_name, *args, **kwargs)
+
+            if tool_name in (self.connect_tool, self.disconnect_tool):
+                arguments = args[0] if len(args) == 1 and isinstance(args[0], dict) else kwargs
+                with self._lock:
+                    self._connect_args = dict(arguments) if tool_name == self.connect_tool else None
+                    self._session_generation += 1
+                    session.session_generation = self._session_generation
+            return result
+        except ValueError:
+            # 引数の誤りや空の応答などはセッションの異常ではない
+            with self._lock:
+                self._failed += 1
+            raise
+        except Exception as e:
+            timed_out = isinstance(e, TimeoutError) or "timed out" in str(e).lower()
+            failure = None if timed_out else _connection_failure(e)
+            if failure is None and not timed_out and not session.is_alive():
+                failure = "lost"
+            with self._lock:
+                self._failed += 1
+                if timed_out:
+                    self._timeouts += 1
+            if failure is None and not timed_out:
+                # ツールのエラー（SQL の ORA- エラーなど）はセッションの異常ではないので、起動し直さない
+                raise
+            # タイムアウトや通信エラーのあとはセッションの状態が分からないので、次の利用時に起動し直す
+            healthy = False
+            if timed_out:
+                raise TimeoutError(f"MCP tool {tool_name} timed out ({self.call_timeout} seconds)") from e
+            raise _SessionLostError(
+                retryable=not sent or failure == "unsent" or tool_name in self.retry_tools
+            ) from e
+        finally:
+            with self._lock:
+                self._calls += 1
+                self._latencies.append(time.monotonic() - started_at)
+            if not healthy:
+                session.stop()
+            self._release(session)
+
+    def _keepalive_loop(self):
+        while True:
+            time.sleep(self.keepalive_interval)
+            if self._closed:
+                return
+            now = time.monotonic()
+            with self._lock:
+                # 停止済みのセッションは次に使うときに起動し直すので、確認しない
+                candidates = [
+                    session for session in self._idle
+                    if session.client is not None and now - session.last_used >= self.keepalive_interval
+                ]
+                for session in candidates:
+                    self._idle.remove(session)
+
+            for session in candidates:
+                try:
+                    session.ping(timeout=min(self.call_timeout, 10))
+                    ok = True
+                except Exception:
+                    ok = False
+                    # 応答しないセッションは停止しておき、次に使うときに起動し直す
+                    session.stop()
+                with self._lock:
+                    self._health_checks += 1
+                    if not ok:
+                        self._health_check_failures += 1
+                self._release(session)
+
+    def stats(self):
+        """セッション数・待ち数・呼び出し回数・レイテンシ（ミリ秒）を返す"""
+        with self._lock:
+            latencies = list(self._latencies)
+            acquire_waits = list(self._acquire_waits)
+            return {
+                "size": self.size,
+                "sessions": len(self._sessions),
+                "alive_sessions": sum(1 for session in self._sessions if session.is_alive()),
+                "idle_sessions": len(self._idle),
+                "starting": self._starting,
+                "waiting": self._waiting,
+                "calls": self._calls,
+                "failed": self._failed,
+                "timeouts": self._timeouts,
+                "restarts": self._restarts,
+                "health_checks": self._health_checks,
+                "health_check_failures": self._health_check_failures,
+                "latency_ms": {
+                    "p50": round(_percentile(latencies, 50) * 1000, 1) if latencies else None,
+                    "p95": round(_percentile(latencies, 95) * 1000, 1) if latencies else None,
+                },
+                "acquire_wait_ms": {
+                    "p50": round(_percentile(acquire_waits, 50) * 1000, 1) if acquire_waits else None,
+                    "p95": round(_percentile(acquire_waits, 95) * 1000, 1) if acquire_waits else None,
+                },
+            }
+
+    def close(self):
+        """すべてのセッションを停止する"""
+        with self._available:
+            if self._closed:
+                return
+            self._closed = True
+            sessions = list(self._sessions)
+            self._sessions.clear()
+            self._idle.clear()
+            self._available.notify_all()
+        for session in sessions:
+            session.stop()
+
+
+def create_sqlcl_mcp_pool():
+    """
+    環境変数の設定に従って SQLcl MCP のセッションプールを作る（この時点では SQLcl を起動しない）。
+
+    Returns:
+        MCPSessionPool
+    """
+    server_parameters = StdioServerParameters(
+        command=os.getenv("SQLCL_MCP_COMMAND", "D:\\tools\\sqlcl\\bin\\sql.exe"),
+        args=shlex.split(os.getenv("SQLCL_MCP_ARGS", "-mcp"), posix=os.name != "nt"),
+    )
+    pool = MCPSessionPool(
+        server_parameters,
+        size=int(os.getenv("SQLCL_MCP_POOL_SIZE", "2")),
+        call_timeout=float(os.getenv("SQLCL_MCP_CALL_TIMEOUT", "120")),
+        startup_timeout=float(os.getenv("SQLCL_MCP_STARTUP_TIMEOUT", "60")),
+        keepalive_interval=float(os.getenv("SQLCL_MCP_KEEPALIVE", "60"))
+    )
+    atexit.register(pool.close)
+    return pool
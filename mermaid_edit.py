@@ -0,0 +1,769 @@
+"""
+Mermaid ダイアグラムの差分編集
+
+「API と DB の間にキャッシュを追加して」のような修正依頼のたびに LLM がスクリプト全体を書き直すと、
+出力トークンが図の大きさに比例して増え、毎回すべてを描き直すことになる。このモジュールは
+生成済みのスクリプトを解析したモデル（ノード・エッジ・subgraph、ER 図のエンティティ・リレーション）として
+保持し、LLM が出力した小さな操作（JSON）だけを適用してスクリプトを組み立て直す。
+
+対応するダイアグラムは flowchart/graph と erDiagram（mermaid_lint.py と同じサブセット）。
+解析できない行（classDef、コメントなど）はそのまま残す。
+
+操作（operations は JSON の配列）:
+    {"op": "add_node", "id": "Cache", "label": "キャッシュ", "shape": "database", "subgraph": "Backend"}
+        shape: rect（既定）, round, stadium, subroutine, database, circle, diamond, hexagon, parallelogram, trapezoid, trapezoid_alt, asymmetric
+        ER 図では "attributes": ["NUMBER ID PK", "VARCHAR2(100) NAME"] でカラムも追加できる
+    {"op": "remove_node", "id": "Cache"}                      ノードと、そのノードにつながるエッジを削除する
+    {"op": "rename_node", "id": "API", "label": "API Gateway", "new_id": "Gateway"}   label と new_id はどちらか一方でもよい
+    {"op": "add_edge", "from": "API", "to": "Cache", "label": "参照", "arrow": "-->"}
+        ER 図では arrow にカーディナリティ（既定 "||--o{"）を指定する
+    {"op": "remove_edge", "from": "API", "to": "DB"}           label を指定するとラベルも一致するエッジだけを削除する
+    {"op": "add_attribute", "node": "CUSTOMERS", "attribute": "VARCHAR2(50) CUST_EMAIL"}   ER 図のみ
+    {"op": "remove_attribute", "node": "CUSTOMERS", "name": "CUST_EMAIL"}                  ER 図のみ
+
+操作に誤り（存在しないノードなど）があれば、操作の番号と内容を含む ValueError を送出する。
+"""
+
+import collections
+import copy
+import json
+import os
+import re
+import threading
+
+from mermaid_lint import (
+    BARE_EDGE, EDGE_LABEL, ER_ENTITY, ER_ENTITY_OPEN, ER_HEADER, ER_RELATION, FLOWCHART_HEADER,
+    NODE_CLASS, NODE_ID, NODE_SHAPES, TEXT_EDGE,
+)
+
+SHAPES = {
+    "rect": ("[", "]"),
+    "round": ("(", ")"),
+    "stadium": ("([", "])"),
+    "subroutine": ("[[", "]]"),
+    "database": ("[(", ")]"),
+    "circle": ("((", "))"),
+    "diamond": ("{", "}"),
+    "hexagon": ("{{", "}}"),
+    "parallelogram": ("[/", "/]"),
+    "trapezoid": ("[/", "\\]"),
+    "trapezoid_alt": ("[\\", "/]"),
+    "asymmetric": (">", "]"),
+}
+ER_CARDINALITY = re.compile(r'^[|}o][|o](?:--|\.\.)[|o][|{o]$')
+FLOW_ARROW = re.compile(r'^[<ox]?(?:-\.+->?|-{2,}[->ox]?|={2,}[=>ox]?|~{3,})$')
+UNSAFE_LABEL = re.compile(r'[()\[\]{}<>|"#;:]')
+INDENT = "    "
+
+
+class Node:
+    """flowchart のノード（opener/closer が None の場合は形状なしの宣言）"""
+
+    def __init__(self, node_id, opener=None, label=None, closer=None, css_class=""):
+        self.id = node_id
+        self.opener = opener
+        self.label = label
+        self.closer = closer
+        self.css_class = css_class
+
+    def to_line(self):
+        if self.opener is None:
+            return f"{self.id}{self.css_class}"
+        return f"{self.id}{self.opener}{self.label}{self.closer}{self.css_class}"
+
+
+class Edge:
+    """flowchart のエッジ（index は解析時の順番。linkStyle の番号の付け直しに使う）"""
+
+    def __init__(self, source, target, arrow="-->", label="", index=None):
+        self.source = source
+        self.target = target
+        self.arrow = arrow
+        self.label = label
+        self.index = index
+
+    def to_line(self):
+        if self.label:
+            return f"{self.source} {self.arrow}|{self.label}| {self.target}"
+        return f"{self.source} {self.arrow} {self.target}"
+
+
+class Subgraph:
+    def __init__(self, subgraph_id, line):
+        self.id = subgraph_id
+        self.line = line
+        self.items = []
+
+
+class Entity:
+    """ER 図のエンティティ（attributes は 1 行 1 カラムの文字列）"""
+
+    def __init__(self, name, attributes=None, block=True):
+        self.name = name
+        self.attributes = attributes if attributes is not None else []
+        self.block = block
+
+    @property
+    def id(self):
+        return self.name
+
+
+class Relationship:
+    def __init__(self, left, cardinality, right, label):
+        self.left = left
+        self.cardinality = cardinality
+        self.right = right
+        self.label = label
+
+
+class Raw:
+    """解析しない行（そのまま出力する）"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+def _format_label(label):
+    """新しいラベルを安全な形にする（記号を含む場合は二重引用符で囲む）"""
+    label = str(label).replace("\n", " ").strip()
+    if UNSAFE_LABEL.search(label):
+        return '"' + label.replace('"', "#quot;") + '"'
+    return label
+
+
+def _strip_quotes(label):
+    if label and len(label) >= 2 and label[0] == label[-1] == '"':
+        return label[1:-1]
+    return label
+
+
+def _subgraph_id(line):
+    rest = line[len("subgraph"):].strip()
+    if rest.startswith('"'):
+        return rest.strip('"')
+    with_title = re.match(r'^([^\s\[]+)\s*\[.*\]$', rest)
+    if with_title:
+        return with_title.group(1)
+    return rest
+
+
+def _replace_id_token(text, old_id, new_id):
+    return re.sub(rf'(?<![\w-]){re.escape(old_id)}(?![\w-])', new_id, text)
+
+
+class FlowchartDiagram:
+    """flowchart/graph を解析したモデル"""
+
+    kind = "flowchart"
+
+    def __init__(self, header):
+        self.header = header
+        self.root = Subgraph(None, None)
+        self._edge_count = 0
+
+    # ---- 解析 ----
+
+    @classmethod
+    def parse(cls, lines, header):
+        diagram = cls(header)
+        stack = [diagram.root]
+        for raw_line in lines:
+            line = raw_line.strip().rstrip(";").strip()
+            if not line:
+                continue
+            word = line.split(None, 1)[0]
+            if word == "subgraph":
+                subgraph = Subgraph(_subgraph_id(line), line)
+                stack[-1].items.append(subgraph)
+                stack.append(subgraph)
+            elif line == "end" and len(stack) > 1:
+                stack.pop()
+            elif line.startswith("%%") or word in ("classDef", "class", "style", "linkStyle", "click", "direction"):
+                stack[-1].items.append(Raw(line))
+            else:
+                items = diagram._parse_statement(line)
+                stack[-1].items.extend(items if items is not None else [Raw(line)])
+        if len(stack) > 1:
+            raise ValueError("subgraph is not closed with 'end'")
+        return diagram
+
+    def _parse_statement(self, line):
+        """ノード (& ノード)* (エッジ ノード (& ノード)*)* を Node と Edge に分解する。解析できなければ None"""
+        groups = [[]]
+        links = []
+        nodes = []
+        pos = 0
+        expect_node = True
+        while True:
+            while pos < len(line) and line[pos] in " \t":
+                pos += 1
+            if pos >= len(line):
+                break
+            if expect_node:
+                node, pos = self._parse_node(line, pos)
+                if node is None:
+                    return None
+                groups[-1].append(node.id)
+                nodes.append(node)
+                expect_node = False
+            elif line[pos] == "&":
+                pos += 1
+                expect_node = True
+            else:
+                text_edge = TEXT_EDGE.match(line, pos)
+                if text_edge:
+                    opener, closer = text_edge.group(1), text_edge.group(2)
+                    label = line[text_edge.start() + len(opener):text_edge.end() - len(closer)].strip()
+                    arrow = {"--": "-->", "==": "==>", "-.": "-.->"}[opener]
+                    if not closer.endswith(">"):
+                        arrow = {"--": "---", "==": "===", "-.": "-.-"}[opener]
+                    pos = text_edge.end()
+                else:
+                    bare_edge = BARE_EDGE.match(line, pos)
+                    if bare_edge is None:
+                        return None
+                    arrow = bare_edge.group(0)
+                    pos = bare_edge.end()
+                    label = ""
+                    edge_label = EDGE_LABEL.match(line, pos)
+                    if edge_label:
+                        label = edge_label.group(1).strip()
+                        pos = edge_label.end()
+                links.append((arrow, label))
+                groups.append([])
+                expect_node = True
+        if expect_node:
+            return None
+
+        # 形状（ラベル）付きで参照されたノードは定義として扱う（エッジのない単独のノード宣言も含む）
+        items = [node for node in nodes if node.opener is not None or node.css_class or not links]
+        for (arrow, label), sources, targets in zip(links, groups, groups[1:]):
+            for source in sources:
+                for target in targets:
+                    items.append(Edge(source, target, arrow, label, index=self._edge_count))
+                    self._edge_count += 1
+        return items
+
+    def _parse_node(self, line, pos):
+        match = NODE_ID.match(line, pos)
+        if match is None:
+            return None, pos
+        node = Node(match.group(0))
+        pos = match.end()
+        openers = [opener for opener, _ in NODE_SHAPES if line.startswith(opener, pos)]
+        if openers:
+            opener = openers[0]
+            label_start = pos + len(opener)
+            # [/ と [\ は閉じ括弧で形状（平行四辺形・台形）が決まるので、先に現れる閉じ括弧を使う
+            found = []
+            for closer in [c for o, c in NODE_SHAPES if o == opener]:
+                if line.startswith('"', label_start):
+                    quote_end = line.find('"', label_start + 1)
+                    label_end = quote_end + 1 if quote_end != -1 and line.startswith(closer, quote_end + 1) else -1
+                else:
+                    label_end = self._find_closer(line, label_start, closer)
+                if label_end != -1:
+                    found.append((label_end, closer))
+            if not found:
+                return None, pos
+            label_end, closer = min(found)
+            node.opener, node.label, node.closer = opener, line[label_start:label_end], closer
+            pos = label_end + len(closer)
+        node_class = NODE_CLASS.match(line, pos)
+        if node_class:
+            node.css_class = node_class.group(0)
+            pos = node_class.end()
+        return node, pos
+
+    @staticmethod
+    def _find_closer(line, start, closer):
+        depth = 0
+        for index in range(start, len(line)):
+            if depth == 0 and line.startswith(closer, index):
+                return index
+            if line[index] == "(":
+                depth += 1
+            elif line[index] == ")":
+                depth = max(0, depth - 1)
+        return -1
+
+    # ---- 参照 ----
+
+    def walk(self, container=None):
+        """(コンテナ, 要素) を順に返す"""
+        container = container or self.root
+        for item in container.items:
+            yield container, item
+            if isinstance(item, Subgraph):
+                yield from self.walk(item)
+
+    def node_ids(self):
+        ids = []
+        for _, item in self.walk():
+            if isinstance(item, Node):
+                ids.append(item.id)
+            elif isinstance(item, Edge):
+                ids.extend((item.source, item.target))
+        return list(dict.fromkeys(ids))
+
+    def _subgraphs(self):
+        return {item.id: item for _, item in self.walk() if isinstance(item, Subgraph)}
+
+    def _definitions(self, node_id):
+        return [(container, item) for container, item in self.walk() if isinstance(item, Node) and item.id == node_id]
+
+    def _edges(self):
+        return [(container, item) for container, item in self.walk() if isinstance(item, Edge)]
+
+    # ---- 操作 ----
+
+    def add_node(self, node_id, label=None, shape=None, subgraph=None, attributes=None):
+        if node_id in self.node_ids():
+            raise ValueError(f"node '{node_id}' already exists")
+        if not NODE_ID.fullmatch(node_id):
+            raise ValueError(f"'{node_id}' is not a valid node id; use letters, digits and '_'")
+        if shape is not None and shape not in SHAPES:
+            raise ValueError(f"unknown shape '{shape}'; use one of {', '.join(SHAPES)}")
+        opener, closer = SHAPES[shape or "rect"]
+        container = self.root
+        if subgraph:
+            container = self._subgraphs().get(subgraph)
+            if container is None:
+                raise ValueError(f"subgraph '{subgraph}' does not exist")
+        # エッジより前に置き、既存のレイアウト（ノードの宣言順）をなるべく保つ
+        node = Node(node_id, opener, _format_label(label if label is not None else node_id), closer)
+        index = next((i for i, item in enumerate(container.items) if isinstance(item, Edge)), len(container.items))
+        container.items.insert(index, node)
+
+    def remove_node(self, node_id):
+        if node_id in self._subgraphs():
+            raise ValueError(f"'{node_id}' is a subgraph; remove the nodes inside it instead")
+        self._require(node_id)
+        for container, item in list(self.walk()):
+            if isinstance(item, Node) and item.id == node_id:
+                container.items.remove(item)
+            elif isinstance(item, Edge) and node_id in (item.source, item.target):
+                container.items.remove(item)
+            elif isinstance(item, Raw):
+                text = self._remove_from_directive(item.text, node_id)
+                if text is None:
+                    container.items.remove(item)
+                else:
+                    item.text = text
+
+    @staticmethod
+    def _remove_from_directive(text, node_id):
+        """style / click / class の行から削除したノードへの参照を取り除く（行ごと不要なら None）"""
+        words = text.split()
+        if len(words) >= 2 and words[0] in ("style", "click") and words[1] == node_id:
+            return None
+        if len(words) >= 3 and words[0] == "class":
+            targets = [target for target in words[1].split(",") if target != node_id]
+            if not targets:
+                return None
+            return " ".join(["class", ",".join(targets)] + words[2:])
+        return text
+
+    def rename_node(self, node_id, label=None, new_id=None):
+        self._require(node_id)
+        if label is not None:
+            definitions = self._definitions(node_id)
+            if definitions:
+                for _, node in definitions:
+                    if node.opener is None:
+                        node.opener, node.closer = SHAPES["rect"]
+                    node.label = _format_label(label)
+            else:
+                # エッジでしか参照されていないノードには定義を追加する
+                opener, closer = SHAPES["rect"]
+                self.root.items.insert(0, Node(node_id, opener, _format_label(label), closer))
+        if new_id is not None and new_id != node_id:
+            if new_id in self.node_ids():
+                raise ValueError(f"node '{new_id}' already exists")
+            if not NODE_ID.fullmatch(new_id):
+                raise ValueError(f"'{new_id}' is not a valid node id; use letters, digits and '_'")
+            for _, item in self.walk():
+                if isinstance(item, Node) and item.id == node_id:
+                    item.id = new_id
+                elif isinstance(item, Edge):
+                    item.source = new_id if item.source == node_id else item.source
+                    item.target = new_id if item.target == node_id else item.target
+                elif isinstance(item, Raw) and not item.text.startswith("%%"):
+                    item.text = _replace_id_token(item.text, node_id, new_id)
+
+    def add_edge(self, source, target, label=None, arrow=None):
+        self._require(source)
+        self._require(target)
+        arrow = arrow or "-->"
+        if not FLOW_ARROW.match(arrow):
+            raise ValueError(f"'{arrow}' is not a valid flowchart arrow (e.g. -->, ---, -.->, ==>)")
+        self.root.items.append(Edge(source, target, arrow, _format_label(label) if label else ""))
+
+    def remove_edge(self, source, target, label=None):
+        removed = 0
+        for container, edge in self._edges():
+            if edge.source == source and edge.target == target and (label is None or _strip_quotes(edge.label) == label):
+                container.items.remove(edge)
+                removed += 1
+        if not removed:
+            raise ValueError(f"edge {source} -> {target} does not exist")
+
+    def _require(self, node_id):
+        if node_id not in self.node_ids():
+            known = self.node_ids()
+            raise ValueError(
+                f"node '{node_id}' does not exist; existing nodes: {', '.join(known[:40])}{' ...' if len(known) > 40 else ''}"
+            )
+
+    # ---- 出力 ----
+
+    def to_script(self):
+        lines = [self.header]
+        edge_order = [edge.index for _, edge in self._edges()]
+        self._write_items(self.root.items, 1, lines, edge_order)
+        return "\n".join(lines) + "\n"
+
+    def _write_items(self, items, depth, lines, edge_order):
+        indent = INDENT * depth
+        for item in items:
+            if isinstance(item, Subgraph):
+                lines.append(indent + item.line)
+                self._write_items(item.items, depth + 1, lines, edge_order)
+                lines.append(indent + "end")
+            elif isinstance(item, Raw):
+                text = self._renumber_link_style(item.text, edge_order) if item.text.startswith("linkStyle") else item.text
+                if text is not None:
+                    lines.append(indent + text)
+            else:
+                lines.append(indent + item.to_line())
+
+    @staticmethod
+    def _renumber_link_style(text, edge_order):
+        """エッジを追加・削除した後の linkStyle の番号を付け直す（対象のエッジがなければ None）"""
+        words = text.split(None, 2)
+        if len(words) < 3 or words[1] == "default":
+            return text
+        new_indexes = []
+        for index in words[1].split(","):
+            if index.isdigit() and int(index) in edge_order:
+                new_indexes.append(str(edge_order.index(int(index))))
+        if not new_indexes:
+            return None
+        return f"linkStyle {','.join(new_indexes)} {words[2]}"
+
+
+class ERDiagram:
+    """erDiagram を解析したモデル"""
+
+    kind = "er"
+
+    def __init__(self, header):
+        self.header = header
+        self.items = []
+
+    @classmethod
+    def parse(cls, lines, header):
+        diagram = cls(header)
+        entity = None
+        for raw_line in lines:
+            line = raw_line.strip()
+            if not line:
+                continue
+            if entity is not None:
+                if line == "}":
+                    entity = None
+                else:
+                    entity.attributes.append(line)
+                continue
+            if line.startswith("%%"):
+                diagram.items.append(Raw(line))
+                continue
+            open_match = ER_ENTITY_OPEN.match(line)
+            relation = ER_RELATION.match(line)
+            if open_match:
+                entity = diagram._entity(open_match.group("name"), block=True)
+            elif relation:
+                diagram.items.append(Relationship(
+                    relation.group("left"), relation.group("card"), relation.group("right"), relation.group("label")
+                ))
+            elif ER_ENTITY.match(line):
+                name = re.sub(r'\s*\{\s*\}$', '', line)
+                diagram._entity(name, block=line.endswith("}"))
+            else:
+                diagram.items.append(Raw(line))
+        if entity is not None:
+            raise ValueError(f"entity block '{entity.name}' is not closed with '}}'")
+        return diagram
+
+    def _entity(self, name, block):
+        existing = self.entities().get(name)
+        if existing is not None:
+            existing.block = existing.block or block
+            return existing
+        entity = Entity(name, block=block)
+        self.items.append(entity)
+        return entity
+
+    def entities(self):
+        return {item.name: item for item in self.items if isinstance(item, Entity)}
+
+    def node_ids(self):
+        ids = []
+        for item in self.items:
+            if isinstance(item, Entity):
+                ids.append(item.name)
+            elif isinstance(item, Relationship):
+                ids.extend((item.left, item.right))
+        return list(dict.fromkeys(ids))
+
+    def _require(self, name):
+        if name not in self.node_ids():
+            known = self.node_ids()
+            raise ValueError(
+                f"entity '{name}' does not exist; existing entities: {', '.join(known[:40])}{' ...' if len(known) > 40 else ''}"
+            )
+
+    def _require_entity(self, name):
+        self._require(name)
+        return self.entities().get(name) or self._entity(name, block=True)
+
+    def add_node(self, node_id, label=None, shape=None, subgraph=None, attributes=None):
+        if node_id in self.node_ids():
+            raise ValueError(f"entity '{node_id}' already exists")
+        if not re.fullmatch(r'[^\s{}:"]+', node_id):
+            raise ValueError(f"'{node_id}' is not a valid entity name")
+        # 既存のエンティティの後ろ（リレーションより前）に置く
+        index = max((i + 1 for i, item in enumerate(self.items) if isinstance(item, Entity)), default=0)
+        self.items.insert(index, Entity(node_id, [str(attribute).strip() for attribute in attributes or []]))
+
+    def remove_node(self, node_id):
+        self._require(node_id)
+        self.items = [
+            item for item in self.items
+            if not (isinstance(item, Entity) and item.name == node_id)
+            and not (isinstance(item, Relationship) and node_id in (item.left, item.right))
+        ]
+
+    def rename_node(self, node_id, label=None, new_id=None):
+        self._require(node_id)
+        if new_id is None or new_id == node_id:
+            if label is not None:
+                raise ValueError("entities have no label in erDiagram; use new_id to rename an entity")
+            return
+        if new_id in self.node_ids():
+            raise ValueError(f"entity '{new_id}' already exists")
+        for item in self.items:
+            if isinstance(item, Entity) and item.name == node_id:
+                item.name = new_id
+            elif isinstance(item, Relationship):
+                item.left = new_id if item.left == node_id else item.left
+                item.right = new_id if item.right == node_id else item.right
+
+    def add_edge(self, source, target, label=None, arrow=None):
+        self._require(source)
+        self._require(target)
+        cardinality = arrow or "||--o{"
+        if not ER_CARDINALITY.match(cardinality):
+            raise ValueError(f"'{cardinality}' is not a valid relationship cardinality (e.g. ||--o{{, }}o--||, |o..o|)")
+        label = str(label).strip() if label else ""
+        if not label or (re.search(r'\s', label) and not label.startswith('"')):
+            label = '"' + label.replace('"', "") + '"'
+        self.items.append(Relationship(source, cardinality, target, label))
+
+    def remove_edge(self, source, target, label=None):
+        before = len(self.items)
+        self.items = [
+            item for item in self.items
+            if not (isinstance(item, Relationship)
+                    and {item.left, item.right} == {source, target}
+                    and (label is None or _strip_quotes(item.label) == label))
+        ]
+        if len(self.items) == before:
+            raise ValueError(f"relationship between {source} and {target} does not exist")
+
+    def add_attribute(self, node, attribute):
+        entity = self._require_entity(node)
+        attribute = str(attribute).strip()
+        name = attribute.split()[1] if len(attribute.split()) >= 2 else None
+        if name is None:
+            raise ValueError(f"attribute '{attribute}' must be 'type name [PK|FK|UK] [\"comment\"]'")
+        if any(len(existing.split()) >= 2 and existing.split()[1] == name for existing in entity.attributes):
+            raise ValueError(f"attribute '{name}' already exists in {node}")
+        entity.attributes.append(attribute)
+        entity.block = True
+
+    def remove_attribute(self, node, name):
+        entity = self._require_entity(node)
+        remaining = [attribute for attribute in entity.attributes if not (len(attribute.split()) >= 2 and attribute.split()[1] == name)]
+        if len(remaining) == len(entity.attributes):
+            raise ValueError(f"attribute '{name}' does not exist in {node}")
+        entity.attributes = remaining
+
+    def to_script(self):
+        lines = [self.header]
+        for item in self.items:
+            if isinstance(item, Entity):
+                if item.block:
+                    lines.append(f"{INDENT}{item.name} {{")
+                    lines.extend(f"{INDENT * 2}{attribute}" for attribute in item.attributes)
+                    lines.append(f"{INDENT}}}")
+                else:
+                    lines.append(f"{INDENT}{item.name}")
+            elif isinstance(item, Relationship):
+                lines.append(f"{INDENT}{item.left} {item.cardinality} {item.right} : {item.label}")
+            else:
+                lines.append(INDENT + item.text)
+        return "\n".join(lines) + "\n"
+
+
+def parse_mermaid_diagram(mermaid_script):
+    """
+    Mermaid スクリプトを編集用のモデルに変換する。
+
+    Returns:
+        FlowchartDiagram | ERDiagram
+
+    Raises:
+        ValueError: flowchart/graph と erDiagram 以外のダイアグラム、または解析できない場合
+    """
+    lines = mermaid_script.splitlines()
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped or stripped.startswith("%%"):
+            continue
+        if FLOWCHART_HEADER.match(stripped):
+            return FlowchartDiagram.parse(lines[index + 1:], stripped)
+        if ER_HEADER.match(stripped):
+            return ERDiagram.parse(lines[index + 1:], stripped)
+        break
+    raise ValueError("Only flowchart/graph and erDiagram can be edited; regenerate other diagrams with generate_mermaid_diagram_tool")
+
+
+def parse_operations(operations):
+    """
+    操作の JSON（文字列、または {"operations": [...]}）を操作のリストにする。
+
+    Raises:
+        ValueError: JSON として解析できない、または形式が誤っている場合
+    """
+    if isinstance(operations, str):
+        try:
+            operations = json.loads(operations)
+        except ValueError as e:
+            raise ValueError(f"operations must be a JSON array: {e}")
+    if isinstance(operations, dict):
+        operations = operations.get("operations", [operations])
+    if not isinstance(operations, list) or not all(isinstance(operation, dict) for operation in operations):
+        raise ValueError('operations must be a JSON array of objects like {"op": "add_node", ...}')
+    return operations
+
+
+def apply_operations(diagram, operations):
+    """
+    モデルに操作を適用した新しいモデルを返す（元のモデルは変更しない）。
+
+    Raises:
+        ValueError: 誤った操作がある場合（すべての誤りを操作の番号付きで返す）
+    """
+    edited = copy.deepcopy(diagram)
+    errors = []
+    for number, operation in enumerate(parse_operations(operations), 1):
+        op = operation.get("op")
+        try:
+            if op == "add_node":
+                edited.add_node(
+                    _required(operation, "id"), operation.get("label"), operation.get("shape"),
+                    operation.get("subgraph"), operation.get("attributes")
+                )
+            elif op == "remove_node":
+                edited.remove_node(_required(operation, "id"))
+            elif op == "rename_node":
+                edited.rename_node(_required(operation, "id"), operation.get("label"), operation.get("new_id"))
+            elif op == "add_edge":
+                edited.add_edge(_required(operation, "from"), _required(operation, "to"), operation.get("label"), operation.get("arrow"))
+            elif op == "remove_edge":
+                edited.remove_edge(_required(operation, "from"), _required(operation, "to"), operation.get("label"))
+            elif op in ("add_attribute", "remove_attribute"):
+                if edited.kind != "er":
+                    raise ValueError(f"{op} can only be used with erDiagram")
+                if op == "add_attribute":
+                    edited.add_attribute(_required(operation, "node"), _required(operation, "attribute"))
+                else:
+                    edited.remove_attribute(_required(operation, "node"), _required(operation, "name"))
+            else:
+                raise ValueError(
+                    f"unknown op '{op}'; use add_node, remove_node, rename_node, add_edge, remove_edge, add_attribute or remove_attribute"
+                )
+        except ValueError as e:
+            errors.append(f"operation {number} ({op}): {e}")
+    if errors:
+        raise ValueError("Diagram edit failed:\n" + "\n".join(errors))
+    return edited
+
+
+def _required(operation, key):
+    value = operation.get(key)
+    if value is None or str(value).strip() == "":
+        raise ValueError(f"'{key}' is required")
+    return str(value).strip()
+
+
+def edit_mermaid_script(mermaid_script, operations):
+    """
+    Mermaid スクリプトに操作を適用する。
+
+    Returns:
+        tuple[str, bool]: (編集後のスクリプト, 元のスクリプトから変わったかどうか)
+
+    Raises:
+        ValueError: 解析できないスクリプト、または誤った操作がある場合
+    """
+    diagram = parse_mermaid_diagram(mermaid_script)
+    edited = apply_operations(diagram, operations)
+    new_script = edited.to_script()
+    return new_script, new_script != diagram.to_script()
+
+
+class DiagramModelCache:
+    """
+    生成済みスクリプト（.mmd）の解析結果を保持する（ファイルの更新時刻が変わったら解析し直す）。
+
+    Args:
+        max_entries: 保持する件数の上限
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._models = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, script_file):
+        """
+        .mmd ファイルを解析したモデルを返す（返したモデルは変更しないこと）。
+
+        Raises:
+            FileNotFoundError: ファイルがない場合
+            ValueError: 解析できない場合
+        """
+        path = os.path.abspath(script_file)
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            cached = self._models.get(path)
+            if cached is not None and cached[0] == mtime:
+                self._models.move_to_end(path)
+                return cached[1]
+        with open(path, 'r', encoding='utf-8') as f:
+            diagram = parse_mermaid_diagram(f.read())
+        with self._lock:
+            self._models[path] = (mtime, diagram)
+            while len(self._models) > self.max_entries:
+                self._models.popitem(last=False)
+        return diagram
+
+
+_diagram_models = DiagramModelCache()
+
+
+def get_diagram_model(script_file):
+    """共有の DiagramModelCache から .mmd ファイルのモデルを返す"""
+    return _diagram_models.get(script_file)
@@ -0,0 +1,483 @@
+"""
+Mermaid スクリプトの事前検証（リンター）
+
+get_mermaid_script_guidelines_tool で LLM に伝えている記法ルールを、
+mmdc を起動する前にローカルで検査する。エージェントが生成する flowchart/graph と erDiagram の
+サブセットを解析し、違反箇所を行・列付きで返す。安全に直せるものは自動修正する。
+
+検査するルール:
+    br-in-label               ノードラベルに <br> を使っている
+    halfwidth-paren-in-label  引用符なしのノードラベルに半角の ( ) を使っている（自動修正: 全角に置換）
+    unquoted-subgraph-name    空白を含む subgraph 名が二重引用符で囲まれていない（自動修正: 引用符で囲む）
+    subgraph-edge             subgraph を直接エッジでつないでいる
+    number-scale              NUMBER(精度,スケール) を使っている（自動修正: NUMBER(精度)）
+    vector-format             VECTOR(次元数, フォーマット) を使っている（自動修正: VECTOR(次元数)）
+    type-comma                その他のデータ型にカンマを含んでいる（自動修正: 最初の引数だけ残す）
+    er-attribute-key          PK/FK/UK 以外の制約を引用符なしで書いている（"NOT NULL" は自動修正）
+    syntax                    上記以外の構文エラー（閉じ括弧なし、subgraph の end 不足など）
+    unrecognized              リンターが解析できない記法（警告。Mermaid では正しい記法のこともあるので
+                              レンダリングは止めず、判断は mmdc に任せる）
+
+先頭のフロントマター（--- で囲んだ title などの設定）は読み飛ばす。
+flowchart/graph と erDiagram 以外のダイアグラム（sequenceDiagram など）は検査しない。
+"""
+
+import bisect
+import re
+
+FLOWCHART_HEADER = re.compile(r'^(flowchart|graph)\b')
+ER_HEADER = re.compile(r'^erDiagram\b')
+OTHER_HEADER = re.compile(r'^[A-Za-z][\w-]*')
+
+# flowchart のノード形状（長いものから順に照合する）
+NODE_SHAPES = [
+    ("(((", ")))"), ("([", "])"), ("[[", "]]"), ("[(", ")]"), ("((", "))"), ("{{", "}}"),
+    ("[/", "/]"), ("[\\", "\\]"), ("[/", "\\]"), ("[\\", "/]"), ("(", ")"), ("[", "]"), ("{", "}"), (">", "]"),
+]
+NODE_ID = re.compile(r'[^\s\[\](){}<>|&;:"=\-.]+(?:[-.][^\s\[\](){}<>|&;:"=\-.]+)*')
+NODE_CLASS = re.compile(r':::[\w-]+')
+EDGE_ID = re.compile(r'[^\s\[\](){}<>|&;:"=\-.@]+@(?=[<ox]?[-=~.])')
+TEXT_EDGE = re.compile(r'(--|==|-\.)\s+[^\n|]*?\s*(-{2,}>|-{3,}|={2,}>|={3,}|\.->|\.-)')
+BARE_EDGE = re.compile(r'[<ox]?(?:-\.+->?|-{2,}[->ox]?|={2,}[=>ox]?|~{3,})')
+EDGE_LABEL = re.compile(r'\s*\|([^|\n]*)\|')
+BR_TAG = re.compile(r'<br\s*/?>', re.IGNORECASE)
+FLOWCHART_DIRECTIVES = ("classDef", "class", "style", "linkStyle", "click", "direction")
+
+ER_RELATION = re.compile(
+    r'^(?P<left>[^\s{]+)\s+(?P<card>[|}o][|o](?:--|\.\.)[|o][|{o])\s+(?P<right>[^\s:]+)\s*:\s*(?P<label>\S.*)$'
+)
+ER_ENTITY_OPEN = re.compile(r'^(?P<name>[^\s{]+)\s*\{\s*$')
+ER_ENTITY = re.compile(r'^[^\s{}:]+(?:\s*\{\s*\})?$')
+ER_TYPE = re.compile(r'(?P<type>[^\s("]+)(?P<args>\([^)]*\))?')
+ER_KEYS = re.compile(r'^(?:PK|FK|UK)(?:\s*,\s*(?:PK|FK|UK))*')
+ER_NAME = re.compile(r'[^\s"]+')
+
+
+class MermaidDiagnostic:
+    """
+    検査結果 1 件。
+
+    Attributes:
+        code: ルール名
+        message: 内容
+        line: 行番号（1 始まり）
+        column: 列番号（1 始まり）
+        fix: 自動修正 (開始オフセット, 終了オフセット, 置換文字列)。自動修正できない場合は None
+        severity: "error"（レンダリングを止める）または "warning"（リンターが解析できないだけの記法）
+    """
+
+    def __init__(self, code, message, line, column, fix=None, severity="error"):
+        self.code = code
+        self.message = message
+        self.line = line
+        self.column = column
+        self.fix = fix
+        self.severity = severity
+
+    def __str__(self):
+        prefix = "warning: " if self.severity == "warning" else ""
+        return f"line {self.line}, column {self.column}: [{self.code}] {prefix}{self.message}"
+
+    def __repr__(self):
+        return f"MermaidDiagnostic({self})"
+
+
+class _Linter:
+    def __init__(self, script):
+        self.script = script
+        self.line_starts = [0] + [m.end() for m in re.finditer(r'\n', script)]
+        self.diagnostics = []
+
+    def position(self, offset):
+        line_index = bisect.bisect_right(self.line_starts, offset) - 1
+        return line_index + 1, offset - self.line_starts[line_index] + 1
+
+    def report(self, code, message, offset, fix=None):
+        line, column = self.position(offset)
+        self.diagnostics.append(MermaidDiagnostic(code, message, line, column, fix))
+
+    def warn_unrecognized(self, message, offset):
+        line, column = self.position(offset)
+        self.diagnostics.append(MermaidDiagnostic("unrecognized", message, line, column, severity="warning"))
+
+    # ---- flowchart ----
+
+    def lint_flowchart(self, start):
+        script = self.script
+        subgraphs = {}
+        subgraph_stack = []
+        endpoints = []
+        pos = start
+
+        while pos < len(script):
+            while pos < len(script) and script[pos] in " \t\r\n;":
+                pos += 1
+            if pos >= len(script):
+                break
+
+            line_end = script.find('\n', pos)
+            if line_end == -1:
+                line_end = len(script)
+            line = script[pos:line_end].rstrip('\r')
+            word = line.split(None, 1)[0] if line.strip() else ""
+
+            if line.startswith("%%") or word in FLOWCHART_DIRECTIVES:
+                pos = line_end
+                continue
+            if word == "subgraph":
+                subgraph_id = self.lint_subgraph(line, pos)
+                subgraphs[subgraph_id] = pos
+                subgraph_stack.append(pos)
+                pos = line_end
+                continue
+            if word == "end" and line.strip() == "end":
+                if not subgraph_stack:
+                    self.report("syntax", "'end' without a matching 'subgraph'", pos)
+                else:
+                    subgraph_stack.pop()
+                pos = line_end
+                continue
+
+            pos = self.lint_statement(pos, endpoints)
+
+        for subgraph_pos in subgraph_stack:
+            self.report("syntax", "subgraph is not closed with 'end'", subgraph_pos)
+
+        for node_id, offset in endpoints:
+            if node_id in subgraphs:
+                self.report(
+                    "subgraph-edge",
+                    f"subgraph '{node_id}' cannot be connected by an edge directly; connect nodes inside it instead",
+                    offset
+                )
+
+    def lint_subgraph(self, line, pos):
+        title_offset = pos + len("subgraph")
+        rest = line[len("subgraph"):]
+        stripped = rest.strip()
+        title_offset += len(rest) - len(rest.lstrip())
+
+        if not stripped:
+            self.report("syntax", "subgraph requires a name", pos)
+            return ""
+        if stripped.startswith('"'):
+            return stripped.strip('"')
+        with_title = re.match(r'^([^\s\[]+)\s*\[.*\]$', stripped)
+        if with_title:
+            return with_title.group(1)
+        if re.search(r'\s', stripped):
+            self.report(
+                "unquoted-subgraph-name",
+                f"subgraph name '{stripped}' contains spaces and must be enclosed in double quotes",
+                title_offset,
+                fix=(title_offset, title_offset + len(stripped), f'"{stripped}"')
+            )
+        return stripped
+
+    def lint_statement(self, pos, endpoints):
+        """ノード (& ノード)* (エッジ ノード (& ノード)*)* を解析し、次の位置を返す"""
+        script = self.script
+        expect_node = True
+        nodes = []
+        has_edge = False
+        while True:
+            while pos < len(script) and script[pos] in " \t":
+                pos += 1
+            if pos >= len(script) or script[pos] in "\r\n;":
+                if expect_node:
+                    self.report("syntax", "edge is missing its target node", pos)
+                if has_edge:
+                    endpoints.extend(nodes)
+                return pos
+
+            if expect_node:
+                node_pos = pos
+                pos, node_id = self.lint_node(pos)
+                if node_id is None:
+                    self.warn_unrecognized(f"unexpected character '{script[node_pos]}'", node_pos)
+                    return self.skip_line(node_pos)
+                nodes.append((node_id, node_pos))
+                expect_node = False
+                continue
+
+            if script[pos] == "&":
+                pos += 1
+                expect_node = True
+                continue
+
+            # リンク ID 付きのエッジ（A e1@--> B）
+            edge_id = EDGE_ID.match(script, pos)
+            if edge_id:
+                pos = edge_id.end()
+            edge = TEXT_EDGE.match(script, pos) or BARE_EDGE.match(script, pos)
+            if edge is None:
+                self.warn_unrecognized(f"unexpected character '{script[pos]}'", pos)
+                return self.skip_line(pos)
+            pos = edge.end()
+            has_edge = True
+            label = EDGE_LABEL.match(script, pos)
+            if label:
+                pos = label.end()
+            expect_node = True
+
+    def skip_line(self, pos):
+        line_end = self.script.find('\n', pos)
+        return len(self.script) if line_end == -1 else line_end
+
+    def lint_node(self, pos):
+        script = self.script
+        match = NODE_ID.match(script, pos)
+        if match is None:
+            return pos, None
+        node_id = match.group(0)
+        pos = match.end()
+
+        for opener, closer in NODE_SHAPES:
+            if script.startswith(opener, pos):
+                # [/ と [\ は閉じ括弧で形状（平行四辺形・台形）が決まるので、行内で先に現れる閉じ括弧を使う
+                line_end = self.skip_line(pos)
+                found = [(script.find(c, pos + len(opener), line_end), c) for o, c in NODE_SHAPES if o == opener]
+                found = [(index, c) for index, c in found if index != -1]
+                if found:
+                    closer = min(found)[1]
+                pos = self.lint_label(pos, opener, closer)
+                break
+
+        node_class = NODE_CLASS.match(script, pos)
+        if node_class:
+            pos = node_class.end()
+        return pos, node_id
+
+    def lint_label(self, pos, opener, closer):
+        """ノードラベルを検査し、閉じ括弧の直後の位置を返す"""
+        script = self.script
+        label_start = pos + len(opener)
+
+        if script.startswith('"', label_start):
+            quote_end = script.find('"', label_start + 1)
+            if quote_end == -1:
+                self.report("syntax", "unterminated quoted label", label_start)
+                return len(script)
+            self.check_br(label_start + 1, quote_end)
+            close = quote_end + 1
+            if not script.startswith(closer, close):
+                self.report("syntax", f"expected '{closer}' after quoted label", close)
+                return close
+            return close + len(closer)
+
+        # 閉じ括弧を探す。ラベル内の半角 ( ) は入れ子として数える
+        depth = 0
+        paren_offsets = []
+        index = label_start
+        while index < len(script):
+            char = script[index]
+            if depth == 0 and script.startswith(closer, index):
+                break
+            if char == "(":
+                depth += 1
+                paren_offsets.append(index)
+            elif char == ")":
+                depth = max(0, depth - 1)
+                paren_offsets.append(index)
+            index += 1
+        else:
+            self.report("syntax", f"node label opened with '{opener}' is not closed with '{closer}'", pos)
+            return len(script)
+
+        self.check_br(label_start, index)
+        for offset in paren_offsets:
+            fullwidth = "（" if script[offset] == "(" else "）"
+            self.report(
+                "halfwidth-paren-in-label",
+                f"half-width '{script[offset]}' cannot be used in a node label; use full-width '{fullwidth}'",
+                offset,
+                fix=(offset, offset + 1, fullwidth)
+            )
+        return index + len(closer)
+
+    def check_br(self, start, end):
+        for match in BR_TAG.finditer(self.script, start, end):
+            self.report("br-in-label", "'<br>' cannot be used in a label; use a newline character instead", match.start())
+
+    # ---- erDiagram ----
+
+    def lint_er(self, start_line):
+        entity_line = None
+        for line_index in range(start_line, len(self.line_starts)):
+            offset = self.line_starts[line_index]
+            line_end = self.line_starts[line_index + 1] - 1 if line_index + 1 < len(self.line_starts) else len(self.script)
+            raw = self.script[offset:line_end].rstrip('\r')
+            stripped = raw.strip()
+            indent = offset + len(raw) - len(raw.lstrip())
+
+            if not stripped or stripped.startswith("%%"):
+                continue
+
+            if entity_line is not None:
+                if stripped == "}":
+                    entity_line = None
+                else:
+                    self.lint_er_attribute(stripped, indent)
+                continue
+
+            if stripped == "}":
+                self.report("syntax", "'}' without a matching entity block", indent)
+            elif ER_ENTITY_OPEN.match(stripped):
+                entity_line = indent
+            elif ER_RELATION.match(stripped) or ER_ENTITY.match(stripped):
+                continue
+            elif re.match(r'^\S+\s+\S+\s+\S+\s*$', stripped):
+                self.report("syntax", "relationship requires a label after ':'", indent)
+            else:
+                self.warn_unrecognized(f"cannot parse erDiagram statement '{stripped}'", indent)
+
+        if entity_line is not None:
+            self.report("syntax", "entity block is not closed with '}'", entity_line)
+
+    def lint_er_attribute(self, text, offset):
+        type_match = ER_TYPE.match(text)
+        if type_match is None:
+            self.warn_unrecognized(f"cannot parse attribute '{text}'; expected 'type name [PK|FK|UK] [\"comment\"]'", offset)
+            return
+
+        type_name = type_match.group("type")
+        args = type_match.group("args")
+        if args and "," in args:
+            self.lint_type_args(type_name, args, offset + type_match.start("args"))
+
+        rest_offset = offset + type_match.end()
+        rest = text[type_match.end():]
+        if not rest[:1].isspace():
+            self.warn_unrecognized(f"cannot parse attribute '{text}'; expected 'type name [PK|FK|UK] [\"comment\"]'", offset)
+            return
+        rest_offset += len(rest) - len(rest.lstrip())
+        rest = rest.strip()
+
+        name_match = ER_NAME.match(rest)
+        if name_match is None:
+            self.report("syntax", f"attribute '{text}' has no column name", rest_offset)
+            return
+
+        key_offset = rest_offset + name_match.end()
+        remainder = rest[name_match.end():]
+        key_offset += len(remainder) - len(remainder.lstrip())
+        remainder = remainder.strip()
+
+        keys = ER_KEYS.match(remainder)
+        if keys:
+            key_offset += keys.end()
+            tail = remainder[keys.end():]
+            key_offset += len(tail) - len(tail.lstrip())
+            remainder = tail.strip()
+
+        if not remainder or re.match(r'^"[^"]*"$', remainder):
+            return
+        if remainder == "NOT NULL":
+            self.report(
+                "er-attribute-key",
+                "NOT NULL must be written as a quoted comment \"NOT NULL\"",
+                key_offset,
+                fix=(key_offset, key_offset + len(remainder), '"NOT NULL"')
+            )
+        else:
+            self.report(
+                "er-attribute-key",
+                f"'{remainder}' is not a valid key; use PK, FK or UK, and write other constraints as a quoted comment",
+                key_offset
+            )
+
+    def lint_type_args(self, type_name, args, offset):
+        first_arg = args[1:-1].split(",")[0].strip()
+        replacement = f"({first_arg})" if first_arg.isdigit() else ""
+        upper_name = type_name.upper()
+        if upper_name == "NUMBER":
+            code, message = "number-scale", "NUMBER(precision,scale) is not allowed; use NUMBER(precision) or NUMBER"
+        elif upper_name == "VECTOR":
+            code, message = "vector-format", "VECTOR(dimensions, format) is not allowed; use VECTOR(dimensions) or VECTOR"
+        else:
+            code, message = "type-comma", f"data type '{type_name}{args}' cannot contain ','"
+        self.report(code, message, offset, fix=(offset, offset + len(args), replacement))
+
+    def skip_frontmatter(self):
+        """先頭のフロントマター（--- で囲んだ設定）の次の行番号（0 始まり）を返す"""
+        for line_index, start in enumerate(self.line_starts):
+            stripped = self.line_text(line_index).strip()
+            if stripped:
+                break
+        else:
+            return 0
+        if stripped != "---":
+            return 0
+        for end_index in range(line_index + 1, len(self.line_starts)):
+            if self.line_text(end_index).strip() == "---":
+                return end_index + 1
+        self.report("syntax", "frontmatter is not closed with '---'", start)
+        return len(self.line_starts)
+
+    def line_text(self, line_index):
+        end = self.line_starts[line_index + 1] if line_index + 1 < len(self.line_starts) else len(self.script)
+        return self.script[self.line_starts[line_index]:end]
+
+    def run(self):
+        first_line = self.skip_frontmatter()
+        for line_index in range(first_line, len(self.line_starts)):
+            start = self.line_starts[line_index]
+            end = self.line_starts[line_index + 1] if line_index + 1 < len(self.line_starts) else len(self.script)
+            stripped = self.script[start:end].strip()
+            if not stripped or stripped.startswith("%%"):
+                continue
+            if FLOWCHART_HEADER.match(stripped):
+                self.lint_flowchart(end)
+            elif ER_HEADER.match(stripped):
+                self.lint_er(line_index + 1)
+            elif not OTHER_HEADER.match(stripped):
+                self.report("syntax", "diagram type declaration is missing", start)
+            # その他のダイアグラム（sequenceDiagram など）は検査対象外
+            break
+        self.diagnostics.sort(key=lambda d: (d.line, d.column))
+        return self.diagnostics
+
+
+def lint_mermaid_script(mermaid_script):
+    """
+    Mermaid スクリプトを検査する。
+
+    Args:
+        mermaid_script: 検査する Mermaid スクリプト
+
+    Returns:
+        list[MermaidDiagnostic]: 検査結果（行・列の順）。問題がなければ空リスト。
+            リンターが解析できない記法は severity が "warning" の検査結果になる
+    """
+    return _Linter(mermaid_script).run()
+
+
+def fix_mermaid_script(mermaid_script):
+    """
+    安全に直せる違反を自動修正し、修正後のスクリプトと残った違反を返す。
+
+    Args:
+        mermaid_script: 修正する Mermaid スクリプト
+
+    Returns:
+        tuple[str, list[MermaidDiagnostic]]: 修正後のスクリプトと、自動修正できなかった検査結果
+    """
+    diagnostics = lint_mermaid_script(mermaid_script)
+    fixes = sorted({d.fix for d in diagnostics if d.fix is not None}, reverse=True)
+    if not fixes:
+        return mermaid_script, diagnostics
+
+    fixed_script = mermaid_script
+    for start, end, replacement in fixes:
+        fixed_script = fixed_script[:start] + replacement + fixed_script[end:]
+    return fixed_script, lint_mermaid_script(fixed_script)
+
+
+def blocking_diagnostics(diagnostics):
+    """レンダリングを止めるべき検査結果（severity が "error" のもの）だけを返す"""
+    return [d for d in diagnostics if d.severity == "error"]
+
+
+def format_diagnostics(diagnostics):
+    """検査結果をエージェント向けの文字列にする"""
+    return "\n".join(str(d) for d in diagnostics)
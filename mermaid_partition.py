@@ -0,0 +1,427 @@
+"""
+大きなダイアグラムの分割と並列レンダリング
+
+SH スキーマ全体や大規模なマイクロサービス構成を 1 枚の 2048x2048 の PNG にすると、文字が読めないほど
+縮小されるうえにレンダリングが遅く、mmdc の 60 秒のタイムアウトにかかることもある。このモジュールは
+ノード数・エッジ数（ER 図ではカラムの行数）が上限を超えるダイアグラムを
+
+- flowchart は最上位の subgraph（サブジェクトエリア）ごと、それ以外は連結成分ごとにまとめ、
+  それでも大きい部分は結びつきの強いノードから順に上限まで集めて分割する
+- 部分ごとのダイアグラム（他の部分とつながるノードは参照用にラベルだけ残す）と、
+  部分どうしのつながりを示す全体図を作る
+- 部分ごとのレンダリングを並列に実行する（部分ごとのタイムアウト付き）
+
+解析は mermaid_edit.py のモデルを使うので、対応するのは flowchart/graph と erDiagram。
+
+環境変数:
+    MERMAID_PARTITION               0 で分割しない
+    MERMAID_PARTITION_MAX_NODES     flowchart のノード数の上限（既定 40）
+    MERMAID_PARTITION_MAX_EDGES     エッジ（リレーション）数の上限（既定 60）
+    MERMAID_PARTITION_MAX_ROWS      ER 図のエンティティ数 + カラム数の上限（既定 100）
+    MERMAID_PARTITION_PART_TIMEOUT  部分ごとのレンダリングのタイムアウト秒数（既定 30）
+    MERMAID_PARTITION_WORKERS       並列にレンダリングする数（既定 4）
+"""
+
+import concurrent.futures
+import contextvars
+import glob
+import os
+import re
+
+from mermaid_edit import (
+    Edge, Entity, ERDiagram, FlowchartDiagram, Node, Raw, Relationship, Subgraph, parse_mermaid_diagram,
+)
+
+
+class DiagramPart:
+    """分割した部分 1 つ（node_ids はこの部分に属するノード）"""
+
+    def __init__(self, number, node_ids, script):
+        self.number = number
+        self.node_ids = node_ids
+        self.script = script
+
+
+class DiagramPartition:
+    """分割結果（全体図のスクリプトと部分のリスト）"""
+
+    def __init__(self, overview_script, parts):
+        self.overview_script = overview_script
+        self.parts = parts
+
+
+def _env_int(name, default):
+    return int(os.getenv(name, str(default)))
+
+
+# ---- グラフ ----
+
+def _graph(diagram):
+    """(ノード ID のリスト, エッジ (from, to) のリスト, ノードごとの重み) を返す"""
+    node_ids = diagram.node_ids()
+    if diagram.kind == "er":
+        edges = [(item.left, item.right) for item in diagram.items if isinstance(item, Relationship)]
+        entities = diagram.entities()
+        # ER 図は描画の大きさがカラムの行数に比例するので、1 + カラム数を重みにする
+        weights = {name: 1 + len(entities[name].attributes) if name in entities else 1 for name in node_ids}
+    else:
+        edges = [(item.source, item.target) for _, item in diagram.walk() if isinstance(item, Edge)]
+        weights = {node_id: 1 for node_id in node_ids}
+    return node_ids, edges, weights
+
+
+def _subject_areas(diagram, node_ids):
+    """flowchart の最上位の subgraph ごとのノードのグループ（ノードは最初に現れた subgraph に属する）"""
+    owners = {}
+    for item in diagram.root.items:
+        if isinstance(item, Subgraph):
+            mentioned = []
+            for _, child in diagram.walk(item):
+                if isinstance(child, Node):
+                    mentioned.append(child.id)
+                elif isinstance(child, Edge):
+                    mentioned.extend((child.source, child.target))
+            owner = item.id
+        elif isinstance(item, Node):
+            mentioned, owner = [item.id], None
+        elif isinstance(item, Edge):
+            mentioned, owner = [item.source, item.target], None
+        else:
+            continue
+        for node_id in mentioned:
+            owners.setdefault(node_id, owner)
+    groups = {}
+    for node_id in node_ids:
+        if owners.get(node_id) is not None:
+            groups.setdefault(owners[node_id], []).append(node_id)
+    return list(groups.values())
+
+
+def _connected_components(node_ids, adjacency):
+    order = {node_id: index for index, node_id in enumerate(node_ids)}
+    seen = set()
+    components = []
+    for start in node_ids:
+        if start in seen:
+            continue
+        component = []
+        stack = [start]
+        seen.add(start)
+        while stack:
+            node_id = stack.pop()
+            component.append(node_id)
+            for neighbor in adjacency[node_id]:
+                if neighbor not in seen:
+                    seen.add(neighbor)
+                    stack.append(neighbor)
+        components.append(sorted(component, key=order.get))
+    return components
+
+
+def _split_greedy(group, adjacency, weights, max_weight):
+    """結びつきの強いノードから順に、重みの合計が max_weight を超えない範囲で部分を作る"""
+    order = {node_id: index for index, node_id in enumerate(group)}
+    remaining = set(group)
+    parts = []
+    while remaining:
+        seed = max(remaining, key=lambda n: (len(adjacency[n] & remaining), -order[n]))
+        part = [seed]
+        members = {seed}
+        weight = weights[seed]
+        remaining.discard(seed)
+        while True:
+            candidates = {neighbor for node_id in part for neighbor in adjacency[node_id]} & remaining
+            if not candidates:
+                break
+            best = max(candidates, key=lambda n: (len(adjacency[n] & members), len(adjacency[n] & remaining), -order[n]))
+            if weight + weights[best] > max_weight:
+                break
+            part.append(best)
+            members.add(best)
+            weight += weights[best]
+            remaining.discard(best)
+        parts.append(sorted(part, key=order.get))
+    return parts
+
+
+def _merge_small_parts(parts, weights, max_weight):
+    """小さな部分（孤立したノードなど）は上限の範囲でまとめる"""
+    merged = []
+    for part in parts:
+        part_weight = sum(weights[node_id] for node_id in part)
+        if part_weight * 4 < max_weight:
+            for target in merged:
+                if sum(weights[node_id] for node_id in target) + part_weight <= max_weight:
+                    target.extend(part)
+                    break
+            else:
+                merged.append(list(part))
+        else:
+            merged.append(list(part))
+    return merged
+
+
+def partition_node_ids(diagram, max_weight):
+    """
+    ダイアグラムのノードを部分に分ける。
+
+    Returns:
+        list[list[str]]: 部分ごとのノード ID
+    """
+    node_ids, edges, weights = _graph(diagram)
+    adjacency = {node_id: set() for node_id in node_ids}
+    for source, target in edges:
+        if source != target:
+            adjacency[source].add(target)
+            adjacency[target].add(source)
+
+    groups = _subject_areas(diagram, node_ids) if diagram.kind == "flowchart" else []
+    grouped = {node_id for group in groups for node_id in group}
+    ungrouped = [node_id for node_id in node_ids if node_id not in grouped]
+    ungrouped_adjacency = {node_id: adjacency[node_id] - grouped for node_id in ungrouped}
+    groups += _connected_components(ungrouped, ungrouped_adjacency)
+
+    parts = []
+    for group in groups:
+        if sum(weights[node_id] for node_id in group) <= max_weight:
+            parts.append(group)
+        else:
+            parts.extend(_split_greedy(group, adjacency, weights, max_weight))
+    return _merge_small_parts(parts, weights, max_weight)
+
+
+# ---- 部分のスクリプト ----
+
+def _flowchart_part(diagram, members, context):
+    part = FlowchartDiagram(diagram.header)
+    labels = {}
+    for _, item in diagram.walk():
+        if isinstance(item, Node) and item.opener is not None:
+            labels.setdefault(item.id, item)
+    # 他の部分のノードは参照用にラベルだけを先頭に置く
+    for node_id in context:
+        source = labels.get(node_id)
+        part.root.items.append(Node(node_id, source.opener, source.label, source.closer) if source else Node(node_id))
+    part.root.items.extend(_copy_flowchart_items(diagram.root.items, members, members | set(context)))
+    return part.to_script()
+
+
+def _copy_flowchart_items(items, members, visible):
+    copied = []
+    for item in items:
+        if isinstance(item, Subgraph):
+            children = _copy_flowchart_items(item.items, members, visible)
+            if any(not isinstance(child, Raw) for child in children):
+                subgraph = Subgraph(item.id, item.line)
+                subgraph.items = children
+                copied.append(subgraph)
+        elif isinstance(item, Node):
+            if item.id in members:
+                copied.append(item)
+        elif isinstance(item, Edge):
+            if {item.source, item.target} <= visible and (item.source in members or item.target in members):
+                copied.append(Edge(item.source, item.target, item.arrow, item.label))
+        else:
+            text = _filter_directive(item.text, visible)
+            if text is not None:
+                copied.append(Raw(text))
+    return copied
+
+
+def _filter_directive(text, visible):
+    """部分に含まれないノードを参照する style / class / click と、番号がずれる linkStyle を除く"""
+    words = text.split()
+    if not words or text.startswith("%%") or words[0] in ("classDef", "direction"):
+        return text
+    if words[0] == "linkStyle":
+        return None
+    if words[0] in ("style", "click"):
+        return text if len(words) >= 2 and words[1] in visible else None
+    if words[0] == "class" and len(words) >= 3:
+        targets = [target for target in words[1].split(",") if target in visible]
+        return " ".join(["class", ",".join(targets)] + words[2:]) if targets else None
+    return text
+
+
+def _er_part(diagram, members, context):
+    part = ERDiagram(diagram.header)
+    entities = diagram.entities()
+    for item in diagram.items:
+        if isinstance(item, Entity) and item.name in members:
+            part.items.append(item)
+    for name in context:
+        part.items.append(Entity(name, block=False))
+    for name in members:
+        if name not in entities:
+            part.items.append(Entity(name, block=False))
+    for item in diagram.items:
+        if isinstance(item, Relationship):
+            endpoints = {item.left, item.right}
+            if endpoints <= members | context and endpoints & members:
+                part.items.append(item)
+        elif isinstance(item, Raw):
+            part.items.append(item)
+    return part.to_script()
+
+
+def _overview_script(parts, edges):
+    owner = {node_id: part.number for part in parts for node_id in part.node_ids}
+    links = {}
+    for source, target in edges:
+        pair = tuple(sorted((owner[source], owner[target])))
+        if pair[0] != pair[1]:
+            links[pair] = links.get(pair, 0) + 1
+
+    lines = ["flowchart LR"]
+    for part in parts:
+        names = ", ".join(part.node_ids[:4])
+        more = f" ほか {len(part.node_ids) - 4} 件" if len(part.node_ids) > 4 else ""
+        label = f"部分 {part.number}: {names}{more}".replace('"', "#quot;")
+        lines.append(f'    P{part.number}["{label}"]')
+    for (left, right), count in sorted(links.items()):
+        lines.append(f"    P{left} ---|{count}| P{right}")
+    return "\n".join(lines) + "\n"
+
+
+def partition_mermaid_script(mermaid_script, max_nodes=None, max_edges=None, max_rows=None):
+    """
+    上限を超える大きさのダイアグラムを分割する。
+
+    Args:
+        mermaid_script: Mermaid スクリプト（検証・自動修正済みのもの）
+        max_nodes: flowchart のノード数の上限（省略時は MERMAID_PARTITION_MAX_NODES）
+        max_edges: エッジ数の上限（省略時は MERMAID_PARTITION_MAX_EDGES）
+        max_rows: ER 図のエンティティ数 + カラム数の上限（省略時は MERMAID_PARTITION_MAX_ROWS）
+
+    Returns:
+        DiagramPartition | None: 分割しない場合（上限以内、分割できない種類、MERMAID_PARTITION=0）は None
+    """
+    if os.getenv("MERMAID_PARTITION", "1") == "0":
+        return None
+    max_nodes = max_nodes or _env_int("MERMAID_PARTITION_MAX_NODES", 40)
+    max_edges = max_edges or _env_int("MERMAID_PARTITION_MAX_EDGES", 60)
+    max_rows = max_rows or _env_int("MERMAID_PARTITION_MAX_ROWS", 100)
+    try:
+        diagram = parse_mermaid_diagram(mermaid_script)
+    except ValueError:
+        return None
+
+    node_ids, edges, weights = _graph(diagram)
+    max_weight = max_rows if diagram.kind == "er" else max_nodes
+    if sum(weights.values()) <= max_weight and len(edges) <= max_edges:
+        return None
+
+    # エッジ数だけが多い場合も、部分あたりのエッジが上限に収まるようノード数を抑える
+    if len(edges) > max_edges:
+        average_weight = sum(weights.values()) / max(1, len(node_ids))
+        max_weight = min(max_weight, max(2, int(max_edges * len(node_ids) / len(edges) * average_weight)))
+    groups = partition_node_ids(diagram, max_weight)
+    if len(groups) < 2:
+        return None
+
+    parts = []
+    for number, group in enumerate(groups, 1):
+        members = set(group)
+        context = []
+        for source, target in edges:
+            if source in members and target not in members:
+                context.append(target)
+            elif target in members and source not in members:
+                context.append(source)
+        context = list(dict.fromkeys(context))
+        if diagram.kind == "er":
+            script = _er_part(diagram, members, set(context))
+        else:
+            script = _flowchart_part(diagram, members, context)
+        parts.append(DiagramPart(number, group, script))
+    return DiagramPartition(_overview_script(parts, edges), parts)
+
+
+# ---- レンダリング ----
+
+def part_file(image_file, suffix, extension):
+    """全体図・部分のファイル名（output/mermaid_diagram_X.png → output/mermaid_diagram_X_part1.png など）"""
+    return re.sub(r'\.png$', '', image_file) + f"_{suffix}{extension}"
+
+
+def render_partitioned_diagram(partition, image_file, render_file, width=2048, height=2048, part_timeout=None, max_workers=None):
+    """
+    全体図を image_file に、部分を <image_file>_partN.png に並列でレンダリングする。
+    全体図のスクリプトは <image_file>_overview.mmd、部分のスクリプトは <image_file>_partN.mmd に書き出す。
+
+    Args:
+        partition: partition_mermaid_script の戻り値
+        image_file: 全体図の出力ファイルのパス
+        render_file: render_file(script_file, image_file, width, height, timeout) でレンダリングする関数
+        part_timeout: 部分ごとのタイムアウト秒数（省略時は MERMAID_PARTITION_PART_TIMEOUT）
+        max_workers: 並列数（省略時は MERMAID_PARTITION_WORKERS）
+
+    Returns:
+        list[tuple[str, str | None]]: 部分ごとの (画像ファイルのパス, 失敗した場合のエラー)
+
+    Raises:
+        RuntimeError: 全体図とすべての部分のレンダリングに失敗した場合
+    """
+    part_timeout = part_timeout or _env_int("MERMAID_PARTITION_PART_TIMEOUT", 30)
+    max_workers = max_workers or _env_int("MERMAID_PARTITION_WORKERS", 4)
+
+    jobs = [(part_file(image_file, "overview", ".mmd"), image_file, partition.overview_script)]
+    for part in partition.parts:
+        suffix = f"part{part.number}"
+        jobs.append((part_file(image_file, suffix, ".mmd"), part_file(image_file, suffix, ".png"), part.script))
+    for script_file, _, script in jobs:
+        with open(script_file, 'w', encoding='utf-8') as f:
+            f.write(script)
+
+    # 停止要求（run_control）とトレースの親スパンは contextvars でレンダリングのスレッドに引き継ぐ
+    def render(script_file, output_file):
+        render_file(script_file, output_file, width, height, part_timeout)
+
+    errors = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(contextvars.copy_context().run, render, script_file, output_file): output_file
+            for script_file, output_file, _ in jobs
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                errors[futures[future]] = f"{type(e).__name__}: {e}"
+
+    if len(errors) == len(jobs):
+        raise RuntimeError(f"Diagram generation failed for all parts: {errors[image_file]}")
+    if image_file in errors:
+        raise RuntimeError(f"Overview diagram generation failed: {errors[image_file]}")
+    return [(output_file, errors.get(output_file)) for _, output_file, _ in jobs[1:]]
+
+
+def remove_diagram_parts(image_file):
+    """
+    image_file に対応する部分・全体図のファイルを削除する（同じファイル名で以前に分割生成した残りを消す）。
+    """
+    for pattern in (part_file(glob.escape(image_file), "part*", ".*"),
+                    part_file(glob.escape(image_file), "overview", ".mmd")):
+        for path in glob.glob(pattern):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def describe_diagram_parts(image_file):
+    """
+    ツールの戻り値にする文字列を返す。分割していなければ image_file、分割していれば全体図と部分の一覧。
+    """
+    part_files = sorted(
+        glob.glob(part_file(glob.escape(image_file), "part*", ".png")),
+        key=lambda path: int(re.search(r'_part(\d+)\.png$', path).group(1))
+    )
+    if not part_files:
+        return image_file
+    lines = [
+        image_file,
+        f"ダイアグラムが大きいため {len(part_files)} つの部分に分割しました（{image_file} は部分どうしのつながりを示す全体図です）:",
+    ]
+    lines.extend(f"- {path}" for path in part_files)
+    return "\n".join(lines)
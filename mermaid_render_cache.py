@@ -0,0 +1,185 @@
+"""
+Mermaid レンダリングキャッシュ
+
+エージェントは 1 回の agent.run の中で同じ（または空白だけ異なる）Mermaid スクリプトを
+何度もレンダリングすることがあり、ユーザーも同じ要件を再送信する。
+正規化したスクリプトとレンダリングオプション（幅・高さ・フォーマット・テーマ）のハッシュをキーに
+生成済みの成果物を記録しておき、キャッシュヒット時は mmdc を起動せずに既存の成果物を返す。
+
+- インデックスは output/.render_cache.json に保存する
+- エントリ数・合計サイズの上限を超えると、最後に参照された時刻が古いものから削除する（LRU）
+- 追い出されたエントリの成果物ファイル（.png/.mmd と、SVG・縮小版などの派生ファイル）も削除する
+- ヒット数・ミス数・追い出し数は stats() で取得できる
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+def normalize_mermaid_script(mermaid_script):
+    """
+    キャッシュキー用にスクリプトを正規化する（改行コード・行頭行末の空白・空行の違いを無視）。
+    """
+    lines = mermaid_script.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    return '\n'.join(line.strip() for line in lines if line.strip())
+
+
+class MermaidRenderCache:
+    """
+    ディスク上の成果物を指すコンテンツアドレス型キャッシュ。
+
+    Args:
+        index_file: インデックスファイルのパス
+        max_entries: 保持する最大エントリ数
+        max_bytes: 保持する成果物の合計サイズ上限（バイト）
+    """
+
+    def __init__(self, index_file, max_entries=500, max_bytes=1024 * 1024 * 1024):
+        self.index_file = index_file
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = self._load()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load(self):
+        if not os.path.exists(self.index_file):
+            return {}
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            # 壊れたインデックスは捨てて作り直す
+            return {}
+
+    def _save(self):
+        directory = os.path.dirname(self.index_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_file = f"{self.index_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_file, self.index_file)
+
+    @staticmethod
+    def make_key(mermaid_script, width=2048, height=2048, fmt="png", theme=None):
+        """正規化スクリプトとレンダリングオプションからキャッシュキーを作る"""
+        payload = json.dumps({
+            "script": normalize_mermaid_script(mermaid_script),
+            "width": width,
+            "height": height,
+            "format": fmt,
+            "theme": theme,
+        }, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """
+        キャッシュされた成果物のパスを返す。
+
+        Returns:
+            str | None: 画像ファイルのパス。キャッシュミスの場合は None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not os.path.exists(entry["image_file"]):
+                # 成果物が外部で削除されていたらエントリも捨てる
+                del self._entries[key]
+                self._save()
+                entry = None
+
+            if entry is None:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            entry["last_access"] = time.time()
+            self._save()
+            return entry["image_file"]
+
+    def put(self, key, image_file, script_file=None, extra_files=()):
+        """
+        レンダリング結果をキャッシュに登録し、上限を超えた分を追い出す。
+
+        Args:
+            extra_files: 追い出すときに一緒に削除する派生ファイル（SVG・縮小版など）
+        """
+        extra_files = [path for path in extra_files if os.path.exists(path)]
+        size = os.path.getsize(image_file) + sum(os.path.getsize(path) for path in extra_files)
+        if script_file and os.path.exists(script_file):
+            size += os.path.getsize(script_file)
+
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {
+                "image_file": image_file,
+                "script_file": script_file,
+                "extra_files": extra_files,
+                "size": size,
+                "created_at": now,
+                "last_access": now,
+            }
+            self._evict(keep=key)
+            self._save()
+
+    def _evict(self, keep):
+        total_bytes = sum(entry["size"] for entry in self._entries.values())
+        by_last_access = sorted(self._entries.items(), key=lambda item: item[1]["last_access"])
+        for key, entry in by_last_access:
+            if len(self._entries) <= self.max_entries and total_bytes <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            del self._entries[key]
+            total_bytes -= entry["size"]
+            self.evictions += 1
+            for path in (entry["image_file"], entry.get("script_file"), *entry.get("extra_files", ())):
+                if path and os.path.exists(path):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+    def stats(self):
+        """ヒット数・ミス数・エントリ数などを返す"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": sum(entry["size"] for entry in self._entries.values()),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_render_cache():
+    """
+    共有レンダリングキャッシュを返す。
+
+    Returns:
+        MermaidRenderCache | None: MERMAID_RENDER_CACHE=0 で無効化されている場合は None
+    """
+    global _cache
+
+    if os.getenv("MERMAID_RENDER_CACHE", "1") == "0":
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = MermaidRenderCache(
+                index_file=os.path.join("output", ".render_cache.json"),
+                max_entries=int(os.getenv("MERMAID_RENDER_CACHE_MAX_ENTRIES", "500")),
+                max_bytes=int(os.getenv("MERMAID_RENDER_CACHE_MAX_MB", "1024")) * 1024 * 1024
+            )
+        return _cache
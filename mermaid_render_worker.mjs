@@ -0,0 +1,68 @@
+// Mermaid 常駐レンダリングワーカー
+//
+// mermaid_renderer_pool.py から起動され、ヘッドレス Chromium を 1 つ起動したまま
+// 標準入力から 1 行 1 ジョブの JSON を受け取り、レンダリング結果を標準出力に 1 行の JSON で返す。
+//
+// 入力: {"id": "...", "input": "xxx.mmd", "output": "xxx.png", "format": "png", "width": 2048, "height": 2048}
+// 出力: {"id": "...", "ok": true} / {"id": "...", "ok": false, "error": "..."}
+//
+// MERMAID_CLI_DIR 環境変数に @mermaid-js/mermaid-cli パッケージのディレクトリを指定する。
+
+import { createRequire } from "node:module";
+import { readFile, writeFile } from "node:fs/promises";
+import path from "node:path";
+import readline from "node:readline";
+import { pathToFileURL } from "node:url";
+
+const cliDir = process.env.MERMAID_CLI_DIR;
+if (!cliDir) {
+  console.error("MERMAID_CLI_DIR is not set");
+  process.exit(2);
+}
+
+const require = createRequire(path.join(cliDir, "package.json"));
+const puppeteer = require("puppeteer");
+const { renderMermaid } = await import(pathToFileURL(path.join(cliDir, "src", "index.js")).href);
+
+const browser = await puppeteer.launch({ headless: "shell" });
+
+function reply(message) {
+  process.stdout.write(JSON.stringify(message) + "\n");
+}
+
+async function handle(job) {
+  const definition = await readFile(job.input, "utf-8");
+  const format = job.format || "png";
+  const { data } = await renderMermaid(browser, definition, format, {
+    viewport: { width: job.width || 800, height: job.height || 600, deviceScaleFactor: 1 },
+    backgroundColor: job.backgroundColor || "white",
+    mermaidConfig: job.theme ? { theme: job.theme } : {},
+  });
+  await writeFile(job.output, data);
+}
+
+const rl = readline.createInterface({ input: process.stdin });
+
+// ジョブは 1 件ずつ順番に処理する（並列度はワーカー数で制御する）
+let chain = Promise.resolve();
+rl.on("line", (line) => {
+  if (!line.trim()) return;
+  chain = chain.then(async () => {
+    let job;
+    try {
+      job = JSON.parse(line);
+      await handle(job);
+      reply({ id: job.id, ok: true });
+    } catch (e) {
+      reply({ id: job ? job.id : null, ok: false, error: String(e && e.message ? e.message : e) });
+    }
+  });
+});
+
+rl.on("close", async () => {
+  await chain;
+  await browser.close();
+  process.exit(0);
+});
+
+reply({ ready: true });
@@ -0,0 +1,474 @@
+"""
+Mermaid 常駐レンダラープール
+
+mmdc をダイアグラムごとに起動すると、Node とヘッドレス Chromium の起動だけで数秒かかる。
+このモジュールは Chromium を起動したままのワーカー（mermaid_render_worker.mjs）を
+指定数だけ常駐させ、キュー経由でレンダリングジョブを割り当てる。
+
+- ワーカー数は環境変数 MERMAID_RENDERER_WORKERS で指定（既定 2、0 でプール無効）
+- クラッシュ・ハングしたワーカーは自動で再起動する
+- キュー長とジョブごとのレイテンシは stats() で取得できる
+- エージェントの実行が停止された場合（run_control.py）、待ち中のジョブは取り消し、処理中のジョブはワーカーを kill する
+- プールが使えない場合は RendererUnavailableError を送出するので、呼び出し側は mmdc の単発実行にフォールバックする
+"""
+
+import atexit
+import collections
+import json
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+
+from run_control import RunCancelled, current_token
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mermaid_render_worker.mjs")
+
+# 起動に失敗した後、再度プールの起動を試みるまでの秒数
+POOL_RETRY_INTERVAL = 300
+
+
+class RendererUnavailableError(RuntimeError):
+    """レンダラープールが利用できないことを表す例外"""
+
+
+def find_mermaid_cli_dir():
+    """
+    @mermaid-js/mermaid-cli パッケージのディレクトリを探す。
+
+    Returns:
+        str | None: パッケージディレクトリ。見つからない場合は None
+    """
+    env_dir = os.getenv("MERMAID_CLI_DIR")
+    if env_dir:
+        return env_dir
+
+    mmdc_path = shutil.which("mmdc")
+    if mmdc_path is None:
+        return None
+
+    candidates = []
+    # Linux/macOS: mmdc は .../@mermaid-js/mermaid-cli/src/cli.js へのシンボリックリンク
+    directory = os.path.dirname(os.path.realpath(mmdc_path))
+    for _ in range(3):
+        candidates.append(directory)
+        directory = os.path.dirname(directory)
+    # Windows: %APPDATA%\npm\mmdc.cmd の隣に node_modules がある
+    candidates.append(os.path.join(os.path.dirname(mmdc_path), "node_modules", "@mermaid-js", "mermaid-cli"))
+
+    for candidate in candidates:
+        package_json = os.path.join(candidate, "package.json")
+        if not os.path.isfile(package_json):
+            continue
+        try:
+            with open(package_json, 'r', encoding='utf-8') as f:
+                if json.load(f).get("name") == "@mermaid-js/mermaid-cli":
+                    return candidate
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+def _percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round((percent / 100) * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class _RenderJob:
+    def __init__(self, input_file, output_file, width, height, fmt, theme, timeout):
+        self.id = uuid.uuid4().hex
+        self.input_file = input_file
+        self.output_file = output_file
+        self.width = width
+        self.height = height
+        self.format = fmt
+        self.theme = theme
+        self.timeout = timeout
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.error = None
+        self.cancelled = False
+        self.worker = None
+
+
+class _RendererWorker:
+    """常駐 Node ワーカープロセス 1 つを管理する"""
+
+    def __init__(self, node_path, cli_dir, startup_timeout):
+        self.node_path = node_path
+        self.cli_dir = cli_dir
+        self.startup_timeout = startup_timeout
+        self.process = None
+        self._lines = None
+        self._stderr_tail = collections.deque(maxlen=20)
+
+    def start(self):
+        env = dict(os.environ, MERMAID_CLI_DIR=self.cli_dir)
+        self._lines = queue.Queue()
+        self._stderr_tail.clear()
+        try:
+            self.process = subprocess.Popen(
+                [self.node_path, WORKER_SCRIPT],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding='utf-8',
+                shell=False,
+                env=env
+            )
+        except OSError as e:
+            raise RendererUnavailableError(f"Failed to start renderer worker: {str(e)}")
+
+        threading.Thread(target=self._read_stdout, args=(self.process, self._lines), daemon=True).start()
+        threading.Thread(target=self._read_stderr, args=(self.process,), daemon=True).start()
+
+        try:
+            message = self._read_message(self.startup_timeout)
+        except TimeoutError:
+            self.stop()
+            raise RendererUnavailableError("Renderer worker did not become ready in time")
+        if not message.get("ready"):
+            self.stop()
+            raise RendererUnavailableError("Renderer worker sent an unexpected startup message")
+
+    def _read_stdout(self, process, lines):
+        for line in process.stdout:
+            lines.put(line)
+        lines.put(None)  # EOF（プロセス終了）
+
+    def _read_stderr(self, process):
+        for line in process.stderr:
+            self._stderr_tail.append(line.strip())
+
+    def _read_message(self, timeout):
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError("renderer worker did not respond")
+        if line is None:
+            detail = " ".join(self._stderr_tail)
+            raise RendererUnavailableError(f"Renderer worker exited unexpectedly: {detail}")
+        try:
+            return json.loads(line)
+        except ValueError:
+            return {}
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def kill(self):
+        """処理中のジョブを打ち切る（ワーカーは次のジョブの前に再起動される）"""
+        process = self.process
+        if process is not None:
+            process.kill()
+
+    def render(self, job, timeout):
+        request = {
+            "id": job.id,
+            "input": os.path.abspath(job.input_file),
+            "output": os.path.abspath(job.output_file),
+            "format": job.format,
+            "width": job.width,
+            "height": job.height,
+            "theme": job.theme,
+        }
+        try:
+            self.process.stdin.write(json.dumps(request) + "\n")
+            self.process.stdin.flush()
+        except (OSError, ValueError) as e:
+            raise RendererUnavailableError(f"Failed to send job to renderer worker: {str(e)}")
+
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError("renderer worker did not respond")
+            message = self._read_message(remaining)
+            if message.get("id") == job.id:
+                return message
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+            self.process.wait()
+        self.process = None
+
+
+class MermaidRendererPool:
+    """
+    常駐ワーカーによる Mermaid レンダラープール。
+
+    Args:
+        size: 常駐させるワーカー数
+        job_timeout: 1 ジョブあたりのタイムアウト秒数（超えたワーカーはハングとみなして再起動）
+        startup_timeout: ワーカー起動待ちのタイムアウト秒数
+        node_path: node コマンドのパス（省略時は PATH から探索）
+        cli_dir: @mermaid-js/mermaid-cli のディレクトリ（省略時は mmdc の位置から探索）
+    """
+
+    def __init__(self, size=2, job_timeout=60, startup_timeout=30, node_path=None, cli_dir=None):
+        self.size = size
+        self.job_timeout = job_timeout
+        self.startup_timeout = startup_timeout
+        self.node_path = node_path or shutil.which("node")
+        self.cli_dir = cli_dir or find_mermaid_cli_dir()
+
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = []
+        self._threads = []
+        self._alive = 0
+        self._closed = False
+        self._completed = 0
+        self._failed = 0
+        self._cancelled = 0
+        self._restarts = 0
+        self._latencies = collections.deque(maxlen=200)
+        self._queue_waits = collections.deque(maxlen=200)
+
+    @property
+    def available(self):
+        return not self._closed and self._alive > 0
+
+    def start(self):
+        """ワーカーを起動する。1 つも起動できなければ RendererUnavailableError を送出する。"""
+        if self.node_path is None:
+            raise RendererUnavailableError("node command not found")
+        if self.cli_dir is None:
+            raise RendererUnavailableError("@mermaid-js/mermaid-cli package not found")
+
+        workers = [_RendererWorker(self.node_path, self.cli_dir, self.startup_timeout) for _ in range(self.size)]
+        errors = []
+
+        def start_worker(worker):
+            try:
+                worker.start()
+            except RendererUnavailableError as e:
+                errors.append(e)
+
+        # Chromium の起動は重いので並列に行う
+        starters = [threading.Thread(target=start_worker, args=(worker,)) for worker in workers]
+        for starter in starters:
+            starter.start()
+        for starter in starters:
+            starter.join()
+
+        started = [worker for worker in workers if worker.is_alive()]
+        if not started:
+            raise RendererUnavailableError(f"No renderer worker could be started: {errors[0] if errors else ''}")
+
+        self._workers = started
+        self._alive = len(started)
+        for worker in started:
+            thread = threading.Thread(target=self._worker_loop, args=(worker,), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _restart_worker(self, worker):
+        worker.stop()
+        try:
+            worker.start()
+        except RendererUnavailableError:
+            return False
+        with self._lock:
+            self._restarts += 1
+        return True
+
+    def _worker_loop(self, worker):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            if job.cancelled:
+                job.done.set()
+                continue
+
+            if not worker.is_alive() and not self._restart_worker(worker):
+                # 再起動できないワーカーは退役させ、ジョブは別のワーカーに回す
+                self._jobs.put(job)
+                self._retire_worker()
+                return
+
+            started_at = time.monotonic()
+            job.worker = worker
+            timeout = job.timeout or self.job_timeout
+            try:
+                message = worker.render(job, timeout)
+                if not message.get("ok"):
+                    job.error = RuntimeError(f"Mermaid rendering failed: {message.get('error', 'unknown error')}")
+            except TimeoutError:
+                job.error = RuntimeError(f"Diagram generation timed out ({timeout} seconds)")
+                self._restart_worker(worker)
+            except RendererUnavailableError as e:
+                job.error = e
+                self._restart_worker(worker)
+            except Exception as e:
+                job.error = RendererUnavailableError(f"Unexpected renderer error: {str(e)}")
+                self._restart_worker(worker)
+            finally:
+                finished_at = time.monotonic()
+                with self._lock:
+                    self._queue_waits.append(started_at - job.enqueued_at)
+                    self._latencies.append(finished_at - job.enqueued_at)
+                    if job.cancelled:
+                        self._cancelled += 1
+                    elif job.error is None:
+                        self._completed += 1
+                    else:
+                        self._failed += 1
+                job.done.set()
+
+    def _retire_worker(self):
+        with self._lock:
+            self._alive -= 1
+            no_workers = self._alive <= 0
+        if no_workers:
+            # 処理できるワーカーがいないので、待っているジョブはすべてフォールバックさせる
+            while True:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is not None:
+                    job.error = RendererUnavailableError("No renderer worker is alive")
+                    job.done.set()
+
+    def render(self, input_file, output_file, width=2048, height=2048, fmt="png", theme=None, timeout=None):
+        """
+        Mermaid スクリプトファイルをレンダリングする。
+
+        Args:
+            input_file: Mermaid スクリプトファイルのパス
+            output_file: 出力ファイルのパス
+            width: 出力幅
+            height: 出力高さ
+            fmt: 出力フォーマット（png, svg, pdf）
+            theme: Mermaid テーマ（省略時は既定テーマ）
+            timeout: このジョブのタイムアウト秒数（省略時はプールの job_timeout）
+
+        Returns:
+            str: 出力ファイルのパス
+
+        Raises:
+            RendererUnavailableError: プールが利用できない場合（呼び出し側でフォールバックする）
+            RuntimeError: レンダリングに失敗した場合
+            RunCancelled: エージェントの実行が停止された場合
+        """
+        if not self.available:
+            raise RendererUnavailableError("Renderer pool is not available")
+
+        job = _RenderJob(input_file, output_file, width, height, fmt, theme, timeout)
+        token = current_token()
+        unregister = token.on_cancel(lambda: self._cancel_job(job)) if token is not None else (lambda: None)
+        self._jobs.put(job)
+        try:
+            job.done.wait()
+        finally:
+            unregister()
+
+        if job.cancelled:
+            raise RunCancelled()
+
+        if job.error is not None:
+            raise job.error
+        if not os.path.exists(output_file):
+            raise RuntimeError("Diagram file was not created")
+        return output_file
+
+    def _cancel_job(self, job):
+        job.cancelled = True
+        if job.worker is not None:
+            job.worker.kill()
+        job.done.set()
+
+    def stats(self):
+        """キュー長・ワーカー状態・レイテンシ（ミリ秒）を返す"""
+        with self._lock:
+            latencies = list(self._latencies)
+            queue_waits = list(self._queue_waits)
+            return {
+                "workers": self.size,
+                "alive_workers": self._alive,
+                "queue_depth": self._jobs.qsize(),
+                "completed": self._completed,
+                "failed": self._failed,
+                "cancelled": self._cancelled,
+                "restarts": self._restarts,
+                "latency_ms": {
+                    "last": round(latencies[-1] * 1000, 1) if latencies else None,
+                    "p50": round(_percentile(latencies, 50) * 1000, 1) if latencies else None,
+                    "p95": round(_percentile(latencies, 95) * 1000, 1) if latencies else None,
+                },
+                "queue_wait_ms": {
+                    "p50": round(_percentile(queue_waits, 50) * 1000, 1) if queue_waits else None,
+                    "p95": round(_percentile(queue_waits, 95) * 1000, 1) if queue_waits else None,
+                },
+            }
+
+    def close(self):
+        """ワーカーを停止する"""
+        if self._closed:
+            return
+        self._closed = True
+        for _ in self._threads:
+            self._jobs.put(None)
+        for thread in self._threads:
+            thread.join(timeout=5)
+        for worker in self._workers:
+            worker.stop()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_failed_at = None
+
+
+def get_renderer_pool():
+    """
+    共有レンダラープールを返す。初回呼び出し時にワーカーを起動する。
+
+    Returns:
+        MermaidRendererPool | None: 利用できない場合は None
+    """
+    global _pool, _pool_failed_at
+
+    size = int(os.getenv("MERMAID_RENDERER_WORKERS", "2"))
+    if size <= 0:
+        return None
+
+    with _pool_lock:
+        if _pool is not None and _pool.available:
+            return _pool
+        if _pool_failed_at is not None and time.monotonic() - _pool_failed_at < POOL_RETRY_INTERVAL:
+            return None
+
+        if _pool is not None:
+            _pool.close()
+        pool = MermaidRendererPool(
+            size=size,
+            job_timeout=int(os.getenv("MERMAID_RENDERER_TIMEOUT", "60"))
+        )
+        try:
+            pool.start()
+        except RendererUnavailableError as e:
+            print(f"⚠️ Mermaid レンダラープールを起動できません（mmdc 単発実行を使用します）: {e}")
+            _pool = None
+            _pool_failed_at = time.monotonic()
+            return None
+
+        atexit.register(pool.close)
+        _pool = pool
+        _pool_failed_at = None
+        return _pool
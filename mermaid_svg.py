@@ -0,0 +1,1067 @@
+"""
+Mermaid ダイアグラムのプロセス内レンダラー（erDiagram と flowchart/graph）
+
+すべてのダイアグラムを mmdc（Node.js・@mermaid-js/mermaid-cli・ヘッドレス Chromium）で生成していたため、
+これらを入れていない軽量なコンテナではダイアグラムを 1 枚も生成できず、入っていても 1 枚ごとに
+ブラウザでの描画を待っていた。このモジュールはエージェントが生成するサブセットを Python だけで描画する。
+
+- 解析: mermaid_edit.py のモデル（ノード・エッジ・subgraph、ER 図のエンティティ・リレーション）を使う
+- レイアウト: 階層型（Sugiyama 方式）。閉路を反転してランクを割り当て、2 ランク以上離れたエッジには
+  中継点を置き、重心法で交差を減らしてから座標を決める。subgraph のノードは同じ列の帯にまとめる
+- 出力: SVG（.svg）と、Pillow で描いた PNG（.png）。同じ描画命令の列（Scene）から両方を作る
+
+対応していない記法（sequenceDiagram などのダイアグラムの種類や、複数行にまたがるラベル、解析できない行）は
+UnsupportedDiagramError になり、呼び出し側は mmdc を使う。
+
+環境変数:
+    MERMAID_RENDER_ENGINE: auto（既定。mmdc がない環境では対応するダイアグラムをこのレンダラーで描画）/
+        python（対応するダイアグラムは常にこのレンダラー）/ mmdc（常に mmdc）
+    MERMAID_FALLBACK_FONT: PNG の描画に使うフォントファイル（省略時は日本語フォントを既知のパスから探す）
+"""
+
+import html
+import math
+import os
+import re
+import shutil
+import unicodedata
+
+from mermaid_edit import Edge, Entity, ERDiagram, FlowchartDiagram, Node, Raw, Relationship, Subgraph, parse_mermaid_diagram
+
+ENGINES = ("auto", "python", "mmdc")
+
+FONT_SIZE = 14
+LINE_HEIGHT = 20
+NODE_PADDING_X = 16
+NODE_PADDING_Y = 10
+RANK_GAP = 60
+NODE_GAP = 36
+CLUSTER_PADDING = 16
+CLUSTER_TITLE = 24
+MARGIN = 20
+ER_ROW_HEIGHT = 22
+ER_CELL_PADDING = 10
+
+THEME = {
+    "background": "#ffffff",
+    "node_fill": "#ECECFF",
+    "node_stroke": "#9370DB",
+    "text": "#333333",
+    "edge": "#333333",
+    "label_background": "#ffffff",
+    "cluster_fill": "#ffffde",
+    "cluster_stroke": "#aaaa33",
+    "er_header": "#ECECFF",
+    "er_row": "#ffffff",
+    "er_row_alt": "#f7f7ff",
+}
+
+DASH = ' stroke-dasharray="5 4"'
+ARROW_MARKER = ' marker-end="url(#arrow)"'
+SVG_FONT_FAMILY = "'Noto Sans CJK JP', 'Noto Sans JP', 'Hiragino Sans', 'Yu Gothic', Meiryo, 'IPAexGothic', sans-serif"
+
+# PNG の描画に使うフォントの候補（日本語を描けるものを先に探す）
+FONT_CANDIDATES = (
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc",
+    "/usr/share/fonts/truetype/noto/NotoSansJP-Regular.ttf",
+    "/usr/share/fonts/opentype/ipaexfont-gothic/ipaexg.ttf",
+    "/usr/share/fonts/truetype/fonts-japanese-gothic.ttf",
+    "/System/Library/Fonts/ヒラギノ角ゴシック W3.ttc",
+    "/System/Library/Fonts/Hiragino Sans GB.ttc",
+    "C:/Windows/Fonts/meiryo.ttc",
+    "C:/Windows/Fonts/YuGothM.ttc",
+    "C:/Windows/Fonts/msgothic.ttc",
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+)
+
+# ER 図のカーディナリティの記号と表示
+ER_MARKERS = {"||": "1", "|o": "0..1", "o|": "0..1", "}o": "0..*", "o{": "0..*", "}|": "1..*", "|{": "1..*"}
+
+
+class UnsupportedDiagramError(ValueError):
+    """このレンダラーでは描画できないダイアグラム（mmdc を使う）"""
+
+
+# ---- テキスト ----
+
+def text_width(text, size=FONT_SIZE):
+    """テキストの幅の概算（全角は 1 文字 = フォントサイズ、半角はその 0.6 倍）"""
+    return sum(size if unicodedata.east_asian_width(ch) in "WF" else size * 0.6 for ch in text)
+
+
+def label_lines(label):
+    """ラベルを表示する行に分ける（引用符・<br>・\\n・HTML 実体参照を扱う）"""
+    label = (label or "").strip()
+    if len(label) >= 2 and label[0] == label[-1] == '"':
+        label = label[1:-1]
+    if len(label) >= 2 and label[0] == label[-1] == '`':
+        label = label[1:-1]
+    label = label.replace("#quot;", '"')
+    label = re.sub(r'#(\d+);', lambda m: chr(int(m.group(1))), label)
+    label = re.sub(r'<br\s*/?>|\\n', "\n", label, flags=re.IGNORECASE)
+    return [line.strip() for line in label.split("\n")] or [""]
+
+
+# ---- 描画命令 ----
+
+class Scene:
+    """描画命令の列（SVG と Pillow の両方で描く）"""
+
+    def __init__(self):
+        self.items = []
+        self.width = 0
+        self.height = 0
+
+    def rect(self, x, y, w, h, fill, stroke, radius=0, dash=False, stroke_width=1):
+        self.items.append(("rect", x, y, w, h, fill, stroke, radius, dash, stroke_width))
+
+    def ellipse(self, cx, cy, rx, ry, fill, stroke):
+        self.items.append(("ellipse", cx, cy, rx, ry, fill, stroke))
+
+    def polygon(self, points, fill, stroke):
+        self.items.append(("polygon", points, fill, stroke))
+
+    def cylinder(self, x, y, w, h, fill, stroke):
+        self.items.append(("cylinder", x, y, w, h, fill, stroke))
+
+    def polyline(self, points, stroke, dash=False, stroke_width=1, arrow=False):
+        self.items.append(("polyline", points, stroke, dash, stroke_width, arrow))
+
+    def text(self, x, y, lines, fill, anchor="middle", bold=False, size=FONT_SIZE):
+        """(x, y) はテキストのブロックの中心（anchor="start" の場合は左端の中央）"""
+        self.items.append(("text", x, y, lines, fill, anchor, bold, size))
+
+    # ---- SVG ----
+
+    def to_svg(self):
+        out = [
+            f'<svg xmlns="http://www.w3.org/2000/svg" width="{self.width:.0f}" height="{self.height:.0f}" '
+            f'viewBox="0 0 {self.width:.0f} {self.height:.0f}" font-family="{html.escape(SVG_FONT_FAMILY)}">',
+            '<defs><marker id="arrow" viewBox="0 0 10 10" refX="9" refY="5" markerWidth="8" markerHeight="8" '
+            f'orient="auto-start-reverse"><path d="M 0 0 L 10 5 L 0 10 z" fill="{THEME["edge"]}"/></marker></defs>',
+            f'<rect width="100%" height="100%" fill="{THEME["background"]}"/>',
+        ]
+        for item in self.items:
+            kind = item[0]
+            if kind == "rect":
+                _, x, y, w, h, fill, stroke, radius, dash, stroke_width = item
+                out.append(f'<rect x="{x:.1f}" y="{y:.1f}" width="{w:.1f}" height="{h:.1f}" rx="{radius:.1f}" '
+                           f'fill="{fill}" stroke="{stroke}" stroke-width="{stroke_width}"{DASH if dash else ""}/>')
+            elif kind == "ellipse":
+                _, cx, cy, rx, ry, fill, stroke = item
+                out.append(f'<ellipse cx="{cx:.1f}" cy="{cy:.1f}" rx="{rx:.1f}" ry="{ry:.1f}" fill="{fill}" stroke="{stroke}"/>')
+            elif kind == "polygon":
+                _, points, fill, stroke = item
+                out.append(f'<polygon points="{_svg_points(points)}" fill="{fill}" stroke="{stroke}"/>')
+            elif kind == "cylinder":
+                _, x, y, w, h, fill, stroke = item
+                ry = min(8.0, h / 6)
+                out.append(
+                    f'<path d="M {x:.1f} {y + ry:.1f} A {w / 2:.1f} {ry:.1f} 0 0 1 {x + w:.1f} {y + ry:.1f} '
+                    f'L {x + w:.1f} {y + h - ry:.1f} A {w / 2:.1f} {ry:.1f} 0 0 1 {x:.1f} {y + h - ry:.1f} Z" '
+                    f'fill="{fill}" stroke="{stroke}"/>'
+                    f'<path d="M {x:.1f} {y + ry:.1f} A {w / 2:.1f} {ry:.1f} 0 0 0 {x + w:.1f} {y + ry:.1f}" '
+                    f'fill="none" stroke="{stroke}"/>'
+                )
+            elif kind == "polyline":
+                _, points, stroke, dash, stroke_width, arrow = item
+                out.append(f'<polyline points="{_svg_points(points)}" fill="none" stroke="{stroke}" '
+                           f'stroke-width="{stroke_width}"{DASH if dash else ""}{ARROW_MARKER if arrow else ""}/>')
+            elif kind == "text":
+                _, x, y, lines, fill, anchor, bold, size = item
+                top = y - (len(lines) - 1) * LINE_HEIGHT / 2
+                weight = ' font-weight="bold"' if bold else ""
+                for index, line in enumerate(lines):
+                    out.append(f'<text x="{x:.1f}" y="{top + index * LINE_HEIGHT:.1f}" fill="{fill}" font-size="{size}" '
+                               f'text-anchor="{anchor}" dominant-baseline="central"{weight}>{html.escape(line)}</text>')
+        out.append("</svg>")
+        return "\n".join(out) + "\n"
+
+    # ---- Pillow ----
+
+    def to_image(self, scale=1.0):
+        from PIL import Image, ImageDraw
+
+        image = Image.new("RGB", (max(1, round(self.width * scale)), max(1, round(self.height * scale))), THEME["background"])
+        draw = ImageDraw.Draw(image)
+        fonts = {}
+
+        def font(size, bold):
+            key = (size, bold)
+            if key not in fonts:
+                fonts[key] = _load_font(round(size * scale))
+            return fonts[key]
+
+        def s(points):
+            return [(x * scale, y * scale) for x, y in points]
+
+        for item in self.items:
+            kind = item[0]
+            if kind == "rect":
+                _, x, y, w, h, fill, stroke, radius, dash, stroke_width = item
+                box = [x * scale, y * scale, (x + w) * scale, (y + h) * scale]
+                if dash:
+                    draw.rounded_rectangle(box, radius=radius * scale, fill=fill)
+                    corners = [(x, y), (x + w, y), (x + w, y + h), (x, y + h), (x, y)]
+                    _dashed_line(draw, s(corners), stroke, max(1, round(stroke_width * scale)))
+                else:
+                    draw.rounded_rectangle(box, radius=radius * scale, fill=fill, outline=stroke,
+                                           width=max(1, round(stroke_width * scale)))
+            elif kind == "ellipse":
+                _, cx, cy, rx, ry, fill, stroke = item
+                draw.ellipse([(cx - rx) * scale, (cy - ry) * scale, (cx + rx) * scale, (cy + ry) * scale],
+                             fill=fill, outline=stroke, width=max(1, round(scale)))
+            elif kind == "polygon":
+                _, points, fill, stroke = item
+                draw.polygon(s(points), fill=fill, outline=stroke, width=max(1, round(scale)))
+            elif kind == "cylinder":
+                _, x, y, w, h, fill, stroke = item
+                ry = min(8.0, h / 6)
+                width = max(1, round(scale))
+                draw.ellipse([x * scale, (y + h - 2 * ry) * scale, (x + w) * scale, (y + h) * scale], fill=fill, outline=stroke, width=width)
+                draw.rectangle([x * scale, (y + ry) * scale, (x + w) * scale, (y + h - ry) * scale], fill=fill)
+                draw.line(s([(x, y + ry), (x, y + h - ry)]), fill=stroke, width=width)
+                draw.line(s([(x + w, y + ry), (x + w, y + h - ry)]), fill=stroke, width=width)
+                draw.ellipse([x * scale, y * scale, (x + w) * scale, (y + 2 * ry) * scale], fill=fill, outline=stroke, width=width)
+            elif kind == "polyline":
+                _, points, stroke, dash, stroke_width, arrow = item
+                width = max(1, round(stroke_width * scale))
+                if dash:
+                    _dashed_line(draw, s(points), stroke, width)
+                else:
+                    draw.line(s(points), fill=stroke, width=width, joint="curve")
+                if arrow and len(points) >= 2:
+                    draw.polygon(s(_arrow_head(points[-2], points[-1])), fill=stroke)
+            elif kind == "text":
+                _, x, y, lines, fill, anchor, bold, size = item
+                top = y - (len(lines) - 1) * LINE_HEIGHT / 2
+                for index, line in enumerate(lines):
+                    draw.text((x * scale, (top + index * LINE_HEIGHT) * scale), line, fill=fill, font=font(size, bold),
+                              anchor="mm" if anchor == "middle" else "lm")
+        return image
+
+
+def _svg_points(points):
+    return " ".join(f"{x:.1f},{y:.1f}" for x, y in points)
+
+
+def _arrow_head(start, end, length=9, half_width=4.5):
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    distance = math.hypot(dx, dy) or 1.0
+    ux, uy = dx / distance, dy / distance
+    base = (end[0] - ux * length, end[1] - uy * length)
+    return [end, (base[0] - uy * half_width, base[1] + ux * half_width), (base[0] + uy * half_width, base[1] - ux * half_width)]
+
+
+def _dashed_line(draw, points, fill, width, dash=6, gap=4):
+    for (x1, y1), (x2, y2) in zip(points, points[1:]):
+        distance = math.hypot(x2 - x1, y2 - y1)
+        position = 0.0
+        while position < distance:
+            end = min(distance, position + dash)
+            draw.line([(x1 + (x2 - x1) * position / distance, y1 + (y2 - y1) * position / distance),
+                       (x1 + (x2 - x1) * end / distance, y1 + (y2 - y1) * end / distance)], fill=fill, width=width)
+            position = end + gap
+
+
+_font_path = None
+
+
+def _load_font(size):
+    from PIL import ImageFont
+
+    global _font_path
+    if _font_path is None:
+        configured = os.getenv("MERMAID_FALLBACK_FONT")
+        candidates = ([configured] if configured else []) + list(FONT_CANDIDATES)
+        _font_path = next((path for path in candidates if path and os.path.exists(path)), "")
+    if _font_path:
+        return ImageFont.truetype(_font_path, size)
+    return ImageFont.load_default(size)
+
+
+# ---- レイアウト ----
+
+class LayoutNode:
+    """レイアウトするノード（w, h は描画する大きさ、group は同じ帯にまとめる subgraph）"""
+
+    def __init__(self, node_id, w, h, group=None, dummy=False):
+        self.id = node_id
+        self.w = w
+        self.h = h
+        self.group = group
+        self.dummy = dummy
+        self.rank = 0
+        self.order = 0
+        self.x = 0.0
+        self.y = 0.0
+
+
+def layered_layout(nodes, edges, direction="TB", label_sizes=None):
+    """
+    階層型のレイアウト。
+
+    ラベル付きのエッジがある場合はランクの間にラベル用のランクを挟み、ラベルを大きさのある中継点として
+    配置する（ラベルどうし・ラベルとノードが重ならない）。
+
+    Args:
+        nodes: LayoutNode のリスト
+        edges: (始点の ID, 終点の ID) のリスト
+        direction: TB / TD / BT / LR / RL
+        label_sizes: エッジごとのラベルの (幅, 高さ)（ラベルのないエッジは None）
+
+    Returns:
+        tuple: (ノードの ID → LayoutNode（x, y は中心）, エッジごとの経由点のリスト, エッジごとのラベルの中心, 幅, 高さ)
+    """
+    label_sizes = label_sizes or [None] * len(edges)
+    labelled = any(label_sizes)
+    rank_gap = RANK_GAP / 2 if labelled else RANK_GAP
+    horizontal = direction in ("LR", "RL")
+    by_id = {node.id: node for node in nodes}
+
+    # ランクの方向の大きさ（breadth は並べる方向、depth はランクの方向）
+    def breadth(node):
+        return node.h if horizontal else node.w
+
+    def depth(node):
+        return node.w if horizontal else node.h
+
+    # エッジのないノードは最後に格子状に並べる
+    connected = {node_id for edge in edges for node_id in edge if edge[0] != edge[1]}
+    isolated = [node for node in nodes if node.id not in connected]
+    graph_nodes = [node for node in nodes if node.id in connected]
+
+    # 1) 閉路の解消（DFS で戻りエッジを反転）
+    successors = {node.id: [] for node in graph_nodes}
+    for index, (source, target) in enumerate(edges):
+        if source != target:
+            successors[source].append((target, index))
+    reversed_edges = set()
+    state = {}
+    for root in successors:
+        if root in state:
+            continue
+        state[root] = "active"
+        stack = [(root, iter(successors[root]))]
+        while stack:
+            node_id, children = stack[-1]
+            for child, index in children:
+                if state.get(child) == "active":
+                    reversed_edges.add(index)
+                elif child not in state:
+                    state[child] = "active"
+                    stack.append((child, iter(successors[child])))
+                    break
+            else:
+                state[node_id] = "done"
+                stack.pop()
+
+    dag = []
+    for index, (source, target) in enumerate(edges):
+        if source == target:
+            continue
+        dag.append((target, source, index) if index in reversed_edges else (source, target, index))
+
+    # 2) ランク（最長経路）
+    incoming = {node.id: 0 for node in graph_nodes}
+    outgoing = {node.id: [] for node in graph_nodes}
+    for source, target, _ in dag:
+        incoming[target] += 1
+        outgoing[source].append(target)
+    queue = [node.id for node in graph_nodes if incoming[node.id] == 0]
+    while queue:
+        node_id = queue.pop(0)
+        for target in outgoing[node_id]:
+            by_id[target].rank = max(by_id[target].rank, by_id[node_id].rank + 1)
+            incoming[target] -= 1
+            if incoming[target] == 0:
+                queue.append(target)
+
+    if labelled:
+        for node in graph_nodes:
+            node.rank *= 2
+
+    # 3) 2 ランク以上離れたエッジに中継点を置く（ラベルはエッジの中央の中継点にする）
+    layers = {}
+    for node in graph_nodes:
+        layers.setdefault(node.rank, []).append(node)
+    chains = {}
+    label_nodes = {}
+    for source, target, index in dag:
+        chain = [by_id[source]]
+        middle = (by_id[source].rank + by_id[target].rank) // 2
+        for rank in range(by_id[source].rank + 1, by_id[target].rank):
+            group = by_id[source].group if by_id[source].group == by_id[target].group else None
+            w, h = label_sizes[index] if rank == middle and label_sizes[index] else (0, 0)
+            dummy = LayoutNode(f"__dummy_{index}_{rank}", w, h, group=group, dummy=True)
+            dummy.rank = rank
+            if w:
+                label_nodes[index] = dummy
+            layers.setdefault(rank, []).append(dummy)
+            chain.append(dummy)
+        chain.append(by_id[target])
+        chains[index] = chain
+    ranks = [layers[rank] for rank in sorted(layers)]
+
+    # 4) 交差を減らす並び順（重心法。subgraph はまとめ、subgraph どうしの左右の順は全ランクでそろえる）
+    upper = {}
+    lower = {}
+    for chain in chains.values():
+        for a, b in zip(chain, chain[1:]):
+            lower.setdefault(a.id, []).append(b)
+            upper.setdefault(b.id, []).append(a)
+    for layer in ranks:
+        for order, node in enumerate(layer):
+            node.order = order
+
+    def group_positions():
+        totals = {}
+        for layer in ranks:
+            for node in layer:
+                if node.group is not None:
+                    total = totals.setdefault(node.group, [0.0, 0])
+                    total[0] += node.order / max(1, len(layer) - 1)
+                    total[1] += 1
+        return {group: total / count for group, (total, count) in totals.items()}
+
+    def reorder(layer, neighbors):
+        groups = group_positions()
+        keys = {}
+        for node in layer:
+            adjacent = neighbors.get(node.id, [])
+            keys[node.id] = sum(n.order for n in adjacent) / len(adjacent) if adjacent else node.order
+        # subgraph の中のノードは subgraph の重心の位置にまとめる
+        block = {}
+        for node in layer:
+            if node.group is not None:
+                block.setdefault(node.group, []).append(keys[node.id])
+        layer.sort(key=lambda node: (
+            sum(block[node.group]) / len(block[node.group]) if node.group is not None else keys[node.id],
+            groups.get(node.group, 0.0),
+            keys[node.id],
+        ))
+        for order, node in enumerate(layer):
+            node.order = order
+
+    def crossings():
+        count = 0
+        for layer in ranks[:-1]:
+            pairs = [(a.order, b.order) for a in layer for b in lower.get(a.id, [])]
+            pairs.sort()
+            for i, (_, b1) in enumerate(pairs):
+                for _, b2 in pairs[i + 1:]:
+                    if b2 < b1:
+                        count += 1
+        return count
+
+    best = (crossings(), [[node.id for node in layer] for layer in ranks])
+    for sweep in range(8):
+        if sweep % 2 == 0:
+            for layer in ranks[1:]:
+                reorder(layer, upper)
+        else:
+            for layer in reversed(ranks[:-1]):
+                reorder(layer, lower)
+        count = crossings()
+        if count < best[0]:
+            best = (count, [[node.id for node in layer] for layer in ranks])
+    all_nodes = {node.id: node for layer in ranks for node in layer}
+    ranks = [[all_nodes[node_id] for node_id in layer] for layer in best[1]]
+    for layer in ranks:
+        for order, node in enumerate(layer):
+            node.order = order
+
+    # 5) 並べる方向の座標（隣接するランクのノードの平均に寄せ、重ならないように詰める）
+    def gap(a, b):
+        separation = NODE_GAP if not (a.dummy or b.dummy) else NODE_GAP / 2
+        if a.group != b.group:
+            separation += CLUSTER_PADDING * 2
+        return (breadth(a) + breadth(b)) / 2 + separation
+
+    position = {}
+    for layer in ranks:
+        cursor = 0.0
+        for index, node in enumerate(layer):
+            if index:
+                cursor += gap(layer[index - 1], node)
+            position[node.id] = cursor
+
+    def place(layer, neighbors):
+        desired = []
+        for node in layer:
+            adjacent = neighbors.get(node.id, [])
+            desired.append(sum(position[n.id] for n in adjacent) / len(adjacent) if adjacent else position[node.id])
+        # 間隔の制約を満たしつつ desired からの二乗誤差が最小の位置（累積の間隔を引くと単調回帰になる）
+        offsets = [0.0]
+        for i in range(1, len(layer)):
+            offsets.append(offsets[-1] + gap(layer[i - 1], layer[i]))
+        blocks = []
+        for value in (d - o for d, o in zip(desired, offsets)):
+            blocks.append([value, 1])
+            while len(blocks) > 1 and blocks[-2][0] > blocks[-1][0]:
+                value, count = blocks.pop()
+                blocks[-1] = [(blocks[-1][0] * blocks[-1][1] + value * count) / (blocks[-1][1] + count), blocks[-1][1] + count]
+        fitted = [mean for mean, count in blocks for _ in range(count)]
+        for node, value, offset in zip(layer, fitted, offsets):
+            position[node.id] = value + offset
+
+    for sweep in range(6):
+        if sweep % 2 == 0:
+            for layer in ranks[1:]:
+                place(layer, upper)
+        else:
+            for layer in reversed(ranks[:-1]):
+                place(layer, lower)
+    # 仕上げに上下両方の隣接ノードへ寄せ、長い辺（ダミーの列）をまっすぐにする
+    both = {node_id: upper.get(node_id, []) + lower.get(node_id, []) for node_id in all_nodes}
+    for _ in range(4):
+        for layer in ranks:
+            place(layer, both)
+
+    # subgraph の枠が他のノードと重ならないよう、subgraph の範囲に入り込んだノードを subgraph の左右どちらかへ出す
+    def shift_from(layer, index, delta):
+        for follower in layer[index:]:
+            position[follower.id] += delta
+
+    for _ in range(4 * sum(len(layer) for layer in ranks)):
+        extents = {}
+        for layer_index, layer in enumerate(ranks):
+            for node in layer:
+                if node.group is not None and not node.dummy:
+                    low, high, first, last = extents.get(node.group, (math.inf, -math.inf, layer_index, layer_index))
+                    extents[node.group] = (min(low, position[node.id] - breadth(node) / 2),
+                                           max(high, position[node.id] + breadth(node) / 2),
+                                           min(first, layer_index), max(last, layer_index))
+        overlap = None
+        for layer_index, layer in enumerate(ranks):
+            for i, node in enumerate(layer):
+                for group, (low, high, first, last) in extents.items():
+                    if node.group == group or not first <= layer_index <= last:
+                        continue
+                    left_edge = position[node.id] - breadth(node) / 2
+                    right_edge = position[node.id] + breadth(node) / 2
+                    if right_edge > low - CLUSTER_PADDING and left_edge < high + CLUSTER_PADDING:
+                        overlap = (layer_index, i, node, group, low, high, left_edge, right_edge)
+                        break
+                if overlap:
+                    break
+            if overlap:
+                break
+        if overlap is None:
+            break
+        layer_index, i, node, group, low, high, left_edge, right_edge = overlap
+        layer = ranks[layer_index]
+        member_orders = [n.order for n in layer if n.group == group]
+        if (member_orders and node.order < min(member_orders)) or (not member_orders and position[node.id] < (low + high) / 2):
+            # ノードを左に残し、subgraph（と各ランクでその右にあるノード）を右へ送る
+            delta = right_edge + CLUSTER_PADDING * 2 + NODE_GAP / 2 - low
+            for other in ranks:
+                members = [index for index, n in enumerate(other) if n.group == group]
+                if members:
+                    shift_from(other, members[0], delta)
+        else:
+            shift_from(layer, i, high + CLUSTER_PADDING * 2 + NODE_GAP / 2 - left_edge)
+
+    # 6) ランクの方向の座標
+    offset = min((position[node.id] - breadth(node) / 2 for layer in ranks for node in layer), default=0.0)
+    cursor = 0.0
+    for layer in ranks:
+        thickness = max((depth(node) for node in layer), default=0.0)
+        for node in layer:
+            along = position[node.id] - offset
+            across = cursor + thickness / 2
+            node.x, node.y = (across, along) if horizontal else (along, across)
+        cursor += thickness + rank_gap
+    main_breadth = max((position[node.id] - offset + breadth(node) / 2 for layer in ranks for node in layer), default=0.0)
+    main_depth = max(0.0, cursor - rank_gap)
+
+    # エッジのないノードは格子状に並べる（1 行の幅は主部分の幅か、ノード数の平方根に合わせる）
+    if isolated:
+        per_row = max(1, math.ceil(math.sqrt(len(isolated))))
+        row_limit = max(main_breadth, sum(breadth(node) for node in isolated[:per_row]) + NODE_GAP * (per_row - 1))
+        cursor_depth = main_depth + (RANK_GAP if ranks else 0)
+        cursor_breadth = 0.0
+        row_depth = 0.0
+        for node in isolated:
+            if cursor_breadth and cursor_breadth + breadth(node) > row_limit:
+                cursor_depth += row_depth + NODE_GAP
+                cursor_breadth = 0.0
+                row_depth = 0.0
+            along = cursor_breadth + breadth(node) / 2
+            across = cursor_depth + depth(node) / 2
+            node.x, node.y = (across, along) if horizontal else (along, across)
+            cursor_breadth += breadth(node) + NODE_GAP
+            row_depth = max(row_depth, depth(node))
+            main_breadth = max(main_breadth, cursor_breadth - NODE_GAP)
+        main_depth = cursor_depth + row_depth
+
+    width, height = (main_depth, main_breadth) if horizontal else (main_breadth, main_depth)
+    placed = {node.id: node for node in nodes}
+    if direction in ("BT", "RL"):
+        for node in list(placed.values()) + [n for chain in chains.values() for n in chain if n.dummy]:
+            if direction == "BT":
+                node.y = height - node.y
+            else:
+                node.x = width - node.x
+
+    routes = []
+    labels = []
+    for index, (source, target) in enumerate(edges):
+        if source == target:
+            node = placed[source]
+            x, y = node.x + node.w / 2, node.y
+            routes.append([(x, y - 8), (x + 24, y - 16), (x + 24, y + 16), (x, y + 8)])
+            labels.append((x + 24 + (label_sizes[index] or (0, 0))[0] / 2 + 4, y) if label_sizes[index] else None)
+            continue
+        points = [(node.x, node.y) for node in chains[index]]
+        if index in reversed_edges:
+            points.reverse()
+        routes.append(points)
+        label_node = label_nodes.get(index)
+        labels.append((label_node.x, label_node.y) if label_node is not None else None)
+    return placed, routes, labels, width, height
+
+
+def clip_to_box(center, toward, w, h, shape="rect"):
+    """ノードの中心から toward へ向かう線分がノードの輪郭と交わる点"""
+    dx, dy = toward[0] - center[0], toward[1] - center[1]
+    if dx == 0 and dy == 0:
+        return center
+    if shape in ("circle", "ellipse"):
+        rx, ry = w / 2, h / 2
+        t = 1.0 / math.sqrt((dx / rx) ** 2 + (dy / ry) ** 2)
+    elif shape == "diamond":
+        t = 1.0 / (abs(dx) / (w / 2) + abs(dy) / (h / 2))
+    else:
+        tx = (w / 2) / abs(dx) if dx else math.inf
+        ty = (h / 2) / abs(dy) if dy else math.inf
+        t = min(tx, ty)
+    t = min(t, 1.0)
+    return center[0] + dx * t, center[1] + dy * t
+
+
+def _route_edge(points, source, target):
+    """経由点の先頭と末尾をノードの輪郭で切る"""
+    if len(points) < 2:
+        return points
+    start = clip_to_box(points[0], points[1], source.w, source.h, getattr(source, "shape", "rect"))
+    end = clip_to_box(points[-1], points[-2], target.w, target.h, getattr(target, "shape", "rect"))
+    return [start] + points[1:-1] + [end]
+
+
+def _midpoint(points):
+    """折れ線の長さの中央の点"""
+    lengths = [math.hypot(b[0] - a[0], b[1] - a[1]) for a, b in zip(points, points[1:])]
+    remaining = sum(lengths) / 2
+    for (a, b), length in zip(zip(points, points[1:]), lengths):
+        if remaining <= length and length:
+            return a[0] + (b[0] - a[0]) * remaining / length, a[1] + (b[1] - a[1]) * remaining / length
+        remaining -= length
+    return points[len(points) // 2]
+
+
+def _label_size(lines):
+    return max(text_width(line) for line in lines) + 8, len(lines) * LINE_HEIGHT + 4
+
+
+def _draw_edge_label(scene, point, lines):
+    w, h = _label_size(lines)
+    scene.rect(point[0] - w / 2, point[1] - h / 2, w, h, THEME["label_background"], THEME["label_background"])
+    scene.text(point[0], point[1], lines, THEME["text"])
+
+
+# ---- flowchart ----
+
+SHAPE_NAMES = {
+    "(((": "circle", "([": "stadium", "[[": "subroutine", "[(": "database", "((": "circle", "{{": "hexagon",
+    "[/": "parallelogram", "[\\": "parallelogram_alt", "(": "round", "[": "rect", "{": "diamond", ">": "asymmetric",
+}
+# [/ と [\ は閉じ括弧が逆向きなら台形
+TRAPEZOID_NAMES = {("[/", "\\]"): "trapezoid", ("[\\", "/]"): "trapezoid_alt"}
+FLOWCHART_DIRECTIVES_IGNORED = ("linkStyle", "click", "direction")
+
+
+def _parse_style(text):
+    style = {}
+    for part in text.split(","):
+        key, _, value = part.partition(":")
+        if key.strip() in ("fill", "stroke", "color") and value.strip():
+            style[key.strip()] = value.strip()
+    return style
+
+
+def _flowchart_scene(diagram):
+    header = diagram.header.split()
+    direction = header[1].upper() if len(header) > 1 else "TB"
+    if direction == "TD":
+        direction = "TB"
+    if direction not in ("TB", "BT", "LR", "RL"):
+        raise UnsupportedDiagramError(f"unsupported flowchart direction: {direction}")
+
+    definitions = {}
+    edges = []
+    parents = {}
+    class_defs = {}
+    node_classes = {}
+    node_styles = {}
+
+    def visit(container, chain):
+        for item in container.items:
+            if isinstance(item, Subgraph):
+                visit(item, chain + [item])
+            elif isinstance(item, Node):
+                if item.id not in definitions or item.opener is not None:
+                    definitions[item.id] = item
+                parents.setdefault(item.id, chain)
+                if item.css_class:
+                    node_classes.setdefault(item.id, []).append(item.css_class[3:])
+            elif isinstance(item, Edge):
+                edges.append(item)
+                for node_id in (item.source, item.target):
+                    parents.setdefault(node_id, chain)
+            elif isinstance(item, Raw):
+                words = item.text.split(None, 2)
+                if item.text.startswith("%%") or words[0] in FLOWCHART_DIRECTIVES_IGNORED:
+                    continue
+                if words[0] == "classDef" and len(words) == 3:
+                    class_defs[words[1]] = _parse_style(words[2])
+                elif words[0] == "class" and len(words) == 3:
+                    for node_id in words[1].split(","):
+                        node_classes.setdefault(node_id.strip(), []).append(words[2].strip())
+                elif words[0] == "style" and len(words) == 3:
+                    node_styles[words[1]] = _parse_style(words[2])
+                else:
+                    raise UnsupportedDiagramError(f"unsupported flowchart statement: {item.text}")
+
+    visit(diagram.root, [])
+    # エッジで先に参照されてから subgraph の中で定義されたノードは、定義した subgraph に属する
+    for _, item in diagram.walk():
+        if isinstance(item, Subgraph):
+            for child in item.items:
+                if isinstance(child, Node):
+                    parents[child.id] = _subgraph_chain(diagram, item)
+
+    node_ids = list(dict.fromkeys(list(parents)))
+    layout_nodes = []
+    for node_id in node_ids:
+        node = definitions.get(node_id)
+        shape = "rect"
+        if node is not None and node.opener:
+            shape = TRAPEZOID_NAMES.get((node.opener, node.closer)) or SHAPE_NAMES.get(node.opener, "rect")
+        lines = label_lines(node.label) if node is not None and node.opener else [node_id]
+        w = max(text_width(line) for line in lines) + NODE_PADDING_X * 2
+        h = len(lines) * LINE_HEIGHT + NODE_PADDING_Y * 2
+        if shape == "diamond":
+            w, h = w * 1.4 + 10, h * 1.4 + 10
+        elif shape == "hexagon":
+            w += h / 2
+        elif shape == "circle":
+            w = h = max(w, h)
+        elif shape == "database":
+            h += 12
+        elif shape in ("parallelogram", "parallelogram_alt", "trapezoid", "trapezoid_alt", "asymmetric"):
+            w += h / 2
+        chain = parents.get(node_id) or []
+        layout_node = LayoutNode(node_id, w, h, group=chain[0].id if chain else None)
+        layout_node.shape = shape
+        layout_node.lines = lines
+        style = {}
+        for css_class in ["default"] + node_classes.get(node_id, []):
+            style.update(class_defs.get(css_class, {}))
+        style.update(node_styles.get(node_id, {}))
+        layout_node.style = style
+        layout_nodes.append(layout_node)
+
+    edge_labels = [label_lines(edge.label) if edge.label else None for edge in edges]
+    placed, routes, label_points, width, height = layered_layout(
+        layout_nodes, [(edge.source, edge.target) for edge in edges], direction,
+        label_sizes=[_label_size(lines) if lines else None for lines in edge_labels]
+    )
+
+    scene = Scene()
+    offset_x = offset_y = MARGIN
+    subgraphs = [item for _, item in diagram.walk() if isinstance(item, Subgraph)]
+    depth_of = {subgraph.id: len(_subgraph_chain(diagram, subgraph)) for subgraph in subgraphs}
+    boxes = []
+    for subgraph in subgraphs:
+        members = [placed[node_id] for node_id, chain in parents.items() if any(s is subgraph for s in chain)]
+        if not members:
+            continue
+        nesting = max([len(parents[m.id]) for m in members]) - depth_of[subgraph.id] + 1
+        pad = CLUSTER_PADDING * nesting
+        left = min(m.x - m.w / 2 for m in members) - pad
+        right = max(m.x + m.w / 2 for m in members) + pad
+        top = min(m.y - m.h / 2 for m in members) - pad - CLUSTER_TITLE * nesting
+        bottom = max(m.y + m.h / 2 for m in members) + pad
+        boxes.append((depth_of[subgraph.id], subgraph, left, top, right, bottom))
+    # 枠が左上・上にはみ出す分だけ全体をずらす
+    if boxes:
+        offset_x += max(0.0, -min(box[2] for box in boxes))
+        offset_y += max(0.0, -min(box[3] for box in boxes))
+        width = max(width, max(box[4] for box in boxes))
+        height = max(height, max(box[5] for box in boxes))
+
+    def shift(point):
+        return point[0] + offset_x, point[1] + offset_y
+
+    for _, subgraph, left, top, right, bottom in sorted(boxes, key=lambda box: box[0]):
+        x, y = shift((left, top))
+        scene.rect(x, y, right - left, bottom - top, THEME["cluster_fill"], THEME["cluster_stroke"])
+        title = _subgraph_title(subgraph)
+        scene.text(x + (right - left) / 2, y + CLUSTER_TITLE / 2 + 2, label_lines(title), THEME["text"])
+
+    for node in layout_nodes:
+        x, y = shift((node.x, node.y))
+        _draw_flowchart_node(scene, node, x, y)
+
+    for edge, points, lines, label_point in zip(edges, routes, edge_labels, label_points):
+        source, target = placed[edge.source], placed[edge.target]
+        points = [shift(point) for point in points]
+        if edge.source != edge.target:
+            points = _route_edge(points, source, target)
+        dotted = "." in edge.arrow
+        thick = "=" in edge.arrow
+        arrow = edge.arrow.endswith(">")
+        scene.polyline(points, THEME["edge"], dash=dotted, stroke_width=2.5 if thick else 1.2, arrow=arrow)
+        if lines:
+            _draw_edge_label(scene, shift(label_point) if label_point else _midpoint(points), lines)
+
+    scene.width = width + offset_x + MARGIN
+    scene.height = height + offset_y + MARGIN
+    return scene
+
+
+def _subgraph_chain(diagram, target):
+    def search(container, chain):
+        for item in container.items:
+            if isinstance(item, Subgraph):
+                if item is target:
+                    return chain + [item]
+                found = search(item, chain + [item])
+                if found:
+                    return found
+        return None
+    return search(diagram.root, []) or [target]
+
+
+def _subgraph_title(subgraph):
+    rest = subgraph.line[len("subgraph"):].strip()
+    title = re.match(r'^[^\s\[]+\s*\[(.*)\]$', rest)
+    return title.group(1) if title else rest
+
+
+def _draw_flowchart_node(scene, node, x, y):
+    fill = node.style.get("fill", THEME["node_fill"])
+    stroke = node.style.get("stroke", THEME["node_stroke"])
+    color = node.style.get("color", THEME["text"])
+    w, h = node.w, node.h
+    left, top = x - w / 2, y - h / 2
+    shape = node.shape
+    if shape == "round":
+        scene.rect(left, top, w, h, fill, stroke, radius=8)
+    elif shape == "stadium":
+        scene.rect(left, top, w, h, fill, stroke, radius=h / 2)
+    elif shape == "circle":
+        scene.ellipse(x, y, w / 2, h / 2, fill, stroke)
+    elif shape == "diamond":
+        scene.polygon([(x, top), (left + w, y), (x, top + h), (left, y)], fill, stroke)
+    elif shape == "hexagon":
+        inset = h / 4
+        scene.polygon([(left + inset, top), (left + w - inset, top), (left + w, y), (left + w - inset, top + h),
+                       (left + inset, top + h), (left, y)], fill, stroke)
+    elif shape == "parallelogram":
+        inset = h / 4
+        scene.polygon([(left + inset, top), (left + w, top), (left + w - inset, top + h), (left, top + h)], fill, stroke)
+    elif shape == "parallelogram_alt":
+        inset = h / 4
+        scene.polygon([(left, top), (left + w - inset, top), (left + w, top + h), (left + inset, top + h)], fill, stroke)
+    elif shape == "trapezoid":
+        inset = h / 4
+        scene.polygon([(left + inset, top), (left + w - inset, top), (left + w, top + h), (left, top + h)], fill, stroke)
+    elif shape == "trapezoid_alt":
+        inset = h / 4
+        scene.polygon([(left, top), (left + w, top), (left + w - inset, top + h), (left + inset, top + h)], fill, stroke)
+    elif shape == "asymmetric":
+        scene.polygon([(left, top), (left + w, top), (left + w, top + h), (left, top + h), (left + h / 4, y)], fill, stroke)
+    elif shape == "database":
+        scene.cylinder(left, top, w, h, fill, stroke)
+    elif shape == "subroutine":
+        scene.rect(left, top, w, h, fill, stroke)
+        scene.polyline([(left + 6, top), (left + 6, top + h)], stroke)
+        scene.polyline([(left + w - 6, top), (left + w - 6, top + h)], stroke)
+    else:
+        scene.rect(left, top, w, h, fill, stroke)
+    scene.text(x, y + (4 if shape == "database" else 0), node.lines, color)
+
+
+# ---- erDiagram ----
+
+def _entity_rows(entity):
+    """カラムを (型, 名前, キー, コメント) の行にする"""
+    rows = []
+    for attribute in entity.attributes:
+        comment = ""
+        quoted = re.search(r'"([^"]*)"\s*$', attribute)
+        if quoted:
+            comment = quoted.group(1)
+            attribute = attribute[:quoted.start()].strip()
+        words = attribute.split()
+        if len(words) < 2:
+            raise UnsupportedDiagramError(f"unsupported attribute: {attribute}")
+        rows.append((words[0], words[1], " ".join(words[2:]), comment))
+    return rows
+
+
+def _er_scene(diagram):
+    entities = diagram.entities()
+    relationships = [item for item in diagram.items if isinstance(item, Relationship)]
+    for item in diagram.items:
+        if isinstance(item, Raw) and not item.text.startswith("%%"):
+            if item.text.split()[0] == "direction":
+                continue
+            raise UnsupportedDiagramError(f"unsupported erDiagram statement: {item.text}")
+
+    layout_nodes = []
+    for name in diagram.node_ids():
+        entity = entities.get(name) or Entity(name)
+        rows = _entity_rows(entity)
+        columns = [max((text_width(row[i]) for row in rows), default=0) for i in range(4)]
+        widths = [width + ER_CELL_PADDING * 2 if width else 0 for width in columns]
+        w = max(text_width(name) + NODE_PADDING_X * 2, sum(widths), 80)
+        h = ER_ROW_HEIGHT + 8 + len(rows) * ER_ROW_HEIGHT
+        node = LayoutNode(name, w, h)
+        node.rows = rows
+        node.column_widths = widths
+        layout_nodes.append(node)
+
+    direction = "TB"
+    relationship_labels = [label_lines(r.label) for r in relationships]
+    placed, routes, label_points, width, height = layered_layout(
+        layout_nodes, [(r.left, r.right) for r in relationships], direction,
+        label_sizes=[_label_size(lines) if any(lines) else None for lines in relationship_labels]
+    )
+    scene = Scene()
+
+    def shift(point):
+        return point[0] + MARGIN, point[1] + MARGIN
+
+    for node in layout_nodes:
+        x, y = shift((node.x - node.w / 2, node.y - node.h / 2))
+        header_height = ER_ROW_HEIGHT + 8
+        scene.rect(x, y, node.w, node.h, THEME["er_row"], THEME["node_stroke"])
+        scene.rect(x, y, node.w, header_height, THEME["er_header"], THEME["node_stroke"])
+        scene.text(x + node.w / 2, y + header_height / 2, [node.id], THEME["text"], bold=True)
+        extra = node.w - sum(node.column_widths)
+        for index, row in enumerate(node.rows):
+            top = y + header_height + index * ER_ROW_HEIGHT
+            if index % 2:
+                scene.rect(x + 1, top, node.w - 2, min(ER_ROW_HEIGHT, y + node.h - 1 - top), THEME["er_row_alt"], THEME["er_row_alt"])
+            cursor = x
+            for column, (value, column_width) in enumerate(zip(row, node.column_widths)):
+                if column_width:
+                    scene.text(cursor + ER_CELL_PADDING, top + ER_ROW_HEIGHT / 2, [value], THEME["text"], anchor="start",
+                               bold=column == 2, size=FONT_SIZE - 1)
+                    cursor += column_width + (extra if column == 1 else 0)
+
+    for relationship, points, label, label_point in zip(relationships, routes, relationship_labels, label_points):
+        source, target = placed[relationship.left], placed[relationship.right]
+        points = [shift(point) for point in points]
+        if relationship.left != relationship.right:
+            points = _route_edge(points, source, target)
+        scene.polyline(points, THEME["edge"], dash=".." in relationship.cardinality, stroke_width=1.2)
+        left_marker = ER_MARKERS.get(relationship.cardinality[:2], "")
+        right_marker = ER_MARKERS.get(relationship.cardinality[-2:], "")
+        for marker, end, toward in ((left_marker, points[0], points[1]), (right_marker, points[-1], points[-2])):
+            if marker:
+                scene.text(*_marker_position(end, toward), [marker], THEME["text"], size=FONT_SIZE - 2)
+        if any(label):
+            _draw_edge_label(scene, shift(label_point) if label_point else _midpoint(points), label)
+
+    scene.width = width + MARGIN * 2
+    scene.height = height + MARGIN * 2
+    return scene
+
+
+def _marker_position(end, toward, distance=14, side=12):
+    dx, dy = toward[0] - end[0], toward[1] - end[1]
+    length = math.hypot(dx, dy) or 1.0
+    ux, uy = dx / length, dy / length
+    return end[0] + ux * distance - uy * side, end[1] + uy * distance + ux * side
+
+
+# ---- 公開関数 ----
+
+def build_scene(mermaid_script):
+    """
+    Mermaid スクリプトを描画命令の列にする。
+
+    Raises:
+        UnsupportedDiagramError: 対応していないダイアグラム・記法の場合
+    """
+    try:
+        diagram = parse_mermaid_diagram(mermaid_script)
+    except ValueError as e:
+        raise UnsupportedDiagramError(str(e)) from e
+    if isinstance(diagram, FlowchartDiagram):
+        return _flowchart_scene(diagram)
+    if isinstance(diagram, ERDiagram):
+        return _er_scene(diagram)
+    raise UnsupportedDiagramError(f"unsupported diagram: {type(diagram).__name__}")
+
+
+def render_svg(mermaid_script):
+    """Mermaid スクリプトを SVG の文字列にする"""
+    return build_scene(mermaid_script).to_svg()
+
+
+def render_to_file(mermaid_script, output_file, width=2048, height=2048):
+    """
+    Mermaid スクリプトを output_file（.svg または .png）に描画する。
+
+    PNG は小さな図ほど拡大して描く（最大 2 倍。width × height を超えない範囲）。
+    一時ファイルに書いてから置き換えるので、途中で失敗しても壊れたファイルは残らない。
+
+    Raises:
+        UnsupportedDiagramError: 対応していないダイアグラム・記法の場合
+    """
+    scene = build_scene(mermaid_script)
+    tmp_file = f"{output_file}.tmp"
+    if output_file.endswith(".svg"):
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(scene.to_svg())
+    else:
+        scale = max(1.0, min(2.0, width / max(scene.width, 1), height / max(scene.height, 1)))
+        scene.to_image(scale).save(tmp_file, format="PNG", optimize=False)
+    os.replace(tmp_file, output_file)
+    return output_file
+
+
+def get_render_engine():
+    engine = os.getenv("MERMAID_RENDER_ENGINE", "auto").strip().lower()
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown MERMAID_RENDER_ENGINE: {engine} (expected one of {', '.join(ENGINES)})")
+    return engine
+
+
+def try_render_file(mmd_file, output_file, width=2048, height=2048):
+    """
+    MERMAID_RENDER_ENGINE に従い、対応するダイアグラムであればこのレンダラーで描画する。
+
+    Returns:
+        bool: 描画した場合は True。mmdc で描画すべき場合（エンジンが mmdc、auto で mmdc がある、
+            .svg・.png 以外の出力、対応していないダイアグラム）は False
+    """
+    engine = get_render_engine()
+    if engine == "mmdc" or (engine == "auto" and shutil.which("mmdc") is not None):
+        return False
+    if os.path.splitext(output_file)[1].lower() not in (".svg", ".png"):
+        return False
+    with open(mmd_file, 'r', encoding='utf-8') as f:
+        mermaid_script = f.read()
+    try:
+        render_to_file(mermaid_script, output_file, width, height)
+    except UnsupportedDiagramError:
+        return False
+    return True
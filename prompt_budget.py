@@ -0,0 +1,306 @@
+"""
+システムプロンプトのトークン予算（コンパクトプロンプトモード）
+
+CodeAgent は LLM を呼び出すたびにシステムプロンプト（smolagents の標準テンプレート、約 9 KB）と
+すべてのツールの説明を送り直す。500 のアプリでは SQLcl MCP のツールのスキーマも毎回含まれる。
+このモジュールは次の機能でステップごとのプロンプトを小さくする。
+
+- measure_prompt_sections(agent): システムプロンプトをテンプレート部分とツールごとの説明に分けてトークン数を概算する
+- agent_prompt_templates(tools): AGENT_PROMPT_MODE=compact の場合に、例題を 1 つに絞ったコンパクトなテンプレートと、
+  ツールの説明を短くした版（例のコード・Raises などを除き、長い説明は文の区切りで切り詰める）を使う
+- ToolSelector: 依頼に関係しないツールのグループ（DB に関係しない依頼での SQLcl MCP のツールなど）を
+  その実行のシステムプロンプトから省く
+- with_prompt_cache(model): プロンプトキャッシュを明示的に指定できるプロバイダー（Anthropic、Gemini）では、
+  system メッセージに cache_control を付ける
+
+プロバイダー側の暗黙のプレフィックスキャッシュ（Grok、Gemini）は先頭が同じリクエストにしか効かないため、
+コンパクトなテンプレートでは依頼ごとに変わりうるツールの説明を末尾に置き、その前までを全セッションで共通にしている。
+
+環境変数:
+    AGENT_PROMPT_MODE: full（既定。smolagents の標準テンプレート）/ compact
+    LLM_PROMPT_CACHE: 0 で cache_control を付けない（既定 1）
+"""
+
+import dataclasses
+import importlib.resources
+import os
+import re
+import weakref
+
+import yaml
+
+from agent_memory import estimate_tokens
+
+PROMPT_MODES = ("full", "compact")
+
+# cache_control を付けるプロバイダー（model_id の "/" より前）と、キャッシュできる最小のトークン数
+PROMPT_CACHE_MIN_TOKENS = {"anthropic": 1024, "gemini": 4096, "vertex_ai": 4096}
+
+# smolagents のツールの型名から、プロンプトに書く Python の型名への対応
+_PYTHON_TYPES = {
+    "string": "str", "integer": "int", "number": "float", "boolean": "bool",
+    "object": "dict", "array": "list", "any": "Any", "null": "None",
+}
+
+# ツールの説明から除く節（例のコードや例外の一覧は、シグネチャと短い説明があれば LLM には不要）
+_OMITTED_SECTIONS = re.compile(r'\n\s*(Example usage|Examples?|Raises|例)\s*[:：].*', re.DOTALL)
+_SENTENCE_END = re.compile(r'(。|\. |\.$)')
+
+COMPACT_SYSTEM_PROMPT = """You are an expert assistant who solves tasks by writing Python code that calls the tools listed below.
+Work in a cycle of 'Thought:', code and 'Observation:'. In each step, explain your reasoning in a 'Thought:' sequence, then write code opened with '{{code_block_opening_tag}}' and closed with '{{code_block_closing_tag}}'.
+Use print() to keep information for the next step: printed output appears in the 'Observation:' field. Return the result with the `final_answer` tool.
+
+Example:
+Task: "What is the result of the following operation: 5 + 3 + 1294.678?"
+
+Thought: I will use Python code to compute the result of the operation and then return the final answer using the `final_answer` tool.
+{{code_block_opening_tag}}
+result = 5 + 3 + 1294.678
+final_answer(result)
+{{code_block_closing_tag}}
+
+Rules:
+1. Always provide a 'Thought:' sequence and a '{{code_block_opening_tag}}' sequence ending with '{{code_block_closing_tag}}'.
+2. Use only variables that you have defined. Pass tool arguments directly, as in 'tool(query="...")', not as a dict.
+3. Do not chain a tool call whose output format is unpredictable with another call in the same code block: print the output and use it in the next step.
+4. Never re-do a tool call with the same parameters, and don't name variables after tools.
+5. You can only import from these modules: {{authorized_imports}}
+6. The state (variables and imports) persists between steps.
+7. Don't give up: you are in charge of solving the task.
+{%- if custom_instructions %}
+{{custom_instructions}}
+{%- endif %}
+{%- if managed_agents and managed_agents.values() | list %}
+
+You can also give tasks to team members by calling them like tools, with a detailed 'task' argument and optional 'additional_args':
+{{code_block_opening_tag}}
+{%- for agent in managed_agents.values() %}
+def {{ agent.name }}(task: str, additional_args: dict[str, Any]) -> str:
+    \"\"\"{{ agent.description }}\"\"\"
+{%- endfor %}
+{{code_block_closing_tag}}
+{%- endif %}
+
+On top of Python computations, you only have access to these tools, which behave like regular Python functions:
+{{code_block_opening_tag}}
+{%- for tool in tools.values() %}
+{{ tool.compact_prompt if tool.compact_prompt is defined else tool.to_code_prompt() }}
+{%- endfor %}
+{{code_block_closing_tag}}
+
+Now Begin!"""
+
+
+def get_prompt_mode():
+    """環境変数 AGENT_PROMPT_MODE のプロンプトモードを返す"""
+    mode = os.getenv("AGENT_PROMPT_MODE", "full")
+    if mode not in PROMPT_MODES:
+        raise ValueError(f"Unknown prompt mode: {mode} (expected one of {', '.join(PROMPT_MODES)})")
+    return mode
+
+
+def _shorten(text, max_chars):
+    """空白をまとめ、max_chars を超える場合は文の区切り（なければ文字数）で切り詰める"""
+    text = re.sub(r'\s+', ' ', text or "").strip()
+    if len(text) <= max_chars:
+        return text
+    ends = [match.end() for match in _SENTENCE_END.finditer(text, 0, max_chars)]
+    return text[:ends[-1]].strip() if ends else text[:max_chars].rstrip() + "…"
+
+
+def _python_type(schema):
+    type_name = schema.get("type", "any")
+    if isinstance(type_name, list):
+        return " | ".join(_PYTHON_TYPES.get(name, name) for name in type_name)
+    python_type = _PYTHON_TYPES.get(type_name, type_name)
+    return f"{python_type} | None" if schema.get("nullable") else python_type
+
+
+def compact_tool_prompt(tool, max_description_chars=300, max_arg_chars=600):
+    """
+    ツールの説明を短くした関数定義の形のテキストを返す（tool.to_code_prompt() のコンパクト版）。
+
+    Args:
+        tool: smolagents のツール
+        max_description_chars: ツールの説明の最大文字数
+        max_arg_chars: 引数ごとの説明の最大文字数（操作の一覧のように引数の説明が仕様そのものの場合があるので長めにする）
+    """
+    signature = ", ".join(f"{name}: {_python_type(schema)}" for name, schema in tool.inputs.items())
+    description = _shorten(_OMITTED_SECTIONS.sub("", tool.description or ""), max_description_chars)
+    lines = [f"def {tool.name}({signature}) -> {_PYTHON_TYPES.get(tool.output_type, tool.output_type)}:", f'    """{description}']
+    for name, schema in tool.inputs.items():
+        arg_description = _shorten(schema.get("description", ""), max_arg_chars)
+        if arg_description:
+            lines.append(f"    {name}: {arg_description}")
+    lines[-1] += '"""'
+    return "\n".join(lines)
+
+
+def compact_tools(tools, max_description_chars=300, max_arg_chars=600):
+    """各ツールにコンパクト版の説明（compact_prompt 属性）を付ける（何度呼んでもよい）"""
+    for tool in tools:
+        if getattr(tool, "compact_prompt", None) is None:
+            tool.compact_prompt = compact_tool_prompt(tool, max_description_chars, max_arg_chars)
+    return tools
+
+
+def agent_prompt_templates(tools, mode=None):
+    """
+    CodeAgent の prompt_templates 引数に渡すテンプレートを返す。
+
+    Args:
+        tools: エージェントに渡すツール（compact モードではコンパクト版の説明を付ける）
+        mode: full または compact（省略時は AGENT_PROMPT_MODE）
+
+    Returns:
+        full モードでは None（smolagents の標準テンプレート）、compact モードではシステムプロンプトだけを
+        差し替えたテンプレート
+    """
+    mode = mode or get_prompt_mode()
+    if mode == "full":
+        return None
+    compact_tools(tools)
+    templates = yaml.safe_load(
+        importlib.resources.files("smolagents.prompts").joinpath("code_agent.yaml").read_text()
+    )
+    templates["system_prompt"] = COMPACT_SYSTEM_PROMPT
+    return templates
+
+
+def measure_prompt_sections(agent):
+    """
+    エージェントのシステムプロンプトのトークン数を部分ごとに概算する。
+
+    Returns:
+        dict: {"total": 全体, "template": ツールの説明以外, "tools": {ツール名: トークン数}}
+    """
+    system_prompt = agent.system_prompt
+    tools = {}
+    for name, tool in agent.tools.items():
+        compact_prompt = getattr(tool, "compact_prompt", None)
+        text = compact_prompt if compact_prompt and compact_prompt in system_prompt else tool.to_code_prompt()
+        tools[name] = estimate_tokens(text)
+    total = estimate_tokens(system_prompt)
+    return {"total": total, "template": max(0, total - sum(tools.values())), "tools": tools}
+
+
+def format_prompt_budget(sections):
+    """measure_prompt_sections の結果を 1 行の文字列にする（ツールはトークン数の多い順）"""
+    tools = sorted(sections["tools"].items(), key=lambda item: item[1], reverse=True)
+    return (f"合計 {sections['total']} トークン（テンプレート {sections['template']}、ツール: "
+            + ", ".join(f"{name} {tokens}" for name, tokens in tools) + "）")
+
+
+class ToolSelector:
+    """
+    依頼に関係しないツールのグループを、その実行のエージェントから外す（システムプロンプトにも含めない）。
+
+    グループは、依頼文がキーワードに一致するか、同じセッションの過去のステップでグループのツールを
+    使っている場合（続けて同じ DB について依頼している場合など）に含める。
+
+    Args:
+        keywords: {グループ名: 依頼文に一致させる正規表現}
+    """
+
+    def __init__(self, keywords):
+        self.keywords = {group: re.compile(pattern, re.IGNORECASE) for group, pattern in keywords.items()}
+        self._agents = weakref.WeakKeyDictionary()
+
+    def register(self, agent, **groups):
+        """
+        エージェントのツールをグループに分けて登録する。
+
+        Args:
+            agent: CodeAgent
+            **groups: グループ名ごとのツールのリスト（例: database=[...]）
+        """
+        names = {group: {tool.name for tool in tools} for group, tools in groups.items()}
+        self._agents[agent] = (dict(agent.tools), names)
+        return agent
+
+    def _used_in_memory(self, agent, tool_names):
+        for step in agent.memory.steps:
+            output = getattr(step, "model_output", None) or ""
+            if isinstance(output, str) and any(f"{name}(" in output for name in tool_names):
+                return True
+        return False
+
+    def select(self, agent, text):
+        """
+        依頼文 text に関係するツールだけをエージェントに設定する。
+
+        Returns:
+            list: 外したグループ名
+        """
+        registered = self._agents.get(agent)
+        if registered is None:
+            return []
+        all_tools, groups = registered
+        excluded_groups = [
+            group for group, tool_names in groups.items()
+            if not self.keywords[group].search(text) and not self._used_in_memory(agent, tool_names)
+        ]
+        excluded = set().union(*(groups[group] for group in excluded_groups)) if excluded_groups else set()
+        agent.tools = {name: tool for name, tool in all_tools.items() if name not in excluded}
+        return excluded_groups
+
+
+def _mark_cache_control(message):
+    """system メッセージの最後のテキストに cache_control を付けたコピーを返す"""
+    content = message.get("content") if isinstance(message, dict) else message.content
+    if not isinstance(content, list) or not content:
+        return message
+    content = [dict(part) for part in content]
+    content[-1]["cache_control"] = {"type": "ephemeral"}
+    if isinstance(message, dict):
+        return {**message, "content": content}
+    return dataclasses.replace(message, content=content)
+
+
+class PromptCachedModel:
+    """
+    system メッセージにプロンプトキャッシュの指定（cache_control）を付けるモデルラッパー。
+    プロバイダーの最小トークン数に満たないシステムプロンプトには付けない。
+    generate / generate_stream 以外の属性はラップしたモデルに委譲する。
+    """
+
+    def __init__(self, model, min_tokens):
+        self.model = model
+        self.min_tokens = min_tokens
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __call__(self, *args, **kwargs):
+        return self.generate(*args, **kwargs)
+
+    def _mark(self, messages):
+        if not messages:
+            return messages
+        first = messages[0]
+        role = first.get("role") if isinstance(first, dict) else first.role
+        if getattr(role, "value", role) != "system":
+            return messages
+        content = first.get("content") if isinstance(first, dict) else first.content
+        text = "".join(part.get("text", "") for part in content if isinstance(part, dict)) if isinstance(content, list) else ""
+        if estimate_tokens(text) < self.min_tokens:
+            return messages
+        return [_mark_cache_control(first), *messages[1:]]
+
+    def generate(self, messages, **kwargs):
+        return self.model.generate(self._mark(messages), **kwargs)
+
+    def generate_stream(self, messages, **kwargs):
+        yield from self.model.generate_stream(self._mark(messages), **kwargs)
+
+
+def with_prompt_cache(model):
+    """
+    プロンプトキャッシュを明示的に指定できるプロバイダーのモデルなら PromptCachedModel で包んで返す
+    （それ以外のプロバイダー、または LLM_PROMPT_CACHE=0 の場合は model をそのまま返す）。
+    """
+    if os.getenv("LLM_PROMPT_CACHE", "1") == "0":
+        return model
+    provider = str(getattr(model, "model_id", "") or "").split("/", 1)[0]
+    min_tokens = PROMPT_CACHE_MIN_TOKENS.get(provider)
+    return PromptCachedModel(model, min_tokens) if min_tokens is not None else model
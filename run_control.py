@@ -0,0 +1,170 @@
+"""
+エージェント実行の停止（キャンセル）
+
+Gradio の「停止」ボタンやブラウザの切断で実行を取り消したときに、エージェントのスレッド・
+LLM のストリーミング・ツールが起動した子プロセスをまとめて止めるための仕組み。
+
+- CancellationToken: 1 回の実行の停止要求。cancel() で登録済みのコールバック（子プロセスの kill、
+  agent.interrupt() など）を呼び出す
+- current_token(): 実行中のトークン（ツールの中から参照する）。contextvars で持つので、
+  contextvars.copy_context() で起動したスレッドにも引き継がれる
+- run_child_process(): subprocess.run の代わりに使う。停止要求があると子プロセスを kill する
+
+停止要求を受けた処理は RunCancelled を送出する。
+"""
+
+import contextlib
+import contextvars
+import subprocess
+import threading
+
+_current_token = contextvars.ContextVar("run_control_token", default=None)
+
+
+class RunCancelled(Exception):
+    """実行が停止された"""
+
+    def __init__(self, message="Run was cancelled"):
+        super().__init__(message)
+
+
+class CancellationToken:
+    """
+    1 回の実行の停止要求と、実行の終了を管理する。
+
+    Args:
+        session_id: 実行したセッション（ツールが成果物をセッションに結び付けるために参照する）
+    """
+
+    def __init__(self, session_id=None):
+        self.session_id = session_id
+        self._lock = threading.Lock()
+        self._cancelled = False
+        self._started = False
+        self._finished = False
+        self._callbacks = []
+        self._finish_callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    @property
+    def finished(self):
+        """実行が始まっていない、または終了した場合は True"""
+        return not self._started or self._finished
+
+    def cancel(self):
+        """停止を要求し、登録済みのコールバックを呼び出す（2 回目以降は何もしない）"""
+        with self._lock:
+            if self._cancelled:
+                return
+            self._cancelled = True
+            callbacks = list(self._callbacks)
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Cancel callback failed: {type(e).__name__}: {e}")
+
+    def on_cancel(self, callback):
+        """
+        停止要求時に呼ぶコールバックを登録する。すでに停止要求がある場合はすぐに呼ぶ。
+
+        Returns:
+            callable: 登録を解除する関数
+        """
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def raise_if_cancelled(self):
+        if self._cancelled:
+            raise RunCancelled()
+
+    def begin(self):
+        """実行の開始を記録する"""
+        with self._lock:
+            self._started = True
+
+    def finish(self):
+        """実行の終了を記録し、when_finished で登録されたコールバックを呼び出す"""
+        with self._lock:
+            self._finished = True
+            callbacks = list(self._finish_callbacks)
+            self._finish_callbacks.clear()
+            self._callbacks.clear()
+        for callback in callbacks:
+            callback()
+
+    def when_finished(self, callback):
+        """実行が終了したら callback を呼ぶ（実行していない・終了済みならすぐに呼ぶ）"""
+        with self._lock:
+            if not self.finished:
+                self._finish_callbacks.append(callback)
+                return
+        callback()
+
+
+def current_token():
+    """現在のコンテキストで実行中のトークンを返す（なければ None）"""
+    return _current_token.get()
+
+
+@contextlib.contextmanager
+def using_token(token):
+    """with ブロック内で current_token() が token を返すようにする"""
+    reset_token = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset_token)
+
+
+def raise_if_cancelled():
+    """現在の実行に停止要求があれば RunCancelled を送出する"""
+    token = current_token()
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def run_child_process(args, timeout=None, **kwargs):
+    """
+    子プロセスを実行して終了を待つ（subprocess.run と同じ引数・戻り値）。
+    実行中に停止要求があった場合は子プロセスを kill する。
+
+    Returns:
+        subprocess.CompletedProcess
+
+    Raises:
+        RunCancelled: 停止要求によって子プロセスを kill した場合
+        subprocess.TimeoutExpired: timeout を超えた場合（子プロセスは kill 済み）
+    """
+    raise_if_cancelled()
+    capture_output = kwargs.pop("capture_output", False)
+    if capture_output:
+        kwargs["stdout"] = subprocess.PIPE
+        kwargs["stderr"] = subprocess.PIPE
+
+    token = current_token()
+    with subprocess.Popen(args, **kwargs) as process:
+        unregister = token.on_cancel(process.kill) if token is not None else (lambda: None)
+        try:
+            stdout, stderr = process.communicate(timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        finally:
+            unregister()
+    raise_if_cancelled()
+    return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
@@ -0,0 +1,293 @@
+"""
+スキーマカタログキャッシュ
+
+MCP 連携アプリでは、DB に関する依頼のたびにエージェントが SQLcl のツールでデータディクショナリを
+問い合わせ、表・カラム・制約を 1 つずつ調べ直す。このモジュールはスキーマ全体のメタデータを
+少数の集合指向の問い合わせでまとめて取得し、SQLite に保存する。
+
+- 取得: USER_TAB_COLUMNS（カラム）と USER_CONSTRAINTS / USER_CONS_COLUMNS（主キー・一意キー・外部キー）の
+  2 つの問い合わせでスキーマ全体を読み込む
+- 鮮度: TTL 内はキャッシュをそのまま使う（DB への問い合わせなし）。TTL を過ぎたら USER_OBJECTS の
+  最終 DDL 時刻と表の数を 1 回だけ問い合わせ、変わっていなければ読み込み直さない
+- 接続（SQLcl の connect ツールの引数）ごとに別のカタログとして保存する
+
+同じスキーマの 2 回目以降の図は、DB への問い合わせが 0 回（TTL 経過後は 1 回）で済む。
+
+環境変数:
+    SCHEMA_CATALOG_DB   保存先（既定 cache/schema_catalog.sqlite）
+    SCHEMA_CATALOG_TTL  問い合わせなしで使う秒数（既定 3600）
+"""
+
+import copy
+import csv
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from ddl_to_er import Column, ForeignKey, Table, normalize_data_type, infer_foreign_keys, tables_to_mermaid_er
+
+COLUMNS_QUERY = """
+SELECT c.TABLE_NAME, c.COLUMN_NAME, c.DATA_TYPE, c.CHAR_LENGTH, c.DATA_PRECISION, c.DATA_SCALE, c.NULLABLE, c.COLUMN_ID
+FROM USER_TAB_COLUMNS c JOIN USER_TABLES t ON t.TABLE_NAME = c.TABLE_NAME
+ORDER BY c.TABLE_NAME, c.COLUMN_ID
+"""
+CONSTRAINTS_QUERY = """
+SELECT c.TABLE_NAME, c.CONSTRAINT_NAME, c.CONSTRAINT_TYPE, cc.COLUMN_NAME, cc.POSITION, r.TABLE_NAME AS R_TABLE_NAME
+FROM USER_CONSTRAINTS c
+JOIN USER_CONS_COLUMNS cc ON cc.CONSTRAINT_NAME = c.CONSTRAINT_NAME AND cc.TABLE_NAME = c.TABLE_NAME
+LEFT JOIN USER_CONSTRAINTS r ON r.CONSTRAINT_NAME = c.R_CONSTRAINT_NAME
+WHERE c.CONSTRAINT_TYPE IN ('P', 'U', 'R')
+ORDER BY c.TABLE_NAME, c.CONSTRAINT_NAME, cc.POSITION
+"""
+FRESHNESS_QUERY = """
+SELECT TO_CHAR(MAX(LAST_DDL_TIME), 'YYYY-MM-DD HH24:MI:SS') AS LAST_DDL_TIME, COUNT(*) AS TABLE_COUNT
+FROM USER_OBJECTS WHERE OBJECT_TYPE = 'TABLE'
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalogs (
+    schema_key TEXT PRIMARY KEY,
+    loaded_at REAL NOT NULL,
+    checked_at REAL NOT NULL,
+    last_ddl_time TEXT,
+    table_count INTEGER
+);
+CREATE TABLE IF NOT EXISTS catalog_columns (
+    schema_key TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    data_type TEXT NOT NULL,
+    nullable INTEGER NOT NULL,
+    column_id INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_catalog_columns ON catalog_columns (schema_key, table_name, column_id);
+CREATE TABLE IF NOT EXISTS catalog_constraints (
+    schema_key TEXT NOT NULL,
+    table_name TEXT NOT NULL,
+    constraint_name TEXT NOT NULL,
+    constraint_type TEXT NOT NULL,
+    column_name TEXT NOT NULL,
+    position INTEGER,
+    r_table_name TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_catalog_constraints ON catalog_constraints (schema_key, table_name);
+"""
+
+
+def parse_csv_result(text, required_column):
+    """
+    SQLcl の run-sql が返す CSV を辞書のリストにする。
+    required_column を含む行をヘッダーとみなし、それより前のメッセージ行は読み飛ばす。
+    """
+    lines = text.splitlines()
+    for index, line in enumerate(lines):
+        if required_column in line.upper():
+            rows = []
+            for row in csv.DictReader(io.StringIO("\n".join(lines[index:]))):
+                if None in row or any(value is None for value in row.values()):
+                    # 末尾の「n rows selected.」などの CSV ではない行
+                    continue
+                rows.append({key.strip().upper(): value for key, value in row.items()})
+            return rows
+    raise RuntimeError(f"Unexpected query result (no {required_column} column): {text[:300]}")
+
+
+def _data_type(row):
+    data_type = row["DATA_TYPE"]
+    if data_type in ("VARCHAR2", "NVARCHAR2", "CHAR", "NCHAR", "RAW") and row.get("CHAR_LENGTH") not in (None, "", "0"):
+        data_type = f"{data_type}({row['CHAR_LENGTH']})"
+    elif data_type == "NUMBER" and row.get("DATA_PRECISION"):
+        data_type = f"NUMBER({row['DATA_PRECISION']})"
+    return normalize_data_type(data_type)
+
+
+class SchemaCatalogCache:
+    """
+    スキーマのメタデータのキャッシュ。
+
+    Args:
+        run_sql: SQL を実行して CSV 文字列を返す関数（SQLcl の run-sql ツールなど）
+        db_file: SQLite ファイルのパス
+        ttl: DB に問い合わせずにキャッシュを使う秒数
+    """
+
+    def __init__(self, run_sql, db_file=os.path.join("cache", "schema_catalog.sqlite"), ttl=3600):
+        self.run_sql = run_sql
+        self.db_file = db_file
+        self.ttl = ttl
+        self.hits = 0
+        self.refreshes = 0
+        self.round_trips = 0
+        self._lock = threading.Lock()
+        self._tables = {}
+        directory = os.path.dirname(db_file)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as connection:
+            connection.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_file, timeout=30)
+
+    def _query(self, sql, required_column):
+        self.round_trips += 1
+        return parse_csv_result(str(self.run_sql(sql)), required_column)
+
+    def _freshness(self):
+        rows = self._query(FRESHNESS_QUERY, "TABLE_COUNT")
+        row = rows[0] if rows else {}
+        table_count = row.get("TABLE_COUNT")
+        return row.get("LAST_DDL_TIME") or None, int(table_count) if table_count else 0
+
+    def _load(self, schema_key):
+        last_ddl_time, table_count = self._freshness()
+        columns = self._query(COLUMNS_QUERY, "COLUMN_NAME")
+        constraints = self._query(CONSTRAINTS_QUERY, "CONSTRAINT_TYPE")
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute("DELETE FROM catalog_columns WHERE schema_key = ?", (schema_key,))
+            connection.execute("DELETE FROM catalog_constraints WHERE schema_key = ?", (schema_key,))
+            connection.executemany(
+                "INSERT INTO catalog_columns VALUES (?, ?, ?, ?, ?, ?)",
+                [(schema_key, row["TABLE_NAME"], row["COLUMN_NAME"], _data_type(row), int(row.get("NULLABLE") != "N"),
+                  int(row.get("COLUMN_ID") or 0)) for row in columns]
+            )
+            connection.executemany(
+                "INSERT INTO catalog_constraints VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(schema_key, row["TABLE_NAME"], row["CONSTRAINT_NAME"], row["CONSTRAINT_TYPE"], row["COLUMN_NAME"],
+                  int(row.get("POSITION") or 0), row.get("R_TABLE_NAME") or None) for row in constraints]
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO catalogs VALUES (?, ?, ?, ?, ?)",
+                (schema_key, now, now, last_ddl_time, table_count)
+            )
+        self.refreshes += 1
+        self._tables.pop(schema_key, None)
+
+    def _build_tables(self, schema_key):
+        tables = {}
+        with self._connect() as connection:
+            for table_name, column_name, data_type, nullable in connection.execute(
+                "SELECT table_name, column_name, data_type, nullable FROM catalog_columns "
+                "WHERE schema_key = ? ORDER BY table_name, column_id", (schema_key,)
+            ):
+                table = tables.setdefault(table_name, Table(table_name))
+                table.columns.append(Column(column_name, data_type, not_null=not nullable))
+
+            keys = {}
+            for table_name, constraint_name, constraint_type, column_name, r_table_name in connection.execute(
+                "SELECT table_name, constraint_name, constraint_type, column_name, r_table_name FROM catalog_constraints "
+                "WHERE schema_key = ? ORDER BY table_name, constraint_name, position", (schema_key,)
+            ):
+                key = keys.setdefault((table_name, constraint_name), (constraint_type, r_table_name, []))
+                key[2].append(column_name)
+
+        for (table_name, _), (constraint_type, r_table_name, column_names) in keys.items():
+            table = tables.get(table_name)
+            if table is None:
+                continue
+            if constraint_type == "P":
+                table.primary_key = column_names
+            elif constraint_type == "U":
+                table.unique_keys.append(column_names)
+            elif constraint_type == "R" and r_table_name:
+                table.foreign_keys.append(ForeignKey(column_names, r_table_name))
+        return tables
+
+    def get_tables(self, schema_key="default", refresh=False):
+        """
+        スキーマの表定義を返す。必要な場合だけ DB に問い合わせる。
+
+        Args:
+            schema_key: カタログを区別するキー（接続名など）
+            refresh: True の場合は鮮度に関係なく読み込み直す
+
+        Returns:
+            dict[str, Table]: 表名 → 表定義
+        """
+        with self._lock:
+            with self._connect() as connection:
+                catalog = connection.execute(
+                    "SELECT checked_at, last_ddl_time, table_count FROM catalogs WHERE schema_key = ?", (schema_key,)
+                ).fetchone()
+
+            if catalog is None or refresh:
+                self._load(schema_key)
+            elif time.time() - catalog[0] > self.ttl:
+                # TTL を過ぎたら DDL の時刻だけ確認し、変わっていればまとめて読み込み直す
+                if self._freshness() != (catalog[1], catalog[2]):
+                    self._load(schema_key)
+                else:
+                    with self._connect() as connection:
+                        connection.execute(
+                            "UPDATE catalogs SET checked_at = ? WHERE schema_key = ?", (time.time(), schema_key)
+                        )
+                    self.hits += 1
+            else:
+                self.hits += 1
+
+            if schema_key not in self._tables:
+                self._tables[schema_key] = self._build_tables(schema_key)
+            return self._tables[schema_key]
+
+    def invalidate(self, schema_key=None):
+        """カタログを破棄する（schema_key を省略した場合はすべて）"""
+        with self._lock:
+            with self._connect() as connection:
+                if schema_key is None:
+                    connection.execute("DELETE FROM catalogs")
+                else:
+                    connection.execute("DELETE FROM catalogs WHERE schema_key = ?", (schema_key,))
+            if schema_key is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(schema_key, None)
+
+    def describe(self, schema_key="default", table_names=None, output_format="mermaid", refresh=False):
+        """
+        カタログの内容をエージェント向けの文字列にする。
+
+        Args:
+            schema_key: カタログを区別するキー
+            table_names: 対象の表名のリスト（省略時はすべて。末尾の * は前方一致）
+            output_format: "mermaid"（ER 図の Mermaid スクリプト）または "tables"（表名とカラム数の一覧）
+            refresh: True の場合は読み込み直す
+
+        Returns:
+            str
+        """
+        tables = self.get_tables(schema_key, refresh=refresh)
+        if table_names:
+            patterns = [name.strip().upper() for name in table_names if name.strip()]
+            selected = [
+                table for name, table in sorted(tables.items())
+                if any(name == pattern or (pattern.endswith("*") and name.startswith(pattern[:-1])) for pattern in patterns)
+            ]
+        else:
+            selected = [table for _, table in sorted(tables.items())]
+        if not selected:
+            return "該当する表がありません。"
+
+        if output_format == "tables":
+            return "\n".join(f"{table.name} ({len(table.columns)} columns)" for table in selected)
+        if not any(table.foreign_keys for table in selected):
+            # 推定したリレーションでキャッシュ上の表定義を変えないよう、コピーに対して推定する
+            selected = [copy.copy(table) for table in selected]
+            for table in selected:
+                table.foreign_keys = list(table.foreign_keys)
+            infer_foreign_keys(selected)
+        return tables_to_mermaid_er(selected)
+
+    def stats(self):
+        """キャッシュヒット数・読み込み回数・DB への問い合わせ回数を返す"""
+        return {"hits": self.hits, "refreshes": self.refreshes, "round_trips": self.round_trips}
+
+
+def schema_key_for(connect_args):
+    """connect ツールの引数からカタログのキーを作る"""
+    if not connect_args:
+        return "default"
+    return json.dumps(connect_args, sort_keys=True, ensure_ascii=False)
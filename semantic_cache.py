@@ -0,0 +1,343 @@
+"""
+過去の要件とダイアグラムのセマンティックキャッシュ
+
+レンダリングキャッシュ（mermaid_render_cache.py）はスクリプトが同じ場合にしか効かず、同じような要件を
+言い回しを変えて送ると、エージェントは毎回 LLM を何ステップも呼び出してスクリプトを一から作り直していた。
+このキャッシュは要件と生成した Mermaid スクリプトをそれぞれベクトルに埋め込んでローカルのインデックスに保存し、
+新しい要件に近い過去の要件を探す。
+
+- 正規化（小文字化・空白の統一）した要件が過去の要件と同じ: 保存済みのダイアグラムをそのまま返す（LLM を呼び出さない）
+- 類似度が SEMANTIC_CACHE_DRAFT_THRESHOLD 以上: 過去のスクリプトを下書きとしてエージェントに渡す
+  （文字 n-gram の類似度では「Kafka」→「RabbitMQ」や「含めて」→「含めないで」の違いも 0.97 を超えるので、
+  類似度だけで保存済みのダイアグラムを返すことはしない）
+- それ以外: 通常どおり生成し、結果をキャッシュに追加する
+
+埋め込みは既定では文字 n-gram の特徴ハッシング（外部のモデルやネットワークを使わない。日本語の要件も
+分かち書きなしで扱える）。SEMANTIC_CACHE_EMBEDDER に "モジュール:関数" を指定すると差し替えられる
+（関数はテキストのリストを受け取り、(件数, 次元) の配列を返す）。
+インデックスは NumPy の行列による全件探索（正規化したベクトルの内積 = コサイン類似度）で、
+cache/semantic/ に保存する。ヒット率と、再利用で省いた生成時間は stats() で取得できる。
+
+環境変数:
+    SEMANTIC_CACHE: 0 で無効化
+    SEMANTIC_CACHE_DIR: 保存先（既定 cache/semantic）
+    SEMANTIC_CACHE_DRAFT_THRESHOLD: 下書きとして渡す類似度（既定 0.75）
+    SEMANTIC_CACHE_MAX_ENTRIES: 保持する最大件数（既定 1000。超えると使われていない古いものから削除）
+    SEMANTIC_CACHE_EMBEDDER: 埋め込み関数（既定 hashing）
+"""
+
+import hashlib
+import importlib
+import json
+import math
+import os
+import re
+import secrets
+import threading
+import time
+
+import numpy as np
+
+from mermaid_render_cache import normalize_mermaid_script
+
+HASHING_DIM = 1024
+NGRAM_SIZES = (1, 2, 3)
+
+
+def _normalize_text(text):
+    return re.sub(r'\s+', ' ', text.lower()).strip()
+
+
+def hashing_embedding(texts, dim=HASHING_DIM):
+    """
+    文字 n-gram の特徴ハッシングによる埋め込み（単位ベクトル）。
+
+    Args:
+        texts: 埋め込むテキストのリスト
+        dim: ベクトルの次元
+
+    Returns:
+        np.ndarray: (len(texts), dim) の float32 配列
+    """
+    vectors = np.zeros((len(texts), dim), dtype=np.float32)
+    for row, text in enumerate(texts):
+        text = _normalize_text(text)
+        counts = {}
+        for size in NGRAM_SIZES:
+            for start in range(max(0, len(text) - size + 1)):
+                gram = text[start:start + size]
+                if gram.strip():
+                    counts[gram] = counts.get(gram, 0) + 1
+        for gram, count in counts.items():
+            digest = hashlib.blake2b(gram.encode('utf-8'), digest_size=8).digest()
+            index = int.from_bytes(digest[:4], 'little') % dim
+            sign = 1.0 if digest[4] & 1 else -1.0
+            # 同じ n-gram の繰り返しが類似度を支配しないよう、出現回数は対数で効かせる
+            vectors[row, index] += sign * (1.0 + math.log(count))
+    return _normalize_rows(vectors)
+
+
+def _normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def load_embedder(spec):
+    """
+    埋め込み関数を返す。
+
+    Args:
+        spec: "hashing" または "モジュール:関数"
+
+    Returns:
+        callable: テキストのリストから単位ベクトルの配列を返す関数
+    """
+    if not spec or spec == "hashing":
+        return hashing_embedding
+    module_name, _, function_name = spec.partition(":")
+    if not function_name:
+        raise ValueError(f"SEMANTIC_CACHE_EMBEDDER must be 'hashing' or 'module:function': {spec}")
+    function = getattr(importlib.import_module(module_name), function_name)
+    return lambda texts: _normalize_rows(function(list(texts)))
+
+
+class SemanticMatch:
+    """lookup の結果（kind は "hit"（そのまま返す）または "draft"（下書きとして渡す））"""
+
+    def __init__(self, kind, score, entry, seconds):
+        self.kind = kind
+        self.score = score
+        self.entry = entry
+        self.lookup_seconds = seconds
+
+    @property
+    def requirement(self):
+        return self.entry["requirement"]
+
+    @property
+    def script(self):
+        return self.entry["script"]
+
+    @property
+    def image_file(self):
+        return self.entry["image_file"]
+
+    def draft_prompt(self):
+        """エージェントへの依頼に添える下書き"""
+        return (
+            f"参考: 過去の類似した要件（類似度 {self.score:.2f}）で生成した Mermaid スクリプトです。"
+            "要件との違いを確認し、必要な箇所を修正して使ってください。\n"
+            f"過去の要件: {self.requirement}\n"
+            f"```mermaid\n{self.script}\n```"
+        )
+
+
+class SemanticCache:
+    """
+    要件とスクリプトの埋め込みを保持し、新しい要件に近い過去の要件を探すキャッシュ。
+
+    Args:
+        directory: インデックスの保存先
+        embed: テキストのリストから単位ベクトルの配列を返す関数
+        embedder_name: 埋め込み関数の名前（保存済みのインデックスと異なる場合は作り直す）
+        draft_threshold: 下書きとして渡す類似度
+        max_entries: 保持する最大件数
+    """
+
+    def __init__(self, directory, embed=hashing_embedding, embedder_name="hashing", draft_threshold=0.75, max_entries=1000):
+        self.directory = directory
+        self.embed = embed
+        self.embedder_name = embedder_name
+        self.draft_threshold = draft_threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.drafts = 0
+        self.saved_seconds = 0.0
+        self._entries, self._requirement_vectors, self._script_vectors = self._load()
+
+    @property
+    def _index_file(self):
+        return os.path.join(self.directory, "index.npz")
+
+    @property
+    def _entries_file(self):
+        return os.path.join(self.directory, "entries.json")
+
+    def _load(self):
+        try:
+            with open(self._entries_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            with np.load(self._index_file) as index:
+                requirement_vectors = index["requirements"]
+                script_vectors = index["scripts"]
+            if data.get("embedder") == self.embedder_name and len(data["entries"]) == len(requirement_vectors):
+                return data["entries"], requirement_vectors, script_vectors
+            print("Semantic cache: embedder changed, rebuilding the index")
+        except (OSError, ValueError, KeyError):
+            # 未作成・壊れたインデックスは作り直す
+            pass
+        return [], None, None
+
+    def _save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_index = f"{self._index_file}.tmp.npz"
+        np.savez(tmp_index, requirements=self._requirement_vectors, scripts=self._script_vectors)
+        os.replace(tmp_index, self._index_file)
+        tmp_entries = f"{self._entries_file}.tmp"
+        with open(tmp_entries, 'w', encoding='utf-8') as f:
+            json.dump({"embedder": self.embedder_name, "entries": self._entries}, f, ensure_ascii=False)
+        os.replace(tmp_entries, self._entries_file)
+
+    def _nearest(self, matrix, vector):
+        if matrix is None or not len(matrix):
+            return None, 0.0
+        scores = matrix @ vector
+        index = int(np.argmax(scores))
+        return index, float(scores[index])
+
+    def _exact(self, requirement, usable):
+        # 正規化した要件が同じエントリのうち、最近使ったものを返す
+        normalized = _normalize_text(requirement)
+        candidates = [i for i, entry in enumerate(self._entries)
+                      if _normalize_text(entry["requirement"]) == normalized and usable(entry)]
+        if not candidates:
+            return None
+        return max(candidates, key=lambda i: self._entries[i]["last_used"])
+
+    def lookup(self, requirement):
+        """
+        要件に最も近い過去の要件を探す。
+
+        Returns:
+            SemanticMatch | None: 類似度が draft_threshold 未満の場合は None。
+                ヒット（"hit"）は正規化した要件が同じで、ダイアグラムのファイルが残っている場合だけ。
+                それ以外は類似度が高くても下書き（"draft"）として返す
+        """
+        started = time.perf_counter()
+        vector = self.embed([requirement])[0]
+        with self._lock:
+            self.lookups += 1
+            index = self._exact(requirement, lambda entry: os.path.exists(entry["image_file"]))
+            if index is not None:
+                kind, score = "hit", 1.0
+            else:
+                index, score = self._nearest(self._requirement_vectors, vector)
+                if index is None or score < self.draft_threshold:
+                    return None
+                kind = "draft"
+            entry = self._entries[index]
+            entry["last_used"] = time.time()
+            entry["uses"] = entry.get("uses", 0) + 1
+            seconds = time.perf_counter() - started
+            if kind == "hit":
+                self.hits += 1
+                self.saved_seconds += max(0.0, entry["seconds"] - seconds)
+            else:
+                self.drafts += 1
+        return SemanticMatch(kind, score, dict(entry), seconds)
+
+    def add(self, requirement, script, image_file, seconds, match=None):
+        """
+        生成した結果を追加する。
+
+        Args:
+            requirement: ユーザーの要件
+            script: 生成した Mermaid スクリプト
+            image_file: 生成した PNG ファイルのパス
+            seconds: 生成にかかった時間（ヒットしたときに省けた時間として数える）
+            match: 下書きを渡して生成した場合の lookup の結果（下書きで短くなった時間を数える）
+        """
+        requirement_vector, script_vector = self.embed([requirement, normalize_mermaid_script(script)])
+        now = time.time()
+        with self._lock:
+            if match is not None and match.kind == "draft":
+                self.saved_seconds += max(0.0, match.entry["seconds"] - seconds)
+            # 同じ要件で同じスクリプトを生成し直した場合は、新しいエントリを作らずに置き換える
+            index = self._exact(requirement, lambda entry: True)
+            if index is not None and float(self._script_vectors[index] @ script_vector) >= 0.99:
+                self._entries[index].update(image_file=image_file, last_used=now)
+                self._save()
+                return
+
+            entry = {
+                "id": secrets.token_hex(8),
+                "requirement": requirement,
+                "script": script,
+                "image_file": image_file,
+                "seconds": round(seconds, 3),
+                "created_at": now,
+                "last_used": now,
+                "uses": 0,
+            }
+            if self._requirement_vectors is None:
+                self._requirement_vectors = requirement_vector.reshape(1, -1)
+                self._script_vectors = script_vector.reshape(1, -1)
+            else:
+                self._requirement_vectors = np.vstack([self._requirement_vectors, requirement_vector])
+                self._script_vectors = np.vstack([self._script_vectors, script_vector])
+            self._entries.append(entry)
+
+            if len(self._entries) > self.max_entries:
+                order = sorted(range(len(self._entries)), key=lambda i: self._entries[i]["last_used"], reverse=True)
+                keep = sorted(order[:self.max_entries])
+                self._entries = [self._entries[i] for i in keep]
+                self._requirement_vectors = self._requirement_vectors[keep]
+                self._script_vectors = self._script_vectors[keep]
+            self._save()
+
+    def clear(self):
+        """すべてのエントリと統計を消す"""
+        with self._lock:
+            self._entries, self._requirement_vectors, self._script_vectors = [], None, None
+            self.lookups = self.hits = self.drafts = 0
+            self.saved_seconds = 0.0
+            for path in (self._index_file, self._entries_file):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def stats(self):
+        """件数・ヒット率・下書きとして使った回数・省いた生成時間を返す"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "drafts": self.drafts,
+                "hit_rate": round(self.hits / self.lookups, 3) if self.lookups else None,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_semantic_cache():
+    """
+    共有のセマンティックキャッシュを返す。
+
+    Returns:
+        SemanticCache | None: SEMANTIC_CACHE=0 で無効化されている場合は None
+    """
+    global _cache
+
+    if os.getenv("SEMANTIC_CACHE", "1") == "0":
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            embedder_name = os.getenv("SEMANTIC_CACHE_EMBEDDER", "hashing")
+            _cache = SemanticCache(
+                directory=os.getenv("SEMANTIC_CACHE_DIR", os.path.join("cache", "semantic")),
+                embed=load_embedder(embedder_name),
+                embedder_name=embedder_name,
+                draft_threshold=float(os.getenv("SEMANTIC_CACHE_DRAFT_THRESHOLD", "0.75")),
+                max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "1000"))
+            )
+        return _cache
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from smolagents import CodeAgent
+from smolagents.models import ChatMessage, MessageRole
+from smolagents.monitoring import TokenUsage
+
+
+class StubModel:
+    """ステップごとに決まったコードを返すスタブ LLM（最後のコードを繰り返す）"""
+
+    model_id = "tests/stub"
+
+    def __init__(self, codes):
+        self.codes = codes
+        self.code_block_tags = ("<code>", "</code>")
+        self.calls = 0
+
+    def generate(self, messages, stop_sequences=None, response_format=None, tools_to_call_from=None, **kwargs):
+        code = self.codes[min(self.calls, len(self.codes) - 1)]
+        self.calls += 1
+        open_tag, close_tag = self.code_block_tags
+        return ChatMessage(
+            role=MessageRole.ASSISTANT,
+            content=f"Thought: run the step.\n{open_tag}\n{code}\n{close_tag}",
+            token_usage=TokenUsage(input_tokens=0, output_tokens=0),
+        )
+
+    def __call__(self, *args, **kwargs):
+        return self.generate(*args, **kwargs)
+
+
+@pytest.fixture
+def stub_agent():
+    """tools と、ステップごとのコードのリストから CodeAgent を作る"""
+
+    def create(tools, codes, **kwargs):
+        model = StubModel(codes)
+        agent = CodeAgent(tools=tools, model=model, max_steps=len(codes) + 1, **kwargs)
+        model.code_block_tags = getattr(agent, "code_block_tags", model.code_block_tags)
+        return agent
+
+    return create
@@ -0,0 +1,36 @@
+from smolagents import tool
+from smolagents.memory import FinalAnswerStep
+
+from agent_stream import DiagramGenerated, notify_diagram_generated, stream_agent_run
+
+
+@tool
+def render_stub_tool(name: str) -> str:
+    """
+    Pretends to render a diagram and notifies the running stream.
+
+    Args:
+        name: diagram name
+    """
+    image_file = f"output/{name}.png"
+    notify_diagram_generated(image_file)
+    return image_file
+
+
+def test_tool_notification_arrives_before_final_answer(stub_agent):
+    agent = stub_agent([render_stub_tool], [
+        'path = render_stub_tool("orders")\nprint(path)',
+        "final_answer(path)",
+    ])
+
+    events = list(stream_agent_run(agent, "draw the orders diagram"))
+
+    kinds = [type(event) for event in events]
+    assert DiagramGenerated in kinds
+    diagram = next(event for event in events if isinstance(event, DiagramGenerated))
+    assert diagram.image_file == "output/orders.png"
+    assert kinds.index(DiagramGenerated) < kinds.index(FinalAnswerStep)
+
+
+def test_notification_outside_a_run_is_ignored():
+    notify_diagram_generated("output/none.png")
@@ -0,0 +1,38 @@
+from smolagents import tool
+
+from agent_stream import stream_agent_run
+from artifact_store import ArtifactStore
+from run_control import CancellationToken
+
+_stores = {}
+
+
+@tool
+def store_diagram_tool(mermaid_script: str) -> str:
+    """
+    Stores a diagram without passing the session, like generate_mermaid_diagram_tool.
+
+    Args:
+        mermaid_script: Mermaid script
+    """
+    store = _stores["store"]
+    artifact = store.create(mermaid_script)
+    with open(artifact.image_file, "wb") as f:
+        f.write(b"png")
+    store.publish(artifact)
+    return artifact.image_file
+
+
+def test_artifacts_created_by_tools_are_indexed_under_the_run_session(stub_agent, tmp_path):
+    store = _stores["store"] = ArtifactStore(root=str(tmp_path))
+    agent = stub_agent([store_diagram_tool], [
+        'path = store_diagram_tool("flowchart TD\\n  A --> B")',
+        "final_answer(path)",
+    ])
+
+    events = list(stream_agent_run(agent, "draw a diagram", cancel_token=CancellationToken(session_id="session-1")))
+
+    artifacts = store.list_session("session-1")
+    assert [artifact.image_file for artifact in artifacts] == [events[-1].output]
+    assert artifacts[0].session_id == "session-1"
+    store.close()
@@ -0,0 +1,68 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("mcpadapt")
+# スタブの MCP サーバは mcp 1.x の FastMCP で動く
+pytest.importorskip("mcp.server.fastmcp")
+
+from mcp import StdioServerParameters
+
+from mcp_session_pool import MCPSessionPool
+
+STUB_SERVER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks",
+                           "stub_sqlcl_mcp_server.py")
+
+
+@pytest.fixture
+def stub_pool():
+    pools = []
+
+    def create(crash_after=0):
+        # StdioServerParameters の既定の環境変数には PYTHONPATH が含まれないので、そのまま引き継ぐ
+        env = dict(os.environ, STUB_MCP_CRASH_AFTER=str(crash_after))
+        pool = MCPSessionPool(
+            StdioServerParameters(command=sys.executable, args=[STUB_SERVER], env=env),
+            size=1, call_timeout=30, startup_timeout=60, keepalive_interval=0
+        )
+        pools.append(pool)
+        pool.get_tools()
+        pool.call_tool("connect", connection_name="sh_schema")
+        return pool
+
+    yield create
+    for pool in pools:
+        pool.close()
+
+
+def test_tool_error_does_not_restart_or_retry(stub_pool):
+    pool = stub_pool()
+
+    with pytest.raises(Exception, match="ORA-00942") as raised:
+        pool.call_tool("run_sql", sql="SELECT * FROM NO_SUCH_TABLE")
+
+    assert not isinstance(raised.value, RuntimeError)
+    assert pool.stats()["restarts"] == 0
+    assert pool.stats()["alive_sessions"] == 1
+    # 同じセッションのまま（接続状態も残っている）
+    assert '"SALES"' in pool.call_tool("run_sql", sql="SELECT TABLE_NAME FROM USER_TABLES")
+    assert pool.stats()["restarts"] == 0
+
+
+def test_crash_restarts_session_without_rerunning_sql(stub_pool):
+    # connect と 1 回目の run-sql の後、3 回目の呼び出しでスタブのプロセスが終了する
+    pool = stub_pool(crash_after=2)
+    pool.call_tool("run_sql", sql="SELECT TABLE_NAME FROM USER_TABLES")
+
+    with pytest.raises(RuntimeError, match="not retried"):
+        pool.call_tool("run_sql", sql="INSERT INTO SALES VALUES (1, 1, 100)")
+    assert pool.stats()["restarts"] == 0
+
+    # 次の呼び出しで起動し直し、connect をやり直してから実行する
+    assert '"SALES"' in pool.call_tool("run_sql", sql="SELECT TABLE_NAME FROM USER_TABLES")
+    assert pool.stats()["restarts"] == 1
+
+    # 何度実行してもよいツールは、起動し直したセッションでやり直す
+    assert "sh_schema" in pool.call_tool("list_connections")
+    assert pool.stats()["restarts"] == 2
@@ -0,0 +1,91 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+from smolagents import tool
+
+from agent_stream import stream_agent_run
+from run_control import CancellationToken, RunCancelled, current_token, run_child_process
+
+# 起動したら PID を書き出し、そのまま 60 秒かかる mmdc のスタブ
+SLOW_MMDC_SOURCE = """
+import sys, time
+with open(sys.argv[1], "w") as f:
+    f.write(str(__import__("os").getpid()))
+time.sleep(60)
+"""
+
+_paths = {}
+
+
+@tool
+def slow_render_tool(name: str) -> str:
+    """
+    Renders a diagram with the slow stub mmdc.
+
+    Args:
+        name: diagram name
+    """
+    _paths["token_in_tool"] = current_token()
+    run_child_process([sys.executable, _paths["mmdc"], _paths["pid"]], timeout=120)
+    return name
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def test_cancel_kills_child_process_started_by_a_tool(stub_agent, tmp_path):
+    _paths["mmdc"] = str(tmp_path / "slow_mmdc.py")
+    _paths["pid"] = str(tmp_path / "mmdc.pid")
+    with open(_paths["mmdc"], "w", encoding="utf-8") as f:
+        f.write(SLOW_MMDC_SOURCE)
+
+    agent = stub_agent([slow_render_tool], ['slow_render_tool("orders")', 'final_answer("done")'])
+    token = CancellationToken(session_id="test")
+    outcome = {}
+
+    def consume():
+        try:
+            for _ in stream_agent_run(agent, "draw the orders diagram", cancel_token=token):
+                pass
+        except Exception as e:
+            outcome["error"] = e
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+    deadline = time.monotonic() + 30
+    while not os.path.exists(_paths["pid"]) or not open(_paths["pid"]).read():
+        assert time.monotonic() < deadline, "stub mmdc was not started"
+        time.sleep(0.05)
+    pid = int(open(_paths["pid"]).read())
+
+    cancelled_at = time.monotonic()
+    token.cancel()
+    consumer.join(timeout=10)
+
+    assert not consumer.is_alive()
+    assert time.monotonic() - cancelled_at < 10
+    assert isinstance(outcome.get("error"), RunCancelled)
+    assert _paths["token_in_tool"] is token
+    assert not _alive(pid)
+
+
+def test_token_follows_copied_context_into_threads():
+    import concurrent.futures
+    import contextvars
+
+    from run_control import using_token
+
+    token = CancellationToken()
+    with using_token(token):
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+            seen = executor.submit(contextvars.copy_context().run, current_token).result()
+    assert seen is token
+    assert current_token() is None
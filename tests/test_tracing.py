@@ -0,0 +1,45 @@
+import sys
+
+import pytest
+from smolagents import tool
+
+import tracing
+from agent_stream import stream_agent_run
+from run_control import run_child_process
+from tracing import Tracer, new_trace_id, trace_span, trace_tools
+
+
+@tool
+def traced_render_tool(name: str) -> str:
+    """
+    Runs a child process inside a subprocess span, like the mmdc renderer.
+
+    Args:
+        name: diagram name
+    """
+    with trace_span("subprocess.stub", kind="subprocess"):
+        run_child_process([sys.executable, "-c", "pass"])
+    return name
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    tracer = Tracer()
+    monkeypatch.setattr(tracing, "_tracer", tracer)
+    monkeypatch.delenv("TRACING", raising=False)
+    return tracer
+
+
+def test_tool_and_subprocess_spans_belong_to_the_run_trace(stub_agent, tracer):
+    agent = stub_agent(trace_tools([traced_render_tool]), ['traced_render_tool("orders")', 'final_answer("done")'])
+    trace_id = new_trace_id()
+
+    list(stream_agent_run(agent, "draw the orders diagram", trace_id=trace_id))
+
+    spans = {span["name"]: span for span in tracer.get_trace(trace_id)}
+    assert {"agent.run", "tool.traced_render_tool", "subprocess.stub"} <= set(spans)
+    assert spans["tool.traced_render_tool"]["parent_id"] == spans["agent.run"]["span_id"]
+    assert spans["subprocess.stub"]["parent_id"] == spans["tool.traced_render_tool"]["span_id"]
+    # ツールのスパンが別のトレースのルートになっていない
+    orphans = [trace for trace in tracer._traces if trace != trace_id]
+    assert orphans == []
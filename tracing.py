@@ -0,0 +1,384 @@
+"""
+ステップ単位のトレースと計測
+
+遅いリクエストの時間が LLM、CodeAgent の Python 実行器、mmdc、SQLcl MCP ツールのどこで
+使われたかを調べるため、次の単位でスパン（開始・終了時刻と属性）を記録する。
+
+    agent.run       エージェント 1 回の実行（ルートスパン）
+    agent.step      アクションステップ（step_callbacks から記録）
+    model.generate  LLM 呼び出し（入出力トークン数、レイテンシ）
+    tool.<名前>     ツール呼び出し（MCP ツールを含む）
+    subprocess.*    mmdc などの子プロセス
+
+- スパンは logs/trace.jsonl にローテーションしながら 1 行 1 スパンで書き出す（TRACE_FILE, TRACE_MAX_MB）
+- OTEL_EXPORTER_OTLP_ENDPOINT を設定すると OTLP/HTTP(JSON) でローカルのコレクターにも送信する
+- 直近のトレースはメモリに保持し、format_trace_timeline() でタイムライン表示用の文字列にできる
+- TRACING=0 で無効化
+
+親スパンは contextvars で引き継ぐ。tool.* と subprocess.* のスパンが実行のトレースに入るのは、
+agent_stream.py がコードをエージェントのスレッドで実行させているため（smolagents 1.22 以降の既定の
+タイムアウト付き実行ではコードが別スレッドで動き、スパンが親のない別のトレースになる）。
+"""
+
+import collections
+import contextlib
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+import urllib.request
+import uuid
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+SPAN_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+class Span:
+    def __init__(self, name, kind, trace_id, parent_id, attributes, start_time=None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_time = start_time if start_time is not None else time.time()
+        self.end_time = None
+        self.status = "ok"
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration_ms": round((self.end_time - self.start_time) * 1000, 1) if self.end_time else None,
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _OTLPExporter:
+    """OTLP/HTTP(JSON) でスパンをまとめて送信する（送信に失敗したスパンは捨てる）"""
+
+    def __init__(self, endpoint, service_name, interval=2.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self.interval = interval
+        self._spans = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def export(self, span):
+        self._spans.put(span)
+
+    @staticmethod
+    def _attribute(key, value):
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def _to_otlp(self, span):
+        otlp_span = {
+            "traceId": span["trace_id"],
+            "spanId": span["span_id"],
+            "name": span["name"],
+            "kind": SPAN_KINDS["client"] if span["kind"] in ("model", "subprocess", "tool") else SPAN_KINDS["internal"],
+            "startTimeUnixNano": str(int(span["start_time"] * 1e9)),
+            "endTimeUnixNano": str(int(span["end_time"] * 1e9)),
+            "attributes": [self._attribute("span.kind", span["kind"])] + [
+                self._attribute(key, value) for key, value in span["attributes"].items()
+            ],
+            "status": {"code": 2 if span["status"] == "error" else 1},
+        }
+        if span["parent_id"]:
+            otlp_span["parentSpanId"] = span["parent_id"]
+        return otlp_span
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            batch = []
+            while True:
+                try:
+                    batch.append(self._spans.get_nowait())
+                except queue.Empty:
+                    break
+            if not batch:
+                continue
+            payload = {
+                "resourceSpans": [{
+                    "resource": {"attributes": [self._attribute("service.name", self.service_name)]},
+                    "scopeSpans": [{"scope": {"name": "mermaid-diagram-agent"}, "spans": [self._to_otlp(s) for s in batch]}],
+                }]
+            }
+            request = urllib.request.Request(
+                self.url,
+                data=json.dumps(payload).encode('utf-8'),
+                headers={"Content-Type": "application/json"},
+                method="POST"
+            )
+            try:
+                urllib.request.urlopen(request, timeout=5).close()
+            except Exception:
+                pass
+
+
+class Tracer:
+    """
+    スパンの記録先。
+
+    Args:
+        trace_file: JSONL の出力先（None でファイル出力しない）
+        max_bytes: ローテーションするファイルサイズ
+        backup_count: 残す世代数
+        otlp_endpoint: OTLP/HTTP コレクターの URL（None で送信しない）
+        keep_traces: メモリに保持するトレース数
+    """
+
+    def __init__(self, trace_file=None, max_bytes=10 * 1024 * 1024, backup_count=5, otlp_endpoint=None,
+                 service_name="mermaid-diagram-agent", keep_traces=100):
+        self._lock = threading.Lock()
+        self._traces = collections.OrderedDict()
+        self.keep_traces = keep_traces
+
+        self._logger = None
+        if trace_file:
+            directory = os.path.dirname(trace_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(
+                trace_file, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8'
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self._logger = logging.getLogger(f"tracing.{trace_file}")
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            self._logger.handlers = [handler]
+
+        self._exporter = _OTLPExporter(otlp_endpoint, service_name) if otlp_endpoint else None
+
+    def record(self, span):
+        data = span.to_dict()
+        with self._lock:
+            spans = self._traces.setdefault(span.trace_id, [])
+            spans.append(data)
+            self._traces.move_to_end(span.trace_id)
+            while len(self._traces) > self.keep_traces:
+                self._traces.popitem(last=False)
+        if self._logger is not None:
+            self._logger.info(json.dumps(data, ensure_ascii=False, default=str))
+        if self._exporter is not None:
+            self._exporter.export(data)
+
+    def get_trace(self, trace_id):
+        """トレースのスパンを開始時刻順に返す"""
+        with self._lock:
+            return sorted(self._traces.get(trace_id, []), key=lambda span: span["start_time"])
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """
+    共有トレーサーを返す。
+
+    Returns:
+        Tracer | None: TRACING=0 で無効化されている場合は None
+    """
+    global _tracer
+    if os.getenv("TRACING", "1") == "0":
+        return None
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer(
+                trace_file=os.getenv("TRACE_FILE", os.path.join("logs", "trace.jsonl")),
+                max_bytes=int(os.getenv("TRACE_MAX_MB", "10")) * 1024 * 1024,
+                otlp_endpoint=os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT")
+            )
+        return _tracer
+
+
+@contextlib.contextmanager
+def trace_span(name, kind="internal", trace_id=None, **attributes):
+    """
+    スパンを開始し、with ブロックの終了時に記録する。
+    親スパンは現在のコンテキストから引き継ぐ（trace_id を指定した場合はそのトレースのルートになる）。
+    """
+    tracer = get_tracer()
+    if tracer is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent is not None else new_trace_id()
+        parent_id = parent.span_id if parent is not None else None
+    else:
+        parent_id = parent.span_id if parent is not None and parent.trace_id == trace_id else None
+
+    span = Span(name, kind, trace_id, parent_id, dict(attributes))
+    token = _current_span.set(span)
+    try:
+        yield span
+    except Exception as e:
+        span.status = "error"
+        span.set_attribute("error", f"{type(e).__name__}: {str(e)[:500]}")
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end_time = time.time()
+        tracer.record(span)
+
+
+def record_span(name, start_time, end_time, kind="internal", error=None, **attributes):
+    """終了済みの処理（エージェントのステップなど）を現在のスパンの子として記録する"""
+    tracer = get_tracer()
+    parent = _current_span.get()
+    if tracer is None or parent is None:
+        return
+    span = Span(name, kind, parent.trace_id, parent.span_id, dict(attributes), start_time=start_time)
+    span.end_time = end_time
+    if error is not None:
+        span.status = "error"
+        span.set_attribute("error", str(error)[:500])
+    tracer.record(span)
+
+
+def trace_step_callback(memory_step, agent=None):
+    """CodeAgent の step_callbacks に登録し、アクションステップをスパンとして記録する"""
+    timing = getattr(memory_step, "timing", None)
+    if timing is None or timing.end_time is None:
+        return
+    attributes = {"step_number": getattr(memory_step, "step_number", None)}
+    token_usage = getattr(memory_step, "token_usage", None)
+    if token_usage is not None:
+        attributes["input_tokens"] = token_usage.input_tokens
+        attributes["output_tokens"] = token_usage.output_tokens
+    record_span("agent.step", timing.start_time, timing.end_time, kind="step",
+                error=getattr(memory_step, "error", None), **attributes)
+
+
+class TracedModel:
+    """
+    LLM 呼び出しをスパンとして記録するモデルラッパー。
+    generate / generate_stream 以外の属性はラップしたモデルに委譲する。
+    """
+
+    def __init__(self, model):
+        self.model = model
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __call__(self, *args, **kwargs):
+        return self.generate(*args, **kwargs)
+
+    @staticmethod
+    def _set_usage(span, token_usage):
+        if span is not None and token_usage is not None:
+            span.set_attribute("input_tokens", token_usage.input_tokens)
+            span.set_attribute("output_tokens", token_usage.output_tokens)
+
+    def generate(self, messages, **kwargs):
+        with trace_span("model.generate", kind="model", model_id=str(getattr(self.model, "model_id", "")),
+                        messages=len(messages)) as span:
+            message = self.model.generate(messages, **kwargs)
+            self._set_usage(span, message.token_usage)
+            return message
+
+    def generate_stream(self, messages, **kwargs):
+        # ジェネレーターは呼び出し側で中断されることがあるので、コンテキストを切り替えずに計測する
+        started = time.time()
+        first_chunk_at = None
+        input_tokens = 0
+        output_tokens = 0
+        error = None
+        try:
+            for delta in self.model.generate_stream(messages, **kwargs):
+                if first_chunk_at is None:
+                    first_chunk_at = time.time()
+                if delta.token_usage is not None:
+                    input_tokens += delta.token_usage.input_tokens
+                    output_tokens += delta.token_usage.output_tokens
+                yield delta
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            attributes = {
+                "model_id": str(getattr(self.model, "model_id", "")),
+                "messages": len(messages),
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "stream": True,
+            }
+            if first_chunk_at is not None:
+                attributes["time_to_first_chunk_ms"] = round((first_chunk_at - started) * 1000, 1)
+            record_span("model.generate", started, time.time(), kind="model", error=error, **attributes)
+
+
+def trace_tools(tools):
+    """ツール呼び出しをスパンとして記録するよう、各ツールの forward をラップする（何度呼んでもよい）"""
+    for tool in tools:
+        forward = tool.forward
+        if getattr(forward, "_traced", False):
+            continue
+
+        def traced_forward(*args, _forward=forward, _name=tool.name, **kwargs):
+            with trace_span(f"tool.{_name}", kind="tool"):
+                return _forward(*args, **kwargs)
+
+        traced_forward._traced = True
+        tool.forward = traced_forward
+    return tools
+
+
+def format_trace_timeline(trace_id):
+    """トレースをタイムライン表示用の文字列にする"""
+    tracer = get_tracer()
+    spans = tracer.get_trace(trace_id) if tracer is not None else []
+    if not spans:
+        return "トレースがありません。"
+
+    parents = {span["span_id"]: span["parent_id"] for span in spans}
+
+    def depth(span_id):
+        level = 0
+        while parents.get(span_id) in parents:
+            span_id = parents[span_id]
+            level += 1
+        return level
+
+    origin = min(span["start_time"] for span in spans)
+    lines = [f"{'開始(s)':>9} {'所要(ms)':>10}  スパン"]
+    for span in spans:
+        details = []
+        for key in ("input_tokens", "output_tokens", "time_to_first_chunk_ms", "step_number", "error"):
+            if key in span["attributes"]:
+                details.append(f"{key}={span['attributes'][key]}")
+        mark = " ✖" if span["status"] == "error" else ""
+        lines.append(
+            f"{span['start_time'] - origin:>9.3f} {span['duration_ms'] or 0:>10.1f}  "
+            f"{'  ' * depth(span['span_id'])}{span['name']}{mark} {' '.join(details)}".rstrip()
+        )
+    return "\n".join(lines)
@@ -0,0 +1,456 @@
+"""
+成功したエージェントの手順（トラジェクトリ）のキャッシュ
+
+「スキーマ X の ER 図」「N 層 Web アプリのシステム構成図」のように同じ形の依頼が多いのに、CodeAgent は毎回
+ガイドラインの取得 → スクリプトの作成 → 記法エラーの修正 → 生成という手順を LLM に考えさせていた。
+このキャッシュは新しい会話で成功した実行のコード（ステップごとのコードと使ったツール）を、依頼の形（シグネチャ）と
+ともに cache/trajectories/ に記録し、同じ形の新しい依頼に次のどちらかで使う。
+
+- 再生: 依頼の文面が同じ（ファイルパス・「」で囲んだ名前・大文字の表名などのスロットの値だけが違う）場合は、
+  スロットの値を置き換えた記録済みのコードを LLM の応答の代わりに順に実行する（ReplayModel）。
+  エラーになったステップ以降は元の LLM に任せる。スロットの値が違う場合は、要件に固有の長い文字列
+  （LLM が書いた Mermaid スクリプトなど）を含まない手順だけを再生する。記録した実行が生成した成果物の ID や
+  出力ファイルのパスをコードに書き込んだ手順は、古い図を回答してしまうので再生しない
+- 手本: シグネチャが同じで文面が違う場合は、最も近い過去の依頼の手順を few-shot の手本として依頼に添える
+
+記録するのはエラーにならなかったステップだけなので、再生や手本では記法エラーの修正などの回り道を省ける。
+
+シグネチャは依頼から判定したダイアグラムの種類（er, sequence, flowchart, architecture など）と入力の種類
+（.sql ファイル、DDL、文章）の組み合わせ。類似度は semantic_cache.py の文字 n-gram の埋め込みで測る。
+
+環境変数:
+    TRAJECTORY_CACHE: 0 で無効化
+    TRAJECTORY_CACHE_DIR: 保存先（既定 cache/trajectories）
+    TRAJECTORY_REPLAY: 0 で再生しない（手本としてだけ使う）
+    TRAJECTORY_EXEMPLAR_THRESHOLD: 手本として使う類似度の下限（既定 0.3）
+    TRAJECTORY_CACHE_MAX_ENTRIES: 保持する最大件数（既定 500。超えると使われていない古いものから削除）
+"""
+
+import ast
+import json
+import os
+import re
+import secrets
+import threading
+import time
+
+from smolagents.memory import ActionStep
+from smolagents.models import ChatMessage, ChatMessageStreamDelta, MessageRole
+from smolagents.monitoring import TokenUsage
+
+from agent_memory import OMITTED_SCRIPT
+from artifact_store import ARTIFACT_ID
+from semantic_cache import hashing_embedding
+
+# (ダイアグラムの種類, 依頼に含まれるキーワード)。先に一致したものを使う
+DIAGRAM_KINDS = (
+    ("sequence", r"シーケンス|sequence"),
+    ("er", r"ER\s*図|erDiagram|エンティティ|リレーションシップ|テーブル定義|スキーマ"),
+    ("flowchart", r"フローチャート|フロー図|作業手順|flowchart"),
+    ("class", r"クラス図|class\s*diagram"),
+    ("state", r"状態遷移|state\s*diagram"),
+    ("gantt", r"ガント|gantt"),
+    ("architecture", r"構成図|アーキテクチャ|architecture|システム構成"),
+)
+
+# 依頼の中で値だけを差し替えられる部分（スロット）
+SLOT_PATTERNS = (
+    ("path", re.compile(r"[\w./\\-]+\.(?:sql|mmd|png|svg|txt|csv|json|md)\b")),
+    ("artifact", ARTIFACT_ID),
+    ("quoted", re.compile(r"「([^」\n]+)」|`([^`\n]+)`")),
+    ("name", re.compile(r"(?<![\w./\\-])([A-Z][A-Z0-9_]+)(?![\w.])")),
+)
+# エージェントが生成する成果物のパス（依頼のスロットでなければ、記録した実行に固有の値）
+GENERATED_PATH = re.compile(r"[\w./\\-]+\.(?:png|svg|mmd|webp|pdf)\b")
+# 大文字の略語のうち、表名・スキーマ名ではないもの
+NOT_NAMES = {"ER", "DB", "DDL", "SQL", "API", "PK", "FK", "UK", "UI", "AI", "LLM", "RAG", "URL", "HTTP", "REST", "CSV", "JSON", "PNG", "SVG", "OCI"}
+
+# 再生してよいコードに含まれる文字列リテラルの最大長（これより長いものは要件に固有の内容とみなす）
+MAX_REPLAY_LITERAL = 80
+# 手本に載せる文字列リテラルの最大長（長い Mermaid スクリプトは先頭だけ見せる）
+MAX_EXEMPLAR_LITERAL = 400
+
+
+def task_signature(requirement):
+    """依頼の形（ダイアグラムの種類:入力の種類）を返す"""
+    kind = next((name for name, pattern in DIAGRAM_KINDS if re.search(pattern, requirement, re.IGNORECASE)), "diagram")
+    if re.search(r"\.sql\b", requirement, re.IGNORECASE):
+        source = "sql_file"
+    elif re.search(r"CREATE\s+TABLE", requirement, re.IGNORECASE):
+        source = "ddl"
+    else:
+        source = "text"
+    return f"{kind}:{source}"
+
+
+def extract_slots(requirement):
+    """
+    依頼からスロットを取り出す。
+
+    Returns:
+        tuple[str, list[tuple[str, str]]]: スロットを {種類} に置き換えた依頼の文面（空白は正規化）と、(種類, 値) のリスト
+    """
+    slots = []
+
+    def replace(kind):
+        def substitute(match):
+            value = next((group for group in match.groups() if group), match.group(0))
+            if kind == "name" and value in NOT_NAMES:
+                return match.group(0)
+            slots.append((kind, value))
+            return match.group(0).replace(value, "{" + kind + "}")
+        return substitute
+
+    template = requirement
+    for kind, pattern in SLOT_PATTERNS:
+        template = pattern.sub(replace(kind), template)
+    # 置き換えた順（種類ごと）ではなく、依頼の中での出現順に並べる
+    slots.sort(key=lambda slot: requirement.find(slot[1]))
+    return re.sub(r"\s+", " ", template).strip(), slots
+
+
+def _string_literals(code):
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    return [node.value for node in ast.walk(tree) if isinstance(node, ast.Constant) and isinstance(node.value, str)]
+
+
+def _substitute(code, old, new):
+    return re.sub(r"(?<![\w./\\-])" + re.escape(old) + r"(?![\w])", lambda _: new, code)
+
+
+class _ShortenLiterals(ast.NodeTransformer):
+    def visit_Constant(self, node):
+        if isinstance(node.value, str) and len(node.value) > MAX_EXEMPLAR_LITERAL:
+            return ast.copy_location(ast.Constant(node.value[:MAX_EXEMPLAR_LITERAL] + "\n...（省略）"), node)
+        return node
+
+
+def _shorten_code(code):
+    try:
+        return ast.unparse(_ShortenLiterals().visit(ast.parse(code)))
+    except SyntaxError:
+        return code
+
+
+def _called_tools(code, tool_names):
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return []
+    called = [node.func.id for node in ast.walk(tree) if isinstance(node, ast.Call) and isinstance(node.func, ast.Name)]
+    return list(dict.fromkeys(name for name in called if name in tool_names))
+
+
+def trajectory_steps(memory_steps, tool_names=()):
+    """
+    エージェントのメモリから、エラーにならなかったステップのコードと使ったツールを取り出す。
+
+    Returns:
+        list[dict]: [{"code": str, "tools": list[str], "final": bool}]。最終回答で終わっていなければ空のリスト
+    """
+    steps = [
+        {"code": step.code_action, "tools": _called_tools(step.code_action, tool_names), "final": bool(step.is_final_answer)}
+        for step in memory_steps
+        if isinstance(step, ActionStep) and step.code_action and step.error is None
+    ]
+    if not steps or not steps[-1]["final"]:
+        return []
+    # メモリの圧縮でスクリプトが省略表記に置き換えられたステップは再現できない
+    omitted = re.compile(re.escape(OMITTED_SCRIPT).replace(re.escape("{kind}"), r"\w+"))
+    if any(omitted.search(step["code"]) for step in steps):
+        return []
+    return steps
+
+
+class TrajectoryMatch:
+    """lookup の結果（kind は "replay"（再生する）または "exemplar"（手本として添える））"""
+
+    def __init__(self, kind, score, entry, steps):
+        self.kind = kind
+        self.score = score
+        self.entry = entry
+        # 再生する場合はスロットの値を置き換えたステップ
+        self.steps = steps
+
+    @property
+    def requirement(self):
+        return self.entry["requirement"]
+
+    def exemplar_prompt(self):
+        """エージェントへの依頼に添える手本"""
+        lines = [
+            f"参考: 同じ種類の過去の依頼は、次の {len(self.steps)} ステップで完了しました。"
+            "同じ手順で、内容は今回の要件に合わせて進めてください（記法エラーの修正などの回り道は除いてあります）。",
+            f"過去の依頼: {self.requirement}",
+        ]
+        for number, step in enumerate(self.steps, 1):
+            tools = f"（ツール: {', '.join(step['tools'])}）" if step["tools"] else ""
+            lines.append(f"ステップ {number}{tools}:\n```python\n{_shorten_code(step['code'])}\n```")
+        return "\n".join(lines)
+
+
+class TrajectoryCache:
+    """
+    成功した手順を依頼のシグネチャとともに保持し、新しい依頼に再生または手本を返すキャッシュ。
+
+    Args:
+        directory: 保存先
+        replay: 文面が同じ依頼の手順を再生するかどうか（False なら手本としてだけ使う）
+        exemplar_threshold: 手本として使う類似度の下限
+        max_entries: 保持する最大件数
+    """
+
+    def __init__(self, directory, replay=True, exemplar_threshold=0.3, max_entries=500):
+        self.directory = directory
+        self.replay = replay
+        self.exemplar_threshold = exemplar_threshold
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.replays = 0
+        self.exemplars = 0
+        self.replayed_steps = 0
+        self.fallbacks = 0
+        self.recorded = 0
+        self._entries = self._load()
+
+    @property
+    def _entries_file(self):
+        return os.path.join(self.directory, "trajectories.json")
+
+    def _load(self):
+        try:
+            with open(self._entries_file, 'r', encoding='utf-8') as f:
+                return json.load(f)["entries"]
+        except (OSError, ValueError, KeyError):
+            # 未作成・壊れたファイルは作り直す
+            return []
+
+    def _save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_file = f"{self._entries_file}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"entries": self._entries}, f, ensure_ascii=False)
+        os.replace(tmp_file, self._entries_file)
+
+    @staticmethod
+    def _replay_steps(entry, slots):
+        """スロットの値を置き換えて再生できる手順を返す（再生できない場合は None）"""
+        changes = [(old[1], new[1]) for old, new in zip(entry["slots"], slots) if tuple(old) != new]
+        if [kind for kind, _ in entry["slots"]] != [kind for kind, _ in slots]:
+            return None
+        steps = []
+        for step in entry["steps"]:
+            code = step["code"]
+            for old, new in changes:
+                code = _substitute(code, old, new)
+            steps.append(dict(step, code=code))
+        # 記録した実行が生成した成果物（ID・出力ファイルのパス）を書き込んだ手順は、再生すると古い図を回答してしまう
+        slot_values = {value for _, value in slots}
+        for step in steps:
+            for value in _string_literals(step["code"]) or ():
+                if any(match.group(1) not in slot_values for match in ARTIFACT_ID.finditer(value)):
+                    return None
+                if any(match.group(0) not in slot_values for match in GENERATED_PATH.finditer(value)):
+                    return None
+        if not changes:
+            return steps
+        all_code = "\n".join(step["code"] for step in entry["steps"])
+        for old, new in changes:
+            # 手順が使っていない値が変わった場合や、文字列リテラルを壊しうる値は再生しない
+            if not re.search(r"(?<![\w./\\-])" + re.escape(old) + r"(?![\w])", all_code) or re.search(r"[\"'\\\n{}]", new):
+                return None
+        for step in steps:
+            literals = _string_literals(step["code"])
+            if literals is None or any(len(value) > MAX_REPLAY_LITERAL or "\n" in value for value in literals):
+                return None
+        return steps
+
+    def lookup(self, requirement):
+        """
+        依頼に使える手順を探す。
+
+        Returns:
+            TrajectoryMatch | None: 同じシグネチャの手順がない場合、または類似度が exemplar_threshold 未満の場合は None
+        """
+        signature = task_signature(requirement)
+        template, slots = extract_slots(requirement)
+        with self._lock:
+            self.lookups += 1
+            candidates = [entry for entry in self._entries if entry["signature"] == signature]
+            if not candidates:
+                return None
+            if self.replay:
+                for entry in sorted(candidates, key=lambda entry: entry["last_used"], reverse=True):
+                    if entry["template"] != template:
+                        continue
+                    steps = self._replay_steps(entry, slots)
+                    if steps is not None:
+                        entry["last_used"] = time.time()
+                        entry["uses"] += 1
+                        self.replays += 1
+                        return TrajectoryMatch("replay", 1.0, dict(entry), steps)
+            vectors = hashing_embedding([requirement] + [entry["requirement"] for entry in candidates])
+            scores = vectors[1:] @ vectors[0]
+            index = int(scores.argmax())
+            if float(scores[index]) < self.exemplar_threshold:
+                return None
+            entry = candidates[index]
+            entry["last_used"] = time.time()
+            entry["uses"] += 1
+            self.exemplars += 1
+            return TrajectoryMatch("exemplar", float(scores[index]), dict(entry), entry["steps"])
+
+    def record(self, requirement, steps, total_steps, seconds):
+        """
+        成功した実行の手順を記録する。
+
+        Args:
+            requirement: ユーザーの依頼
+            steps: trajectory_steps() で取り出したステップ
+            total_steps: エラーになったステップを含む実行全体のステップ数
+            seconds: 実行にかかった時間
+        """
+        if not steps:
+            return
+        template, slots = extract_slots(requirement)
+        now = time.time()
+        with self._lock:
+            self.recorded += 1
+            # 同じ依頼（文面とスロットの値が同じ）の手順は 1 つにし、ステップ数が少ない方を残す
+            for entry in self._entries:
+                if entry["template"] == template and [tuple(slot) for slot in entry["slots"]] == slots:
+                    if len(steps) < len(entry["steps"]):
+                        entry.update(steps=steps, total_steps=total_steps, seconds=round(seconds, 3))
+                    entry["last_used"] = now
+                    self._save()
+                    return
+            self._entries.append({
+                "id": secrets.token_hex(8),
+                "signature": task_signature(requirement),
+                "requirement": requirement,
+                "template": template,
+                "slots": slots,
+                "steps": steps,
+                "total_steps": total_steps,
+                "seconds": round(seconds, 3),
+                "created_at": now,
+                "last_used": now,
+                "uses": 0,
+            })
+            if len(self._entries) > self.max_entries:
+                self._entries.sort(key=lambda entry: entry["last_used"], reverse=True)
+                del self._entries[self.max_entries:]
+            self._save()
+
+    def replay_model(self, model, agent, match):
+        """agent.model を置き換えて、match の手順を再生するモデルを返す"""
+        return ReplayModel(model, agent, match.steps, self)
+
+    def _count_replay(self, replayed=0, fallback=False):
+        with self._lock:
+            self.replayed_steps += replayed
+            self.fallbacks += int(fallback)
+
+    def clear(self):
+        """すべてのエントリと統計を消す"""
+        with self._lock:
+            self._entries = []
+            self.lookups = self.replays = self.exemplars = self.replayed_steps = self.fallbacks = self.recorded = 0
+            if os.path.exists(self._entries_file):
+                os.remove(self._entries_file)
+
+    def stats(self):
+        """件数・再生と手本の回数・再生したステップ数（省いた LLM 呼び出し）を返す"""
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "lookups": self.lookups,
+                "replays": self.replays,
+                "exemplars": self.exemplars,
+                "replayed_steps": self.replayed_steps,
+                "fallbacks": self.fallbacks,
+                "recorded": self.recorded,
+            }
+
+
+class ReplayModel:
+    """
+    記録した手順のコードを LLM の応答として順に返すモデルラッパー。
+    直前のステップがエラーになった場合と、手順を使い切った場合はラップしたモデルを呼ぶ。
+    generate / generate_stream 以外の属性はラップしたモデルに委譲する。
+    """
+
+    def __init__(self, model, agent, steps, cache=None):
+        self.model = model
+        self.agent = agent
+        self.steps = steps
+        self.cache = cache
+        self.start = len(agent.memory.steps)
+        self.replaying = True
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    def __call__(self, *args, **kwargs):
+        return self.generate(*args, **kwargs)
+
+    def _next_code(self):
+        if not self.replaying:
+            return None
+        done = [step for step in self.agent.memory.steps[self.start:] if isinstance(step, ActionStep)]
+        if (done and done[-1].error is not None) or len(done) >= len(self.steps):
+            self.replaying = False
+            if self.cache is not None:
+                self.cache._count_replay(fallback=bool(done and done[-1].error is not None))
+            return None
+        if self.cache is not None:
+            self.cache._count_replay(replayed=1)
+        return self.steps[len(done)]["code"]
+
+    def _message(self, code):
+        open_tag, close_tag = getattr(self.agent, "code_block_tags", ("<code>", "</code>"))
+        return f"Thought: 過去に成功した同じ形の依頼の手順を再生します。\n{open_tag}\n{code}\n{close_tag}"
+
+    def generate(self, messages, **kwargs):
+        code = self._next_code()
+        if code is None:
+            return self.model.generate(messages, **kwargs)
+        return ChatMessage(role=MessageRole.ASSISTANT, content=self._message(code), token_usage=TokenUsage(input_tokens=0, output_tokens=0))
+
+    def generate_stream(self, messages, **kwargs):
+        code = self._next_code()
+        if code is None:
+            yield from self.model.generate_stream(messages, **kwargs)
+            return
+        yield ChatMessageStreamDelta(content=self._message(code), token_usage=TokenUsage(input_tokens=0, output_tokens=0))
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_trajectory_cache():
+    """
+    共有のトラジェクトリキャッシュを返す。
+
+    Returns:
+        TrajectoryCache | None: TRAJECTORY_CACHE=0 で無効化されている場合は None
+    """
+    global _cache
+
+    if os.getenv("TRAJECTORY_CACHE", "1") == "0":
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            _cache = TrajectoryCache(
+                directory=os.getenv("TRAJECTORY_CACHE_DIR", os.path.join("cache", "trajectories")),
+                replay=os.getenv("TRAJECTORY_REPLAY", "1") != "0",
+                exemplar_threshold=float(os.getenv("TRAJECTORY_EXEMPLAR_THRESHOLD", "0.3")),
+                max_entries=int(os.getenv("TRAJECTORY_CACHE_MAX_ENTRIES", "500"))
+            )
+        return _cache
@@ -0,0 +1,517 @@
+"""
+Web 取得ツール（コネクションプール・HTTP キャッシュ・並列取得・HTML のテキスト化）
+
+200/300 のコード例では、LLM がステップごとに requests / bs4 のコードを書いて毎回新しい接続を張り、
+同じページや同じ地名の緯度経度（国土地理院の住所検索）・天気予報（Open-Meteo）を何度も取得していた。
+このモジュールは CodeAgent のツールとして次をまとめて提供する。
+
+- 接続の再利用: プロセスで 1 つの requests.Session（ホストごとのコネクションプール、接続エラー時の再試行）
+- HTTP キャッシュ: 応答を cache/http/ に保存し、Cache-Control の max-age・Expires（どちらもなければ
+  WEB_FETCH_TTL）の間はネットワークに出ない。期限切れのエントリは ETag / Last-Modified 付きの条件付き GET で
+  確認し、304 なら保存済みの本文を使う。no-store の応答とエラー応答は保存しない
+- 並列取得: fetch_urls_tool は複数の URL を WEB_FETCH_WORKERS 並列で取得する
+- テキスト化: HTML は script・style・nav などを除いた本文のテキスト（タイトル・見出し付き）に、
+  JSON は空白を詰めた文字列にして max_chars で切り詰める（LLM に渡すトークンを減らす）
+
+ローカルのスタブサーバ（benchmarks/stub_http_server.py）で動作を確認できる:
+    python benchmarks/stub_http_server.py --port 8765
+    python web_fetch.py --repeat 2 http://127.0.0.1:8765/page/1 "http://127.0.0.1:8765/address-search/AddressSearch?q=東京"
+
+環境変数:
+    WEB_FETCH_CACHE        0 でキャッシュを無効化（既定 1）
+    WEB_FETCH_CACHE_DIR    保存先（既定 cache/http）
+    WEB_FETCH_TTL          鮮度の情報がない応答を新しいとみなす秒数（既定 600）
+    WEB_FETCH_MAX_ENTRIES  保存する最大件数（既定 2000。超えると古いものから削除。件数はメモリ上で数える）
+    WEB_FETCH_TIMEOUT      1 リクエストのタイムアウト秒数（既定 20）
+    WEB_FETCH_WORKERS      並列取得の数・ホストごとの最大接続数（既定 8）
+    WEB_FETCH_USER_AGENT   User-Agent ヘッダ
+"""
+
+import argparse
+import concurrent.futures
+import email.utils
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from html.parser import HTMLParser
+from typing import Any
+
+import requests
+from requests.adapters import HTTPAdapter
+from smolagents import tool
+from urllib3.util.retry import Retry
+
+from cache_eviction import get_entry_limit
+
+DEFAULT_USER_AGENT = "Mozilla/5.0 (compatible; smolagents-samples web_fetch)"
+
+# 保存して再利用するレスポンスヘッダ（Set-Cookie などは保存しない）
+STORED_HEADERS = ("content-type", "etag", "last-modified", "cache-control", "expires", "date")
+
+# テキスト化で中身ごと捨てる要素
+SKIPPED_TAGS = {"script", "style", "noscript", "template", "svg", "canvas", "iframe", "nav", "footer", "aside", "form", "button", "select"}
+# 前後で改行する要素
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "header", "br", "hr", "li", "ul", "ol", "dl", "dt", "dd",
+    "table", "tr", "blockquote", "pre", "figure", "figcaption", "h1", "h2", "h3", "h4", "h5", "h6",
+}
+VOID_TAGS = {"area", "base", "br", "col", "embed", "hr", "img", "input", "link", "meta", "source", "track", "wbr"}
+
+
+class FetchError(RuntimeError):
+    """HTTP エラー（4xx/5xx）や接続エラーで取得できなかった場合の例外"""
+
+
+class _TextExtractor(HTMLParser):
+    """HTML から本文のテキストを取り出す（見出しは # 、リストは - を付ける）"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.parts = []
+        self._skip_depth = 0
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        if tag in SKIPPED_TAGS:
+            if tag not in VOID_TAGS:
+                self._skip_depth += 1
+            return
+        if self._skip_depth:
+            return
+        if tag == "title":
+            self._in_title = True
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+            if re.fullmatch(r"h[1-6]", tag):
+                self.parts.append("#" * int(tag[1]) + " ")
+            elif tag == "li":
+                self.parts.append("- ")
+        elif tag in ("td", "th"):
+            self.parts.append(" | ")
+
+    def handle_endtag(self, tag):
+        if tag in SKIPPED_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+            return
+        if self._skip_depth:
+            return
+        if tag == "title":
+            self._in_title = False
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if self._skip_depth:
+            return
+        if self._in_title:
+            self.title += data
+        else:
+            self.parts.append(data)
+
+
+def html_to_text(html_text, max_chars=None):
+    """
+    HTML を本文のテキストにする（空白をまとめ、空行を詰める）。
+
+    Returns:
+        str: 1 行目がタイトル（あれば）のテキスト
+    """
+    extractor = _TextExtractor()
+    extractor.feed(html_text)
+    extractor.close()
+    lines = []
+    for line in "".join(extractor.parts).split("\n"):
+        line = re.sub(r"\s+", " ", line).strip()
+        if line and line not in ("|", "-", "- |"):
+            lines.append(line)
+    title = re.sub(r"\s+", " ", extractor.title).strip()
+    text = "\n".join(([f"タイトル: {title}", ""] if title else []) + lines)
+    return _truncate(text, max_chars)
+
+
+def _truncate(text, max_chars):
+    if max_chars and len(text) > max_chars:
+        return text[:max_chars] + f"\n...（以下 {len(text) - max_chars} 文字省略）"
+    return text
+
+
+def _cache_directives(headers):
+    directives = {}
+    for part in headers.get("cache-control", "").lower().split(","):
+        name, _, value = part.strip().partition("=")
+        if name:
+            directives[name] = value.strip('"')
+    return directives
+
+
+def _freshness(headers, default_ttl):
+    """レスポンスヘッダから新しいとみなせる秒数を決める（max-age → Expires → 既定の TTL）"""
+    directives = _cache_directives(headers)
+    if "no-cache" in directives:
+        return 0
+    if directives.get("max-age", "").isdigit():
+        return int(directives["max-age"])
+    if headers.get("expires"):
+        try:
+            expires = email.utils.parsedate_to_datetime(headers["expires"]).timestamp()
+            date = email.utils.parsedate_to_datetime(headers["date"]).timestamp() if headers.get("date") else time.time()
+        except (TypeError, ValueError):
+            return 0
+        return max(0, int(expires - date))
+    return default_ttl
+
+
+def _charset(headers, content):
+    match = re.search(r"charset=([\w.-]+)", headers.get("content-type", ""), re.IGNORECASE)
+    if match is None:
+        match = re.search(rb"<meta[^>]+charset=[\"']?([\w.-]+)", content[:4096], re.IGNORECASE)
+        if match is not None:
+            return match.group(1).decode("ascii")
+        return "utf-8"
+    return match.group(1)
+
+
+class FetchResult:
+    """
+    取得結果。
+
+    Attributes:
+        source: network（取得した）/ fresh（キャッシュをそのまま使った）/ revalidated（304 で確認してキャッシュを使った）
+    """
+
+    def __init__(self, url, status, headers, content, source, elapsed):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.content = content
+        self.source = source
+        self.elapsed = elapsed
+
+    @property
+    def content_type(self):
+        return self.headers.get("content-type", "").split(";")[0].strip().lower()
+
+    @property
+    def text(self):
+        charset = _charset(self.headers, self.content)
+        try:
+            return self.content.decode(charset, errors="replace")
+        except LookupError:
+            return self.content.decode("utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def to_text(self, max_chars=None):
+        """LLM に渡すテキスト（HTML は本文、JSON は空白を詰めた文字列）"""
+        if self.content_type in ("text/html", "application/xhtml+xml"):
+            return html_to_text(self.text, max_chars)
+        if self.content_type.endswith("json"):
+            try:
+                return _truncate(json.dumps(self.json(), ensure_ascii=False, separators=(",", ":")), max_chars)
+            except ValueError:
+                pass
+        return _truncate(self.text, max_chars)
+
+
+class HttpCache:
+    """
+    HTTP 応答のディスクキャッシュ（URL のハッシュごとにメタデータの JSON と本文のファイル）。
+
+    Args:
+        cache_dir: 保存先
+        default_ttl: 鮮度の情報がない応答を新しいとみなす秒数
+        max_entries: 保持する最大エントリ数
+    """
+
+    def __init__(self, cache_dir=os.path.join("cache", "http"), default_ttl=600, max_entries=2000):
+        self.cache_dir = cache_dir
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._limit = get_entry_limit(cache_dir, max_entries, companions=(".body",))
+
+    @staticmethod
+    def make_key(url):
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.cache_dir, key[:2], key)
+        return f"{base}.json", f"{base}.body"
+
+    def get(self, url):
+        """
+        保存済みのエントリを返す。
+
+        Returns:
+            tuple[dict, bytes] | None: メタデータ（status, headers, stored_at, fresh_until）と本文
+        """
+        meta_path, body_path = self._paths(self.make_key(url))
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            with open(body_path, 'rb') as f:
+                body = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get("url") != url:
+            return None
+        return meta, body
+
+    def put(self, url, status, headers, body):
+        """応答を保存する。no-store の応答は保存しない"""
+        directives = _cache_directives(headers)
+        if "no-store" in directives:
+            return False
+        key = self.make_key(url)
+        meta_path, body_path = self._paths(key)
+        now = time.time()
+        meta = {
+            "url": url,
+            "status": status,
+            "headers": {name: headers[name] for name in STORED_HEADERS if name in headers},
+            "stored_at": now,
+            "fresh_until": now + _freshness(headers, self.default_ttl),
+        }
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        created = not os.path.exists(meta_path)
+        # 本文を先に置き換え、メタデータを最後に置き換える（メタデータがあれば本文もそろっている）
+        for path, data, mode in ((body_path, body, 'wb'), (meta_path, meta, 'w')):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            if mode == 'wb':
+                with open(tmp_path, mode) as f:
+                    f.write(data)
+            else:
+                with open(tmp_path, mode, encoding='utf-8') as f:
+                    json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        self._limit.added(created)
+        return True
+
+    def refresh(self, url, meta, headers):
+        """304 応答を受けたエントリの鮮度とヘッダを更新する"""
+        merged = dict(meta["headers"])
+        merged.update({name: headers[name] for name in STORED_HEADERS if name in headers and name != "content-type"})
+        now = time.time()
+        meta = dict(meta, headers=merged, stored_at=now, fresh_until=now + _freshness(merged, self.default_ttl))
+        meta_path, _ = self._paths(self.make_key(url))
+        tmp_path = f"{meta_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp_path, meta_path)
+        return meta
+
+
+class WebFetcher:
+    """
+    コネクションプールを共有し、HTTP キャッシュを通して GET する。
+
+    Args:
+        cache: HttpCache（None ならキャッシュしない）
+        timeout: 1 リクエストのタイムアウト秒数
+        workers: 並列取得の数・ホストごとの最大接続数
+        user_agent: User-Agent ヘッダ
+    """
+
+    def __init__(self, cache=None, timeout=20, workers=8, user_agent=DEFAULT_USER_AGENT):
+        self.cache = cache
+        self.timeout = timeout
+        self.workers = workers
+        self.session = requests.Session()
+        self.session.headers["User-Agent"] = user_agent
+        # 接続エラーと一時的なサーバエラーは GET なので再試行してよい
+        retry = Retry(total=2, connect=2, read=1, backoff_factor=0.3, status_forcelist=(502, 503, 504), allowed_methods=("GET",))
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=workers, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "network": 0, "fresh": 0, "revalidated": 0, "errors": 0,
+                        "bytes_downloaded": 0, "bytes_from_cache": 0}
+
+    def _count(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                self._counts[name] += delta
+
+    def fetch(self, url, params=None):
+        """
+        URL を GET する（キャッシュが新しければネットワークに出ない）。
+
+        Raises:
+            FetchError: HTTP エラーや接続エラーの場合
+        """
+        started = time.perf_counter()
+        url = requests.Request("GET", url, params=params).prepare().url
+        self._count(requests=1)
+        cached = self.cache.get(url) if self.cache is not None else None
+        headers = {}
+        if cached is not None:
+            meta, body = cached
+            if time.time() < meta["fresh_until"]:
+                self._count(fresh=1, bytes_from_cache=len(body))
+                return FetchResult(url, meta["status"], meta["headers"], body, "fresh", time.perf_counter() - started)
+            if meta["headers"].get("etag"):
+                headers["If-None-Match"] = meta["headers"]["etag"]
+            if meta["headers"].get("last-modified"):
+                headers["If-Modified-Since"] = meta["headers"]["last-modified"]
+
+        try:
+            response = self.session.get(url, headers=headers, timeout=self.timeout)
+        except requests.RequestException as e:
+            self._count(errors=1)
+            raise FetchError(f"{url} の取得に失敗しました: {e}") from e
+        response_headers = {name.lower(): value for name, value in response.headers.items()}
+
+        if response.status_code == 304 and cached is not None:
+            meta = self.cache.refresh(url, cached[0], response_headers)
+            self._count(revalidated=1, bytes_from_cache=len(cached[1]))
+            return FetchResult(url, meta["status"], meta["headers"], cached[1], "revalidated", time.perf_counter() - started)
+
+        body = response.content
+        self._count(network=1, bytes_downloaded=len(body))
+        if response.status_code >= 400:
+            self._count(errors=1)
+            raise FetchError(f"{url} の取得に失敗しました: HTTP {response.status_code} {_truncate(response.text.strip(), 200)}")
+        if self.cache is not None and response.status_code == 200:
+            self.cache.put(url, response.status_code, response_headers, body)
+        return FetchResult(url, response.status_code, response_headers, body, "network", time.perf_counter() - started)
+
+    def fetch_many(self, urls):
+        """
+        複数の URL を並列に取得する（同じ URL は 1 回だけ取得する）。
+
+        Returns:
+            dict: URL → FetchResult、または取得できなかった場合は FetchError
+        """
+        unique = list(dict.fromkeys(urls))
+
+        def fetch_or_error(url):
+            try:
+                return self.fetch(url)
+            except FetchError as e:
+                return e
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(self.workers, len(unique)))) as executor:
+            return dict(zip(unique, executor.map(fetch_or_error, unique)))
+
+    def stats(self):
+        """リクエスト数・キャッシュの利用状況・転送量を返す"""
+        with self._lock:
+            counts = dict(self._counts)
+        served = counts["fresh"] + counts["revalidated"]
+        counts["cache_hit_rate"] = round(served / counts["requests"], 3) if counts["requests"] else None
+        return counts
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_web_fetcher():
+    """共有の WebFetcher を返す（WEB_FETCH_CACHE=0 ならキャッシュなし）"""
+    global _fetcher
+
+    with _fetcher_lock:
+        if _fetcher is None:
+            cache = None
+            if os.getenv("WEB_FETCH_CACHE", "1") != "0":
+                cache = HttpCache(
+                    cache_dir=os.getenv("WEB_FETCH_CACHE_DIR", os.path.join("cache", "http")),
+                    default_ttl=int(os.getenv("WEB_FETCH_TTL", "600")),
+                    max_entries=int(os.getenv("WEB_FETCH_MAX_ENTRIES", "2000"))
+                )
+            _fetcher = WebFetcher(
+                cache=cache,
+                timeout=float(os.getenv("WEB_FETCH_TIMEOUT", "20")),
+                workers=int(os.getenv("WEB_FETCH_WORKERS", "8")),
+                user_agent=os.getenv("WEB_FETCH_USER_AGENT", DEFAULT_USER_AGENT)
+            )
+        return _fetcher
+
+
+@tool
+def fetch_url_tool(url: str, max_chars: int = 4000) -> str:
+    """
+    URL の内容を取得し、読みやすいテキストにして返すツール（接続の再利用と HTTP キャッシュ付き）。
+    HTML はタイトル・見出し付きの本文のテキスト（script・style・ナビゲーションなどは除く）、
+    JSON は空白を詰めた JSON 文字列になる。同じ URL は再ダウンロードしないので、何度呼んでもよい。
+
+    Args:
+        url: 取得する URL（クエリパラメータを含めてよい。日本語もそのまま書いてよい）
+        max_chars: 返すテキストの最大文字数。超えた分は省略する
+
+    Returns:
+        str: ページのテキスト
+
+    Raises:
+        RuntimeError: HTTP エラー（4xx/5xx）や接続エラーの場合
+    """
+    return get_web_fetcher().fetch(url).to_text(max_chars)
+
+
+@tool
+def fetch_json_tool(url: str) -> Any:
+    """
+    JSON を返す Web API を呼び出し、解析済みの値（dict または list）を返すツール（接続の再利用と HTTP キャッシュ付き）。
+    同じ URL の呼び出しはキャッシュから返すので、同じ地名の検索などを何度呼んでもよい。
+
+    Args:
+        url: API の URL（クエリパラメータを含めてよい。日本語もそのまま書いてよい）
+
+    Returns:
+        Any: JSON を解析した値
+
+    Raises:
+        RuntimeError: HTTP エラー（4xx/5xx）や接続エラー、応答が JSON でない場合
+    """
+    result = get_web_fetcher().fetch(url)
+    try:
+        return result.json()
+    except ValueError as e:
+        raise FetchError(f"{result.url} の応答が JSON ではありません: {_truncate(result.text.strip(), 200)}") from e
+
+
+@tool
+def fetch_urls_tool(urls: list[str], max_chars: int = 2000) -> dict:
+    """
+    複数の URL を並列に取得し、それぞれをテキストにして返すツール（fetch_url_tool をまとめて呼ぶより速い）。
+
+    Args:
+        urls: 取得する URL のリスト
+        max_chars: URL ごとに返すテキストの最大文字数
+
+    Returns:
+        dict: URL → テキスト。取得できなかった URL は "ERROR: " で始まるメッセージ
+    """
+    results = get_web_fetcher().fetch_many(urls)
+    return {
+        url: f"ERROR: {result}" if isinstance(result, Exception) else result.to_text(max_chars)
+        for url, result in results.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="URL を取得してテキストにする（HTTP キャッシュ付き）")
+    parser.add_argument("urls", nargs="+", help="取得する URL")
+    parser.add_argument("--max-chars", type=int, default=1000, help="URL ごとに表示する最大文字数")
+    parser.add_argument("--repeat", type=int, default=1, help="同じ URL を取得する回数（2 回目以降はキャッシュを使う）")
+    args = parser.parse_args()
+
+    fetcher = get_web_fetcher()
+    for round_index in range(args.repeat):
+        started = time.perf_counter()
+        results = fetcher.fetch_many(args.urls)
+        print(f"=== {round_index + 1} 回目: {time.perf_counter() - started:.3f} 秒")
+        for url, result in results.items():
+            if isinstance(result, Exception):
+                print(f"--- {url}\nERROR: {result}")
+            else:
+                print(f"--- {url} [{result.status} {result.source} {result.elapsed:.3f}s]\n{result.to_text(args.max_chars)}")
+    print(json.dumps(fetcher.stats(), ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()